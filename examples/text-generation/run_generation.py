@@ -19,6 +19,7 @@ Conditional text generation on Habana Gaudi/Gaudi2.
 """
 
 import argparse
+import inspect
 import logging
 import os
 import tempfile
@@ -82,9 +83,67 @@ def main():
         action="store_true",
         help="Whether to use sampling for generation.",
     )
+    parser.add_argument("--num_beams", type=int, default=1, help="Number of beams used for beam search.")
+    parser.add_argument(
+        "--tensor_parallel",
+        action="store_true",
+        help="Whether to shard BLOOM across devices with the tensor parallelism of Optimum Habana instead of DeepSpeed.",
+    )
+    parser.add_argument(
+        "--prefill_chunk_size",
+        type=int,
+        default=None,
+        help="Optional number of prompt tokens per forward pass of the prefill, to bound its memory with long prompts.",
+    )
+    parser.add_argument(
+        "--batch_compaction_sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Optional batch sizes to shrink the batch to as sequences reach the end-of-sequence token.",
+    )
+    parser.add_argument(
+        "--kv_cache_dtype",
+        default="default",
+        choices=["default", "int8"],
+        help="Data type of the key/value cache, `int8` quantizes the cache of BLOOM to halve its memory footprint.",
+    )
+    parser.add_argument(
+        "--prompt_length_buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Optional lengths to pad prompts to, so that prompts of different lengths reuse the same compiled graphs.",
+    )
+    parser.add_argument(
+        "--total_length_buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Optional lengths to pad prompts plus generated tokens to, only used with `--prompt_length_buckets`.",
+    )
+    parser.add_argument(
+        "--assistant_model_name_or_path",
+        default=None,
+        type=str,
+        help="Optional smaller model sharing the tokenizer of the main model, used to draft tokens for speculative decoding.",
+    )
+    parser.add_argument(
+        "--num_assistant_tokens",
+        type=int,
+        default=5,
+        help="Number of tokens drafted by the assistant model at each step of speculative decoding.",
+    )
 
     args = parser.parse_args()
 
+    if args.kv_cache_dtype == "int8" and args.prompt_length_buckets is not None:
+        raise ValueError("`--kv_cache_dtype int8` cannot be used with `--prompt_length_buckets`.")
+    if args.kv_cache_dtype == "int8" and args.assistant_model_name_or_path is not None:
+        raise ValueError("`--kv_cache_dtype int8` cannot be used with `--assistant_model_name_or_path`.")
+    if args.prefill_chunk_size is not None and args.assistant_model_name_or_path is not None:
+        raise ValueError("`--prefill_chunk_size` cannot be used with `--assistant_model_name_or_path`.")
+
     # If the DeepSpeed launcher is used, the env variable _ will be equal to /usr/local/bin/deepspeed
     # For multi node, the value of the env variable WORLD_SIZE should be larger than 8
     use_deepspeed = "deepspeed" in os.environ["_"] or (
@@ -104,6 +163,11 @@ def main():
 
     world_size, rank, args.local_rank = initialize_distributed_hpu()
 
+    if args.tensor_parallel:
+        if use_deepspeed:
+            raise ValueError("`--tensor_parallel` should not be used with DeepSpeed.")
+        torch.distributed.init_process_group(backend="hccl", rank=rank, world_size=world_size)
+
     if use_deepspeed:
         # Check if DeepSpeed is installed
         from transformers.deepspeed import is_deepspeed_available
@@ -145,14 +209,18 @@ def main():
                             fp32_file_path=hmp_fp32_file.name,
                             isVerbose=gaudi_config.hmp_is_verbose,
                         )
-        logger.info("Single-device run.")
+        if args.tensor_parallel:
+            logger.info(f"Tensor-parallel run on {world_size} devices.")
+        else:
+            logger.info("Single-device run.")
 
     # Tweak generation so that it runs faster on Gaudi
     from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
 
     adapt_transformers_to_gaudi()
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path)
+    # Prompts are left-padded so that generation starts at the same index for all of them
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path, padding_side="left")
 
     if use_deepspeed:
         config = AutoConfig.from_pretrained(args.model_name_or_path)
@@ -190,10 +258,18 @@ def main():
         if is_bloom:
             model.module.split_lm_head()
         model = model.module
+        # Models that accept token_idx (e.g. BLOOM, GPT-2) keep static shapes during generation
+        use_token_idx = "token_idx" in inspect.signature(model.forward).parameters
     else:
         model = AutoModelForCausalLM.from_pretrained(args.model_name_or_path)
+        if args.tensor_parallel:
+            if not model_is_bloom(model.config):
+                raise ValueError("`--tensor_parallel` is only supported for BLOOM.")
+            # Each device only keeps its shard of the weights
+            model.shard_for_tensor_parallel()
         model = model.eval().to(args.device)
-        is_bloom = model_is_bloom(model.config)
+        # Models that accept token_idx (e.g. BLOOM, GPT-2) keep static shapes during generation
+        use_token_idx = "token_idx" in inspect.signature(model.forward).parameters
 
         if args.use_hpu_graphs:
             from habana_frameworks.torch.hpu import wrap_in_hpu_graph
@@ -213,11 +289,68 @@ def main():
             use_bf16 = True
         logger.info(f"device: {args.device}, n_hpu: {world_size}, bf16: {use_bf16}")
 
+    # Optional draft model for speculative decoding
+    if args.assistant_model_name_or_path is not None:
+        assistant_model = AutoModelForCausalLM.from_pretrained(args.assistant_model_name_or_path)
+        assistant_model = assistant_model.eval().to(args.device)
+        assistant_kwargs = {"assistant_model": assistant_model, "num_assistant_tokens": args.num_assistant_tokens}
+    else:
+        assistant_kwargs = {}
+
+    # Optional bucketing of input shapes
+    if args.prompt_length_buckets is not None:
+        from optimum.habana.transformers.generation import GenerationShapeBuckets
+
+        shape_buckets = GenerationShapeBuckets(args.prompt_length_buckets, args.total_length_buckets)
+    else:
+        shape_buckets = None
+
+    # Optional int8 key/value cache, allocated for each batch of padded inputs
+    if args.kv_cache_dtype == "int8":
+        if not use_token_idx or not model_is_bloom(model.config):
+            raise ValueError("`--kv_cache_dtype int8` is only supported for BLOOM.")
+        from optimum.habana.transformers.models import GaudiBloomInt8KVCache
+
+        def int8_kv_cache_kwargs(batch_size, max_length):
+            cache = GaudiBloomInt8KVCache(
+                model.config,
+                batch_size * args.num_beams,
+                max_length,
+                dtype=model.dtype,
+                device=args.device,
+                num_heads=model.config.n_head // world_size if use_deepspeed or args.tensor_parallel else None,
+            )
+            return {"int8_kv_cache": cache}
+
+    else:
+
+        def int8_kv_cache_kwargs(batch_size, max_length):
+            return {}
+
+    # Optional chunked prefill of the prompts
+    if args.prefill_chunk_size is not None:
+        if not use_token_idx or not model_is_bloom(model.config):
+            raise ValueError("`--prefill_chunk_size` is only supported for BLOOM.")
+        prefill_kwargs = {"prefill_chunk_size": args.prefill_chunk_size}
+    else:
+        prefill_kwargs = {}
+
+    # Optional shrinking of the batch as sequences finish
+    if args.batch_compaction_sizes is not None:
+        from optimum.habana.transformers.generation import BatchCompaction
+
+        batch_compaction = BatchCompaction(batch_sizes=args.batch_compaction_sizes)
+        compaction_kwargs = {"batch_compaction": batch_compaction}
+    else:
+        batch_compaction = None
+        compaction_kwargs = {}
+
     # Generation configuration
     generation_config = GenerationConfig(
         max_new_tokens=args.max_new_tokens,
         use_cache=args.use_kv_cache,
         do_sample=args.do_sample,
+        num_beams=args.num_beams,
     )
 
     if args.dataset_name is None:
@@ -247,17 +380,22 @@ def main():
             # Tokenization
             input_tokens = tokenizer.batch_encode_plus(input_sentences, return_tensors="pt", padding=True)
 
-            # Pad inputs to have static shapes during generation, this gives better performance than dynamic shapes on HPUs
-            input_token_len = input_tokens.input_ids.shape[-1]
-            input_tokens["input_ids"] = F.pad(
-                input_tokens.input_ids, (0, args.max_new_tokens), value=model.config.pad_token_id
-            )
-            input_tokens["attention_mask"] = F.pad(input_tokens.attention_mask, (0, args.max_new_tokens), value=0)
-            if is_bloom:
-                # token_idx is the current index in the generation process, it is incremented each time a new token is generated
-                kwargs = {"token_idx": torch.tensor(input_token_len, device=args.device)}
+            if shape_buckets is not None:
+                # Padding and token_idx are managed by the shape buckets
+                kwargs = {"shape_buckets": shape_buckets}
             else:
-                kwargs = {}
+                # Pad inputs to have static shapes during generation, this gives better performance than dynamic shapes on HPUs
+                input_token_len = input_tokens.input_ids.shape[-1]
+                input_tokens["input_ids"] = F.pad(
+                    input_tokens.input_ids, (0, args.max_new_tokens), value=model.config.pad_token_id
+                )
+                input_tokens["attention_mask"] = F.pad(input_tokens.attention_mask, (0, args.max_new_tokens), value=0)
+                if use_token_idx:
+                    # token_idx is the current index in the generation process, it is incremented each time a new token is generated
+                    kwargs = {"token_idx": torch.tensor(input_token_len, device=args.device)}
+                else:
+                    kwargs = {}
+                kwargs.update(int8_kv_cache_kwargs(len(input_sentences), input_tokens.input_ids.shape[-1]))
 
             # Move inputs to target device(s)
             for t in input_tokens:
@@ -267,6 +405,9 @@ def main():
             outputs = model.generate(
                 **input_tokens,
                 **kwargs,
+                **assistant_kwargs,
+                **prefill_kwargs,
+                **compaction_kwargs,
                 generation_config=generation_config,
                 lazy_mode=True,
                 hpu_graphs=args.use_hpu_graphs,
@@ -303,6 +444,10 @@ def main():
             print(stats)
             if args.use_hpu_graphs:
                 print(f"Graph compilation duration = {compilation_duration} seconds")
+            if shape_buckets is not None:
+                print(f"Number of distinct input shapes = {shape_buckets.num_shapes}")
+            if batch_compaction is not None:
+                print(f"Batch sizes of the last generation = {batch_compaction.batch_sizes_history}")
             print(separator)
             print()
             print("Input/outputs:")
@@ -371,13 +516,16 @@ def main():
             for t in batch:
                 if torch.is_tensor(batch[t]):
                     batch[t] = batch[t].to(args.device)
-            if is_bloom:
+            if use_token_idx:
                 # token_idx is the current index in the generation process, it is incremented each time a new token is generated
                 batch["token_idx"] = torch.tensor(prompt_length, device=args.device)
 
             # Generate new sequences
             outputs = model.generate(
                 **batch,
+                **int8_kv_cache_kwargs(batch["input_ids"].shape[0], batch["input_ids"].shape[-1]),
+                **prefill_kwargs,
+                **compaction_kwargs,
                 generation_config=generation_config,
                 lazy_mode=args.use_hpu_graphs,
                 hpu_graphs=args.use_hpu_graphs,
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Latency benchmark of text generation on Habana Gaudi/Gaudi2, replaying a trace of requests.
+"""
+
+import argparse
+import inspect
+import json
+import logging
+
+import torch
+from transformers import AutoModelForCausalLM, BloomConfig, GPT2Config
+
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    datefmt="%m/%d/%Y %H:%M:%S",
+    level=logging.INFO,
+)
+logger = logging.getLogger(__name__)
+
+
+# Small randomly initialized models, e.g. to run the benchmark on CPU in CI
+TINY_RANDOM_CONFIGS = {
+    "bloom": BloomConfig(
+        vocab_size=1024, hidden_size=64, n_layer=2, n_head=4, bos_token_id=1, eos_token_id=2, pad_token_id=0
+    ),
+    "gpt2": GPT2Config(
+        vocab_size=1024,
+        n_embd=64,
+        n_layer=2,
+        n_head=4,
+        n_positions=512,
+        bos_token_id=1,
+        eos_token_id=2,
+        pad_token_id=0,
+    ),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument(
+        "--model_name_or_path", default=None, type=str, help="Path to pre-trained model (on the HF Hub or locally)."
+    )
+    model_group.add_argument(
+        "--tiny_random_model",
+        default=None,
+        choices=list(TINY_RANDOM_CONFIGS.keys()),
+        help="Benchmark a tiny randomly initialized model instead of a pre-trained one.",
+    )
+    parser.add_argument("--device", default="hpu", choices=["hpu", "cpu"], help="The device to run on.")
+    parser.add_argument("--use_hpu_graphs", action="store_true", help="Whether to use HPU graphs or not.")
+    parser.add_argument(
+        "--trace_file",
+        default=None,
+        type=str,
+        help="Optional JSON file with a list of requests, each with `arrival_time`, `prompt_length` and `max_new_tokens`.",
+    )
+    parser.add_argument("--num_requests", type=int, default=32, help="Number of requests of the sampled trace.")
+    parser.add_argument(
+        "--request_rate",
+        type=float,
+        default=float("inf"),
+        help="Average number of requests per second of the sampled trace, all requests arrive at once by default.",
+    )
+    parser.add_argument("--arrival_process", default="poisson", choices=["poisson", "constant"])
+    parser.add_argument(
+        "--prompt_length", type=int, nargs="+", default=[32], help="A prompt length, or the bounds of a uniform range."
+    )
+    parser.add_argument(
+        "--max_new_tokens",
+        type=int,
+        nargs="+",
+        default=[32],
+        help="A number of tokens to generate, or the bounds of a uniform range.",
+    )
+    parser.add_argument(
+        "--prompt_length_buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Optional lengths to pad prompts to, so that prompts of different lengths reuse the same compiled graphs.",
+    )
+    parser.add_argument(
+        "--total_length_buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Optional lengths to pad prompts plus generated tokens to, only used with `--prompt_length_buckets`.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the trace and of the prompts.")
+    parser.add_argument("--output_file", default=None, type=str, help="Optional JSON file to write the results to.")
+    parser.add_argument("--name", default=None, type=str, help="Key of the results in the JSON file.")
+    args = parser.parse_args()
+
+    from optimum.habana.transformers.generation import (
+        GenerationLatencyBenchmark,
+        GenerationShapeBuckets,
+        load_request_trace,
+        sample_request_trace,
+    )
+    from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+
+    # Tweak generation so that it runs faster on Gaudi
+    adapt_transformers_to_gaudi()
+
+    if args.device == "hpu":
+        import habana_frameworks.torch.core  # noqa: F401
+
+    if args.tiny_random_model is not None:
+        torch.manual_seed(args.seed)
+        model = AutoModelForCausalLM.from_config(TINY_RANDOM_CONFIGS[args.tiny_random_model])
+    else:
+        model = AutoModelForCausalLM.from_pretrained(args.model_name_or_path)
+    model = model.eval().to(args.device)
+    if model.generation_config.pad_token_id is None:
+        model.generation_config.pad_token_id = model.generation_config.eos_token_id
+    # Models that accept token_idx (e.g. BLOOM, GPT-2) keep static shapes during generation
+    use_token_idx = "token_idx" in inspect.signature(model.forward).parameters
+
+    if args.use_hpu_graphs:
+        from habana_frameworks.torch.hpu import wrap_in_hpu_graph
+
+        model = wrap_in_hpu_graph(model)
+
+    if args.trace_file is not None:
+        requests = load_request_trace(args.trace_file)
+    else:
+        requests = sample_request_trace(
+            args.num_requests,
+            prompt_length=args.prompt_length[0] if len(args.prompt_length) == 1 else tuple(args.prompt_length),
+            max_new_tokens=args.max_new_tokens[0] if len(args.max_new_tokens) == 1 else tuple(args.max_new_tokens),
+            request_rate=args.request_rate,
+            arrival_process=args.arrival_process,
+            seed=args.seed,
+        )
+
+    shape_buckets = None
+    if args.prompt_length_buckets is not None:
+        shape_buckets = GenerationShapeBuckets(args.prompt_length_buckets, args.total_length_buckets)
+
+    benchmark = GenerationLatencyBenchmark(
+        model,
+        requests,
+        static_shapes=use_token_idx,
+        shape_buckets=shape_buckets,
+        lazy_mode=args.device == "hpu",
+        hpu_graphs=args.use_hpu_graphs,
+        seed=args.seed,
+    )
+    results = benchmark.run()
+
+    summary = {key: value for key, value in results.items() if key != "requests"}
+    print(json.dumps(summary, indent=4))
+    if args.output_file is not None:
+        name = args.name if args.name is not None else (args.model_name_or_path or args.tiny_random_model)
+        benchmark.save(results, args.output_file, name=name)
+        logger.info(f"Results written to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,2 @@
 from .distributed_runner import DistributedRunner
+from .tensor_parallel import ColumnParallelLinear, RowParallelLinear, VocabParallelEmbedding, VocabParallelLMHead
@@ -0,0 +1,194 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Tuple
+
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.nn import functional as F
+
+
+def _shard(tensor: torch.Tensor, dim: int, rank: int, world_size: int) -> nn.Parameter:
+    """
+    Returns the `rank`-th of `world_size` contiguous shards of `tensor` along `dim`, as a new parameter so that the
+    full tensor can be freed.
+    """
+    if tensor.shape[dim] % world_size != 0:
+        raise ValueError(
+            f"Dimension {dim} of size {tensor.shape[dim]} cannot be split evenly across {world_size} ranks."
+        )
+    shard_size = tensor.shape[dim] // world_size
+    return nn.Parameter(tensor.detach().narrow(dim, rank * shard_size, shard_size).clone(), requires_grad=False)
+
+
+class ColumnParallelLinear(nn.Module):
+    """
+    Linear layer whose output features are split across the ranks of a process group. Each rank computes its own
+    slice of the output, no communication is needed.
+
+    Args:
+        linear (`torch.nn.Linear`):
+            The layer to shard, its weights are copied.
+        group (`torch.distributed.ProcessGroup`, *optional*):
+            The tensor-parallel process group. Defaults to the default process group.
+    """
+
+    def __init__(self, linear: nn.Linear, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        self.group = group
+        rank, world_size = dist.get_rank(group), dist.get_world_size(group)
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features // world_size
+        self.weight = _shard(linear.weight, 0, rank, world_size)
+        self.bias = _shard(linear.bias, 0, rank, world_size) if linear.bias is not None else None
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return F.linear(hidden_states, self.weight, self.bias)
+
+
+class RowParallelLinear(nn.Module):
+    """
+    Linear layer whose input features are split across the ranks of a process group, typically fed by a
+    [`ColumnParallelLinear`]. The partial outputs of the ranks are summed with an all-reduce, then the bias is added.
+
+    Args:
+        linear (`torch.nn.Linear`):
+            The layer to shard, its weights are copied.
+        group (`torch.distributed.ProcessGroup`, *optional*):
+            The tensor-parallel process group. Defaults to the default process group.
+    """
+
+    def __init__(self, linear: nn.Linear, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        self.group = group
+        rank, world_size = dist.get_rank(group), dist.get_world_size(group)
+        self.in_features = linear.in_features // world_size
+        self.out_features = linear.out_features
+        self.weight = _shard(linear.weight, 1, rank, world_size)
+        self.bias = (
+            nn.Parameter(linear.bias.detach().clone(), requires_grad=False) if linear.bias is not None else None
+        )
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        output = F.linear(hidden_states, self.weight)
+        dist.all_reduce(output, group=self.group)
+        if self.bias is not None:
+            output = output + self.bias
+        return output
+
+
+class VocabParallelEmbedding(nn.Module):
+    """
+    Embedding layer whose vocabulary is split across the ranks of a process group. Each rank looks up the tokens of
+    its slice of the vocabulary and the embeddings are summed with an all-reduce.
+
+    Args:
+        embedding (`torch.nn.Embedding`):
+            The layer to shard, its weights are copied. The vocabulary size should be a multiple of the group size.
+        group (`torch.distributed.ProcessGroup`, *optional*):
+            The tensor-parallel process group. Defaults to the default process group.
+    """
+
+    def __init__(self, embedding: nn.Embedding, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        self.group = group
+        rank, world_size = dist.get_rank(group), dist.get_world_size(group)
+        self.num_embeddings = embedding.num_embeddings // world_size
+        self.embedding_dim = embedding.embedding_dim
+        self.vocab_start = rank * self.num_embeddings
+        self.weight = _shard(embedding.weight, 0, rank, world_size)
+
+    def forward(self, input_ids: torch.LongTensor) -> torch.Tensor:
+        local_ids = input_ids - self.vocab_start
+        out_of_shard = (local_ids < 0) | (local_ids >= self.num_embeddings)
+        embeddings = F.embedding(local_ids.masked_fill(out_of_shard, 0), self.weight)
+        embeddings = embeddings.masked_fill(out_of_shard.unsqueeze(-1), 0.0)
+        dist.all_reduce(embeddings, group=self.group)
+        return embeddings
+
+
+class VocabParallelLMHead(nn.Module):
+    """
+    Language modeling head whose vocabulary is split across the ranks of a process group. Each rank only computes the
+    logits of its slice of the vocabulary, `[..., vocab_size // world_size]`, and the full logits are never gathered:
+    [`~VocabParallelLMHead.argmax`] and [`~VocabParallelLMHead.top_k`] only exchange one or `k` candidates per
+    sequence and per rank.
+
+    Args:
+        lm_head (`torch.nn.Linear`):
+            The head to shard, without bias. Its weights are copied. The vocabulary size should be a multiple of the
+            group size.
+        group (`torch.distributed.ProcessGroup`, *optional*):
+            The tensor-parallel process group. Defaults to the default process group.
+    """
+
+    def __init__(self, lm_head: nn.Linear, group: Optional[dist.ProcessGroup] = None):
+        super().__init__()
+        if lm_head.bias is not None:
+            raise ValueError("`VocabParallelLMHead` does not support heads with a bias.")
+        self.group = group
+        self.rank, self.world_size = dist.get_rank(group), dist.get_world_size(group)
+        self.in_features = lm_head.in_features
+        self.out_features = lm_head.out_features // self.world_size
+        self.vocab_start = self.rank * self.out_features
+        self.weight = _shard(lm_head.weight, 0, self.rank, self.world_size)
+
+    def forward(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        return F.linear(hidden_states, self.weight)
+
+    def _all_gather(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Concatenates `tensor` of all the ranks along the last dimension, in rank order.
+        """
+        tensors = [torch.empty_like(tensor) for _ in range(self.world_size)]
+        dist.all_gather(tensors, tensor.contiguous(), group=self.group)
+        return torch.cat(tensors, dim=-1)
+
+    def argmax(self, scores: torch.FloatTensor) -> torch.LongTensor:
+        """
+        Returns the ids of the tokens with the highest score over the whole vocabulary.
+
+        Args:
+            scores (`torch.FloatTensor` of shape `(batch_size, vocab_size // world_size)`):
+                The scores of the slice of the vocabulary of this rank.
+        """
+        local_ids = torch.argmax(scores, dim=-1, keepdim=True)
+        candidate_scores = self._all_gather(torch.gather(scores, -1, local_ids))
+        candidate_ids = self._all_gather(local_ids + self.vocab_start)
+        # Ties go to the lowest rank, i.e. to the lowest token id like `torch.argmax`
+        best_rank = torch.argmax(candidate_scores, dim=-1, keepdim=True)
+        return torch.gather(candidate_ids, -1, best_rank).squeeze(-1)
+
+    def top_k(self, scores: torch.FloatTensor, k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Returns candidates containing the `k` tokens with the highest scores over the whole vocabulary: the best `k`
+        tokens of each rank, with their scores and ids, of shape `(batch_size, world_size * k)`.
+
+        Args:
+            scores (`torch.FloatTensor` of shape `(batch_size, vocab_size // world_size)`):
+                The scores of the slice of the vocabulary of this rank.
+            k (`int`):
+                The number of tokens to keep.
+        """
+        top_scores, top_ids = torch.topk(scores, min(k, scores.shape[-1]), dim=-1)
+        return self._all_gather(top_scores), self._all_gather(top_ids + self.vocab_start)
+
+    def broadcast(self, tokens: torch.LongTensor) -> torch.LongTensor:
+        """
+        Returns the tokens of the first rank of the group on all ranks, e.g. so that all ranks keep the tokens drawn
+        by the first one when their random number generators differ.
+        """
+        return self._all_gather(tokens.unsqueeze(-1))[..., 0]
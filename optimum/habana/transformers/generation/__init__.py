@@ -1 +1,18 @@
+from .beam_search import StaticBeamSearchScorer, StaticConstrainedBeamSearchScorer
+from .benchmark import BenchmarkRequest, GenerationLatencyBenchmark, load_request_trace, sample_request_trace
+from .bucketing import GenerationShapeBuckets
+from .compaction import BatchCompaction
+from .continuous_batching import ContinuousBatchingRequest, ContinuousBatchingScheduler
+from .logits_process import (
+    BatchSamplingParams,
+    StaticMinLengthLogitsProcessor,
+    StaticMinNewTokensLengthLogitsProcessor,
+    StaticNoRepeatNGramLogitsProcessor,
+    StaticRepetitionPenaltyLogitsProcessor,
+    StaticTopKTopPSampler,
+)
+from .logprobs import LogprobsBuffer
+from .streamers import AsyncTokenStreamer
+from .streaming_session import StreamingGenerationSession
+from .token_fsm import TokenConstraintFSM, json_schema_to_regex
 from .utils import GaudiGenerationMixin
@@ -0,0 +1,569 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import UserDict
+from typing import List, Optional, Tuple, Union
+
+import torch
+from transformers.generation.beam_constraints import Constraint, PhrasalConstraint
+from transformers.generation.beam_search import BeamScorer
+
+
+class StaticBeamSearchScorer(BeamScorer):
+    r"""
+    [`BeamScorer`] implementing beam search decoding on the static-shape generation path.
+
+    It follows the same rules as [`~transformers.BeamSearchScorer`], but finished hypotheses are kept on device in a
+    `(batch_size, num_beams, max_length)` buffer instead of Python lists, so that [`~StaticBeamSearchScorer.process`]
+    does not need any host synchronization. It expects `input_ids` to be a preallocated buffer whose current length is
+    given by `token_idx`, and returns sequences of the length of this buffer, padded with `pad_token_id`.
+
+    Args:
+        batch_size (`int`):
+            Batch size of `input_ids` for which beam search decoding is run in parallel.
+        num_beams (`int`):
+            Number of beams for beam search.
+        device (`torch.device`):
+            The device the hypotheses are kept on.
+        length_penalty (`float`, *optional*, defaults to 1.0):
+            Exponential penalty to the length that is used with beam-based generation. It is applied as an exponent to
+            the sequence length, which in turn is used to divide the score of the sequence.
+        do_early_stopping (`bool` or `str`, *optional*, defaults to `False`):
+            Controls the stopping condition for beam-based methods, see [`~transformers.BeamSearchScorer`].
+        num_beam_hyps_to_keep (`int`, *optional*, defaults to 1):
+            The number of beam hypotheses that shall be returned upon calling [`~StaticBeamSearchScorer.finalize`].
+        num_beam_groups (`int`, *optional*, defaults to 1):
+            Number of groups to divide `num_beams` into in order to ensure diversity among different groups of beams.
+        max_length (`int`, *optional*):
+            The maximum length of the sequence to be generated, only used when `do_early_stopping="never"`. Defaults
+            to the length of `input_ids`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        num_beams: int,
+        device: torch.device,
+        length_penalty: Optional[float] = 1.0,
+        do_early_stopping: Optional[Union[bool, str]] = False,
+        num_beam_hyps_to_keep: Optional[int] = 1,
+        num_beam_groups: Optional[int] = 1,
+        max_length: Optional[int] = None,
+    ):
+        if not isinstance(num_beams, int) or num_beams <= 1:
+            raise ValueError(
+                f"`num_beams` has to be an integer strictly greater than 1, but is {num_beams}. For `num_beams` == 1,"
+                " one should make use of `greedy_search` instead."
+            )
+        if not isinstance(num_beam_groups, int) or (num_beam_groups > num_beams) or (num_beams % num_beam_groups != 0):
+            raise ValueError(
+                "`num_beam_groups` has to be an integer smaller or equal than `num_beams` and `num_beams` has to be"
+                f" divisible by `num_beam_groups`, but is {num_beam_groups} with `num_beams` being {num_beams}."
+            )
+
+        self.batch_size = batch_size
+        self.num_beams = num_beams
+        self.device = device
+        self.length_penalty = length_penalty
+        self.do_early_stopping = do_early_stopping
+        self.num_beam_hyps_to_keep = num_beam_hyps_to_keep
+        self.num_beam_groups = num_beam_groups
+        self.group_size = self.num_beams // self.num_beam_groups
+        self.max_length = max_length
+
+        # Finished hypotheses, allocated on the first call to `process` since their length is the one of `input_ids`
+        self._hyp_ids = None
+        self._hyp_scores = torch.full((batch_size, num_beams), -float("inf"), dtype=torch.float, device=device)
+        self._num_hyps = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self._done = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+    @property
+    def is_done(self) -> bool:
+        return self._done.all()
+
+    def _init_hypotheses(self, input_ids: torch.LongTensor, pad_token_id: Optional[int], token_idx: torch.Tensor):
+        if token_idx is None:
+            raise ValueError("`StaticBeamSearchScorer` requires static shapes, `token_idx` should be given.")
+        if self._hyp_ids is None:
+            self._hyp_ids = input_ids.new_full(
+                (self.batch_size, self.num_beams, input_ids.shape[-1]), pad_token_id if pad_token_id is not None else 0
+            )
+
+    def _add_hypotheses(self, candidate_ids: torch.LongTensor, candidate_scores: torch.FloatTensor):
+        """
+        Merges candidates of shape `(batch_size, num_candidates, max_length)` into the finished hypotheses, keeping the
+        `num_beams` best ones of each batch. Candidates that should not be added have a score of `-inf`.
+        """
+        scores = torch.cat([self._hyp_scores, candidate_scores], dim=-1)
+        self._hyp_scores, best = torch.topk(scores, self.num_beams, dim=-1)
+        ids = torch.cat([self._hyp_ids, candidate_ids], dim=1)
+        self._hyp_ids = torch.gather(ids, 1, best.unsqueeze(-1).expand(-1, -1, ids.shape[-1]))
+        num_candidates = (candidate_scores > -float("inf")).sum(dim=-1)
+        self._num_hyps = torch.clamp(self._num_hyps + num_candidates, max=self.num_beams)
+
+    def _get_eos_mask(self, next_tokens: torch.LongTensor, eos_token_id: Optional[List[int]]) -> torch.BoolTensor:
+        if eos_token_id is None:
+            return torch.zeros_like(next_tokens, dtype=torch.bool)
+        return (next_tokens.unsqueeze(-1) == torch.tensor(eos_token_id, device=next_tokens.device)).any(dim=-1)
+
+    def _add_finished_candidates(
+        self,
+        input_ids: torch.LongTensor,
+        next_scores: torch.FloatTensor,
+        next_indices: torch.LongTensor,
+        is_eos: torch.BoolTensor,
+        eos_token_id: Optional[List[int]],
+        token_idx: torch.Tensor,
+        can_finish: Optional[torch.BoolTensor] = None,
+    ):
+        """
+        Adds the candidates ending with EOS among the `group_size` best ones to the finished hypotheses. If given,
+        `can_finish` of shape `(batch_size, group_size)` tells which beams are allowed to finish.
+        """
+        if eos_token_id is None:
+            return
+        batch_size, num_candidates = next_scores.shape
+        rank = torch.arange(num_candidates, device=next_scores.device)
+        is_new_hyp = is_eos & (rank < self.group_size) & ~self._done.unsqueeze(-1)
+        if can_finish is not None:
+            is_new_hyp = is_new_hyp & torch.gather(can_finish, 1, next_indices)
+
+        hyp_ids = torch.gather(
+            input_ids.view(batch_size, self.group_size, -1),
+            1,
+            next_indices.unsqueeze(-1).expand(-1, -1, input_ids.shape[-1]),
+        )
+        hyp_ids.index_fill_(2, token_idx, eos_token_id[0])
+        # Length of the hypotheses, without the EOS token
+        cur_len = token_idx.to(torch.float)
+        hyp_scores = torch.where(
+            is_new_hyp, next_scores / cur_len**self.length_penalty, torch.full_like(next_scores, -float("inf"))
+        )
+        self._add_hypotheses(hyp_ids, hyp_scores)
+
+    def _select_running_candidates(
+        self,
+        next_scores: torch.FloatTensor,
+        next_tokens: torch.LongTensor,
+        next_indices: torch.LongTensor,
+        is_eos: torch.BoolTensor,
+    ) -> Tuple[torch.FloatTensor, torch.LongTensor, torch.LongTensor]:
+        """
+        Returns the scores, tokens and beam indices within the batch of the `group_size` best candidates that do not end
+        with EOS, in order of score.
+        """
+        num_candidates = next_scores.shape[-1]
+        rank = torch.arange(num_candidates, device=next_scores.device)
+        is_kept = ~is_eos & (torch.cumsum(~is_eos, dim=-1) <= self.group_size)
+        _, kept = torch.topk(is_kept * (num_candidates - rank).to(next_scores.dtype), self.group_size, dim=-1)
+        return (
+            torch.gather(next_scores, 1, kept),
+            torch.gather(next_tokens, 1, kept),
+            torch.gather(next_indices, 1, kept),
+        )
+
+    def _end_step(
+        self,
+        input_ids: torch.LongTensor,
+        next_scores: torch.FloatTensor,
+        next_beam_scores: torch.FloatTensor,
+        next_beam_tokens: torch.LongTensor,
+        next_beam_indices: torch.LongTensor,
+        pad_token_id: Optional[int],
+        token_idx: torch.Tensor,
+    ) -> UserDict:
+        """
+        Pads the batches that are done, updates the done flags and returns the beams of the next step. Beam indices
+        are given within their batch.
+        """
+        batch_size = next_scores.shape[0]
+        batch_offset = torch.arange(batch_size, device=next_scores.device).unsqueeze(-1) * self.group_size
+        next_beam_indices = next_beam_indices + batch_offset
+
+        # Batches that are done only produce padding
+        done = self._done.unsqueeze(-1)
+        next_beam_scores = next_beam_scores.masked_fill(done, 0)
+        if pad_token_id is not None:
+            next_beam_tokens = next_beam_tokens.masked_fill(done, pad_token_id)
+        next_beam_indices = torch.where(done, batch_offset, next_beam_indices)
+
+        # Check if we are done so that we can save a pad step if all(done)
+        is_full = self._num_hyps >= self.num_beams
+        if self.do_early_stopping is True:
+            is_done = is_full
+        else:
+            if self.do_early_stopping is False or self.length_penalty <= 0.0:
+                max_length = token_idx.to(torch.float) + 1
+            else:
+                max_length = self.max_length if self.max_length is not None else input_ids.shape[-1]
+            highest_attainable_score = next_scores.max(dim=-1).values / max_length**self.length_penalty
+            is_done = is_full & (self._hyp_scores.min(dim=-1).values >= highest_attainable_score)
+        self._done = self._done | is_done
+
+        return UserDict(
+            {
+                "next_beam_scores": next_beam_scores.view(-1),
+                "next_beam_tokens": next_beam_tokens.view(-1),
+                "next_beam_indices": next_beam_indices.view(-1),
+            }
+        )
+
+    def process(
+        self,
+        input_ids: torch.LongTensor,
+        next_scores: torch.FloatTensor,
+        next_tokens: torch.LongTensor,
+        next_indices: torch.LongTensor,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        beam_indices: Optional[torch.LongTensor] = None,
+        token_idx: Optional[torch.Tensor] = None,
+    ) -> UserDict:
+        batch_size = next_scores.shape[0]
+        if input_ids.shape[0] != batch_size * self.group_size:
+            raise ValueError(
+                f"A beam size of {input_ids.shape[0]} is used as the input, but a beam size of "
+                f"{batch_size * self.group_size} is expected by the beam scorer."
+            )
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self._init_hypotheses(input_ids, pad_token_id, token_idx)
+
+        is_eos = self._get_eos_mask(next_tokens, eos_token_id)
+        self._add_finished_candidates(input_ids, next_scores, next_indices, is_eos, eos_token_id, token_idx)
+        next_beam_scores, next_beam_tokens, next_beam_indices = self._select_running_candidates(
+            next_scores, next_tokens, next_indices, is_eos
+        )
+
+        return self._end_step(
+            input_ids, next_scores, next_beam_scores, next_beam_tokens, next_beam_indices, pad_token_id, token_idx
+        )
+
+    def _add_running_beams(
+        self,
+        input_ids: torch.LongTensor,
+        final_beam_scores: torch.FloatTensor,
+        token_idx: torch.Tensor,
+        can_finish: Optional[torch.BoolTensor] = None,
+    ):
+        """
+        Adds the open beams of the batches that are not done to the finished hypotheses.
+        """
+        cur_len = token_idx.to(torch.float)
+        final_scores = final_beam_scores.view(self.batch_size, self.num_beams) / cur_len**self.length_penalty
+        final_scores = final_scores.masked_fill(self._done.unsqueeze(-1), -float("inf"))
+        if can_finish is not None:
+            final_scores = final_scores.masked_fill(~can_finish, -float("inf"))
+        self._add_hypotheses(input_ids.view(self.batch_size, self.num_beams, -1), final_scores)
+
+    def _get_best_hypotheses(self, input_ids: torch.LongTensor) -> UserDict:
+        # `_add_hypotheses` keeps the hypotheses sorted
+        best_scores = self._hyp_scores[:, : self.num_beam_hyps_to_keep].reshape(-1)
+        sequences = self._hyp_ids[:, : self.num_beam_hyps_to_keep].reshape(-1, input_ids.shape[-1])
+
+        return UserDict(
+            {
+                "sequences": sequences,
+                "sequence_scores": best_scores,
+                "beam_indices": None,
+            }
+        )
+
+    def finalize(
+        self,
+        input_ids: torch.LongTensor,
+        final_beam_scores: torch.FloatTensor,
+        final_beam_tokens: torch.LongTensor,
+        final_beam_indices: torch.LongTensor,
+        max_length: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        beam_indices: Optional[torch.LongTensor] = None,
+        token_idx: Optional[torch.Tensor] = None,
+    ) -> UserDict:
+        self._init_hypotheses(input_ids, pad_token_id, token_idx)
+        self._add_running_beams(input_ids, final_beam_scores, token_idx)
+        return self._get_best_hypotheses(input_ids)
+
+
+class StaticConstrainedBeamSearchScorer(StaticBeamSearchScorer):
+    r"""
+    [`BeamScorer`] implementing constrained beam search decoding on the static-shape generation path.
+
+    It follows the same algorithm as [`~transformers.ConstrainedBeamSearchScorer`], but the progress of every beam
+    towards each constraint is a tensor of shape `(batch_size * num_beams, num_constraints)` holding the number of
+    tokens of the constraint that have been fulfilled so far, instead of a list of `ConstraintListState` objects. The
+    tokens that advance the constraints, the banks and the selection of the next beams are then computed for the whole
+    batch at once on device.
+
+    Only [`~transformers.PhrasalConstraint`] constraints (i.e. `force_words_ids` given as a `List[List[int]]`) are
+    supported.
+
+    Args:
+        batch_size (`int`):
+            Batch size of `input_ids` for which beam search decoding is run in parallel.
+        num_beams (`int`):
+            Number of beams for beam search.
+        constraints (`List[Constraint]`):
+            A list of positive constraints that must be fulfilled in the generation output.
+        device (`torch.device`):
+            The device the hypotheses and constraint states are kept on.
+        length_penalty (`float`, *optional*, defaults to 1.0):
+            Exponential penalty to the length that is used with beam-based generation.
+        do_early_stopping (`bool` or `str`, *optional*, defaults to `False`):
+            Controls the stopping condition for beam-based methods, see [`~transformers.BeamSearchScorer`].
+        num_beam_hyps_to_keep (`int`, *optional*, defaults to 1):
+            The number of beam hypotheses that shall be returned upon calling
+            [`~StaticConstrainedBeamSearchScorer.finalize`].
+        num_beam_groups (`int`, *optional*, defaults to 1):
+            Number of groups to divide `num_beams` into, only 1 is supported.
+        max_length (`int`, *optional*):
+            The maximum length of the sequence to be generated, only used when `do_early_stopping="never"`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        num_beams: int,
+        constraints: List[Constraint],
+        device: torch.device,
+        length_penalty: Optional[float] = 1.0,
+        do_early_stopping: Optional[Union[bool, str]] = False,
+        num_beam_hyps_to_keep: Optional[int] = 1,
+        num_beam_groups: Optional[int] = 1,
+        max_length: Optional[int] = None,
+    ):
+        super().__init__(
+            batch_size=batch_size,
+            num_beams=num_beams,
+            device=device,
+            length_penalty=length_penalty,
+            do_early_stopping=do_early_stopping,
+            num_beam_hyps_to_keep=num_beam_hyps_to_keep,
+            num_beam_groups=num_beam_groups,
+            max_length=max_length,
+        )
+        if num_beam_groups != 1:
+            raise ValueError("`num_beam_groups` not supported yet for constrained generation.")
+        if len(constraints) == 0:
+            raise ValueError("At least one constraint should be given for constrained generation.")
+        if any(not isinstance(constraint, PhrasalConstraint) for constraint in constraints):
+            raise ValueError(
+                "Only phrasal constraints are supported with static shapes, `force_words_ids` should be a"
+                " `List[List[int]]`."
+            )
+        self.constraints = constraints
+
+        # Tokens of the constraints right-padded with -1, which never matches a token
+        self.constraint_lengths = torch.tensor([constraint.seqlen for constraint in constraints], device=device)
+        self.max_constraint_length = max(constraint.seqlen for constraint in constraints)
+        self.constraint_tokens = torch.full(
+            (len(constraints), self.max_constraint_length), -1, dtype=torch.long, device=device
+        )
+        for i, constraint in enumerate(constraints):
+            self.constraint_tokens[i, : constraint.seqlen] = torch.tensor(constraint.token_ids, device=device)
+
+        # Number of fulfilled tokens of each constraint for every beam, initialized from the prompts
+        self._progress = None
+
+    def _step_constraints(self, progress: torch.LongTensor, tokens: torch.LongTensor) -> torch.LongTensor:
+        """
+        Returns the progress of beams with progress `progress` of shape `(..., num_constraints)` after generating
+        `tokens` of shape `(...)`. This is the tensor version of `ConstraintListState.add`: a beam fulfills one
+        constraint at a time, a token that does not continue the constraint in progress resets it, and otherwise the
+        first pending constraint starting with the token is started.
+        """
+        is_complete = progress >= self.constraint_lengths
+        is_in_progress = (progress > 0) & ~is_complete
+        expected = self.constraint_tokens[
+            torch.arange(len(self.constraints), device=progress.device),
+            torch.clamp(progress, max=self.max_constraint_length - 1),
+        ]
+        matches = expected == tokens.unsqueeze(-1)
+
+        in_progress_step = torch.where(is_in_progress, torch.where(matches, progress + 1, 0), progress)
+        starts = (progress == 0) & (self.constraint_tokens[:, 0] == tokens.unsqueeze(-1))
+        starts = starts & (torch.cumsum(starts, dim=-1) == 1)
+        pending_step = progress + starts.long()
+
+        next_progress = torch.where(is_in_progress.any(dim=-1, keepdim=True), in_progress_step, pending_step)
+        return torch.where(is_complete.all(dim=-1, keepdim=True), progress, next_progress)
+
+    def _get_banks(self, progress: torch.LongTensor) -> torch.LongTensor:
+        """
+        Tensor version of `ConstraintListState.get_bank`: beams are ranked by number of completed constraints, then by
+        progress in the constraint in progress.
+        """
+        is_complete = progress >= self.constraint_lengths
+        is_in_progress = (progress > 0) & ~is_complete
+        in_progress_bank = (self.max_constraint_length - self.constraint_lengths + progress) * is_in_progress
+        return is_complete.sum(dim=-1) * self.max_constraint_length + in_progress_bank.sum(dim=-1)
+
+    def _get_advance_tokens(self, progress: torch.LongTensor) -> Tuple[torch.LongTensor, torch.BoolTensor]:
+        """
+        Tensor version of `ConstraintListState.advance`: returns, for each beam and constraint, the token that would
+        advance the constraint and whether it can be used. Only the constraint in progress can be advanced if there is
+        one, otherwise every pending constraint can be started.
+        """
+        is_complete = progress >= self.constraint_lengths
+        is_in_progress = (progress > 0) & ~is_complete
+        has_in_progress = is_in_progress.any(dim=-1, keepdim=True)
+        tokens = self.constraint_tokens[
+            torch.arange(len(self.constraints), device=progress.device),
+            torch.clamp(progress, max=self.max_constraint_length - 1),
+        ]
+        is_valid = torch.where(has_in_progress, is_in_progress, ~is_complete)
+        # Several pending constraints may start with the same token, it is only proposed once
+        is_duplicate = (tokens.unsqueeze(-1) == tokens.unsqueeze(-2)) & is_valid.unsqueeze(-2)
+        is_duplicate = torch.tril(is_duplicate, diagonal=-1).any(dim=-1)
+        return tokens, is_valid & ~is_duplicate
+
+    def _init_progress(self, input_ids: torch.LongTensor, token_idx: torch.Tensor):
+        if self._progress is not None:
+            return
+        progress = torch.zeros(
+            (input_ids.shape[0], len(self.constraints)), dtype=torch.long, device=self.constraint_tokens.device
+        )
+        # The prompts may already fulfill (part of) the constraints
+        for position in range(input_ids.shape[-1]):
+            next_progress = self._step_constraints(progress, input_ids[:, position])
+            progress = torch.where(position < token_idx, next_progress, progress)
+        self._progress = progress
+
+    def is_complete(self, progress: Optional[torch.LongTensor] = None) -> torch.BoolTensor:
+        """
+        Returns whether the beams fulfill all the constraints.
+        """
+        progress = progress if progress is not None else self._progress
+        return (progress >= self.constraint_lengths).all(dim=-1)
+
+    def process(
+        self,
+        input_ids: torch.LongTensor,
+        next_scores: torch.FloatTensor,
+        next_tokens: torch.LongTensor,
+        next_indices: torch.LongTensor,
+        scores_for_all_vocab: torch.FloatTensor,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        token_idx: Optional[torch.Tensor] = None,
+    ) -> UserDict:
+        batch_size = next_scores.shape[0]
+        num_beams = self.num_beams
+        if input_ids.shape[0] != batch_size * num_beams:
+            raise ValueError(
+                f"A beam size of {input_ids.shape[0]} is used as the input, but a beam size of "
+                f"{batch_size * num_beams} is expected by the beam scorer."
+            )
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self._init_hypotheses(input_ids, pad_token_id, token_idx)
+        self._init_progress(input_ids, token_idx)
+        device = input_ids.device
+        num_constraints = len(self.constraints)
+        vocab_size = scores_for_all_vocab.shape[-1]
+        progress = self._progress.view(batch_size, num_beams, num_constraints)
+
+        # 1. Only beams that fulfill all the constraints can finish
+        is_eos = self._get_eos_mask(next_tokens, eos_token_id)
+        can_finish = self.is_complete().view(batch_size, num_beams)
+        self._add_finished_candidates(
+            input_ids, next_scores, next_indices, is_eos, eos_token_id, token_idx, can_finish=can_finish
+        )
+        topk_scores, topk_tokens, topk_indices = self._select_running_candidates(
+            next_scores, next_tokens, next_indices, is_eos
+        )
+
+        # 2. Every beam also proposes the tokens that advance its constraints, with shape (batch, beams, constraints)
+        advance_tokens, is_advance_valid = self._get_advance_tokens(progress)
+        advance_indices = torch.arange(num_beams, device=device).view(1, -1, 1).expand_as(advance_tokens)
+        advance_scores = torch.gather(
+            scores_for_all_vocab.view(batch_size, num_beams, vocab_size), 2, torch.clamp(advance_tokens, min=0)
+        )
+
+        # Beams with the same sequence (e.g. at the first step) would propose the same hypotheses, only the first one
+        # is kept. Proposals that are already among the best candidates are dropped too.
+        sequences = input_ids.view(batch_size, num_beams, -1)
+        is_same_sequence = (sequences.unsqueeze(2) == sequences.unsqueeze(1)).all(dim=-1)
+        first_same_sequence = torch.argmax(is_same_sequence.int(), dim=-1)
+        is_advance_valid = is_advance_valid & (first_same_sequence == advance_indices[..., 0]).unsqueeze(-1)
+        topk_keys = torch.gather(first_same_sequence, 1, topk_indices) * vocab_size + topk_tokens
+        advance_keys = advance_indices * vocab_size + advance_tokens
+        is_advance_valid = is_advance_valid & ~(advance_keys.view(batch_size, -1, 1) == topk_keys.unsqueeze(1)).any(
+            dim=-1
+        ).view_as(is_advance_valid)
+
+        # 3. Gather all candidates, shape (batch, num_beams + num_beams * num_constraints)
+        all_scores = torch.cat([topk_scores, advance_scores.view(batch_size, -1)], dim=-1)
+        all_tokens = torch.cat([topk_tokens, advance_tokens.view(batch_size, -1)], dim=-1)
+        all_indices = torch.cat([topk_indices, advance_indices.reshape(batch_size, -1)], dim=-1)
+        is_valid = torch.cat(
+            [torch.ones_like(topk_tokens, dtype=torch.bool), is_advance_valid.view(batch_size, -1)], -1
+        )
+        all_progress = self._step_constraints(
+            torch.gather(progress, 1, all_indices.unsqueeze(-1).expand(-1, -1, num_constraints)), all_tokens
+        )
+        all_banks = self._get_banks(all_progress)
+
+        # 4. Sort candidates by bank then score, and take them in turn from each bank: first the best candidate of
+        # every bank, then the second best one, etc.
+        num_candidates = all_scores.shape[-1]
+        positions = torch.arange(num_candidates, device=device)
+        zipped = torch.where(is_valid, all_banks * 100 + all_scores, torch.full_like(all_scores, -float("inf")))
+        order = torch.sort(zipped, dim=-1, descending=True).indices
+        sorted_banks = torch.gather(all_banks, 1, order)
+        is_bank_start = torch.ones_like(sorted_banks, dtype=torch.bool)
+        is_bank_start[:, 1:] = sorted_banks[:, 1:] != sorted_banks[:, :-1]
+        bank_start = torch.cummax(torch.where(is_bank_start, positions, 0), dim=-1).values
+        increments = torch.where(torch.gather(is_valid, 1, order), positions - bank_start, num_candidates + positions)
+        rearrangers = torch.sort(increments, dim=-1, stable=True).indices[:, :num_beams]
+        selected = torch.gather(order, 1, rearrangers)
+        # Without any proposal, the best candidates are kept as they are
+        has_advance = is_advance_valid.view(batch_size, -1).any(dim=-1, keepdim=True)
+        selected = torch.where(has_advance, selected, positions[:num_beams])
+
+        next_beam_scores = torch.gather(all_scores, 1, selected)
+        next_beam_tokens = torch.gather(all_tokens, 1, selected)
+        next_beam_indices = torch.gather(all_indices, 1, selected)
+        next_progress = torch.gather(all_progress, 1, selected.unsqueeze(-1).expand(-1, -1, num_constraints))
+        # Beams of the batches that are done restart from the first beam of their batch
+        self._progress = torch.where(
+            self._done.view(-1, 1, 1), progress[:, :1].expand_as(next_progress), next_progress
+        ).view(-1, num_constraints)
+
+        return self._end_step(
+            input_ids, next_scores, next_beam_scores, next_beam_tokens, next_beam_indices, pad_token_id, token_idx
+        )
+
+    def finalize(
+        self,
+        input_ids: torch.LongTensor,
+        final_beam_scores: torch.FloatTensor,
+        final_beam_tokens: torch.LongTensor,
+        final_beam_indices: torch.LongTensor,
+        max_length: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        token_idx: Optional[torch.Tensor] = None,
+    ) -> UserDict:
+        self._init_hypotheses(input_ids, pad_token_id, token_idx)
+        self._init_progress(input_ids, token_idx)
+
+        # Open beams that fulfill the constraints are added. If there are not enough of them, e.g. because the
+        # constraints are too complex, all open beams are added so that the best outputs are returned anyway.
+        can_finish = self.is_complete().view(self.batch_size, self.num_beams)
+        not_enough = can_finish.sum(dim=-1, keepdim=True) < self.num_beam_hyps_to_keep
+        self._add_running_beams(input_ids, final_beam_scores, token_idx, can_finish=can_finish | not_enough)
+        return self._get_best_hypotheses(input_ids)
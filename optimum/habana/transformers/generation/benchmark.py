@@ -0,0 +1,358 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import inspect
+import json
+import math
+import random
+import time
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+from transformers.generation.streamers import BaseStreamer
+
+from optimum.utils import logging
+
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedModel
+
+    from .bucketing import GenerationShapeBuckets
+
+
+logger = logging.get_logger(__name__)
+
+
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class BenchmarkRequest:
+    """
+    A request of the trace replayed by [`GenerationLatencyBenchmark`].
+
+    Args:
+        arrival_time (`float`):
+            The time the request arrives at, in seconds from the start of the replay.
+        prompt_length (`int`):
+            The number of tokens of the prompt.
+        max_new_tokens (`int`):
+            The number of tokens to generate.
+    """
+
+    arrival_time: float
+    prompt_length: int
+    max_new_tokens: int
+
+
+def _sample_length(length: Union[int, Tuple[int, int]], rng: random.Random) -> int:
+    if isinstance(length, int):
+        return length
+    return rng.randint(*length)
+
+
+def sample_request_trace(
+    num_requests: int,
+    prompt_length: Union[int, Tuple[int, int]],
+    max_new_tokens: Union[int, Tuple[int, int]],
+    request_rate: float = math.inf,
+    arrival_process: str = "poisson",
+    seed: int = 0,
+) -> List[BenchmarkRequest]:
+    """
+    Samples a request trace.
+
+    Args:
+        num_requests (`int`):
+            The number of requests.
+        prompt_length (`int` or `Tuple[int, int]`):
+            The prompt length of all the requests, or the bounds of a uniform distribution.
+        max_new_tokens (`int` or `Tuple[int, int]`):
+            The number of tokens to generate for all the requests, or the bounds of a uniform distribution.
+        request_rate (`float`, *optional*, defaults to `math.inf`):
+            The average number of requests per second. If infinite, all the requests arrive at the start.
+        arrival_process (`str`, *optional*, defaults to `"poisson"`):
+            `"poisson"` for exponentially distributed inter-arrival times, or `"constant"` for evenly spaced arrivals.
+        seed (`int`, *optional*, defaults to 0):
+            The seed of the random number generator.
+
+    Returns:
+        `List[BenchmarkRequest]`: the requests in order of arrival.
+    """
+    if arrival_process not in ("poisson", "constant"):
+        raise ValueError(f"`arrival_process` should be 'poisson' or 'constant', but is {arrival_process}.")
+    if request_rate <= 0:
+        raise ValueError(f"`request_rate` should be strictly positive, but is {request_rate}.")
+
+    rng = random.Random(seed)
+    requests = []
+    arrival_time = 0.0
+    for _ in range(num_requests):
+        requests.append(
+            BenchmarkRequest(
+                arrival_time=arrival_time,
+                prompt_length=_sample_length(prompt_length, rng),
+                max_new_tokens=_sample_length(max_new_tokens, rng),
+            )
+        )
+        if not math.isinf(request_rate):
+            arrival_time += rng.expovariate(request_rate) if arrival_process == "poisson" else 1 / request_rate
+    return requests
+
+
+def load_request_trace(path: str) -> List[BenchmarkRequest]:
+    """
+    Loads a request trace from a JSON file holding a list of objects with the fields of [`BenchmarkRequest`].
+    """
+    with open(path) as f:
+        return sorted((BenchmarkRequest(**request) for request in json.load(f)), key=lambda r: r.arrival_time)
+
+
+class _TimingStreamer(BaseStreamer):
+    """
+    Records the time each generated token reaches the host. Putting tokens in a streamer copies them to the host,
+    which synchronizes the device, so that the timestamps are the ones of the generation steps.
+    """
+
+    def __init__(self):
+        self.skip_prompt = True
+        self.token_times: List[float] = []
+
+    def put(self, value: torch.Tensor):
+        if self.skip_prompt:
+            self.skip_prompt = False
+            return
+        now = time.perf_counter()
+        # Several tokens at once with assisted decoding
+        self.token_times.extend([now] * (value.shape[-1] if value.dim() > 1 else 1))
+
+    def end(self):
+        pass
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if len(values) == 0:
+        return {f"p{p}": None for p in PERCENTILES}
+    values = sorted(values)
+    results = {}
+    for p in PERCENTILES:
+        # Linear interpolation between the closest ranks
+        rank = p / 100 * (len(values) - 1)
+        low = math.floor(rank)
+        high = min(low + 1, len(values) - 1)
+        results[f"p{p}"] = round(values[low] + (values[high] - values[low]) * (rank - low), 6)
+    return results
+
+
+class GenerationLatencyBenchmark:
+    """
+    Replays a request trace against `model.generate` and measures latencies as seen by the requests.
+
+    Requests are served one at a time in order of arrival: a request waits until it arrives and until the previous one
+    is done, and its latencies are counted from its arrival time. The following metrics are reported, in seconds:
+
+    - `time_to_first_token`: from the arrival of a request to its first generated token,
+    - `inter_token_latency`: between two consecutive generated tokens of a request,
+    - `end_to_end_latency`: from the arrival of a request to the end of its generation,
+    - `graph_compilation_time`: the time spent compiling graphs, measured before the replay by running a request of
+      each distinct input shape twice and subtracting the second (compiled) run from the first one.
+
+    Prompts are random token ids. On the static-shape path, each prompt is padded with room for its new tokens and
+    `token_idx` is set, or `shape_buckets` pad them.
+
+    Args:
+        model ([`transformers.PreTrainedModel`]):
+            The model to benchmark.
+        requests (`List[BenchmarkRequest]`):
+            The request trace, see [`sample_request_trace`] and [`load_request_trace`].
+        static_shapes (`bool`, *optional*):
+            Whether to use the static-shape generation path. Defaults to whether the `forward` method of the model
+            accepts `token_idx`.
+        shape_buckets (`GenerationShapeBuckets`, *optional*):
+            Shape buckets passed to `generate` on the static-shape path.
+        lazy_mode (`bool`, *optional*, defaults to `False`):
+            Whether the run is executed in lazy mode or not (i.e. eager mode).
+        hpu_graphs (`bool`, *optional*, defaults to `False`):
+            Whether to use HPU graphs for inference.
+        seed (`int`, *optional*, defaults to 0):
+            The seed used to draw the prompts.
+        generate_kwargs (`dict`, *optional*):
+            Additional keyword arguments passed to `generate`. Generation ignores the end-of-sequence token by default
+            so that each request generates exactly its `max_new_tokens` tokens.
+
+    Example:
+
+    ```python
+    >>> requests = sample_request_trace(64, prompt_length=(16, 128), max_new_tokens=(32, 64), request_rate=2.0)
+    >>> benchmark = GenerationLatencyBenchmark(model, requests, lazy_mode=True, hpu_graphs=True)
+    >>> results = benchmark.run()
+    >>> benchmark.save(results, "bloom_latency.json", name="bloom-7b1")
+    ```
+    """
+
+    def __init__(
+        self,
+        model: "PreTrainedModel",
+        requests: List[BenchmarkRequest],
+        static_shapes: Optional[bool] = None,
+        shape_buckets: Optional["GenerationShapeBuckets"] = None,
+        lazy_mode: bool = False,
+        hpu_graphs: bool = False,
+        seed: int = 0,
+        **generate_kwargs,
+    ):
+        if len(requests) == 0:
+            raise ValueError("The request trace is empty.")
+        if static_shapes is None:
+            static_shapes = "token_idx" in inspect.signature(model.forward).parameters
+        if shape_buckets is not None and not static_shapes:
+            raise ValueError("Shape buckets can only be used with static shapes.")
+
+        self.model = model
+        self.requests = sorted(requests, key=lambda r: r.arrival_time)
+        self.static_shapes = static_shapes
+        self.shape_buckets = shape_buckets
+        self.lazy_mode = lazy_mode
+        self.hpu_graphs = hpu_graphs
+        self.generate_kwargs = {"ignore_eos": True, "do_sample": False, **generate_kwargs}
+
+        pad_token_id = model.generation_config.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = model.generation_config.eos_token_id
+        self.pad_token_id = pad_token_id if pad_token_id is not None else 0
+
+        generator = torch.Generator().manual_seed(seed)
+        self.prompts = [
+            torch.randint(0, model.config.vocab_size, (request.prompt_length,), generator=generator)
+            for request in self.requests
+        ]
+
+    def _get_shape(self, request: BenchmarkRequest) -> Tuple[int, int]:
+        """
+        Returns the (prompt length, total length) of the inputs of `request` given to the model.
+        """
+        if self.shape_buckets is not None:
+            prompt_bucket = self.shape_buckets.get_prompt_bucket(request.prompt_length)
+            return prompt_bucket, self.shape_buckets.get_total_length(prompt_bucket, request.max_new_tokens)
+        return request.prompt_length, request.prompt_length + request.max_new_tokens
+
+    def _generate(self, prompt: torch.LongTensor, max_new_tokens: int, streamer: Optional[BaseStreamer] = None):
+        input_ids = prompt.view(1, -1)
+        kwargs = dict(self.generate_kwargs)
+        if self.shape_buckets is not None:
+            kwargs["shape_buckets"] = self.shape_buckets
+        elif self.static_shapes:
+            kwargs["token_idx"] = torch.tensor(input_ids.shape[-1], device=self.model.device)
+            kwargs["attention_mask"] = F.pad(torch.ones_like(input_ids), (0, max_new_tokens), value=0).to(
+                self.model.device
+            )
+            input_ids = F.pad(input_ids, (0, max_new_tokens), value=self.pad_token_id)
+
+        outputs = self.model.generate(
+            input_ids.to(self.model.device),
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
+            lazy_mode=self.lazy_mode,
+            hpu_graphs=self.hpu_graphs,
+            **kwargs,
+        )
+        # Waits for the device
+        return outputs.cpu()
+
+    def _measure_compilation_time(self) -> float:
+        compilation_time = 0.0
+        shapes = set()
+        for prompt, request in zip(self.prompts, self.requests):
+            shape = self._get_shape(request)
+            if shape in shapes:
+                continue
+            shapes.add(shape)
+            logger.info(f"Compiling graphs for a prompt of {shape[0]} tokens and a total length of {shape[1]} tokens.")
+            durations = []
+            for _ in range(2):
+                start = time.perf_counter()
+                self._generate(prompt, request.max_new_tokens)
+                durations.append(time.perf_counter() - start)
+            compilation_time += max(durations[0] - durations[1], 0.0)
+        return compilation_time
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Measures the graph compilation time, then replays the trace.
+
+        Returns:
+            `Dict[str, Any]`: the aggregated metrics, with the 50th, 90th and 99th percentiles of each latency, and the
+            metrics of each request under `"requests"`.
+        """
+        compilation_time = self._measure_compilation_time()
+
+        per_request = []
+        time_to_first_token = []
+        inter_token_latency = []
+        start_time = time.perf_counter()
+        for prompt, request in zip(self.prompts, self.requests):
+            arrival_time = start_time + request.arrival_time
+            # The server is idle until the request arrives
+            time.sleep(max(arrival_time - time.perf_counter(), 0.0))
+
+            streamer = _TimingStreamer()
+            self._generate(prompt, request.max_new_tokens, streamer=streamer)
+            end_time = time.perf_counter()
+
+            token_times = streamer.token_times
+            latencies = [t1 - t0 for t0, t1 in zip(token_times[:-1], token_times[1:])]
+            inter_token_latency.extend(latencies)
+            if len(token_times) > 0:
+                time_to_first_token.append(token_times[0] - arrival_time)
+            per_request.append(
+                {
+                    **asdict(request),
+                    "num_generated_tokens": len(token_times),
+                    "time_to_first_token": round(token_times[0] - arrival_time, 6) if len(token_times) > 0 else None,
+                    "mean_inter_token_latency": round(sum(latencies) / len(latencies), 6) if latencies else None,
+                    "end_to_end_latency": round(end_time - arrival_time, 6),
+                }
+            )
+        duration = time.perf_counter() - start_time
+
+        num_generated_tokens = sum(r["num_generated_tokens"] for r in per_request)
+        return {
+            "num_requests": len(per_request),
+            "num_generated_tokens": num_generated_tokens,
+            "duration": round(duration, 6),
+            "throughput": round(num_generated_tokens / duration, 6),
+            "graph_compilation_time": round(compilation_time, 6),
+            "time_to_first_token": _percentiles(time_to_first_token),
+            "inter_token_latency": _percentiles(inter_token_latency),
+            "end_to_end_latency": _percentiles([r["end_to_end_latency"] for r in per_request]),
+            "requests": per_request,
+        }
+
+    @staticmethod
+    def save(results: Dict[str, Any], path: str, name: str):
+        """
+        Writes `results` to a JSON file under the key `name`, in the format of the baselines of the tests. Other keys
+        of an existing file are kept.
+        """
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except FileNotFoundError:
+            content = {}
+        content[name] = results
+        with open(path, "w") as f:
+            json.dump(content, f, indent=4)
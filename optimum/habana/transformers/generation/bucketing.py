@@ -0,0 +1,133 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List, Optional, Set, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from optimum.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+
+class GenerationShapeBuckets:
+    """
+    Pads generation inputs to a small, fixed set of shapes so that lazy-mode graphs and HPU graphs can be reused across
+    prompts of different lengths.
+
+    Prompts are left-padded to the smallest prompt-length bucket that fits them, then right-padded so that there is
+    room for `max_new_tokens` new tokens. If total-length buckets are given, the right padding goes up to the smallest
+    total-length bucket that fits. Generation then starts at `token_idx` equal to the prompt bucket.
+
+    Args:
+        prompt_length_buckets (`List[int]`):
+            The lengths prompts can be padded to.
+        total_length_buckets (`List[int]`, *optional*):
+            The lengths the padded prompts plus the generated tokens can be padded to. If not given, sequences are padded
+            to the prompt bucket plus `max_new_tokens`.
+
+    Example:
+
+    ```python
+    >>> buckets = GenerationShapeBuckets(prompt_length_buckets=[32, 64, 128], total_length_buckets=[256, 512])
+    >>> outputs = model.generate(**inputs, max_new_tokens=100, shape_buckets=buckets, lazy_mode=True)
+    >>> buckets.num_shapes
+    1
+    ```
+    """
+
+    def __init__(self, prompt_length_buckets: List[int], total_length_buckets: Optional[List[int]] = None):
+        if len(prompt_length_buckets) == 0:
+            raise ValueError("At least one prompt-length bucket should be given.")
+        if any(bucket <= 0 for bucket in prompt_length_buckets):
+            raise ValueError(f"Buckets should be strictly positive, but got {prompt_length_buckets}.")
+        if total_length_buckets is not None and len(total_length_buckets) == 0:
+            total_length_buckets = None
+
+        self.prompt_length_buckets = sorted(set(prompt_length_buckets))
+        self.total_length_buckets = sorted(set(total_length_buckets)) if total_length_buckets is not None else None
+        # (batch size, total length) of every input that went through `pad_inputs`, the prompt bucket only sets the
+        # value of `token_idx` and does not change the shapes the model is run with
+        self.shapes: Set[Tuple[int, int]] = set()
+
+    @property
+    def num_shapes(self) -> int:
+        """
+        The number of distinct `(batch_size, total_length)` input shapes produced so far, i.e. the number of input shapes
+        the model had to be compiled for.
+        """
+        return len(self.shapes)
+
+    @staticmethod
+    def _find_bucket(length: int, buckets: List[int], name: str) -> int:
+        for bucket in buckets:
+            if bucket >= length:
+                return bucket
+        raise ValueError(f"No {name} bucket can fit a length of {length}, the largest one is {buckets[-1]}.")
+
+    def get_prompt_bucket(self, prompt_length: int) -> int:
+        return self._find_bucket(prompt_length, self.prompt_length_buckets, "prompt-length")
+
+    def get_total_length(self, prompt_bucket: int, max_new_tokens: int) -> int:
+        if self.total_length_buckets is None:
+            return prompt_bucket + max_new_tokens
+        return self._find_bucket(prompt_bucket + max_new_tokens, self.total_length_buckets, "total-length")
+
+    def pad_inputs(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.LongTensor],
+        max_new_tokens: int,
+        pad_token_id: int,
+    ) -> Tuple[torch.LongTensor, torch.LongTensor, torch.Tensor]:
+        """
+        Pads a batch of left-padded prompts into its buckets.
+
+        Args:
+            input_ids (`torch.LongTensor` of shape `(batch_size, prompt_length)`):
+                The prompts.
+            attention_mask (`torch.LongTensor` of shape `(batch_size, prompt_length)`, *optional*):
+                The attention mask of the prompts.
+            max_new_tokens (`int`):
+                The number of tokens that will be generated.
+            pad_token_id (`int`):
+                The id of the *padding* token.
+
+        Returns:
+            `Tuple[torch.LongTensor, torch.LongTensor, torch.Tensor]`: the padded input ids and attention mask, and the
+            `token_idx` to start generation at.
+        """
+        batch_size, prompt_length = input_ids.shape
+        prompt_bucket = self.get_prompt_bucket(prompt_length)
+        total_length = self.get_total_length(prompt_bucket, max_new_tokens)
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        padding = (prompt_bucket - prompt_length, total_length - prompt_bucket)
+        input_ids = F.pad(input_ids, padding, value=pad_token_id)
+        attention_mask = F.pad(attention_mask, padding, value=0)
+        token_idx = torch.tensor(prompt_bucket, device=input_ids.device)
+
+        shape = (batch_size, total_length)
+        if shape not in self.shapes:
+            self.shapes.add(shape)
+            logger.info(
+                f"New generation shape: batch size {batch_size}, total length {total_length} ({self.num_shapes}"
+                " shape(s) so far)."
+            )
+
+        return input_ids, attention_mask, token_idx
@@ -0,0 +1,193 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+
+from optimum.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+
+class BatchCompaction:
+    """
+    Shrinks the batch of greedy search and sampling as sequences finish, so that long-tail sequences do not keep the
+    whole batch running on padding.
+
+    When sequences finish, the rows of the sequences that are still running are gathered into a smaller batch: the input
+    ids, the tensors of the model kwargs with a batch dimension (e.g. the attention mask) and the key/value cache. The
+    rows that are dropped are kept aside and all rows are scattered back to their original positions at the end of
+    generation, finished sequences being padded with `pad_token_id` like without compaction. Whether to compact is
+    decided when generation checks if all sequences are finished, i.e. every `eos_check_interval` steps if given.
+
+    - Without `batch_sizes` (eager mode), the batch is shrunk to the number of running sequences once it is at most
+      `threshold` times the current batch size.
+    - With `batch_sizes` (bucketed mode), the batch is shrunk to the smallest of `batch_sizes` that fits the running
+      sequences once it is smaller than the current batch size, finished rows filling the remaining slots. Generation
+      then only runs with these batch sizes, so lazy-mode graphs and HPU graphs are compiled once per batch size.
+
+    Only for decoder-only models with a cache of tensors whose first dimension is the batch one, possibly merged with
+    the number of heads like in BLOOM.
+
+    Args:
+        batch_sizes (`List[int]`, *optional*):
+            The batch sizes the batch can be shrunk to.
+        threshold (`float`, *optional*, defaults to 0.5):
+            Without `batch_sizes`, the fraction of the current batch size the number of running sequences should be
+            at most for the batch to be shrunk.
+
+    Example:
+
+    ```python
+    >>> compaction = BatchCompaction(batch_sizes=[4, 8, 16])
+    >>> outputs = model.generate(**inputs, max_new_tokens=256, batch_compaction=compaction)
+    >>> compaction.batch_sizes_history
+    [32, 16, 4]
+    ```
+    """
+
+    def __init__(self, batch_sizes: Optional[List[int]] = None, threshold: float = 0.5):
+        if batch_sizes is not None and any(batch_size <= 0 for batch_size in batch_sizes):
+            raise ValueError(f"Batch sizes should be strictly positive, but got {batch_sizes}.")
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"`threshold` should be in (0, 1], but is {threshold}.")
+        self.batch_sizes = sorted(set(batch_sizes)) if batch_sizes else None
+        self.threshold = threshold
+        # Batch sizes generation ran with, starting with the initial one
+        self.batch_sizes_history: List[int] = []
+        self._row_ids = None
+        self._kept_rows = None
+        self._dropped = []
+
+    def start(self, input_ids: torch.LongTensor):
+        """
+        Starts tracking the rows of a new batch.
+        """
+        self.batch_sizes_history = [input_ids.shape[0]]
+        self._row_ids = torch.arange(input_ids.shape[0], device=input_ids.device)
+        self._kept_rows = None
+        # (original row ids, input ids, number of valid tokens) of the rows removed from the batch
+        self._dropped = []
+
+    def get_batch_size(self, num_unfinished: int, batch_size: int) -> int:
+        """
+        Returns the batch size to continue with when `num_unfinished` of the `batch_size` sequences are running.
+        """
+        if self.batch_sizes is None:
+            return num_unfinished if num_unfinished <= self.threshold * batch_size else batch_size
+        for new_batch_size in self.batch_sizes:
+            if new_batch_size >= num_unfinished:
+                return min(new_batch_size, batch_size)
+        return batch_size
+
+    @staticmethod
+    def _select_past(past_key_values: Any, rows: torch.LongTensor, batch_size: int) -> Tuple[Tuple[torch.Tensor]]:
+        if not isinstance(past_key_values, (tuple, list)):
+            raise ValueError(
+                f"Batch compaction does not support key/value caches of type {type(past_key_values).__name__}."
+            )
+        new_past_key_values = ()
+        for layer_past in past_key_values:
+            new_layer_past = ()
+            for past_state in layer_past:
+                num_rows_per_sequence = past_state.shape[0] // batch_size
+                if num_rows_per_sequence > 1:
+                    offsets = torch.arange(num_rows_per_sequence, device=rows.device)
+                    state_rows = (rows.unsqueeze(-1) * num_rows_per_sequence + offsets).view(-1)
+                else:
+                    state_rows = rows
+                new_layer_past += (torch.index_select(past_state, 0, state_rows),)
+            new_past_key_values += (new_layer_past,)
+        return new_past_key_values
+
+    def compact(
+        self,
+        input_ids: torch.LongTensor,
+        unfinished_sequences: torch.LongTensor,
+        model_kwargs: Dict[str, Any],
+    ) -> Tuple[torch.LongTensor, torch.LongTensor, Dict[str, Any]]:
+        """
+        Shrinks the batch if enough sequences are finished, see [`~BatchCompaction.get_batch_size`].
+
+        Args:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The sequences being generated.
+            unfinished_sequences (`torch.LongTensor` of shape `(batch_size,)`):
+                1 for the sequences that are still running, 0 for the finished ones.
+            model_kwargs (`Dict[str, Any]`):
+                The model kwargs of generation, the tensors whose first dimension is the batch size and the cache are
+                shrunk.
+
+        Returns:
+            `Tuple[torch.LongTensor, torch.LongTensor, Dict[str, Any]]`: `input_ids`, `unfinished_sequences` and
+            `model_kwargs`, shrunk or unchanged.
+        """
+        self._kept_rows = None
+        batch_size = input_ids.shape[0]
+        new_batch_size = self.get_batch_size(int(unfinished_sequences.sum()), batch_size)
+        if new_batch_size >= batch_size or new_batch_size == 0:
+            return input_ids, unfinished_sequences, model_kwargs
+
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None and token_idx.dim() > 0:
+            raise ValueError("Batch compaction does not support one `token_idx` per sequence.")
+        num_tokens = int(token_idx) if token_idx is not None else input_ids.shape[-1]
+
+        # Running rows first, then finished rows to fill the batch size, each in their original order
+        order = torch.argsort(unfinished_sequences, descending=True, stable=True)
+        kept, _ = torch.sort(order[:new_batch_size])
+        dropped, _ = torch.sort(order[new_batch_size:])
+        self._dropped.append((self._row_ids[dropped], input_ids[dropped], num_tokens))
+        self._row_ids = self._row_ids[kept]
+        self._kept_rows = kept.tolist()
+
+        new_model_kwargs = {}
+        for key, value in model_kwargs.items():
+            if key == "past_key_values" and value is not None:
+                value = self._select_past(value, kept, batch_size)
+            elif isinstance(value, torch.Tensor) and value.dim() > 0 and value.shape[0] == batch_size:
+                value = torch.index_select(value, 0, kept)
+            new_model_kwargs[key] = value
+
+        self.batch_sizes_history.append(new_batch_size)
+        logger.debug(f"Batch compacted from {batch_size} to {new_batch_size} sequences.")
+        return input_ids[kept], unfinished_sequences[kept], new_model_kwargs
+
+    def select_rows(self, items: Union[List[Any], torch.Tensor]) -> Union[List[Any], torch.Tensor]:
+        """
+        Returns the items of a per-sequence list (e.g. random number generators) or tensor (e.g. sampling parameters)
+        that match the rows kept by the last call to [`~BatchCompaction.compact`].
+        """
+        if self._kept_rows is None:
+            return items
+        if isinstance(items, torch.Tensor):
+            return items[torch.tensor(self._kept_rows, device=items.device)]
+        return [items[row] for row in self._kept_rows]
+
+    def gather(self, input_ids: torch.LongTensor, pad_token_id: int) -> torch.LongTensor:
+        """
+        Returns the sequences of all the rows of the batch in their original order. Rows removed from the batch are
+        padded with `pad_token_id` after the tokens they had when they were removed.
+        """
+        if len(self._dropped) == 0:
+            return input_ids
+        batch_size = self.batch_sizes_history[0]
+        sequences = input_ids.new_full((batch_size, input_ids.shape[-1]), pad_token_id)
+        for row_ids, dropped_input_ids, num_tokens in self._dropped:
+            sequences[row_ids, :num_tokens] = dropped_input_ids[:, :num_tokens]
+        sequences[self._row_ids] = input_ids
+        return sequences
@@ -0,0 +1,382 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import inspect
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+import torch
+from transformers.generation.logits_process import LogitsProcessorList
+
+from optimum.utils import logging
+
+
+if TYPE_CHECKING:
+    from ..models import GaudiBloomPagedKVCache
+
+
+logger = logging.get_logger(__name__)
+
+
+@dataclass
+class ContinuousBatchingRequest:
+    """
+    A generation request handled by [`ContinuousBatchingScheduler`].
+
+    Args:
+        request_id (`int`):
+            Identifier returned by [`ContinuousBatchingScheduler.add_request`].
+        prompt_ids (`torch.LongTensor` of shape `(prompt_length,)`):
+            The tokenized prompt, without padding.
+        max_new_tokens (`int`):
+            The maximum number of tokens to generate for this request.
+        sequences (`torch.LongTensor`, *optional*):
+            The prompt followed by the generated tokens, set once the request is finished.
+    """
+
+    request_id: int
+    prompt_ids: torch.LongTensor
+    max_new_tokens: int
+    sequences: Optional[torch.LongTensor] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.sequences is not None
+
+
+class ContinuousBatchingScheduler:
+    """
+    In-flight batching on top of the static-shape (`token_idx`) generation path.
+
+    The scheduler owns a batch of `num_slots` rows of `max_length` tokens. Each slot has its own position in
+    `token_idx`, its own row in the attention mask and its own rows in the key/value cache. Between two decoding steps,
+    the slots whose sequence is finished are evicted and queued requests are prefilled into the free slots, so that
+    the decoding batch does not keep running rows that are done while others are still generating.
+
+    Two shapes only are ever run by the model: `(1, max_length)` for prefilling a request and `(num_slots, 1)` for a
+    decoding step. This makes the scheduler well-suited for lazy mode and HPU graphs, but it also works in eager mode
+    on CPU.
+
+    Args:
+        model ([`transformers.PreTrainedModel`]):
+            A causal language model whose `forward` accepts `token_idx`, for instance [`GaudiBloomForCausalLM`].
+        num_slots (`int`):
+            The number of sequences decoded together.
+        max_length (`int`):
+            The length of each slot, it bounds the prompt length plus the number of generated tokens of a request.
+        pad_token_id (`int`, *optional*):
+            The id of the *padding* token. Defaults to the one of the model's generation configuration, or to its
+            *end-of-sequence* token.
+        eos_token_id (`Union[int, List[int]]`, *optional*):
+            The id(s) of the *end-of-sequence* token. Defaults to the one of the model's generation configuration.
+        logits_processor (`LogitsProcessorList`, *optional*):
+            Processors applied to the next-token logits at each step.
+        logits_warper (`LogitsProcessorList`, *optional*):
+            Warpers applied to the next-token logits before sampling when `do_sample=True`.
+        do_sample (`bool`, *optional*, defaults to `False`):
+            Whether to sample the next token or to pick it greedily.
+        lazy_mode (`bool`, *optional*, defaults to `False`):
+            Whether the run is executed in lazy mode or not (i.e. eager mode).
+        paged_kv_cache ([`GaudiBloomPagedKVCache`], *optional*):
+            A block-paged key/value cache with `num_slots` rows of `max_length` tokens. If given, a request only holds
+            the blocks needed for its prompt and `max_new_tokens`, prompts are written directly into the cache and
+            requests wait in the queue until enough blocks are free. Otherwise, every slot holds a dense cache of
+            `max_length` tokens.
+
+    Example:
+
+    ```python
+    >>> scheduler = ContinuousBatchingScheduler(model, num_slots=8, max_length=256)
+    >>> request_ids = [scheduler.add_request(tokenizer(p).input_ids, max_new_tokens=64) for p in prompts]
+    >>> outputs = scheduler.run()
+    >>> tokenizer.batch_decode([outputs[i] for i in request_ids], skip_special_tokens=True)
+    ```
+    """
+
+    def __init__(
+        self,
+        model,
+        num_slots: int,
+        max_length: int,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        logits_warper: Optional[LogitsProcessorList] = None,
+        do_sample: bool = False,
+        lazy_mode: bool = False,
+        paged_kv_cache: Optional["GaudiBloomPagedKVCache"] = None,
+    ):
+        if "token_idx" not in inspect.signature(model.forward).parameters:
+            raise ValueError(
+                f"{model.__class__.__name__} does not support static shapes (no `token_idx` argument in its forward"
+                " method), so it cannot be used for continuous batching."
+            )
+        if num_slots < 1:
+            raise ValueError(f"`num_slots` should be a strictly positive integer, but is {num_slots}.")
+        if paged_kv_cache is not None and (
+            paged_kv_cache.batch_size != num_slots or paged_kv_cache.max_length != max_length
+        ):
+            raise ValueError(
+                f"The paged key/value cache has {paged_kv_cache.batch_size} rows of {paged_kv_cache.max_length}"
+                f" tokens, but the scheduler has {num_slots} slots of {max_length} tokens."
+            )
+
+        self.model = model
+        self.num_slots = num_slots
+        self.max_length = max_length
+        self.device = model.device
+
+        eos_token_id = eos_token_id if eos_token_id is not None else model.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_id_tensor = torch.tensor(eos_token_id, device=self.device) if eos_token_id is not None else None
+        pad_token_id = pad_token_id if pad_token_id is not None else model.generation_config.pad_token_id
+        if pad_token_id is None:
+            if eos_token_id is None:
+                raise ValueError("Either `pad_token_id` or `eos_token_id` should be defined for continuous batching.")
+            pad_token_id = eos_token_id[0]
+        self.pad_token_id = pad_token_id
+
+        self.logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        self.logits_warper = logits_warper if logits_warper is not None else LogitsProcessorList()
+        self.do_sample = do_sample
+
+        if lazy_mode:
+            import habana_frameworks.torch.core as htcore
+
+            self.htcore = htcore
+        self.lazy_mode = lazy_mode
+
+        # Per-slot state, kept on device so that a decoding step does not need any host input
+        self.input_ids = torch.full((num_slots, max_length), pad_token_id, dtype=torch.long, device=self.device)
+        self.attention_mask = torch.zeros((num_slots, max_length), dtype=torch.long, device=self.device)
+        # token_idx starts at 1 in free slots so that gathering the current token is always valid
+        self.token_idx = torch.ones(num_slots, dtype=torch.long, device=self.device)
+        self.stop_idx = torch.full((num_slots,), max_length, dtype=torch.long, device=self.device)
+        self.active = torch.zeros(num_slots, dtype=torch.long, device=self.device)
+        # Allocated at the first prefill, once the cache layout of the model is known
+        self.past_key_values = paged_kv_cache
+        self.paged_kv_cache = paged_kv_cache
+
+        self.slots: List[Optional[ContinuousBatchingRequest]] = [None] * num_slots
+        self.queue = deque()
+        self.requests: Dict[int, ContinuousBatchingRequest] = {}
+        self._next_request_id = 0
+
+    @property
+    def num_active(self) -> int:
+        return sum(request is not None for request in self.slots)
+
+    def has_unfinished_requests(self) -> bool:
+        return len(self.queue) > 0 or self.num_active > 0
+
+    def add_request(self, prompt_ids: Union[List[int], torch.LongTensor], max_new_tokens: int) -> int:
+        """
+        Queues a new request. It will be prefilled into the first slot that becomes free.
+
+        Args:
+            prompt_ids (`List[int]` or `torch.LongTensor` of shape `(prompt_length,)`):
+                The tokenized prompt, without padding.
+            max_new_tokens (`int`):
+                The maximum number of tokens to generate for this request.
+
+        Returns:
+            `int`: the id of the request.
+        """
+        prompt_ids = torch.as_tensor(prompt_ids, dtype=torch.long).flatten()
+        if prompt_ids.numel() == 0:
+            raise ValueError("Cannot schedule a request with an empty prompt.")
+        if max_new_tokens < 1:
+            raise ValueError(f"`max_new_tokens` should be a strictly positive integer, but is {max_new_tokens}.")
+        if prompt_ids.numel() + max_new_tokens > self.max_length:
+            raise ValueError(
+                f"The prompt length ({prompt_ids.numel()}) plus `max_new_tokens` ({max_new_tokens}) exceeds the slot"
+                f" length ({self.max_length})."
+            )
+        if self.paged_kv_cache is not None and not self._fits_in_empty_cache(prompt_ids.numel() + max_new_tokens):
+            raise ValueError(
+                f"The prompt length ({prompt_ids.numel()}) plus `max_new_tokens` ({max_new_tokens}) needs more blocks"
+                f" than the paged key/value cache has ({self.paged_kv_cache.num_blocks - 1})."
+            )
+
+        request = ContinuousBatchingRequest(self._next_request_id, prompt_ids, max_new_tokens)
+        self._next_request_id += 1
+        self.requests[request.request_id] = request
+        self.queue.append(request)
+        return request.request_id
+
+    def _fits_in_empty_cache(self, num_tokens: int) -> bool:
+        return self.paged_kv_cache.get_num_blocks(num_tokens) <= self.paged_kv_cache.num_blocks - 1
+
+    def _can_prefill(self, request: ContinuousBatchingRequest) -> bool:
+        if self.paged_kv_cache is None:
+            return True
+        return self.paged_kv_cache.can_allocate(request.prompt_ids.numel() + request.max_new_tokens)
+
+    def _next_tokens(self, input_ids: torch.LongTensor, next_token_logits: torch.FloatTensor) -> torch.LongTensor:
+        next_token_scores = self.logits_processor(input_ids, next_token_logits)
+        if self.do_sample:
+            next_token_scores = self.logits_warper(input_ids, next_token_scores)
+            probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
+            return torch.multinomial(probs, num_samples=1).squeeze(1)
+        return torch.argmax(next_token_scores, dim=-1)
+
+    def _is_eos(self, tokens: torch.LongTensor) -> torch.BoolTensor:
+        if self.eos_token_id_tensor is None:
+            return torch.zeros_like(tokens, dtype=torch.bool)
+        return tokens.unsqueeze(-1).eq(self.eos_token_id_tensor).any(dim=-1)
+
+    def _prefill(self, slot: int, request: ContinuousBatchingRequest):
+        """
+        Runs the prompt of `request` alone and copies its key/value cache, tokens and mask into `slot`.
+        The first token is generated here so that the slot can directly join the next decoding step.
+        """
+        prompt_length = request.prompt_ids.numel()
+        input_ids = torch.full((1, self.max_length), self.pad_token_id, dtype=torch.long, device=self.device)
+        input_ids[0, :prompt_length] = request.prompt_ids.to(self.device)
+        attention_mask = torch.zeros((1, self.max_length), dtype=torch.long, device=self.device)
+        attention_mask[0, :prompt_length] = 1
+        token_idx = torch.tensor(prompt_length, device=self.device)
+
+        if self.paged_kv_cache is not None:
+            # The prompt is written directly into the blocks of the slot
+            self.paged_kv_cache.allocate(slot, prompt_length + request.max_new_tokens)
+            model_inputs = self.model.prepare_inputs_for_generation(
+                input_ids,
+                attention_mask=attention_mask,
+                token_idx=token_idx,
+                paged_kv_cache=self.paged_kv_cache.select([slot]),
+                use_cache=True,
+                trim_logits=True,
+            )
+        else:
+            model_inputs = self.model.prepare_inputs_for_generation(
+                input_ids, attention_mask=attention_mask, token_idx=token_idx, use_cache=True, trim_logits=True
+            )
+        outputs = self.model(**model_inputs, return_dict=True)
+
+        # Models that support it only compute the logits of the last prompt position
+        if outputs.logits.shape[-2] > 1:
+            next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+        else:
+            next_token_logits = outputs.logits[:, -1, :]
+        next_token = self._next_tokens(input_ids, next_token_logits)
+        input_ids.index_copy_(1, token_idx, next_token.unsqueeze(-1))
+        attention_mask.index_fill_(1, token_idx, 1)
+
+        slot_index = torch.tensor([slot], device=self.device)
+        if self.paged_kv_cache is None:
+            if self.past_key_values is None:
+                self.past_key_values = tuple(
+                    tuple(t.new_zeros((self.num_slots * t.shape[0], *t.shape[1:])) for t in layer)
+                    for layer in outputs.past_key_values
+                )
+            for batch_layer, request_layer in zip(self.past_key_values, outputs.past_key_values):
+                for batch_t, request_t in zip(batch_layer, request_layer):
+                    # Works both for caches laid out as [batch * num_heads, ...] and as [batch, num_heads, ...]
+                    batch_t.view(self.num_slots, -1, *batch_t.shape[1:]).index_copy_(
+                        0, slot_index, request_t.view(1, -1, *request_t.shape[1:])
+                    )
+
+        self.input_ids.index_copy_(0, slot_index, input_ids)
+        self.attention_mask.index_copy_(0, slot_index, attention_mask)
+        self.token_idx.index_fill_(0, slot_index, prompt_length + 1)
+        self.stop_idx.index_fill_(0, slot_index, prompt_length + request.max_new_tokens)
+        self.active.index_fill_(0, slot_index, 1)
+        self.slots[slot] = request
+
+        return self._is_eos(next_token)
+
+    def _evict(self, finished_slots: List[int]) -> List[ContinuousBatchingRequest]:
+        finished_requests = []
+        token_idx = self.token_idx.cpu()
+        for slot in finished_slots:
+            request = self.slots[slot]
+            request.sequences = self.input_ids[slot, : token_idx[slot]].to("cpu", copy=True)
+            finished_requests.append(request)
+            self.slots[slot] = None
+            if self.paged_kv_cache is not None:
+                self.paged_kv_cache.free(slot)
+
+        slot_index = torch.tensor(finished_slots, device=self.device)
+        self.input_ids.index_fill_(0, slot_index, self.pad_token_id)
+        self.attention_mask.index_fill_(0, slot_index, 0)
+        self.token_idx.index_fill_(0, slot_index, 1)
+        self.active.index_fill_(0, slot_index, 0)
+        return finished_requests
+
+    def step(self) -> List[ContinuousBatchingRequest]:
+        """
+        Fills the free slots with queued requests and runs one decoding step on all slots.
+
+        Returns:
+            `List[ContinuousBatchingRequest]`: the requests that finished during this step.
+        """
+        finished_requests = []
+        for slot in range(self.num_slots):
+            while self.slots[slot] is None and len(self.queue) > 0 and self._can_prefill(self.queue[0]):
+                request = self.queue.popleft()
+                first_token_is_eos = self._prefill(slot, request)
+                if self.lazy_mode:
+                    self.htcore.mark_step()
+                # A request can be done with its first token, its slot is then directly given to the next one
+                if request.max_new_tokens == 1 or first_token_is_eos.item():
+                    finished_requests.extend(self._evict([slot]))
+
+        if self.num_active == 0:
+            return finished_requests
+
+        model_inputs = self.model.prepare_inputs_for_generation(
+            self.input_ids,
+            past_key_values=self.past_key_values,
+            attention_mask=self.attention_mask,
+            token_idx=self.token_idx,
+            use_cache=True,
+        )
+        outputs = self.model(**model_inputs, return_dict=True)
+
+        # Free slots are run too to keep shapes static, their tokens are replaced by padding
+        next_tokens = self._next_tokens(self.input_ids, outputs.logits[:, -1, :])
+        next_tokens = next_tokens * self.active + self.pad_token_id * (1 - self.active)
+
+        write_idx = self.token_idx.unsqueeze(-1)
+        self.input_ids.scatter_(1, write_idx, next_tokens.unsqueeze(-1))
+        self.attention_mask.scatter_(1, write_idx, self.active.unsqueeze(-1))
+        self.token_idx.add_(self.active)
+
+        if self.lazy_mode:
+            self.htcore.mark_step()
+
+        # Single host synchronization of the step, needed to decide which slots to evict
+        done = self.active.bool() & (self._is_eos(next_tokens) | self.token_idx.ge(self.stop_idx))
+        finished_slots = done.nonzero().flatten().tolist()
+        if len(finished_slots) > 0:
+            finished_requests.extend(self._evict(finished_slots))
+
+        return finished_requests
+
+    def run(self) -> Dict[int, torch.LongTensor]:
+        """
+        Runs decoding steps until all the requests are finished.
+
+        Returns:
+            `Dict[int, torch.LongTensor]`: the prompt followed by the generated tokens for each request id.
+        """
+        outputs = {}
+        while self.has_unfinished_requests():
+            for request in self.step():
+                outputs[request.request_id] = request.sequences
+        return outputs
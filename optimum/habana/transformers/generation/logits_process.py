@@ -0,0 +1,426 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+import torch
+from transformers.generation.configuration_utils import GenerationConfig
+from transformers.generation.logits_process import LogitsProcessor
+
+
+if TYPE_CHECKING:
+    from .compaction import BatchCompaction
+
+
+def _get_lengths(token_idx: torch.Tensor) -> torch.Tensor:
+    """
+    Returns the number of valid tokens of each row of `input_ids` as a tensor of shape `(batch_size, 1)` or `(1, 1)`.
+    On the static-shape path, `token_idx` is the number of valid tokens when the logits processors are called, either
+    for the whole batch (scalar) or for each row.
+    """
+    return token_idx.view(-1, 1)
+
+
+class StaticRepetitionPenaltyLogitsProcessor(LogitsProcessor):
+    r"""
+    [`~transformers.RepetitionPenaltyLogitsProcessor`] for `input_ids` padded to a static shape, where only the first
+    `token_idx` tokens of each row are valid. Tokens that appeared are found with a scatter over the whole buffer
+    masked by position, so shapes are fixed and the padding is never penalized.
+
+    Args:
+        penalty (`float`):
+            The parameter for repetition penalty. 1.0 means no penalty.
+        token_idx (`torch.Tensor`):
+            The tensor holding the number of valid tokens, updated in place during generation.
+    """
+
+    def __init__(self, penalty: float, token_idx: torch.Tensor):
+        if not isinstance(penalty, float) or not (penalty > 0):
+            raise ValueError(f"`penalty` has to be a strictly positive float, but is {penalty}")
+
+        self.penalty = penalty
+        self.token_idx = token_idx
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        positions = torch.arange(input_ids.shape[-1], device=input_ids.device)
+        is_valid = (positions < _get_lengths(self.token_idx)).expand_as(input_ids)
+        has_appeared = torch.zeros_like(scores, dtype=torch.int32).scatter_add_(1, input_ids, is_valid.int()) > 0
+
+        # if score < 0 then repetition penalty has to be multiplied to reduce the previous token probability
+        penalized_scores = torch.where(scores < 0, scores * self.penalty, scores / self.penalty)
+        return torch.where(has_appeared, penalized_scores, scores)
+
+
+class StaticNoRepeatNGramLogitsProcessor(LogitsProcessor):
+    r"""
+    [`~transformers.NoRepeatNGramLogitsProcessor`] for `input_ids` padded to a static shape, where only the first
+    `token_idx` tokens of each row are valid.
+
+    Instead of building a dictionary of n-grams on the host, the n-grams are all the windows of `ngram_size` tokens of
+    the padded buffer. The windows whose first `ngram_size - 1` tokens match the last `ngram_size - 1` valid tokens and
+    that only hold valid tokens ban their last token, with a scatter into a `(batch_size, vocab_size)` mask.
+
+    Args:
+        ngram_size (`int`):
+            All ngrams of size `ngram_size` can only occur once.
+        token_idx (`torch.Tensor`):
+            The tensor holding the number of valid tokens, updated in place during generation.
+    """
+
+    def __init__(self, ngram_size: int, token_idx: torch.Tensor):
+        if not isinstance(ngram_size, int) or ngram_size <= 0:
+            raise ValueError(f"`ngram_size` has to be a strictly positive integer, but is {ngram_size}")
+
+        self.ngram_size = ngram_size
+        self.token_idx = token_idx
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if input_ids.shape[-1] < self.ngram_size:
+            return scores
+
+        lengths = _get_lengths(self.token_idx)
+        # (batch_size, num_windows, ngram_size)
+        ngrams = input_ids.unfold(1, self.ngram_size, 1)
+        window_starts = torch.arange(ngrams.shape[1], device=input_ids.device)
+        is_valid = window_starts + self.ngram_size <= lengths
+
+        # The last ngram_size - 1 valid tokens, positions before the start are clamped but no window is valid then
+        prefix_positions = lengths - self.ngram_size + 1 + torch.arange(self.ngram_size - 1, device=input_ids.device)
+        prefix = torch.gather(input_ids, 1, prefix_positions.clamp(min=0).expand(input_ids.shape[0], -1))
+        matches = (ngrams[:, :, :-1] == prefix.unsqueeze(1)).all(dim=-1) & is_valid
+
+        is_banned = torch.zeros_like(scores, dtype=torch.int32).scatter_add_(1, ngrams[:, :, -1], matches.int()) > 0
+        return scores.masked_fill(is_banned, -float("inf"))
+
+
+class StaticMinLengthLogitsProcessor(LogitsProcessor):
+    r"""
+    [`~transformers.MinLengthLogitsProcessor`] for `input_ids` padded to a static shape: the current length is
+    `token_idx` and not the length of `input_ids`.
+
+    Args:
+        min_length (`int`):
+            The minimum length below which the score of `eos_token_id` is set to `-float("Inf")`.
+        eos_token_id (`Union[int, List[int]]`):
+            The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
+        token_idx (`torch.Tensor`):
+            The tensor holding the number of valid tokens, updated in place during generation.
+    """
+
+    def __init__(self, min_length: int, eos_token_id: Union[int, List[int]], token_idx: torch.Tensor):
+        if not isinstance(min_length, int) or min_length < 0:
+            raise ValueError(f"`min_length` has to be a positive integer, but is {min_length}")
+
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        if not all(isinstance(i, int) for i in eos_token_id) or any(i < 0 for i in eos_token_id):
+            raise ValueError(f"`eos_token_id` has to be a list of positive integers, but is {eos_token_id}")
+
+        self.min_length = min_length
+        self.eos_token_id = eos_token_id
+        self.token_idx = token_idx
+
+    def _get_min_length(self) -> Union[int, torch.Tensor]:
+        return self.min_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        is_eos = torch.zeros(scores.shape[-1], dtype=torch.bool, device=scores.device)
+        is_eos[self.eos_token_id] = True
+        is_too_short = _get_lengths(self.token_idx) < self._get_min_length()
+        return scores.masked_fill(is_eos & is_too_short, -float("inf"))
+
+
+class StaticMinNewTokensLengthLogitsProcessor(StaticMinLengthLogitsProcessor):
+    r"""
+    [`~transformers.MinNewTokensLengthLogitsProcessor`] for `input_ids` padded to a static shape: the number of new
+    tokens is counted from the value of `token_idx` when the processor is created, as the length of the padded
+    `input_ids` is not the prompt length.
+
+    Args:
+        min_new_tokens (`int`):
+            The minimum *new* tokens length below which the score of `eos_token_id` is set to `-float("Inf")`.
+        eos_token_id (`Union[int, List[int]]`):
+            The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
+        token_idx (`torch.Tensor`):
+            The tensor holding the number of valid tokens, updated in place during generation.
+    """
+
+    def __init__(self, min_new_tokens: int, eos_token_id: Union[int, List[int]], token_idx: torch.Tensor):
+        super().__init__(min_new_tokens, eos_token_id, token_idx)
+        self.min_new_tokens = min_new_tokens
+        # Kept on device, no synchronization
+        self.prompt_length = _get_lengths(token_idx).clone()
+
+    def _get_min_length(self) -> Union[int, torch.Tensor]:
+        return self.prompt_length + self.min_new_tokens
+
+
+def _to_row_tensor(values: Optional[Union[List, torch.Tensor]], dtype: torch.dtype) -> Optional[torch.Tensor]:
+    if values is None:
+        return None
+    values = torch.as_tensor(values, dtype=dtype)
+    if values.dim() != 1:
+        raise ValueError(f"Per-sequence parameters should have one value per sequence, but got shape {values.shape}.")
+    return values
+
+
+class BatchSamplingParams:
+    r"""
+    Sampling parameters given per sequence, so that requests with different settings share one batch of static shape
+    and the same compiled graphs. Passed to `generate` as `sampling_params` for sampling with static shapes
+    (`token_idx`).
+
+    Temperature, top-k and top-p are applied by [`StaticTopKTopPSampler`] with masks over the `max(top_k)` best tokens
+    of each sequence, each seed initializes the random number generator of its sequence, and a sequence is finished
+    once it generated its `max_new_tokens` tokens, generation running up to the largest of them. Parameters that are
+    not given are taken from the generation config for all sequences.
+
+    Args:
+        temperature (`Union[List[float], torch.FloatTensor]`, *optional*):
+            The temperature of each sequence.
+        top_k (`Union[List[int], torch.LongTensor]`, *optional*):
+            The number of highest probability vocabulary tokens to keep for each sequence.
+        top_p (`Union[List[float], torch.FloatTensor]`, *optional*):
+            The top-p cutoff of each sequence, 1.0 to disable it.
+        seed (`List[int]`, *optional*):
+            The seed of the random number generator of each sequence.
+        max_new_tokens (`Union[List[int], torch.LongTensor]`, *optional*):
+            The maximum number of tokens to generate for each sequence.
+
+    Example:
+
+    ```python
+    >>> sampling_params = BatchSamplingParams(temperature=[0.7, 1.0], top_k=[50, 5], seed=[0, 1], max_new_tokens=[64, 8])
+    >>> outputs = model.generate(**inputs, do_sample=True, sampling_params=sampling_params)
+    ```
+    """
+
+    def __init__(
+        self,
+        temperature: Optional[Union[List[float], torch.FloatTensor]] = None,
+        top_k: Optional[Union[List[int], torch.LongTensor]] = None,
+        top_p: Optional[Union[List[float], torch.FloatTensor]] = None,
+        seed: Optional[List[int]] = None,
+        max_new_tokens: Optional[Union[List[int], torch.LongTensor]] = None,
+    ):
+        self.temperature = _to_row_tensor(temperature, torch.float)
+        self.top_k = _to_row_tensor(top_k, torch.long)
+        self.top_p = _to_row_tensor(top_p, torch.float)
+        self.seed = [int(row_seed) for row_seed in seed] if seed is not None else None
+        self.max_new_tokens = _to_row_tensor(max_new_tokens, torch.long)
+
+        if self.max_new_tokens is not None and (self.max_new_tokens <= 0).any():
+            raise ValueError(f"`max_new_tokens` should be strictly positive integers, but is {max_new_tokens}.")
+        batch_sizes = {
+            len(values)
+            for values in (self.temperature, self.top_k, self.top_p, self.seed, self.max_new_tokens)
+            if values is not None
+        }
+        if len(batch_sizes) > 1:
+            raise ValueError(f"All per-sequence parameters should have the same length, but got {batch_sizes}.")
+        self.batch_size = batch_sizes.pop() if batch_sizes else None
+
+    def to(self, device: torch.device) -> "BatchSamplingParams":
+        """
+        Returns the same parameters with their tensors on `device`.
+        """
+        return BatchSamplingParams(
+            temperature=self.temperature.to(device) if self.temperature is not None else None,
+            top_k=self.top_k.to(device) if self.top_k is not None else None,
+            top_p=self.top_p.to(device) if self.top_p is not None else None,
+            seed=self.seed,
+            max_new_tokens=self.max_new_tokens.to(device) if self.max_new_tokens is not None else None,
+        )
+
+
+class StaticTopKTopPSampler:
+    r"""
+    Sampling stage that applies temperature, top-k and top-p warping and draws the next tokens at once, in place of
+    [`~transformers.TemperatureLogitsWarper`], [`~transformers.TopKLogitsWarper`],
+    [`~transformers.TopPLogitsWarper`] and a multinomial draw over the whole vocabulary.
+
+    The `top_k` best scores are selected with a partial sort, and the temperature, the top-p cutoff and the draw only
+    apply to them. All shapes only depend on the batch size and `top_k`, so the cost of a step does not grow with the
+    vocabulary size beyond the selection. Exactly `top_k` tokens are kept, even if other tokens have the same score as
+    the last one.
+
+    `top_k`, `top_p` and `temperature` can also be given per sequence as tensors of shape `(batch_size,)`: the
+    `max(top_k)` best scores are selected and each sequence masks the tokens beyond its own `top_k`, so sequences with
+    different parameters share the same shapes.
+
+    Args:
+        top_k (`Union[int, torch.LongTensor]`):
+            The number of highest probability vocabulary tokens to keep.
+        top_p (`Union[float, torch.FloatTensor]`, *optional*, defaults to 1.0):
+            If set to < 1, only the smallest set of most probable tokens with probabilities that add up to `top_p` or
+            higher are kept for generation.
+        temperature (`Union[float, torch.FloatTensor]`, *optional*, defaults to 1.0):
+            The value used to module the logits distribution.
+        min_tokens_to_keep (`int`, *optional*, defaults to 1):
+            Minimum number of tokens that cannot be filtered.
+        generators (`List[torch.Generator]`, *optional*):
+            One random number generator per sequence, so that the tokens drawn for a sequence do not depend on the
+            other sequences of the batch. If not given, the default generator is used.
+    """
+
+    def __init__(
+        self,
+        top_k: Union[int, torch.LongTensor],
+        top_p: Union[float, torch.FloatTensor] = 1.0,
+        temperature: Union[float, torch.FloatTensor] = 1.0,
+        min_tokens_to_keep: int = 1,
+        generators: Optional[List[torch.Generator]] = None,
+    ):
+        # Per-sequence tensors are checked once here, and kept as columns to broadcast over the selected tokens
+        self.row_top_k = None
+        if isinstance(top_k, torch.Tensor):
+            if top_k.dtype.is_floating_point or (top_k <= 0).any():
+                raise ValueError(f"`top_k` has to be strictly positive integers, but is {top_k}")
+            self.row_top_k = top_k.clamp(min=min_tokens_to_keep).view(-1, 1)
+            top_k = int(top_k.max())
+        elif not isinstance(top_k, int) or top_k <= 0:
+            raise ValueError(f"`top_k` has to be a strictly positive integer, but is {top_k}")
+        if isinstance(top_p, torch.Tensor):
+            if (top_p < 0).any() or (top_p > 1.0).any():
+                raise ValueError(f"`top_p` has to be floats >= 0 and <= 1, but is {top_p}")
+            self._use_top_p = bool((top_p < 1.0).any())
+            top_p = top_p.view(-1, 1)
+        else:
+            top_p = float(top_p)
+            if top_p < 0 or top_p > 1.0:
+                raise ValueError(f"`top_p` has to be a float >= 0 and <= 1, but is {top_p}")
+            self._use_top_p = top_p < 1.0
+        if isinstance(temperature, torch.Tensor):
+            if not temperature.dtype.is_floating_point or not (temperature > 0).all():
+                raise ValueError(f"`temperature` has to be strictly positive floats, but is {temperature}")
+            temperature = temperature.view(-1, 1)
+        elif not isinstance(temperature, float) or not (temperature > 0):
+            raise ValueError(f"`temperature` has to be a strictly positive float, but is {temperature}")
+
+        self.top_k = max(top_k, min_tokens_to_keep)
+        self.top_p = top_p
+        self.temperature = temperature
+        self.min_tokens_to_keep = min_tokens_to_keep
+        self.generators = generators
+
+    @classmethod
+    def from_generation_config(
+        cls,
+        generation_config: GenerationConfig,
+        generators: Optional[List[torch.Generator]] = None,
+        sampling_params: Optional[BatchSamplingParams] = None,
+    ) -> Optional["StaticTopKTopPSampler"]:
+        """
+        Returns the sampler equivalent to the logits warpers of `generation_config`, or `None` if they cannot be fused
+        because there is no `top_k` to bound the selection or other warpers are used. The temperature, top-k and top-p
+        of `sampling_params` take precedence over the ones of `generation_config`.
+        """
+        if sampling_params is None:
+            sampling_params = BatchSamplingParams()
+        if (
+            (sampling_params.top_k is None and not generation_config.top_k)
+            or (generation_config.typical_p is not None and generation_config.typical_p < 1.0)
+            or (generation_config.epsilon_cutoff is not None and 0.0 < generation_config.epsilon_cutoff < 1.0)
+            or (generation_config.eta_cutoff is not None and 0.0 < generation_config.eta_cutoff < 1.0)
+        ):
+            return None
+
+        top_k, top_p, temperature = sampling_params.top_k, sampling_params.top_p, sampling_params.temperature
+        if top_k is None:
+            top_k = generation_config.top_k
+        if top_p is None:
+            top_p = generation_config.top_p if generation_config.top_p is not None else 1.0
+        if temperature is None:
+            temperature = float(generation_config.temperature) if generation_config.temperature is not None else 1.0
+        return cls(
+            top_k=top_k,
+            top_p=top_p,
+            temperature=temperature,
+            min_tokens_to_keep=2 if generation_config.num_beams > 1 else 1,
+            generators=generators,
+        )
+
+    def warp(self, scores: torch.FloatTensor) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Returns the warped scores of the `top_k` best tokens, in decreasing order, and their ids. Tokens removed by
+        top-p get a score of `-float("Inf")`.
+        """
+        top_scores, top_ids = torch.topk(scores, min(self.top_k, scores.shape[-1]), dim=-1)
+        if self.row_top_k is not None:
+            positions = torch.arange(top_scores.shape[-1], device=top_scores.device)
+            top_scores = top_scores.masked_fill(positions >= self.row_top_k, -float("inf"))
+        if isinstance(self.temperature, torch.Tensor):
+            top_scores = top_scores / self.temperature.to(top_scores.dtype)
+        elif self.temperature != 1.0:
+            top_scores = top_scores / self.temperature
+
+        if self._use_top_p:
+            # Same cutoff as `TopPLogitsWarper`, scores in increasing order
+            sorted_scores = top_scores.flip(-1)
+            cumulative_probs = sorted_scores.softmax(dim=-1).cumsum(dim=-1)
+            sorted_indices_to_remove = cumulative_probs <= (1 - self.top_p)
+            sorted_indices_to_remove[..., -self.min_tokens_to_keep :] = False
+            top_scores = top_scores.masked_fill(sorted_indices_to_remove.flip(-1), -float("inf"))
+
+        return top_scores, top_ids
+
+    def sample(self, top_scores: torch.FloatTensor, top_ids: torch.LongTensor) -> torch.LongTensor:
+        """
+        Draws one token per sequence among the tokens returned by [`~StaticTopKTopPSampler.warp`].
+        """
+        probs = torch.nn.functional.softmax(top_scores, dim=-1)
+        if self.generators is None:
+            next_indices = torch.multinomial(probs, num_samples=1)
+        else:
+            if len(self.generators) != probs.shape[0]:
+                raise ValueError(
+                    f"{len(self.generators)} generators were given, but there are {probs.shape[0]} sequences."
+                )
+            # Inverse transform sampling with one uniform per sequence, so that the token drawn for a sequence does
+            # not depend on the number of tokens masked by its top-k and top-p, e.g. when batched with a larger top-k
+            uniforms = torch.cat(
+                [torch.rand(1, generator=generator, device=generator.device) for generator in self.generators]
+            ).to(probs.device)
+            cumulative_probs = probs.float().cumsum(dim=-1)
+            next_indices = (cumulative_probs < uniforms.unsqueeze(-1)).sum(dim=-1, keepdim=True)
+            # Kept tokens come first, rounding errors must not pick a masked token
+            next_indices = torch.minimum(next_indices, (probs > 0).sum(dim=-1, keepdim=True) - 1)
+        return torch.gather(top_ids, 1, next_indices).squeeze(1)
+
+    def select_rows(self, batch_compaction: "BatchCompaction"):
+        """
+        Keeps the generators and per-sequence parameters of the rows kept by the last call to
+        [`~BatchCompaction.compact`].
+        """
+        if self.generators is not None:
+            self.generators = batch_compaction.select_rows(self.generators)
+        if self.row_top_k is not None:
+            self.row_top_k = batch_compaction.select_rows(self.row_top_k)
+        if isinstance(self.top_p, torch.Tensor):
+            self.top_p = batch_compaction.select_rows(self.top_p)
+        if isinstance(self.temperature, torch.Tensor):
+            self.temperature = batch_compaction.select_rows(self.temperature)
+
+    @staticmethod
+    def scatter(top_scores: torch.FloatTensor, top_ids: torch.LongTensor, vocab_size: int) -> torch.FloatTensor:
+        """
+        Returns the warped scores over the whole vocabulary, the other tokens getting a score of `-float("Inf")`.
+        """
+        return torch.full(
+            (top_scores.shape[0], vocab_size), -float("inf"), dtype=top_scores.dtype, device=top_scores.device
+        ).scatter_(1, top_ids, top_scores)
+
+    def __call__(self, scores: torch.FloatTensor) -> torch.LongTensor:
+        return self.sample(*self.warp(scores))
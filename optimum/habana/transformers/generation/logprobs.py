@@ -0,0 +1,111 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional
+
+import torch
+
+
+class LogprobsBuffer:
+    """
+    Compact alternative to `output_scores=True` that keeps only log-probabilities of the generated tokens.
+
+    Instead of a tuple with the full-vocabulary scores of each step, `generate` writes the log-probability of the chosen
+    token, and optionally the `num_top_logprobs` highest log-probabilities with their token ids, into device tensors
+    preallocated for `max_new_tokens` steps. Log-probabilities are computed from the scores the tokens are picked from,
+    i.e. after the logits processors (and the logits warpers when sampling). Steps after the end of generation are left
+    to zero, and the tokens chosen for finished sequences are the ones the model picked before they are replaced by
+    padding.
+
+    After generation, the following attributes are available:
+
+    - `token_logprobs` (`torch.FloatTensor` of shape `(batch_size, max_new_tokens)`): the log-probability of each
+      generated token,
+    - `top_logprobs` (`torch.FloatTensor` of shape `(batch_size, max_new_tokens, num_top_logprobs)`): the highest
+      log-probabilities of each step, in decreasing order, `-inf` where fewer tokens could be picked,
+    - `top_token_ids` (`torch.LongTensor` of shape `(batch_size, max_new_tokens, num_top_logprobs)`): the
+      corresponding token ids.
+
+    Supported with greedy search, contrastive search and sampling.
+
+    Args:
+        num_top_logprobs (`int`, *optional*, defaults to 0):
+            The number of highest log-probabilities to keep at each step in addition to the one of the chosen token.
+
+    Example:
+
+    ```python
+    >>> logprobs = LogprobsBuffer(num_top_logprobs=5)
+    >>> outputs = model.generate(**inputs, max_new_tokens=32, logprobs=logprobs)
+    >>> sequence_logprobs = logprobs.token_logprobs.sum(dim=-1)
+    ```
+    """
+
+    def __init__(self, num_top_logprobs: int = 0):
+        if num_top_logprobs < 0:
+            raise ValueError(f"`num_top_logprobs` should be a positive integer, but is {num_top_logprobs}.")
+        self.num_top_logprobs = num_top_logprobs
+        self.token_logprobs = None
+        self.top_logprobs = None
+        self.top_token_ids = None
+        self._step = None
+
+    def allocate(self, batch_size: int, max_new_tokens: int, device: torch.device):
+        """
+        Allocates the buffers for a new call to `generate`.
+        """
+        self.token_logprobs = torch.zeros((batch_size, max_new_tokens), dtype=torch.float, device=device)
+        self.top_logprobs = torch.full(
+            (batch_size, max_new_tokens, self.num_top_logprobs), -float("inf"), dtype=torch.float, device=device
+        )
+        self.top_token_ids = torch.zeros(
+            (batch_size, max_new_tokens, self.num_top_logprobs), dtype=torch.long, device=device
+        )
+        # Kept on device so that writing a step does not depend on its value
+        self._step = torch.zeros(1, dtype=torch.long, device=device)
+
+    def put(
+        self, scores: torch.FloatTensor, next_tokens: torch.LongTensor, token_ids: Optional[torch.LongTensor] = None
+    ):
+        """
+        Writes the log-probabilities of a generation step.
+
+        Args:
+            scores (`torch.FloatTensor` of shape `(batch_size, num_tokens)`):
+                The scores the next tokens are picked from.
+            next_tokens (`torch.LongTensor` of shape `(batch_size,)`):
+                The chosen tokens.
+            token_ids (`torch.LongTensor` of shape `(batch_size, num_tokens)`, *optional*):
+                The ids of the tokens of `scores` if they only cover part of the vocabulary, e.g. after top-k.
+        """
+        if self._step is None:
+            raise ValueError("The buffers of `LogprobsBuffer` should be allocated before writing to them.")
+        logprobs = torch.log_softmax(scores.float(), dim=-1)
+        next_tokens = next_tokens.view(-1, 1)
+
+        if token_ids is None:
+            token_logprobs = torch.gather(logprobs, 1, next_tokens)
+        else:
+            token_logprobs = logprobs.masked_fill(token_ids != next_tokens, 0).sum(dim=-1, keepdim=True)
+        self.token_logprobs.index_copy_(1, self._step, token_logprobs)
+
+        num_top_logprobs = min(self.num_top_logprobs, logprobs.shape[-1])
+        if num_top_logprobs > 0:
+            top_logprobs, top_indices = torch.topk(logprobs, num_top_logprobs, dim=-1)
+            top_token_ids = top_indices if token_ids is None else torch.gather(token_ids, 1, top_indices)
+            self.top_logprobs[..., :num_top_logprobs].index_copy_(1, self._step, top_logprobs.unsqueeze(1))
+            self.top_token_ids[..., :num_top_logprobs].index_copy_(1, self._step, top_token_ids.unsqueeze(1))
+
+        self._step.add_(1)
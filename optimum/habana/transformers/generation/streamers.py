@@ -0,0 +1,222 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from queue import Queue
+from threading import Thread
+from typing import TYPE_CHECKING, List, Optional, Union
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerBase
+
+
+class AsyncTokenStreamer(BaseStreamer):
+    """
+    Streamer that does not synchronize the device with the host at every generation step.
+
+    The tokens generated at each step are written into a ring of `num_chunks` device buffers of `chunk_size` steps. Once
+    a buffer is full, it is handed to a background thread that copies it to the host, so the decoding loop only waits
+    when all the buffers are still being copied. The background thread optionally decodes the tokens incrementally, and
+    the results can be consumed by iterating over the streamer, typically while `generate` runs in another thread.
+
+    Each item of the iteration holds the tokens of the batch copied at once: a `torch.LongTensor` of shape
+    `(batch_size, num_tokens)` if no tokenizer is given, or else a list with the new text of each sequence. Text is
+    only emitted up to the last space or newline so that words are not split.
+
+    Args:
+        tokenizer (`PreTrainedTokenizerBase`, *optional*):
+            The tokenizer used to decode the tokens. If not given, token ids are streamed.
+        chunk_size (`int`, *optional*, defaults to 8):
+            The number of generation steps copied to the host at once.
+        num_chunks (`int`, *optional*, defaults to 2):
+            The number of device buffers in the ring.
+        skip_prompt (`bool`, *optional*, defaults to `False`):
+            Whether to skip the prompt given to `generate` or not.
+        timeout (`float`, *optional*):
+            The timeout for the output queue. If `None`, the queue will block indefinitely.
+        decode_kwargs (`dict`, *optional*):
+            Additional keyword arguments to pass to the tokenizer's `decode` method.
+
+    Example:
+
+    ```python
+    >>> from threading import Thread
+
+    >>> streamer = AsyncTokenStreamer(tokenizer, chunk_size=16, skip_prompt=True, skip_special_tokens=True)
+    >>> thread = Thread(target=model.generate, kwargs=dict(**inputs, streamer=streamer, lazy_mode=True))
+    >>> thread.start()
+    >>> for texts in streamer:
+    ...     print(texts[0], end="")
+    ```
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional["PreTrainedTokenizerBase"] = None,
+        chunk_size: int = 8,
+        num_chunks: int = 2,
+        skip_prompt: bool = False,
+        timeout: Optional[float] = None,
+        **decode_kwargs,
+    ):
+        if chunk_size < 1:
+            raise ValueError(f"`chunk_size` should be a strictly positive integer, but is {chunk_size}.")
+        if num_chunks < 1:
+            raise ValueError(f"`num_chunks` should be a strictly positive integer, but is {num_chunks}.")
+
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.num_chunks = num_chunks
+        self.skip_prompt = skip_prompt
+        self.timeout = timeout
+        self.decode_kwargs = decode_kwargs
+
+        self.output_queue = Queue()
+        self.stop_signal = None
+
+        # Device buffers are allocated at the first step since the batch size and the device are not known before
+        self.free_buffers = None
+        self.buffer = None
+        self.slots = None
+        self.num_buffered_steps = 0
+
+        self.thread = None
+        self.transfer_queue = None
+        self.next_tokens_are_prompt = True
+
+        # Incremental detokenization state, one entry per sequence
+        self.token_caches: List[List[int]] = []
+        self.print_lens: List[int] = []
+
+    def put(self, value: torch.Tensor):
+        """
+        Receives the tokens of a generation step of shape `(batch_size,)`, or several tokens of shape
+        `(batch_size, num_tokens)` such as the prompt. Tokens of a single step are buffered on device.
+        """
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        self.next_tokens_are_prompt = False
+
+        if self.thread is None:
+            self.transfer_queue = Queue()
+            self.thread = Thread(target=self._transfer_loop, daemon=True)
+            self.thread.start()
+
+        if value.dim() == 1:
+            if self.buffer is None or self.buffer.shape[0] != value.shape[0] or self.buffer.device != value.device:
+                self._flush()
+                self._allocate_buffers(value)
+            self.buffer.index_copy_(
+                1, self.slots[self.num_buffered_steps : self.num_buffered_steps + 1], value.unsqueeze(-1)
+            )
+            self.num_buffered_steps += 1
+            if self.num_buffered_steps == self.chunk_size:
+                self._flush()
+        else:
+            # Buffered steps come first
+            self._flush()
+            self.transfer_queue.put((value, value.shape[-1], None))
+
+    def end(self):
+        """
+        Flushes the buffered steps and signals the end of the stream once they have been copied to the host.
+        """
+        if self.thread is not None:
+            self._flush()
+            self.transfer_queue.put(None)
+            self.thread.join()
+            self.thread = None
+        else:
+            self.output_queue.put(self.stop_signal, timeout=self.timeout)
+        self.next_tokens_are_prompt = True
+
+    def _allocate_buffers(self, value: torch.Tensor):
+        shape = (value.shape[0], self.chunk_size)
+        self.free_buffers = Queue()
+        for _ in range(self.num_chunks):
+            self.free_buffers.put(torch.empty(shape, dtype=value.dtype, device=value.device))
+        self.slots = torch.arange(self.chunk_size, device=value.device)
+        self.buffer = self.free_buffers.get()
+
+    def _flush(self):
+        """
+        Hands the current buffer to the background thread and takes the next one, waiting for a copy to finish if
+        none is free.
+        """
+        if self.num_buffered_steps == 0:
+            return
+        self.transfer_queue.put((self.buffer, self.num_buffered_steps, self.free_buffers))
+        self.buffer = self.free_buffers.get()
+        self.num_buffered_steps = 0
+
+    def _transfer_loop(self):
+        while True:
+            item = self.transfer_queue.get()
+            if item is None:
+                break
+            tokens, num_tokens, free_buffers = item
+            # The only device synchronization, outside of the decoding loop. A copy is made so that the buffer can be
+            # reused even when it is already on the host.
+            host_tokens = tokens[:, :num_tokens].to("cpu", copy=True)
+            if free_buffers is not None:
+                # The buffer can be written again
+                free_buffers.put(tokens)
+            self.output_queue.put(self._process(host_tokens), timeout=self.timeout)
+
+        if self.tokenizer is not None and any(len(cache) > 0 for cache in self.token_caches):
+            self.output_queue.put(self._decode(flush=True), timeout=self.timeout)
+        self.token_caches = []
+        self.print_lens = []
+        self.output_queue.put(self.stop_signal, timeout=self.timeout)
+
+    def _process(self, tokens: torch.LongTensor) -> Union[torch.LongTensor, List[str]]:
+        if self.tokenizer is None:
+            return tokens
+        if len(self.token_caches) != tokens.shape[0]:
+            self.token_caches = [[] for _ in range(tokens.shape[0])]
+            self.print_lens = [0] * tokens.shape[0]
+        for cache, row in zip(self.token_caches, tokens.tolist()):
+            cache.extend(row)
+        return self._decode()
+
+    def _decode(self, flush: bool = False) -> List[str]:
+        """
+        Returns the new text of every sequence, up to the last space or newline unless `flush` is True.
+        """
+        texts = []
+        for i, cache in enumerate(self.token_caches):
+            text = self.tokenizer.decode(cache, **self.decode_kwargs)
+            if flush or text.endswith("\n"):
+                printable_text = text[self.print_lens[i] :]
+                self.token_caches[i] = []
+                self.print_lens[i] = 0
+            else:
+                printable_text = text[self.print_lens[i] : text.rfind(" ") + 1]
+                self.print_lens[i] += len(printable_text)
+            texts.append(printable_text)
+        return texts
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Union[torch.LongTensor, List[str]]:
+        value = self.output_queue.get(timeout=self.timeout)
+        if value is self.stop_signal:
+            raise StopIteration()
+        return value
@@ -0,0 +1,233 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import TYPE_CHECKING, List, Optional, Union
+
+import torch
+import torch.nn.functional as F
+from transformers.generation.logits_process import LogitsProcessorList
+from transformers.generation.streamers import BaseStreamer
+
+
+if TYPE_CHECKING:
+    from ..models import GaudiSinkKVCache
+
+
+class StreamingGenerationSession:
+    """
+    Unbounded generation with a rolling [`GaudiSinkKVCache`], e.g. for a long-running chat session.
+
+    Each call to [`~StreamingGenerationSession.generate`] continues the stream of the previous ones: the new input ids
+    (e.g. the next message of the user) are appended after the tokens generated so far and the session generates the
+    following tokens. The cache only keeps the attention sinks and the most recent tokens, so memory does not grow with
+    the length of the stream and a decoding step always runs with the same shapes, `(batch_size, 1)` for the inputs
+    and the number of slots of the cache for the keys and values. Inputs are written into the cache in a single
+    forward pass while the window is not full, token by token afterwards.
+
+    All the rows of the batch advance together and cannot be padded. Rows that are finished keep being fed
+    `pad_token_id` until all the rows are finished or `max_new_tokens` is reached. The new tokens are written into a
+    buffer of fixed size at `token_idx`, so that the selection of the next tokens also runs with the same shapes at
+    every step.
+
+    Args:
+        model ([`transformers.PreTrainedModel`]):
+            A causal language model supporting [`GaudiSinkKVCache`], i.e. [`GaudiBloomForCausalLM`] or
+            [`GaudiGPT2LMHeadModel`].
+        sink_kv_cache ([`GaudiSinkKVCache`]):
+            The cache of the session.
+        pad_token_id (`int`, *optional*):
+            The id of the *padding* token. Defaults to the one of the model's generation configuration, or to its
+            *end-of-sequence* token.
+        eos_token_id (`Union[int, List[int]]`, *optional*):
+            The id(s) of the *end-of-sequence* token. Defaults to the one of the model's generation configuration.
+        logits_processor (`LogitsProcessorList`, *optional*):
+            Processors applied to the next-token logits at each step. They are given the buffer of the input ids and
+            of the tokens generated by the current call to `generate`, padded with `pad_token_id` after the
+            `token_idx` valid tokens as on the static-shape path of `generate`, see e.g.
+            [`StaticRepetitionPenaltyLogitsProcessor`].
+        logits_warper (`LogitsProcessorList`, *optional*):
+            Warpers applied to the next-token logits before sampling when `do_sample=True`.
+        do_sample (`bool`, *optional*, defaults to `False`):
+            Whether to sample the next token or to pick it greedily.
+        lazy_mode (`bool`, *optional*, defaults to `False`):
+            Whether the run is executed in lazy mode or not (i.e. eager mode).
+        eos_check_interval (`int`, *optional*):
+            If set, whether all the rows are finished is only checked every `eos_check_interval` steps, also in lazy
+            mode. Otherwise, it is checked at every step in eager mode and never in lazy mode, as it syncs with the
+            host.
+
+    Example:
+
+    ```python
+    >>> cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=1020, dtype=torch.bfloat16, device="hpu")
+    >>> session = StreamingGenerationSession(model, cache, lazy_mode=True, eos_check_interval=16)
+    >>> for message in messages:
+    ...     reply = session.generate(tokenizer(message, return_tensors="pt").input_ids, max_new_tokens=256)
+    ...     print(tokenizer.decode(reply[0], skip_special_tokens=True))
+    ```
+    """
+
+    def __init__(
+        self,
+        model,
+        sink_kv_cache: "GaudiSinkKVCache",
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        logits_warper: Optional[LogitsProcessorList] = None,
+        do_sample: bool = False,
+        lazy_mode: bool = False,
+        eos_check_interval: Optional[int] = None,
+    ):
+        if eos_check_interval is not None and eos_check_interval < 1:
+            raise ValueError(
+                f"`eos_check_interval` should be a strictly positive integer, but is {eos_check_interval}."
+            )
+        self.model = model
+        self.sink_kv_cache = sink_kv_cache
+        self.device = model.device
+
+        eos_token_id = eos_token_id if eos_token_id is not None else model.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_id_tensor = torch.tensor(eos_token_id, device=self.device) if eos_token_id is not None else None
+        pad_token_id = pad_token_id if pad_token_id is not None else model.generation_config.pad_token_id
+        if pad_token_id is None:
+            if eos_token_id is None:
+                raise ValueError("Either `pad_token_id` or `eos_token_id` should be defined for streaming generation.")
+            pad_token_id = eos_token_id[0]
+        self.pad_token_id = pad_token_id
+
+        self.logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        self.logits_warper = logits_warper if logits_warper is not None else LogitsProcessorList()
+        self.do_sample = do_sample
+
+        if lazy_mode:
+            import habana_frameworks.torch.core as htcore
+
+            self.htcore = htcore
+        self.lazy_mode = lazy_mode
+        self.eos_check_interval = eos_check_interval
+
+        # Number of valid tokens in the buffer given to the logits processors, updated in place
+        self.token_idx = torch.zeros((), dtype=torch.long, device=self.device)
+
+        # Last generated tokens, written into the cache at the beginning of the next call to `generate`
+        self._pending_ids = None
+
+    @property
+    def num_tokens(self) -> int:
+        """
+        The number of tokens of the stream written into the cache so far.
+        """
+        return int(self.sink_kv_cache.num_tokens)
+
+    def reset(self):
+        """
+        Starts a new stream, e.g. a new conversation.
+        """
+        self.sink_kv_cache.reset()
+        self._pending_ids = None
+
+    def _forward(self, input_ids: torch.LongTensor) -> torch.FloatTensor:
+        outputs = self.model(input_ids=input_ids, past_key_values=self.sink_kv_cache, use_cache=True, return_dict=True)
+        if self.lazy_mode:
+            self.htcore.mark_step()
+        return outputs.logits[:, -1, :]
+
+    def _next_tokens(self, input_ids: torch.LongTensor, next_token_logits: torch.FloatTensor) -> torch.LongTensor:
+        next_token_scores = self.logits_processor(input_ids, next_token_logits)
+        if self.do_sample:
+            next_token_scores = self.logits_warper(input_ids, next_token_scores)
+            probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
+            return torch.multinomial(probs, num_samples=1).squeeze(1)
+        return torch.argmax(next_token_scores, dim=-1)
+
+    def generate(
+        self, input_ids: torch.LongTensor, max_new_tokens: int, streamer: Optional[BaseStreamer] = None
+    ) -> torch.LongTensor:
+        """
+        Appends `input_ids` to the stream and generates the next tokens.
+
+        Args:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The new tokens of the stream, without padding. They can be empty to continue generating.
+            max_new_tokens (`int`):
+                The maximum number of tokens to generate.
+            streamer (`BaseStreamer`, *optional*):
+                Streamer object that receives `input_ids` and then the generated tokens as they are generated.
+
+        Returns:
+            `torch.LongTensor` of shape `(batch_size, num_generated_tokens)`: the generated tokens, finished rows are
+            padded with `pad_token_id`.
+        """
+        if max_new_tokens < 1:
+            raise ValueError(f"`max_new_tokens` should be a strictly positive integer, but is {max_new_tokens}.")
+        input_ids = torch.as_tensor(input_ids, dtype=torch.long, device=self.device)
+        if input_ids.dim() == 1:
+            input_ids = input_ids.unsqueeze(0)
+        if input_ids.shape[0] != self.sink_kv_cache.batch_size:
+            raise ValueError(
+                f"The batch size is {input_ids.shape[0]} but the cache has {self.sink_kv_cache.batch_size} rows."
+            )
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+
+        new_ids = input_ids if self._pending_ids is None else torch.cat([self._pending_ids, input_ids], dim=-1)
+        if new_ids.shape[-1] == 0:
+            raise ValueError("The stream is empty, `input_ids` should contain at least one token.")
+
+        # Inputs are written in one forward pass while they fit before the window wraps around, token by token after
+        num_slots = self.sink_kv_cache.num_slots
+        num_tokens = self.num_tokens
+        start = 0
+        while start < new_ids.shape[-1]:
+            chunk_length = min(new_ids.shape[-1] - start, max(num_slots - num_tokens, 1))
+            next_token_logits = self._forward(new_ids[:, start : start + chunk_length])
+            start += chunk_length
+            num_tokens += chunk_length
+
+        input_length = input_ids.shape[-1]
+        generated_ids = F.pad(input_ids, (0, max_new_tokens), value=self.pad_token_id)
+        self.token_idx.fill_(input_length)
+        unfinished_sequences = torch.ones(input_ids.shape[0], dtype=torch.long, device=self.device)
+        num_generated_tokens = max_new_tokens
+        for step in range(max_new_tokens):
+            next_tokens = self._next_tokens(generated_ids, next_token_logits)
+            next_tokens = next_tokens * unfinished_sequences + self.pad_token_id * (1 - unfinished_sequences)
+            generated_ids.index_copy_(1, self.token_idx, next_tokens.unsqueeze(-1))
+            self.token_idx.add_(1)
+            if streamer is not None:
+                streamer.put(next_tokens.cpu())
+
+            if self.eos_token_id_tensor is not None:
+                is_eos = next_tokens.unsqueeze(-1).eq(self.eos_token_id_tensor).any(dim=-1)
+                unfinished_sequences = unfinished_sequences.mul((~is_eos).long())
+                if self.eos_check_interval is None:
+                    check_eos = not self.lazy_mode
+                else:
+                    check_eos = (step + 1) % self.eos_check_interval == 0
+                if check_eos and unfinished_sequences.max() == 0:
+                    num_generated_tokens = step + 1
+                    break
+            if step < max_new_tokens - 1:
+                next_token_logits = self._forward(next_tokens.unsqueeze(-1))
+
+        generated_ids = generated_ids[:, input_length : input_length + num_generated_tokens]
+        # The last tokens are written into the cache by the next call
+        self._pending_ids = generated_ids[:, -1:]
+        if streamer is not None:
+            streamer.end()
+        return generated_ids
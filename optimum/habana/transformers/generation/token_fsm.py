@@ -0,0 +1,611 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Union
+
+import torch
+from torch.nn import functional as F
+from transformers import PreTrainedTokenizerBase
+
+from optimum.utils import logging
+
+
+logger = logging.get_logger(__name__)
+
+
+# Compiled automata, most recently used last
+_COMPILED_FSMS: "OrderedDict[str, TokenConstraintFSM]" = OrderedDict()
+_MAX_COMPILED_FSMS = 16
+
+# Code point ranges of the character classes of regular expressions
+_DIGITS = ((ord("0"), ord("9")),)
+_WORD = ((ord("0"), ord("9")), (ord("A"), ord("Z")), (ord("_"), ord("_")), (ord("a"), ord("z")))
+_SPACES = ((ord("\t"), ord("\r")), (ord(" "), ord(" ")))
+_CLASS_ESCAPES = {"d": _DIGITS, "w": _WORD, "s": _SPACES}
+_CHAR_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+
+# JSON values, see https://www.json.org
+_JSON_STRING_CHAR = r'(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+_JSON_INTEGER = r"-?(?:0|[1-9][0-9]*)"
+_JSON_NUMBER = r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
+_JSON_TYPES = {"integer": _JSON_INTEGER, "number": _JSON_NUMBER, "boolean": r"(?:true|false)", "null": "null"}
+
+
+class _CharSet:
+    """
+    Set of characters given by code point ranges, possibly negated.
+    """
+
+    def __init__(self, ranges: Tuple[Tuple[int, int], ...], negated: bool = False):
+        self.ranges = ranges
+        self.negated = negated
+
+    def __contains__(self, char: str) -> bool:
+        code = ord(char)
+        return any(low <= code <= high for low, high in self.ranges) != self.negated
+
+
+class _RegexParser:
+    """
+    Parses a regular expression into a tree of `("chars", _CharSet)`, `("concat", [nodes])`, `("alt", [nodes])` and
+    `("repeat", node, min, max)` nodes. Supports literals, escapes, character classes, `.`, groups, alternations and
+    the `*`, `+`, `?` and `{m,n}` quantifiers, the whole string having to match.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.position = 0
+
+    def parse(self):
+        node = self._parse_alternation()
+        if self.position != len(self.pattern):
+            self._error("unbalanced parenthesis")
+        return node
+
+    def _error(self, message: str):
+        raise ValueError(f"Unsupported regular expression {self.pattern!r} at position {self.position}: {message}.")
+
+    def _peek(self) -> Optional[str]:
+        return self.pattern[self.position] if self.position < len(self.pattern) else None
+
+    def _next(self) -> str:
+        if self.position >= len(self.pattern):
+            self._error("unexpected end")
+        char = self.pattern[self.position]
+        self.position += 1
+        return char
+
+    def _parse_alternation(self):
+        branches = [self._parse_concatenation()]
+        while self._peek() == "|":
+            self.position += 1
+            branches.append(self._parse_concatenation())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _parse_concatenation(self):
+        nodes = []
+        while self._peek() not in (None, "|", ")"):
+            nodes.append(self._parse_repetition())
+        return ("concat", nodes)
+
+    def _parse_repetition(self):
+        node = self._parse_atom()
+        while self._peek() in ("*", "+", "?", "{"):
+            char = self._next()
+            if char == "*":
+                node = ("repeat", node, 0, None)
+            elif char == "+":
+                node = ("repeat", node, 1, None)
+            elif char == "?":
+                node = ("repeat", node, 0, 1)
+            else:
+                match = re.compile(r"(\d+)(?:(,)(\d*))?\}").match(self.pattern, self.position)
+                if match is None:
+                    self._error("invalid quantifier")
+                self.position = match.end()
+                minimum = int(match.group(1))
+                maximum = minimum if match.group(2) is None else (int(match.group(3)) if match.group(3) else None)
+                if maximum is not None and maximum < minimum:
+                    self._error("invalid quantifier")
+                node = ("repeat", node, minimum, maximum)
+            # Lazy and greedy quantifiers match the same strings
+            if self._peek() == "?":
+                self.position += 1
+        return node
+
+    def _parse_atom(self):
+        char = self._next()
+        if char == "(":
+            if self.pattern.startswith("?:", self.position):
+                self.position += 2
+            elif self._peek() == "?":
+                self._error("only non-capturing groups are supported")
+            node = self._parse_alternation()
+            if self._next() != ")":
+                self._error("unbalanced parenthesis")
+            return node
+        if char == "[":
+            return ("chars", self._parse_class())
+        if char == ".":
+            return ("chars", _CharSet(((ord("\n"), ord("\n")),), negated=True))
+        if char == "\\":
+            return ("chars", self._parse_escape())
+        if char in ("^", "$"):
+            # The whole string has to match
+            return ("concat", [])
+        if char in ("*", "+", "?", "{", ")"):
+            self._error(f"unexpected {char!r}")
+        return ("chars", _CharSet(((ord(char), ord(char)),)))
+
+    def _parse_escape(self, in_class: bool = False) -> _CharSet:
+        char = self._next()
+        if char in _CLASS_ESCAPES:
+            return _CharSet(_CLASS_ESCAPES[char])
+        if char.lower() in _CLASS_ESCAPES:
+            if in_class:
+                self._error(f"\\{char} is not supported in character classes")
+            return _CharSet(_CLASS_ESCAPES[char.lower()], negated=True)
+        if char in ("x", "u"):
+            num_digits = 2 if char == "x" else 4
+            digits = self.pattern[self.position : self.position + num_digits]
+            if not re.fullmatch(f"[0-9a-fA-F]{{{num_digits}}}", digits):
+                self._error(f"invalid \\{char} escape")
+            self.position += num_digits
+            code = int(digits, 16)
+        else:
+            code = ord(_CHAR_ESCAPES.get(char, char))
+        return _CharSet(((code, code),))
+
+    def _parse_class(self) -> _CharSet:
+        negated = self._peek() == "^"
+        if negated:
+            self.position += 1
+        ranges = []
+        first = True
+        while True:
+            char = self._next()
+            if char == "]" and not first:
+                break
+            first = False
+            if char == "\\":
+                char_set = self._parse_escape(in_class=True)
+                if len(char_set.ranges) > 1 or char_set.ranges[0][0] != char_set.ranges[0][1]:
+                    ranges.extend(char_set.ranges)
+                    continue
+                low = char_set.ranges[0][0]
+            else:
+                low = ord(char)
+            high = low
+            if self._peek() == "-" and self.pattern[self.position + 1 : self.position + 2] not in ("]", ""):
+                self.position += 1
+                char = self._next()
+                high = self._parse_escape(in_class=True).ranges[0][0] if char == "\\" else ord(char)
+                if high < low:
+                    self._error("invalid character range")
+            ranges.append((low, high))
+        return _CharSet(tuple(ranges), negated=negated)
+
+
+class _NFA:
+    """
+    Thompson automaton of a regular expression, with a lazily built deterministic automaton on top of it whose states
+    are sets of states of this one.
+    """
+
+    def __init__(self, pattern: str):
+        self.epsilons: List[List[int]] = []
+        self.edges: List[List[Tuple[_CharSet, int]]] = []
+        start, self.final = self._build(_RegexParser(pattern).parse())
+        self.start = self.closure({start})
+        self._steps: Dict[Tuple[FrozenSet[int], str], FrozenSet[int]] = {}
+
+    def _new_state(self) -> int:
+        self.epsilons.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def _build(self, node) -> Tuple[int, int]:
+        kind = node[0]
+        if kind == "chars":
+            start, end = self._new_state(), self._new_state()
+            self.edges[start].append((node[1], end))
+            return start, end
+        if kind == "concat":
+            start = end = self._new_state()
+            for child in node[1]:
+                child_start, child_end = self._build(child)
+                self.epsilons[end].append(child_start)
+                end = child_end
+            return start, end
+        if kind == "alt":
+            start, end = self._new_state(), self._new_state()
+            for child in node[1]:
+                child_start, child_end = self._build(child)
+                self.epsilons[start].append(child_start)
+                self.epsilons[child_end].append(end)
+            return start, end
+
+        # Repetition: `minimum` mandatory copies, then a loop or `maximum - minimum` optional copies
+        _, child, minimum, maximum = node
+        start = end = self._new_state()
+        for _ in range(minimum):
+            child_start, child_end = self._build(child)
+            self.epsilons[end].append(child_start)
+            end = child_end
+        if maximum is None:
+            child_start, child_end = self._build(child)
+            loop_end = self._new_state()
+            self.epsilons[end] += [child_start, loop_end]
+            self.epsilons[child_end] += [child_start, loop_end]
+            return start, loop_end
+        optional_end = self._new_state()
+        for _ in range(maximum - minimum):
+            child_start, child_end = self._build(child)
+            self.epsilons[end] += [child_start, optional_end]
+            end = child_end
+        self.epsilons[end].append(optional_end)
+        return start, optional_end
+
+    def closure(self, states) -> FrozenSet[int]:
+        stack, closure = list(states), set(states)
+        while stack:
+            for next_state in self.epsilons[stack.pop()]:
+                if next_state not in closure:
+                    closure.add(next_state)
+                    stack.append(next_state)
+        return frozenset(closure)
+
+    def step(self, states: FrozenSet[int], char: str) -> FrozenSet[int]:
+        key = (states, char)
+        if key not in self._steps:
+            self._steps[key] = self.closure(
+                {next_state for state in states for char_set, next_state in self.edges[state] if char in char_set}
+            )
+        return self._steps[key]
+
+    def is_accepting(self, states: FrozenSet[int]) -> bool:
+        return self.final in states
+
+
+def _escape_json(value: Any) -> str:
+    return re.escape(json.dumps(value, ensure_ascii=False))
+
+
+def json_schema_to_regex(schema: Union[str, Dict[str, Any]], whitespace_pattern: str = r"[ ]?") -> str:
+    """
+    Returns a regular expression matching the JSON documents valid against `schema`.
+
+    Supported keywords are `type` (`object` with `properties`, `array` with `items`, `string`, `integer`, `number`,
+    `boolean` and `null`, or a list of them), `enum`, `const`, `anyOf`, `oneOf`, `required`, `minLength` and `maxLength`
+    for strings, and `minItems` and `maxItems` for arrays. Object properties are generated in the order of the schema,
+    the ones that are not required being optional.
+
+    Args:
+        schema (`Union[str, Dict[str, Any]]`):
+            The JSON schema, as a dictionary or serialized.
+        whitespace_pattern (`str`, *optional*, defaults to `r"[ ]?"`):
+            The regular expression of the whitespace allowed between the tokens of the documents.
+    """
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    whitespace = f"(?:{whitespace_pattern})"
+
+    if "const" in schema:
+        return _escape_json(schema["const"])
+    if "enum" in schema:
+        return "(?:" + "|".join(_escape_json(value) for value in schema["enum"]) + ")"
+    for keyword in ("anyOf", "oneOf"):
+        if keyword in schema:
+            return "(?:" + "|".join(json_schema_to_regex(sub, whitespace_pattern) for sub in schema[keyword]) + ")"
+    if "type" not in schema:
+        raise ValueError(
+            f"Unsupported JSON schema, it should have a `type`, `enum`, `const`, `anyOf` or `oneOf`: {schema}"
+        )
+
+    schema_type = schema["type"]
+    if isinstance(schema_type, list):
+        return (
+            "(?:"
+            + "|".join(
+                json_schema_to_regex({**schema, "type": sub_type}, whitespace_pattern) for sub_type in schema_type
+            )
+            + ")"
+        )
+    if schema_type in _JSON_TYPES:
+        return _JSON_TYPES[schema_type]
+    if schema_type == "string":
+        min_length, max_length = schema.get("minLength", 0), schema.get("maxLength", None)
+        return f'"{_JSON_STRING_CHAR}{{{min_length},{max_length if max_length is not None else ""}}}"'
+    if schema_type == "array":
+        item = json_schema_to_regex(
+            schema.get("items", {"type": ["string", "number", "boolean", "null"]}), whitespace_pattern
+        )
+        min_items, max_items = schema.get("minItems", 0), schema.get("maxItems", None)
+        if max_items == 0:
+            return rf"\[{whitespace}\]"
+        more_items = f"{{{max(min_items - 1, 0)},{max_items - 1 if max_items is not None else ''}}}"
+        items = f"{item}(?:{whitespace},{whitespace}{item}){more_items}"
+        return rf"\[{whitespace}{items if min_items > 0 else f'(?:{items})?'}{whitespace}\]"
+    if schema_type == "object":
+        if "properties" not in schema:
+            raise ValueError("Only JSON schemas of objects with `properties` are supported.")
+        required = set(schema.get("required", []))
+        properties = [
+            (
+                f"{_escape_json(name)}{whitespace}:{whitespace}{json_schema_to_regex(sub, whitespace_pattern)}",
+                name in required,
+            )
+            for name, sub in schema["properties"].items()
+        ]
+        # One alternative per property that can be the first one, i.e. that only follows optional properties
+        alternatives = []
+        for first, (first_property, first_required) in enumerate(properties):
+            following = "".join(
+                f"(?:{whitespace},{whitespace}{prop})" + ("" if is_required else "?")
+                for prop, is_required in properties[first + 1 :]
+            )
+            alternatives.append(first_property + following)
+            if first_required:
+                break
+        else:
+            # All properties are optional
+            alternatives.append("")
+        return rf"\{{{whitespace}(?:{'|'.join(alternatives)}){whitespace}\}}"
+    raise ValueError(f"Unsupported JSON schema type {schema_type!r}.")
+
+
+def _get_token_strings(tokenizer: PreTrainedTokenizerBase) -> List[Optional[str]]:
+    """
+    Returns the text of each token of `tokenizer`, or `None` for special tokens and for tokens that do not decode to
+    complete characters.
+    """
+    special_ids = set(tokenizer.all_special_ids)
+    tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    texts = []
+    for token_id, token in enumerate(tokens):
+        if token_id in special_ids or token is None:
+            texts.append(None)
+            continue
+        text = tokenizer.convert_tokens_to_string([token])
+        # SentencePiece drops the leading space of the first token of a text
+        if token.startswith("▁") and not text.startswith(" "):
+            text = " " + text
+        texts.append(None if "�" in text else text)
+    return texts
+
+
+class TokenConstraintFSM:
+    r"""
+    Token-level finite-state machine of a regular expression or a JSON schema, to constrain greedy search and sampling
+    to the texts it matches without calling Python code per sequence and per step like `prefix_allowed_tokens_fn`.
+
+    The regular expression is compiled once over the vocabulary of the tokenizer: each state of the machine gets the
+    tokens that can be generated from it, stored as a boolean mask in `allowed_tokens` of shape `(num_states,
+    vocab_size)`, and the state each token leads to, stored in `transitions` of the same shape. During generation, the
+    scores of the tokens that are not allowed in the state of each sequence are masked and the states are updated with
+    a gather, with fixed shapes. The end-of-sequence token is only allowed once the text matches, and only the
+    end-of-sequence token is allowed after it.
+
+    Compiled machines are cached by a hash of the regular expression (or of the regular expression of the JSON schema)
+    and of the vocabulary, so use [`~TokenConstraintFSM.from_regex`] or [`~TokenConstraintFSM.from_json_schema`] to
+    create them.
+
+    Args:
+        allowed_tokens (`torch.BoolTensor` of shape `(num_states, vocab_size)`):
+            Whether each token can be generated from each state.
+        transitions (`torch.Tensor` of shape `(num_states, vocab_size)`):
+            The state each token leads to from each state, the state itself for the tokens that are not allowed.
+
+    Example:
+
+    ```python
+    >>> fsm = TokenConstraintFSM.from_json_schema(
+    ...     {"type": "object", "properties": {"name": {"type": "string"}, "age": {"type": "integer"}}}, tokenizer
+    ... )
+    >>> outputs = model.generate(**inputs, max_new_tokens=64, token_constraint=fsm)
+    ```
+    """
+
+    def __init__(self, allowed_tokens: torch.BoolTensor, transitions: torch.Tensor):
+        if allowed_tokens.shape != transitions.shape:
+            raise ValueError(
+                f"`allowed_tokens` and `transitions` should have the same shape, but got {allowed_tokens.shape} and"
+                f" {transitions.shape}."
+            )
+        self.allowed_tokens = allowed_tokens
+        self.transitions = transitions
+        self.initial_state = 0
+        self._on_device: Dict[torch.device, "TokenConstraintFSM"] = {}
+
+    @property
+    def num_states(self) -> int:
+        return self.allowed_tokens.shape[0]
+
+    @classmethod
+    def from_regex(
+        cls,
+        pattern: str,
+        tokenizer: Union[PreTrainedTokenizerBase, List[Optional[str]]],
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+    ) -> "TokenConstraintFSM":
+        """
+        Compiles the machine of the texts matching `pattern`, or returns it from the cache.
+
+        Args:
+            pattern (`str`):
+                The regular expression the whole generated text should match.
+            tokenizer (`Union[PreTrainedTokenizerBase, List[Optional[str]]]`):
+                The tokenizer of the model, or the text of each token of the vocabulary, `None` for the tokens that
+                should never be generated.
+            eos_token_id (`Union[int, List[int]]`, *optional*):
+                The id of the *end-of-sequence* token(s). Defaults to the one of `tokenizer`.
+        """
+        if isinstance(tokenizer, PreTrainedTokenizerBase):
+            if eos_token_id is None:
+                eos_token_id = tokenizer.eos_token_id
+            token_strings = _get_token_strings(tokenizer)
+        else:
+            token_strings = list(tokenizer)
+        if eos_token_id is None:
+            raise ValueError("`eos_token_id` should be given to compile a token constraint.")
+        eos_token_ids = [eos_token_id] if isinstance(eos_token_id, int) else list(eos_token_id)
+
+        key = hashlib.sha256(json.dumps([pattern, token_strings, eos_token_ids]).encode()).hexdigest()
+        if key in _COMPILED_FSMS:
+            _COMPILED_FSMS.move_to_end(key)
+            return _COMPILED_FSMS[key]
+
+        fsm = cls._compile(pattern, token_strings, eos_token_ids)
+        _COMPILED_FSMS[key] = fsm
+        if len(_COMPILED_FSMS) > _MAX_COMPILED_FSMS:
+            _COMPILED_FSMS.popitem(last=False)
+        return fsm
+
+    @classmethod
+    def from_json_schema(
+        cls,
+        schema: Union[str, Dict[str, Any]],
+        tokenizer: Union[PreTrainedTokenizerBase, List[Optional[str]]],
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        whitespace_pattern: str = r"[ ]?",
+    ) -> "TokenConstraintFSM":
+        """
+        Compiles the machine of the JSON documents valid against `schema`, or returns it from the cache. See
+        [`json_schema_to_regex`] for the supported schemas and [`~TokenConstraintFSM.from_regex`] for the other
+        arguments.
+        """
+        return cls.from_regex(json_schema_to_regex(schema, whitespace_pattern), tokenizer, eos_token_id)
+
+    @classmethod
+    def _compile(
+        cls, pattern: str, token_strings: List[Optional[str]], eos_token_ids: List[int]
+    ) -> "TokenConstraintFSM":
+        nfa = _NFA(pattern)
+
+        # Trie of the vocabulary, so that tokens sharing a prefix are matched together
+        trie: Dict[str, Any] = {}
+        for token_id, text in enumerate(token_strings):
+            if text and token_id not in eos_token_ids:
+                node = trie
+                for char in text:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append(token_id)
+
+        # Explore the states reachable from the start state with whole tokens
+        state_ids = {nfa.start: 0}
+        states = [nfa.start]
+        edges: List[Dict[int, int]] = []
+        while len(edges) < len(states):
+            token_edges = {}
+            stack = [(trie, states[len(edges)])]
+            while stack:
+                node, nfa_states = stack.pop()
+                for char, child in node.items():
+                    if char is None:
+                        continue
+                    next_nfa_states = nfa.step(nfa_states, char)
+                    if not next_nfa_states:
+                        continue
+                    for token_id in child.get(None, []):
+                        if next_nfa_states not in state_ids:
+                            state_ids[next_nfa_states] = len(states)
+                            states.append(next_nfa_states)
+                        token_edges[token_id] = state_ids[next_nfa_states]
+                    stack.append((child, next_nfa_states))
+            edges.append(token_edges)
+
+        # Only keep the states from which the text can still match, so that generation can always end
+        accepting = [nfa.is_accepting(nfa_states) for nfa_states in states]
+        predecessors: List[List[int]] = [[] for _ in states]
+        for state, token_edges in enumerate(edges):
+            for next_state in set(token_edges.values()):
+                predecessors[next_state].append(state)
+        live = [False] * len(states)
+        stack = [state for state, is_accepting in enumerate(accepting) if is_accepting]
+        for state in stack:
+            live[state] = True
+        while stack:
+            for previous_state in predecessors[stack.pop()]:
+                if not live[previous_state]:
+                    live[previous_state] = True
+                    stack.append(previous_state)
+        if not live[0]:
+            raise ValueError(f"No sequence of tokens of the vocabulary matches the regular expression {pattern!r}.")
+
+        # Live states keep their order, the start state being the first one, and the last state is the one after the
+        # end-of-sequence token
+        new_ids = {}
+        for state, is_live in enumerate(live):
+            if is_live:
+                new_ids[state] = len(new_ids)
+        num_states = len(new_ids) + 1
+        end_state = num_states - 1
+        vocab_size = max(len(token_strings), max(eos_token_ids) + 1)
+        allowed_tokens = torch.zeros((num_states, vocab_size), dtype=torch.bool)
+        dtype = torch.int16 if num_states <= torch.iinfo(torch.int16).max else torch.int32
+        transitions = torch.arange(num_states, dtype=dtype).unsqueeze(-1).repeat(1, vocab_size)
+        for state, new_state in new_ids.items():
+            token_edges = [
+                (token_id, new_ids[next_state]) for token_id, next_state in edges[state].items() if live[next_state]
+            ]
+            if token_edges:
+                token_ids, next_states = zip(*token_edges)
+                allowed_tokens[new_state, list(token_ids)] = True
+                transitions[new_state, list(token_ids)] = torch.tensor(next_states, dtype=dtype)
+            if accepting[state]:
+                allowed_tokens[new_state, eos_token_ids] = True
+                transitions[new_state, eos_token_ids] = end_state
+        allowed_tokens[end_state, eos_token_ids] = True
+
+        logger.info(f"Compiled the token constraint of {pattern!r} into {num_states} states.")
+        return cls(allowed_tokens, transitions)
+
+    def to(self, device: torch.device) -> "TokenConstraintFSM":
+        """
+        Returns the machine with its tables on `device`, copied once per device.
+        """
+        device = torch.device(device)
+        if self.allowed_tokens.device == device:
+            return self
+        if device not in self._on_device:
+            self._on_device[device] = TokenConstraintFSM(self.allowed_tokens.to(device), self.transitions.to(device))
+        return self._on_device[device]
+
+    def initial_states(self, batch_size: int, device: torch.device) -> torch.LongTensor:
+        """
+        Returns the states of `batch_size` sequences that start being generated.
+        """
+        return torch.full((batch_size,), self.initial_state, dtype=torch.long, device=device)
+
+    def mask(self, scores: torch.FloatTensor, states: torch.LongTensor) -> torch.FloatTensor:
+        """
+        Sets the scores of the tokens that are not allowed in `states` to `-float("Inf")`. Tokens beyond the
+        vocabulary of the machine, e.g. when the embedding matrix is padded, are never allowed.
+        """
+        allowed_tokens = torch.index_select(self.allowed_tokens, 0, states)
+        if allowed_tokens.shape[-1] < scores.shape[-1]:
+            allowed_tokens = F.pad(allowed_tokens, (0, scores.shape[-1] - allowed_tokens.shape[-1]), value=False)
+        return scores.masked_fill(~allowed_tokens[:, : scores.shape[-1]], -float("inf"))
+
+    def advance(self, states: torch.LongTensor, tokens: torch.LongTensor) -> torch.LongTensor:
+        """
+        Returns the states the sequences are in after generating `tokens`.
+        """
+        tokens = tokens.clamp(max=self.transitions.shape[-1] - 1)
+        return self.transitions[states, tokens].long()
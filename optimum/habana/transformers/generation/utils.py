@@ -17,7 +17,7 @@
 import copy
 import inspect
 import warnings
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 import torch.distributed as dist
@@ -25,17 +25,40 @@ from transformers.deepspeed import is_deepspeed_zero3_enabled
 from transformers.generation.beam_constraints import DisjunctiveConstraint, PhrasalConstraint
 from transformers.generation.beam_search import BeamScorer, BeamSearchScorer, ConstrainedBeamSearchScorer
 from transformers.generation.configuration_utils import GenerationConfig
-from transformers.generation.logits_process import LogitsProcessorList
+from transformers.generation.logits_process import (
+    EncoderNoRepeatNGramLogitsProcessor,
+    EncoderRepetitionPenaltyLogitsProcessor,
+    ExponentialDecayLengthPenalty,
+    ForcedBOSTokenLogitsProcessor,
+    ForcedEOSTokenLogitsProcessor,
+    ForceTokensLogitsProcessor,
+    HammingDiversityLogitsProcessor,
+    InfNanRemoveLogitsProcessor,
+    LogitNormalization,
+    LogitsProcessorList,
+    MinLengthLogitsProcessor,
+    MinNewTokensLengthLogitsProcessor,
+    NoBadWordsLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    PrefixConstrainedLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    SuppressTokensAtBeginLogitsProcessor,
+    SuppressTokensLogitsProcessor,
+)
 from transformers.generation.stopping_criteria import (
     StoppingCriteria,
     StoppingCriteriaList,
     validate_stopping_criteria,
 )
 from transformers.generation.utils import (
+    BeamSampleDecoderOnlyOutput,
+    BeamSampleEncoderDecoderOutput,
     BeamSampleOutput,
     BeamSearchDecoderOnlyOutput,
     BeamSearchEncoderDecoderOutput,
     BeamSearchOutput,
+    ContrastiveSearchDecoderOnlyOutput,
+    ContrastiveSearchEncoderDecoderOutput,
     ContrastiveSearchOutput,
     GenerateOutput,
     GenerationMixin,
@@ -45,14 +68,34 @@ from transformers.generation.utils import (
     SampleDecoderOnlyOutput,
     SampleEncoderDecoderOutput,
     SampleOutput,
+    _ranking_fast,
 )
+from transformers.modeling_outputs import CausalLMOutputWithPast, Seq2SeqLMOutput
 from transformers.utils import ModelOutput
 
 from optimum.utils import logging
 
+from ...distributed.tensor_parallel import VocabParallelLMHead
+from .beam_search import StaticBeamSearchScorer, StaticConstrainedBeamSearchScorer
+from .logits_process import (
+    BatchSamplingParams,
+    StaticMinLengthLogitsProcessor,
+    StaticMinNewTokensLengthLogitsProcessor,
+    StaticNoRepeatNGramLogitsProcessor,
+    StaticRepetitionPenaltyLogitsProcessor,
+    StaticTopKTopPSampler,
+)
+from .streamers import AsyncTokenStreamer
+
 
 if TYPE_CHECKING:
-    from .streamers import BaseStreamer
+    from transformers.generation.streamers import BaseStreamer
+    from transformers.modeling_utils import PreTrainedModel
+
+    from .bucketing import GenerationShapeBuckets
+    from .compaction import BatchCompaction
+    from .logprobs import LogprobsBuffer
+    from .token_fsm import TokenConstraintFSM
 
 
 logger = logging.get_logger(__name__)
@@ -68,6 +111,48 @@ class StaticMaxLengthCriteria(StoppingCriteria):
         return self.cur_step >= self.max_steps
 
 
+def _put_to_streamer(streamer: "BaseStreamer", value: torch.Tensor):
+    """
+    Gives the tokens of a generation step to `streamer`. Streamers that buffer tokens on device copy them to the host
+    themselves, the other ones get host tensors.
+    """
+    streamer.put(value if isinstance(streamer, AsyncTokenStreamer) else value.cpu())
+
+
+def _get_vocab_parallel_lm_head(model: "PreTrainedModel") -> Optional[VocabParallelLMHead]:
+    """
+    Returns the LM head of `model` if its vocabulary is split across tensor-parallel ranks, `None` otherwise.
+    """
+    output_embeddings = model.get_output_embeddings()
+    return output_embeddings if isinstance(output_embeddings, VocabParallelLMHead) else None
+
+
+def _ranking_static(
+    context_hidden: torch.FloatTensor,
+    next_hidden: torch.FloatTensor,
+    next_top_k_probs: torch.FloatTensor,
+    alpha: float,
+    context_length: torch.Tensor,
+) -> torch.LongTensor:
+    """
+    Static-shape version of `_ranking_fast` for contrastive search. `context_hidden` is the preallocated buffer of
+    shape `(batch_size, max_length, hidden_size)` holding the hidden states of the sequences, of which only the first
+    `context_length` positions are valid, and `next_hidden` the hidden states of the `top_k` candidates of shape
+    `(batch_size * top_k, 1, hidden_size)`. The context is not repeated for every candidate.
+    """
+    batch_size, max_length, _ = context_hidden.shape
+    norm_context_hidden = context_hidden / context_hidden.norm(dim=2, keepdim=True)
+    norm_next_hidden = next_hidden / next_hidden.norm(dim=2, keepdim=True)
+    norm_next_hidden = norm_next_hidden.view(batch_size, -1, norm_next_hidden.shape[-1])
+    cosine_matrix = torch.matmul(norm_next_hidden, norm_context_hidden.transpose(1, 2))  # [B, K, max_length]
+    is_context = torch.arange(max_length, device=context_hidden.device) < context_length
+    cosine_matrix = torch.where(is_context, cosine_matrix, torch.finfo(cosine_matrix.dtype).min)
+    degeneration_penalty, _ = torch.max(cosine_matrix, dim=-1)  # [B, K]
+    contrastive_score = (1.0 - alpha) * next_top_k_probs - alpha * degeneration_penalty
+    _, selected_idx = contrastive_score.max(dim=-1)  # [B]
+    return selected_idx
+
+
 class GaudiGenerationMixin(GenerationMixin):
     """
     This class enables to perform fast generation in lazy mode and with HPU graphs.
@@ -127,6 +212,232 @@ class GaudiGenerationMixin(GenerationMixin):
 
         return model_kwargs
 
+    @staticmethod
+    def _expand_inputs_for_generation(
+        expand_size: int = 1,
+        is_encoder_decoder: bool = False,
+        input_ids: Optional[torch.LongTensor] = None,
+        **model_kwargs,
+    ) -> Tuple[torch.LongTensor, Dict[str, Any]]:
+        """Expands tensors from [batch_size, ...] to [batch_size * expand_size, ...]"""
+
+        def _expand_dict_for_generation(dict_to_expand):
+            for key in dict_to_expand:
+                # Scalars such as token_idx are shared by the whole batch
+                if (
+                    dict_to_expand[key] is not None
+                    and isinstance(dict_to_expand[key], torch.Tensor)
+                    and dict_to_expand[key].dim() > 0
+                ):
+                    dict_to_expand[key] = dict_to_expand[key].repeat_interleave(expand_size, dim=0)
+            return dict_to_expand
+
+        if input_ids is not None:
+            input_ids = input_ids.repeat_interleave(expand_size, dim=0)
+
+        model_kwargs = _expand_dict_for_generation(model_kwargs)
+
+        if is_encoder_decoder:
+            if model_kwargs.get("encoder_outputs") is None:
+                raise ValueError("If `is_encoder_decoder` is True, make sure that `encoder_outputs` is defined.")
+            model_kwargs["encoder_outputs"] = _expand_dict_for_generation(model_kwargs["encoder_outputs"])
+
+        return input_ids, model_kwargs
+
+    @staticmethod
+    def _reorder_static_cache(
+        past_key_values: Tuple[Tuple[torch.Tensor]], beam_idx: torch.LongTensor
+    ) -> Tuple[Tuple[torch.Tensor]]:
+        """
+        Reorders a preallocated cache in place so that it matches `beam_idx` at every generation step. Unlike
+        `_reorder_cache`, no new cache is allocated so its shape and address stay the same. The first dimension of the
+        cache tensors should be the batch one, possibly merged with the number of heads like in BLOOM.
+        """
+        batch_beam_size = beam_idx.shape[0]
+        for layer_past in past_key_values:
+            for past_state in layer_past:
+                num_rows_per_beam = past_state.shape[0] // batch_beam_size
+                if num_rows_per_beam > 1:
+                    rows = torch.arange(num_rows_per_beam, device=beam_idx.device)
+                    row_idx = (beam_idx.unsqueeze(-1) * num_rows_per_beam + rows).view(-1)
+                else:
+                    row_idx = beam_idx
+                past_state.index_copy_(
+                    0,
+                    torch.arange(past_state.shape[0], device=beam_idx.device),
+                    torch.index_select(past_state, 0, row_idx),
+                )
+        return past_key_values
+
+    @staticmethod
+    def _expand_static_cache(
+        past_key_values: Tuple[Tuple[torch.Tensor]], batch_size: int, expand_size: int
+    ) -> Tuple[Tuple[torch.Tensor]]:
+        """
+        Expands a preallocated cache from `batch_size` to `batch_size * expand_size` sequences, like
+        `_expand_inputs_for_generation` does for the inputs. The cache tensors are laid out as in
+        `_reorder_static_cache`.
+        """
+        expanded_idx = torch.arange(batch_size, device=past_key_values[0][0].device).repeat_interleave(expand_size)
+        new_past_key_values = ()
+        for layer_past in past_key_values:
+            new_layer_past = ()
+            for past_state in layer_past:
+                num_rows_per_sequence = past_state.shape[0] // batch_size
+                rows = torch.arange(num_rows_per_sequence, device=expanded_idx.device)
+                row_idx = (expanded_idx.unsqueeze(-1) * num_rows_per_sequence + rows).view(-1)
+                new_layer_past += (torch.index_select(past_state, 0, row_idx),)
+            new_past_key_values += (new_layer_past,)
+        return new_past_key_values
+
+    def _get_logits_processor(
+        self,
+        generation_config: GenerationConfig,
+        input_ids_seq_length: int,
+        encoder_input_ids: torch.LongTensor,
+        prefix_allowed_tokens_fn: Callable[[int, torch.Tensor], List[int]],
+        logits_processor: Optional[LogitsProcessorList],
+        token_idx: Optional[torch.Tensor] = None,
+    ) -> LogitsProcessorList:
+        """
+        This class returns a [`LogitsProcessorList`] list object that contains all relevant [`LogitsProcessor`]
+        instances used to modify the scores of the language model head.
+
+        If `token_idx` is given, `input_ids` are padded to a static shape and the processors that depend on the
+        number of valid tokens (repetition penalty, no-repeat n-grams, minimum length) are replaced by their static
+        counterparts, which read it from `token_idx` and use fixed-shape masked operations only.
+        """
+        # instantiate processors list
+        processors = LogitsProcessorList()
+
+        # the following idea is largely copied from this PR: https://github.com/huggingface/transformers/pull/5420/files
+        # all samplers can be found in `generation_utils_samplers.py`
+        if generation_config.diversity_penalty is not None and generation_config.diversity_penalty > 0.0:
+            processors.append(
+                HammingDiversityLogitsProcessor(
+                    diversity_penalty=generation_config.diversity_penalty,
+                    num_beams=generation_config.num_beams,
+                    num_beam_groups=generation_config.num_beam_groups,
+                )
+            )
+        if (
+            generation_config.encoder_repetition_penalty is not None
+            and generation_config.encoder_repetition_penalty != 1.0
+        ):
+            processors.append(
+                EncoderRepetitionPenaltyLogitsProcessor(
+                    penalty=generation_config.encoder_repetition_penalty, encoder_input_ids=encoder_input_ids
+                )
+            )
+        if generation_config.repetition_penalty is not None and generation_config.repetition_penalty != 1.0:
+            if token_idx is not None:
+                processors.append(
+                    StaticRepetitionPenaltyLogitsProcessor(generation_config.repetition_penalty, token_idx)
+                )
+            else:
+                processors.append(RepetitionPenaltyLogitsProcessor(penalty=generation_config.repetition_penalty))
+        if generation_config.no_repeat_ngram_size is not None and generation_config.no_repeat_ngram_size > 0:
+            if token_idx is not None:
+                processors.append(
+                    StaticNoRepeatNGramLogitsProcessor(generation_config.no_repeat_ngram_size, token_idx)
+                )
+            else:
+                processors.append(NoRepeatNGramLogitsProcessor(generation_config.no_repeat_ngram_size))
+        if (
+            generation_config.encoder_no_repeat_ngram_size is not None
+            and generation_config.encoder_no_repeat_ngram_size > 0
+        ):
+            if self.config.is_encoder_decoder:
+                processors.append(
+                    EncoderNoRepeatNGramLogitsProcessor(
+                        generation_config.encoder_no_repeat_ngram_size, encoder_input_ids
+                    )
+                )
+            else:
+                raise ValueError(
+                    "It's impossible to use `encoder_no_repeat_ngram_size` with decoder-only architecture"
+                )
+        if generation_config.bad_words_ids is not None:
+            processors.append(
+                NoBadWordsLogitsProcessor(generation_config.bad_words_ids, generation_config.eos_token_id)
+            )
+        if (
+            generation_config.min_length is not None
+            and generation_config.eos_token_id is not None
+            and generation_config.min_length > 0
+        ):
+            if token_idx is not None:
+                processors.append(
+                    StaticMinLengthLogitsProcessor(
+                        generation_config.min_length, generation_config.eos_token_id, token_idx
+                    )
+                )
+            else:
+                processors.append(
+                    MinLengthLogitsProcessor(generation_config.min_length, generation_config.eos_token_id)
+                )
+        if (
+            generation_config.min_new_tokens is not None
+            and generation_config.eos_token_id is not None
+            and generation_config.min_new_tokens > 0
+        ):
+            if token_idx is not None:
+                processors.append(
+                    StaticMinNewTokensLengthLogitsProcessor(
+                        generation_config.min_new_tokens, generation_config.eos_token_id, token_idx
+                    )
+                )
+            else:
+                processors.append(
+                    MinNewTokensLengthLogitsProcessor(
+                        input_ids_seq_length, generation_config.min_new_tokens, generation_config.eos_token_id
+                    )
+                )
+        if prefix_allowed_tokens_fn is not None:
+            processors.append(
+                PrefixConstrainedLogitsProcessor(
+                    prefix_allowed_tokens_fn, generation_config.num_beams // generation_config.num_beam_groups
+                )
+            )
+        if generation_config.forced_bos_token_id is not None:
+            processors.append(ForcedBOSTokenLogitsProcessor(generation_config.forced_bos_token_id))
+        if generation_config.forced_eos_token_id is not None:
+            processors.append(
+                ForcedEOSTokenLogitsProcessor(generation_config.max_length, generation_config.forced_eos_token_id)
+            )
+        if generation_config.remove_invalid_values is True:
+            processors.append(InfNanRemoveLogitsProcessor())
+        if generation_config.exponential_decay_length_penalty is not None:
+            processors.append(
+                ExponentialDecayLengthPenalty(
+                    generation_config.exponential_decay_length_penalty,
+                    generation_config.eos_token_id,
+                    input_ids_seq_length,
+                )
+            )
+        if generation_config.suppress_tokens is not None:
+            processors.append(SuppressTokensLogitsProcessor(generation_config.suppress_tokens))
+        if generation_config.begin_suppress_tokens is not None:
+            begin_index = input_ids_seq_length
+            begin_index = (
+                begin_index
+                if (input_ids_seq_length > 1 or generation_config.forced_bos_token_id is None)
+                else begin_index + 1
+            )
+            if generation_config.forced_decoder_ids is not None:
+                # generation starts after the last token that is forced
+                begin_index += generation_config.forced_decoder_ids[-1][0]
+            processors.append(
+                SuppressTokensAtBeginLogitsProcessor(generation_config.begin_suppress_tokens, begin_index)
+            )
+        if generation_config.forced_decoder_ids is not None:
+            processors.append(ForceTokensLogitsProcessor(generation_config.forced_decoder_ids))
+        processors = self._merge_criteria_processor_list(processors, logits_processor)
+        # `LogitNormalization` should always be the last logit processor, when present
+        if generation_config.renormalize_logits is True:
+            processors.append(LogitNormalization())
+        return processors
+
     @torch.no_grad()
     def generate(
         self,
@@ -140,6 +451,15 @@ class GaudiGenerationMixin(GenerationMixin):
         lazy_mode: Optional[bool] = False,
         hpu_graphs: Optional[bool] = False,
         ignore_eos: Optional[bool] = None,
+        eos_check_interval: Optional[int] = None,
+        shape_buckets: Optional["GenerationShapeBuckets"] = None,
+        assistant_model: Optional["PreTrainedModel"] = None,
+        num_assistant_tokens: int = 5,
+        generators: Optional[List[torch.Generator]] = None,
+        logprobs: Optional["LogprobsBuffer"] = None,
+        batch_compaction: Optional["BatchCompaction"] = None,
+        sampling_params: Optional[BatchSamplingParams] = None,
+        token_constraint: Optional["TokenConstraintFSM"] = None,
         **kwargs,
     ) -> Union[GenerateOutput, torch.LongTensor]:
         r"""
@@ -199,6 +519,39 @@ class GaudiGenerationMixin(GenerationMixin):
                 Whether to use HPU graphs for inference.
             ignore_eos (`bool`, *optional*):
                 Whether to ignore finished sequences (faster in lazy mode and with HPU graphs) or not (eager mode).
+            eos_check_interval (`int`, *optional*):
+                If set, whether all the sequences are finished is only checked every `eos_check_interval` steps, also in
+                lazy mode. Finished sequences are tracked on device and each check is a single host synchronization,
+                so generation can stop early without syncing at every step.
+            shape_buckets (`GenerationShapeBuckets`, *optional*):
+                If provided, prompts are padded into the given prompt-length and total-length buckets and generation
+                runs on the static-shape path (`token_idx`), so that inputs of different lengths reuse a small set of
+                compiled graphs. Only for decoder-only models whose `forward` accepts `token_idx`.
+            assistant_model (`PreTrainedModel`, *optional*):
+                A smaller model sharing the tokenizer of this one. If provided, greedy search and sampling use
+                speculative decoding (see [`~GaudiGenerationMixin.assisted_decoding`]): the assistant model proposes
+                tokens that this model checks in a single forward pass. Requires static shapes (`token_idx`) and a
+                batch size of 1.
+            num_assistant_tokens (`int`, *optional*, defaults to 5):
+                The number of tokens proposed by `assistant_model` at each step.
+            generators (`List[torch.Generator]`, *optional*):
+                One random number generator per returned sequence (`batch_size * num_return_sequences`) for sampling
+                with static shapes, so that the tokens drawn for a sequence do not depend on the rest of the batch.
+            logprobs (`LogprobsBuffer`, *optional*):
+                If provided, the log-probabilities of the generated tokens are written into its preallocated device
+                buffers, a lighter alternative to `output_scores=True`. Only for greedy search, contrastive search and
+                sampling.
+            batch_compaction (`BatchCompaction`, *optional*):
+                If provided, the batch is shrunk to the sequences that are still running as sequences finish, and the
+                sequences are returned in their original order. Only for greedy search and sampling of decoder-only
+                models, without streamer, `logprobs` nor outputs other than the sequences. Implies `ignore_eos=False`.
+            sampling_params (`BatchSamplingParams`, *optional*):
+                Temperature, top-k, top-p, seed and maximum number of new tokens of each sequence, which take
+                precedence over the ones of the generation config. Only for sampling with static shapes (`token_idx`)
+                and `num_return_sequences=1`.
+            token_constraint (`TokenConstraintFSM`, *optional*):
+                If provided, the generated texts are constrained to match its regular expression or JSON schema, with
+                a token mask and a state transition per step computed on device. Only for greedy search and sampling.
             kwargs:
                 Ad hoc parametrization of `generate_config` and/or additional model-specific kwargs that will be
                 forwarded to the `forward` function of the model. If the model is an encoder-decoder model, encoder
@@ -232,6 +585,20 @@ class GaudiGenerationMixin(GenerationMixin):
             raise ValueError(
                 "`hpu_graphs` is True but `lazy_mode` is False. HPU graphs require `lazy_mode` to be set to True."
             )
+        if eos_check_interval is not None:
+            if eos_check_interval < 1:
+                raise ValueError(
+                    f"`eos_check_interval` should be a strictly positive integer, but is {eos_check_interval}."
+                )
+            if ignore_eos:
+                raise ValueError("`eos_check_interval` cannot be used with `ignore_eos=True`.")
+            # Finished sequences have to be tracked to be checked
+            ignore_eos = False
+        if batch_compaction is not None:
+            if ignore_eos:
+                raise ValueError("`batch_compaction` cannot be used with `ignore_eos=True`.")
+            # Finished sequences have to be tracked to be removed from the batch
+            ignore_eos = False
         if ignore_eos is None:
             ignore_eos = lazy_mode
 
@@ -255,6 +622,9 @@ class GaudiGenerationMixin(GenerationMixin):
         generation_config.validate()
         model_kwargs = generation_config.update(**kwargs)  # All unused kwargs must be model kwargs
         self._validate_model_kwargs(model_kwargs.copy())
+        if sampling_params is not None and sampling_params.max_new_tokens is not None:
+            # Generation runs until the longest sequence is done, the other ones are finished on the way
+            generation_config.max_new_tokens = int(sampling_params.max_new_tokens.max())
 
         # 2. Set generation parameters if not already defined
         logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
@@ -331,6 +701,29 @@ class GaudiGenerationMixin(GenerationMixin):
         else:
             input_ids = inputs_tensor if model_input_name == "input_ids" else model_kwargs.pop("input_ids")
 
+        if shape_buckets is not None:
+            if self.config.is_encoder_decoder:
+                raise ValueError("Shape buckets are only supported by decoder-only models.")
+            if "token_idx" not in set(inspect.signature(self.forward).parameters.keys()):
+                raise ValueError(
+                    f"{self.__class__.__name__} does not support static shapes, so shape buckets cannot be used."
+                )
+            if "token_idx" in model_kwargs:
+                raise ValueError("`token_idx` should not be given when using shape buckets, it is set by the buckets.")
+            if generation_config.max_new_tokens is None:
+                raise ValueError(
+                    "You need to set `max_new_tokens` in your generation configuration to use shape buckets."
+                )
+            if generation_config.pad_token_id is None:
+                raise ValueError("`pad_token_id` should be defined to use shape buckets.")
+            input_ids, model_kwargs["attention_mask"], model_kwargs["token_idx"] = shape_buckets.pad_inputs(
+                input_ids,
+                model_kwargs.get("attention_mask", None),
+                generation_config.max_new_tokens,
+                generation_config.pad_token_id,
+            )
+            inputs_tensor = input_ids
+
         if streamer is not None:
             streamer.put(input_ids.cpu())
 
@@ -424,6 +817,32 @@ class GaudiGenerationMixin(GenerationMixin):
                 "Diverse beam search cannot be used in sampling mode. Make sure that `do_sample` is set to `False`."
             )
 
+        if model_kwargs.get("prefix_cache", None) is not None and (
+            is_contrastive_search_gen_mode or assistant_model is not None
+        ):
+            # Both need the outputs of the whole prompt at the first step
+            raise ValueError("A prefix cache cannot be used with contrastive search or assisted generation.")
+        if model_kwargs.get("prefill_chunk_size", None) is not None and (
+            is_contrastive_search_gen_mode or assistant_model is not None
+        ):
+            # Contrastive search needs the hidden states of the whole prompt at the first step, and assisted decoding
+            # runs its own prefill
+            raise ValueError("Chunked prefill cannot be used with contrastive search or assisted generation.")
+        if is_contrastive_search_gen_mode and (
+            model_kwargs.get("paged_kv_cache", None) is not None
+            or not isinstance(model_kwargs.get("past_key_values", None) or (), (tuple, list))
+        ):
+            # Contrastive search expands the cache to `top_k` candidates per sequence, as a cache of batch rows
+            raise ValueError("Paged and sink key/value caches cannot be used with contrastive search.")
+        if model_kwargs.get("paged_kv_cache", None) is not None:
+            if assistant_model is not None:
+                # Assisted decoding runs the model without the paged cache
+                raise ValueError("A paged key/value cache cannot be used with assisted generation.")
+            if generation_config.num_beams > 1:
+                # Beams would have to share and copy blocks, reordering the cache does not follow the block tables
+                raise ValueError("A paged key/value cache cannot be used with beam search.")
+            model_kwargs["paged_kv_cache"].check_allocated(input_ids_seq_length)
+
         if streamer is not None and (generation_config.num_beams > 1):
             raise ValueError(
                 "`streamer` cannot be used with beam search (yet!). Make sure that `num_beams` is set to 1."
@@ -449,6 +868,8 @@ class GaudiGenerationMixin(GenerationMixin):
             encoder_input_ids=inputs_tensor,
             prefix_allowed_tokens_fn=prefix_allowed_tokens_fn,
             logits_processor=logits_processor,
+            # Assisted decoding masks the positions after its own `token_idx` instead
+            token_idx=model_kwargs.get("token_idx", None) if assistant_model is None else None,
         )
 
         # 9. prepare stopping criteria
@@ -463,13 +884,130 @@ class GaudiGenerationMixin(GenerationMixin):
                     "You need to set `max_new_tokens` in your generation configuration to use static shapes."
                 )
 
+        # Only apply the LM head to the last prompt position at prefill if the model supports it, assisted decoding
+        # needs the logits of all the tokens it verifies
+        if assistant_model is None and "logits_positions" in set(inspect.signature(self.forward).parameters.keys()):
+            model_kwargs["trim_logits"] = True
+
         # In lazy mode, import Habana torch to be able to add mark_step()
         if lazy_mode:
             import habana_frameworks.torch.core as htcore
 
             self.htcore_generation = htcore
 
+        if _get_vocab_parallel_lm_head(self) is not None:
+            if assistant_model is not None or not (is_greedy_gen_mode or is_sample_gen_mode):
+                raise ValueError(
+                    "Models with a vocabulary-parallel LM head only support greedy search and sampling, without an"
+                    " assistant model."
+                )
+            if len(logits_processor) > 0:
+                raise ValueError(
+                    "Logits processors are not supported with a vocabulary-parallel LM head, as they need the scores"
+                    " of the whole vocabulary."
+                )
+            if generation_config.output_scores or logprobs is not None:
+                raise ValueError(
+                    "`output_scores` and `logprobs` are not supported with a vocabulary-parallel LM head, as each rank"
+                    " only has the scores of its slice of the vocabulary."
+                )
+
+        if batch_compaction is not None:
+            if assistant_model is not None or not (is_greedy_gen_mode or is_sample_gen_mode):
+                raise ValueError("`batch_compaction` is only supported with greedy search and sampling.")
+            if self.config.is_encoder_decoder:
+                raise ValueError("`batch_compaction` is only supported with decoder-only models.")
+            if streamer is not None or logprobs is not None:
+                raise ValueError("`batch_compaction` cannot be used with a streamer or `logprobs`.")
+            if (
+                model_kwargs.get("int8_kv_cache", None) is not None
+                or model_kwargs.get("paged_kv_cache", None) is not None
+                or not isinstance(model_kwargs.get("past_key_values", None) or (), (tuple, list))
+            ):
+                # Checked here rather than at the first compaction, when tokens have already been generated
+                raise ValueError(
+                    "`batch_compaction` only supports key/value caches of tensors, not int8, paged or sink caches."
+                )
+            if generation_config.return_dict_in_generate and (
+                generation_config.output_scores
+                or generation_config.output_attentions
+                or generation_config.output_hidden_states
+            ):
+                raise ValueError(
+                    "`batch_compaction` cannot be used with `output_scores`, `output_attentions` or"
+                    " `output_hidden_states`, as the batch size changes during generation."
+                )
+
+        if sampling_params is not None:
+            if assistant_model is not None or not is_sample_gen_mode:
+                raise ValueError("`sampling_params` is only supported with sampling.")
+            if "token_idx" not in model_kwargs:
+                raise ValueError("`sampling_params` requires static shapes (`token_idx`).")
+            if generation_config.num_return_sequences > 1:
+                raise ValueError("`sampling_params` cannot be used with `num_return_sequences` > 1.")
+            if sampling_params.batch_size is not None and sampling_params.batch_size != batch_size:
+                raise ValueError(
+                    f"`sampling_params` holds parameters for {sampling_params.batch_size} sequences, but the batch size"
+                    f" is {batch_size}."
+                )
+            if sampling_params.seed is not None and generators is not None:
+                raise ValueError("`generators` and the seeds of `sampling_params` cannot be given together.")
+            sampling_params = sampling_params.to(input_ids.device)
+
+        if token_constraint is not None:
+            if assistant_model is not None or not (is_greedy_gen_mode or is_sample_gen_mode):
+                raise ValueError("`token_constraint` is only supported with greedy search and sampling.")
+            if _get_vocab_parallel_lm_head(self) is not None:
+                raise ValueError("`token_constraint` is not supported with a vocabulary-parallel LM head.")
+            token_constraint = token_constraint.to(input_ids.device)
+
+        if logprobs is not None:
+            if assistant_model is not None or not (
+                is_greedy_gen_mode or is_contrastive_search_gen_mode or is_sample_gen_mode
+            ):
+                raise ValueError("`logprobs` is only supported with greedy search, contrastive search and sampling.")
+            if generation_config.max_new_tokens is not None:
+                max_new_tokens = generation_config.max_new_tokens
+            else:
+                max_new_tokens = generation_config.max_length - input_ids_seq_length
+            logprobs.allocate(batch_size * generation_config.num_return_sequences, max_new_tokens, input_ids.device)
+
         # 10. go into different generation modes
+        if assistant_model is not None:
+            if not is_greedy_gen_mode and not is_sample_gen_mode:
+                raise ValueError("Assisted generation is only supported with greedy search and sampling.")
+            if batch_size != 1 or generation_config.num_return_sequences > 1:
+                raise ValueError("Assisted generation only supports a batch size of 1 and a single returned sequence.")
+            if generation_config.return_dict_in_generate:
+                raise ValueError("Assisted generation does not support `return_dict_in_generate` yet.")
+            if "token_idx" not in model_kwargs:
+                raise ValueError("Assisted generation requires static shapes, `token_idx` should be given.")
+            if model_kwargs.get("int8_kv_cache", None) is not None:
+                # The verification pass writes several tokens at `token_idx - 1`, which the int8 cache does not support
+                raise ValueError("An int8 key/value cache cannot be used with assisted generation.")
+            if "token_idx" not in set(inspect.signature(assistant_model.forward).parameters.keys()):
+                raise ValueError(
+                    f"{assistant_model.__class__.__name__} does not support static shapes, so it cannot be used as an"
+                    " assistant model."
+                )
+
+            # 11. run assisted generation
+            return self.assisted_decoding(
+                input_ids,
+                assistant_model=assistant_model,
+                num_assistant_tokens=num_assistant_tokens,
+                do_sample=generation_config.do_sample,
+                logits_processor=logits_processor,
+                logits_warper=self._get_logits_warper(generation_config) if generation_config.do_sample else None,
+                max_new_tokens=generation_config.max_new_tokens,
+                pad_token_id=generation_config.pad_token_id,
+                eos_token_id=generation_config.eos_token_id,
+                streamer=streamer,
+                lazy_mode=lazy_mode,
+                ignore_eos=ignore_eos,
+                **model_kwargs,
+            )
+
         if is_greedy_gen_mode:
             if generation_config.num_return_sequences > 1:
                 raise ValueError(
@@ -488,8 +1026,12 @@ class GaudiGenerationMixin(GenerationMixin):
                 return_dict_in_generate=generation_config.return_dict_in_generate,
                 synced_gpus=synced_gpus,
                 streamer=streamer,
+                logprobs=logprobs,
+                batch_compaction=batch_compaction,
+                token_constraint=token_constraint,
                 lazy_mode=lazy_mode,
                 ignore_eos=ignore_eos,
+                eos_check_interval=eos_check_interval,
                 **model_kwargs,
             )
 
@@ -512,12 +1054,40 @@ class GaudiGenerationMixin(GenerationMixin):
                 return_dict_in_generate=generation_config.return_dict_in_generate,
                 synced_gpus=synced_gpus,
                 streamer=streamer,
+                logprobs=logprobs,
+                lazy_mode=lazy_mode,
+                ignore_eos=ignore_eos,
+                eos_check_interval=eos_check_interval,
                 **model_kwargs,
             )
 
         elif is_sample_gen_mode:
-            # 11. prepare logits warper
-            logits_warper = self._get_logits_warper(generation_config)
+            # 11. prepare logits warper, with static shapes temperature, top-k and top-p are fused with the draw
+            sampler = None
+            if sampling_params is not None and sampling_params.seed is not None:
+                generators = [
+                    torch.Generator(device=input_ids.device).manual_seed(seed) for seed in sampling_params.seed
+                ]
+            if "token_idx" in model_kwargs:
+                sampler = StaticTopKTopPSampler.from_generation_config(
+                    generation_config, generators=generators, sampling_params=sampling_params
+                )
+            if sampling_params is not None and sampler is None:
+                raise ValueError(
+                    "`sampling_params` requires `top_k` > 0, in the generation config or per sequence, and no typical,"
+                    " epsilon or eta sampling."
+                )
+            if generators is not None and sampler is None:
+                raise ValueError(
+                    "`generators` can only be used for sampling with static shapes (`token_idx`) and `top_k` > 0, "
+                    "without typical, epsilon or eta sampling."
+                )
+            if _get_vocab_parallel_lm_head(self) is not None and sampler is None:
+                raise ValueError(
+                    "Sampling with a vocabulary-parallel LM head requires static shapes (`token_idx`) and `top_k` > 0,"
+                    " without typical, epsilon or eta sampling."
+                )
+            logits_warper = self._get_logits_warper(generation_config) if sampler is None else None
 
             # 12. expand input_ids with `num_return_sequences` additional sequences per batch
             input_ids, model_kwargs = self._expand_inputs_for_generation(
@@ -532,6 +1102,7 @@ class GaudiGenerationMixin(GenerationMixin):
                 input_ids,
                 logits_processor=logits_processor,
                 logits_warper=logits_warper,
+                sampler=sampler,
                 stopping_criteria=stopping_criteria,
                 pad_token_id=generation_config.pad_token_id,
                 eos_token_id=generation_config.eos_token_id,
@@ -539,7 +1110,13 @@ class GaudiGenerationMixin(GenerationMixin):
                 return_dict_in_generate=generation_config.return_dict_in_generate,
                 synced_gpus=synced_gpus,
                 streamer=streamer,
+                logprobs=logprobs,
+                batch_compaction=batch_compaction,
+                token_constraint=token_constraint,
                 lazy_mode=lazy_mode,
+                ignore_eos=ignore_eos,
+                eos_check_interval=eos_check_interval,
+                max_new_tokens=sampling_params.max_new_tokens if sampling_params is not None else None,
                 **model_kwargs,
             )
 
@@ -550,15 +1127,17 @@ class GaudiGenerationMixin(GenerationMixin):
             if stopping_criteria.max_length is None:
                 raise ValueError("`max_length` needs to be a stopping_criteria for now.")
 
-            # 11. prepare beam search scorer
-            beam_scorer = BeamSearchScorer(
+            # 11. prepare beam search scorer, with static shapes finished hypotheses are kept on device and the
+            # maximum length is the one of the padded inputs
+            static_shapes = "token_idx" in model_kwargs
+            beam_scorer = (StaticBeamSearchScorer if static_shapes else BeamSearchScorer)(
                 batch_size=batch_size,
                 num_beams=generation_config.num_beams,
                 device=inputs_tensor.device,
                 length_penalty=generation_config.length_penalty,
                 do_early_stopping=generation_config.early_stopping,
                 num_beam_hyps_to_keep=generation_config.num_return_sequences,
-                max_length=generation_config.max_length,
+                max_length=None if static_shapes else generation_config.max_length,
             )
             # 12. interleave input_ids with `num_beams` additional sequences per batch
             input_ids, model_kwargs = self._expand_inputs_for_generation(
@@ -589,13 +1168,14 @@ class GaudiGenerationMixin(GenerationMixin):
             if stopping_criteria.max_length is None:
                 raise ValueError("`max_length` needs to be a stopping_criteria for now.")
             # 12. prepare beam search scorer
-            beam_scorer = BeamSearchScorer(
+            static_shapes = "token_idx" in model_kwargs
+            beam_scorer = (StaticBeamSearchScorer if static_shapes else BeamSearchScorer)(
                 batch_size=batch_size * generation_config.num_return_sequences,
                 num_beams=generation_config.num_beams,
                 device=inputs_tensor.device,
                 length_penalty=generation_config.length_penalty,
                 do_early_stopping=generation_config.early_stopping,
-                max_length=generation_config.max_length,
+                max_length=None if static_shapes else generation_config.max_length,
             )
 
             # 13. interleave input_ids with `num_beams` additional sequences per batch
@@ -637,7 +1217,8 @@ class GaudiGenerationMixin(GenerationMixin):
                 raise ValueError("Decoder argument `typical_p` is not supported with beam groups.")
 
             # 11. prepare beam search scorer
-            beam_scorer = BeamSearchScorer(
+            static_shapes = "token_idx" in model_kwargs
+            beam_scorer = (StaticBeamSearchScorer if static_shapes else BeamSearchScorer)(
                 batch_size=batch_size,
                 num_beams=generation_config.num_beams,
                 device=inputs_tensor.device,
@@ -645,7 +1226,7 @@ class GaudiGenerationMixin(GenerationMixin):
                 do_early_stopping=generation_config.early_stopping,
                 num_beam_hyps_to_keep=generation_config.num_return_sequences,
                 num_beam_groups=generation_config.num_beam_groups,
-                max_length=generation_config.max_length,
+                max_length=None if static_shapes else generation_config.max_length,
             )
             # 12. interleave input_ids with `num_beams` additional sequences per batch
             input_ids, model_kwargs = self._expand_inputs_for_generation(
@@ -726,7 +1307,10 @@ class GaudiGenerationMixin(GenerationMixin):
                     final_constraints.append(constraint)
 
             # 11. prepare beam search scorer
-            constrained_beam_scorer = ConstrainedBeamSearchScorer(
+            static_shapes = "token_idx" in model_kwargs
+            constrained_beam_scorer = (
+                StaticConstrainedBeamSearchScorer if static_shapes else ConstrainedBeamSearchScorer
+            )(
                 constraints=final_constraints,
                 batch_size=batch_size,
                 num_beams=generation_config.num_beams,
@@ -734,7 +1318,7 @@ class GaudiGenerationMixin(GenerationMixin):
                 length_penalty=generation_config.length_penalty,
                 do_early_stopping=generation_config.early_stopping,
                 num_beam_hyps_to_keep=generation_config.num_return_sequences,
-                max_length=generation_config.max_length,
+                max_length=None if static_shapes else generation_config.max_length,
             )
             # 12. interleave input_ids with `num_beams` additional sequences per batch
             input_ids, model_kwargs = self._expand_inputs_for_generation(
@@ -775,7 +1359,10 @@ class GaudiGenerationMixin(GenerationMixin):
         return_dict_in_generate: Optional[bool] = None,
         synced_gpus: Optional[bool] = False,
         streamer: Optional["BaseStreamer"] = None,
+        logprobs: Optional["LogprobsBuffer"] = None,
         lazy_mode: Optional[bool] = False,
+        ignore_eos: Optional[bool] = None,
+        eos_check_interval: Optional[int] = None,
         **model_kwargs,
     ) -> Union[ContrastiveSearchOutput, torch.LongTensor]:
         r"""
@@ -826,8 +1413,16 @@ class GaudiGenerationMixin(GenerationMixin):
             streamer (`BaseStreamer`, *optional*):
                 Streamer object that will be used to stream the generated sequences. Generated tokens are passed
                 through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
+            logprobs (`LogprobsBuffer`, *optional*):
+                If provided, the log-probabilities of the generated tokens are written into its buffers, which should
+                have been allocated for this generation.
             lazy_mode (`bool`, *optional*, defaults to `False`):
                 Whether the run is executed in lazy mode or not (i.e. eager mode).
+            ignore_eos (`bool`, *optional*):
+                Whether to ignore finished sequences (faster in lazy mode and with HPU graphs) or not (eager mode).
+            eos_check_interval (`int`, *optional*):
+                If set, whether all the sequences are finished is only checked every `eos_check_interval` steps, also in
+                lazy mode.
             model_kwargs:
                 Additional model specific keyword arguments will be forwarded to the `forward` function of the model.
                 If model is an encoder-decoder model the kwargs should include `encoder_outputs`.
@@ -863,84 +1458,429 @@ class GaudiGenerationMixin(GenerationMixin):
         ['DeepMind Company is a company that focuses on the development and commercialization of artificial intelligence (AI). DeepMind’s mission is to help people understand and solve problems that are difficult to solve in the world today.\n\nIn this post, we talk about the benefits of deep learning in business and how it']
         ```"""
 
-        raise NotImplementedError("Contrastive search is not supported by optimum-habana yet.")
+        # init values
+        logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        logits_warper = logits_warper if logits_warper is not None else LogitsProcessorList()
+        stopping_criteria = stopping_criteria if stopping_criteria is not None else StoppingCriteriaList()
+        pad_token_id = pad_token_id if pad_token_id is not None else self.generation_config.pad_token_id
+        eos_token_id = eos_token_id if eos_token_id is not None else self.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        eos_token_id_tensor = torch.tensor(eos_token_id).to(input_ids.device) if eos_token_id is not None else None
+        output_scores = output_scores if output_scores is not None else self.generation_config.output_scores
+        output_attentions = (
+            output_attentions if output_attentions is not None else self.generation_config.output_attentions
+        )
+        output_hidden_states = (
+            output_hidden_states if output_hidden_states is not None else self.generation_config.output_hidden_states
+        )
+        return_dict_in_generate = (
+            return_dict_in_generate
+            if return_dict_in_generate is not None
+            else self.generation_config.return_dict_in_generate
+        )
 
-    def greedy_search(
-        self,
-        input_ids: torch.LongTensor,
-        logits_processor: Optional[LogitsProcessorList] = None,
-        stopping_criteria: Optional[StoppingCriteriaList] = None,
-        max_length: Optional[int] = None,
-        pad_token_id: Optional[int] = None,
-        eos_token_id: Optional[Union[int, List[int]]] = None,
-        output_attentions: Optional[bool] = None,
-        output_hidden_states: Optional[bool] = None,
-        output_scores: Optional[bool] = None,
-        return_dict_in_generate: Optional[bool] = None,
-        synced_gpus: Optional[bool] = False,
-        streamer: Optional["BaseStreamer"] = None,
-        lazy_mode: Optional[bool] = False,
-        ignore_eos: Optional[bool] = None,
-        **model_kwargs,
-    ) -> Union[GreedySearchOutput, torch.LongTensor]:
-        r"""
-        Generates sequences of token ids for models with a language modeling head using **greedy decoding** and can be
-        used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+        # init attention / hidden states / scores tuples
+        scores = () if (return_dict_in_generate and output_scores) else None
+        decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
+        cross_attentions = () if (return_dict_in_generate and output_attentions) else None
+        decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
 
-        <Tip warning={true}>
+        # if model is an encoder-decoder, retrieve encoder attention weights and hidden states
+        if return_dict_in_generate and self.config.is_encoder_decoder:
+            encoder_attentions = model_kwargs["encoder_outputs"].get("attentions") if output_attentions else None
+            encoder_hidden_states = (
+                model_kwargs["encoder_outputs"].get("hidden_states") if output_hidden_states else None
+            )
 
-        In most cases, you do not need to call [`~generation.GenerationMixin.greedy_search`] directly. Use generate()
-        instead. For an overview of generation strategies and code examples, check the [following
-        guide](../generation_strategies).
+        # keep track of which sequences are already finished
+        if not ignore_eos:
+            unfinished_sequences = torch.ones(input_ids.shape[0], dtype=torch.long, device=input_ids.device)
 
-        </Tip>
+        this_peer_finished = False  # used by synced_gpus only
+        num_steps = 0
+        batch_size = input_ids.shape[0]
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None and self.config.is_encoder_decoder:
+            raise ValueError("Contrastive search with static shapes is only supported for decoder-only models.")
 
+        while True:
+            if lazy_mode:
+                self.htcore_generation.mark_step()
 
-        Parameters:
-            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
-                The sequence used as a prompt for the generation.
-            logits_processor (`LogitsProcessorList`, *optional*):
-                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
-                used to modify the prediction scores of the language modeling head applied at each generation step.
-            stopping_criteria (`StoppingCriteriaList`, *optional*):
-                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
-                used to tell if the generation loop should stop.
-            max_length (`int`, *optional*, defaults to 20):
-                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
-                tokens. The maximum length of the sequence to be generated.
-            pad_token_id (`int`, *optional*):
-                The id of the *padding* token.
-            eos_token_id (`Union[int, List[int]]`, *optional*):
-                The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
-            output_attentions (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
-                returned tensors for more details.
-            output_hidden_states (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
-                for more details.
-            output_scores (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
-            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
-                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
-            synced_gpus (`bool`, *optional*, defaults to `False`):
-                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
-            streamer (`BaseStreamer`, *optional*):
-                Streamer object that will be used to stream the generated sequences. Generated tokens are passed
-                through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
-            lazy_mode (`bool`, *optional*, defaults to `False`):
-                Whether the run is executed in lazy mode or not (i.e. eager mode).
-            ignore_eos (`bool`, *optional*):
-                Whether to ignore finished sequences (faster in lazy mode and with HPU graphs) or not (eager mode).
-            model_kwargs:
-                Additional model specific keyword arguments will be forwarded to the `forward` function of the model.
-                If model is an encoder-decoder model the kwargs should include `encoder_outputs`.
+            if synced_gpus:
+                # Under synced_gpus the `forward` call must continue until all gpus complete their sequence.
+                # The following logic allows an early break if all peers finished generating their sequence
+                this_peer_finished_flag = torch.tensor(0.0 if this_peer_finished else 1.0).to(input_ids.device)
+                # send 0.0 if we finished, 1.0 otherwise
+                dist.all_reduce(this_peer_finished_flag, op=dist.ReduceOp.SUM)
+                # did all peers finish? the reduced sum will be 0.0 then
+                if this_peer_finished_flag.item() == 0.0:
+                    break
 
-        Return:
-            [`transformers.generation.GreedySearchDecoderOnlyOutput`], [`transformers.generation.GreedySearchEncoderDecoderOutput`]
-            or `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
-            [`transformers.generation.GreedySearchDecoderOnlyOutput`] if `model.config.is_encoder_decoder=False` and
-            `return_dict_in_generate=True` or a [`transformers.generation.GreedySearchEncoderDecoderOutput`] if
-            `model.config.is_encoder_decoder=True`.
+            # if the first step in the loop, encode all the prefix and obtain: (1) past_key_values;
+            # (2) last_hidden_states; (3) logit_for_next_step; (4) update model kwargs for the next step
+            if model_kwargs.get("past_key_values") is None:
+                # prepare inputs
+                model_kwargs["use_cache"] = True
+                model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+
+                # encode the given prefix and prepare model inputs; encoder-decoder model process the prefix and save
+                # the `encoder_outputs`
+                outputs = self(
+                    **model_inputs, return_dict=True, output_hidden_states=True, output_attentions=output_attentions
+                )
+
+                # last decoder hidden states will be used to compute the degeneration penalty (cosine similarity with
+                # previous tokens)
+                if self.config.is_encoder_decoder:
+                    last_hidden_states = outputs.decoder_hidden_states[-1]
+                else:
+                    last_hidden_states = outputs.hidden_states[-1]
+
+                if token_idx is not None:
+                    # With static shapes, the hidden states of the padded prompts are the buffer the hidden states of
+                    # the generated tokens are written to, and the cache is expanded once for the top_k candidates
+                    if outputs.logits.shape[-2] > 1:
+                        logit_for_next_step = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+                    else:
+                        logit_for_next_step = outputs.logits[:, -1, :]
+                    past_key_values = self._extract_past_from_model_output(outputs)
+                    model_kwargs["past_key_values"] = self._expand_static_cache(past_key_values, batch_size, top_k)
+                    _, model_kwargs = self._expand_inputs_for_generation(
+                        expand_size=top_k, is_encoder_decoder=self.config.is_encoder_decoder, **model_kwargs
+                    )
+                    # Only the candidate tokens at `token_idx - 1` are read from this buffer
+                    candidate_ids = input_ids.repeat_interleave(top_k, dim=0)
+                    outputs = CausalLMOutputWithPast(
+                        past_key_values=model_kwargs["past_key_values"],
+                        hidden_states=outputs.hidden_states,
+                        attentions=outputs.attentions,
+                    )
+                else:
+                    # next logit for contrastive search to select top-k candidate tokens
+                    logit_for_next_step = outputs.logits[:, -1, :]
+
+                    model_kwargs = self._update_model_kwargs_for_generation(
+                        outputs,
+                        model_kwargs,
+                        is_encoder_decoder=self.config.is_encoder_decoder,
+                        standardize_cache_format=True,
+                    )
+
+                    # Expands model inputs top_k times, for batched forward passes (akin to beam search).
+                    _, model_kwargs = self._expand_inputs_for_generation(
+                        expand_size=top_k, is_encoder_decoder=self.config.is_encoder_decoder, **model_kwargs
+                    )
+
+                past_key_values = model_kwargs.get("past_key_values")
+                if past_key_values is None:
+                    raise ValueError(
+                        f"{self.__class__.__name__} does not support caching and therefore **can't** be used "
+                        "for contrastive search."
+                    )
+                elif token_idx is None and (
+                    not isinstance(past_key_values[0], (tuple, torch.Tensor))
+                    or past_key_values[0][0].shape[0] != batch_size
+                ):
+                    raise ValueError(
+                        f"{self.__class__.__name__} does not have a standard cache format and therefore **can't** be "
+                        "used for contrastive search without further modifications."
+                    )
+
+            # contrastive_search main logic start:
+            # contrastive search decoding consists of two steps: (1) candidate tokens recall; (2) candidate re-rank by
+            # degeneration penalty
+
+            logit_for_next_step = logits_processor(input_ids, logit_for_next_step)
+            logit_for_next_step = logits_warper(input_ids, logit_for_next_step)
+            next_probs = torch.nn.functional.softmax(logit_for_next_step, dim=-1)
+            top_k_probs, top_k_ids = torch.topk(next_probs, dim=-1, k=top_k)
+
+            # Store scores, attentions and hidden_states when required
+            if return_dict_in_generate:
+                if output_scores:
+                    scores += (logit_for_next_step,)
+                if output_attentions:
+                    decoder_attentions += (
+                        (outputs.decoder_attentions,) if self.config.is_encoder_decoder else (outputs.attentions,)
+                    )
+                    if self.config.is_encoder_decoder:
+                        cross_attentions += (outputs.cross_attentions,)
+
+                if output_hidden_states:
+                    decoder_hidden_states += (
+                        (outputs.decoder_hidden_states,)
+                        if self.config.is_encoder_decoder
+                        else (outputs.hidden_states,)
+                    )
+
+            if token_idx is not None:
+                # The attention mask and `token_idx` are updated before computing the candidates rather than after
+                # selecting them so that they never go past the padded length, but after the logits processors so that
+                # `token_idx` is the number of valid tokens for them. Candidates are at `token_idx - 1`.
+                model_kwargs = self._update_model_kwargs_for_generation(
+                    outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+                )
+                candidate_ids.index_copy_(1, token_idx - 1, top_k_ids.view(-1, 1))
+                next_model_inputs = self.prepare_inputs_for_generation(candidate_ids, **model_kwargs)
+            else:
+                # Replicates the new past_key_values to match the `top_k` candidates
+                new_key_values = []
+                for layer in model_kwargs["past_key_values"]:
+                    items = []
+                    # item is either the key or the value matrix
+                    for item in layer:
+                        items.append(item.repeat_interleave(top_k, dim=0))
+                    new_key_values.append(items)
+                model_kwargs["past_key_values"] = new_key_values
+
+                next_model_inputs = self.prepare_inputs_for_generation(top_k_ids.view(-1, 1), **model_kwargs)
+
+            # compute the candidate tokens by the language model and collects their hidden_states
+            outputs = self(
+                **next_model_inputs, return_dict=True, output_hidden_states=True, output_attentions=output_attentions
+            )
+
+            logits = outputs.logits[:, -1, :]
+            # name is different for encoder-decoder and decoder-only models
+            if self.config.is_encoder_decoder:
+                next_hidden = outputs.decoder_hidden_states[-1]
+                full_hidden_states = outputs.decoder_hidden_states
+            else:
+                next_hidden = outputs.hidden_states[-1]
+                full_hidden_states = outputs.hidden_states
+
+            # compute the degeneration penalty and re-rank the candidates based on the degeneration penalty and the
+            # model confidence
+            if token_idx is not None:
+                selected_idx = _ranking_static(
+                    last_hidden_states, next_hidden, top_k_probs, penalty_alpha, token_idx - 1
+                )
+            else:
+                context_hidden = last_hidden_states.repeat_interleave(top_k, dim=0)
+                selected_idx = _ranking_fast(context_hidden, next_hidden, top_k_probs, penalty_alpha, top_k)
+
+            # prepare for the next step: (1) next token_id; (2) past_key_values; (3) last_hidden_states for computing
+            # the degeneration penalty; (4) logits for selecting next top-k candidates; (5) selected tokens scores
+            # (model confidence minus degeneration penalty); (6) decoder hidden_states
+            batch_range = torch.arange(batch_size, device=input_ids.device)
+            next_tokens = top_k_ids[batch_range, selected_idx]
+            if logprobs is not None:
+                logprobs.put(logit_for_next_step, next_tokens)
+            next_hidden = next_hidden.view(batch_size, top_k, *next_hidden.shape[1:])[batch_range, selected_idx]
+            if token_idx is not None:
+                last_hidden_states.index_copy_(1, token_idx - 1, next_hidden)
+            else:
+                last_hidden_states = torch.cat([last_hidden_states, next_hidden], dim=1)
+
+            next_decoder_hidden_states = ()
+            for layer in full_hidden_states:
+                layer = torch.stack(torch.split(layer, top_k))[batch_range, selected_idx, :]
+                next_decoder_hidden_states += (layer,)
+
+            # select the past_key_value
+            if token_idx is not None:
+                # All the candidates of a sequence take the cache of the selected one, in place
+                selected_rows = (batch_range * top_k + selected_idx).repeat_interleave(top_k)
+                next_past_key_values = self._reorder_static_cache(
+                    self._extract_past_from_model_output(outputs), selected_rows
+                )
+            else:
+                next_past_key_values = self._extract_past_from_model_output(outputs, standardize_cache_format=True)
+                new_key_values = ()
+                for layer in next_past_key_values:
+                    items = ()
+                    # item is either the key or the value matrix
+                    for item in layer:
+                        item = torch.stack(torch.split(item, top_k, dim=0))  # [B, K, num_head, seq_len, esz]
+                        item = item[batch_range, selected_idx, ...]  # [B, num_head, seq_len, esz]
+                        items += (item,)
+                    new_key_values += (items,)
+                next_past_key_values = new_key_values
+
+            logit_for_next_step = torch.stack(torch.split(logits, top_k))[batch_range, selected_idx, :]
+
+            # Rebuilds the relevant parts of the model output for the selected token, for use in the next iteration
+            if self.config.is_encoder_decoder:
+                next_step_cross_attentions = ()
+                next_step_decoder_attentions = ()
+                if output_attentions:
+                    for layer in outputs.cross_attentions:
+                        layer = torch.stack(torch.split(layer, top_k, dim=0))[batch_range, selected_idx, ...]
+                        next_step_cross_attentions += (layer,)
+                    for layer in outputs.decoder_attentions:
+                        layer = torch.stack(torch.split(layer, top_k, dim=0))[batch_range, selected_idx, ...]
+                        next_step_decoder_attentions += (layer,)
+                outputs = Seq2SeqLMOutput(
+                    past_key_values=next_past_key_values,
+                    decoder_hidden_states=next_decoder_hidden_states,
+                    decoder_attentions=next_step_decoder_attentions or None,
+                    cross_attentions=next_step_cross_attentions or None,
+                )
+            else:
+                next_step_attentions = ()
+                if output_attentions:
+                    for layer in outputs.attentions:
+                        layer = torch.stack(torch.split(layer, top_k, dim=0))[batch_range, selected_idx, ...]
+                        next_step_attentions += (layer,)
+                outputs = CausalLMOutputWithPast(
+                    past_key_values=next_past_key_values,
+                    hidden_states=next_decoder_hidden_states,
+                    attentions=next_step_attentions or None,
+                )
+            # contrastive_search main logic end
+
+            if synced_gpus and this_peer_finished:
+                continue  # don't waste resources running the code we don't need
+
+            # finished sentences should have their next token be a padding token
+            if not ignore_eos and eos_token_id is not None:
+                if pad_token_id is None:
+                    raise ValueError("If `eos_token_id` is defined, make sure that `pad_token_id` is defined.")
+                next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
+
+            # update generated ids, model inputs, and length for next step
+            if token_idx is not None:
+                input_ids.index_copy_(1, token_idx - 1, next_tokens.unsqueeze(-1))
+            else:
+                input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+            if streamer is not None:
+                _put_to_streamer(streamer, next_tokens)
+            if token_idx is None:
+                model_kwargs = self._update_model_kwargs_for_generation(
+                    outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+                )
+
+            # if eos_token was found in one sentence, set sentence to finished
+            if not ignore_eos and eos_token_id_tensor is not None:
+                unfinished_sequences = unfinished_sequences.mul(
+                    next_tokens.tile(eos_token_id_tensor.shape[0], 1).ne(eos_token_id_tensor.unsqueeze(1)).prod(dim=0)
+                )
+
+            # stop when each sentence is finished, or if we exceed the maximum length
+            num_steps += 1
+            check_eos = not ignore_eos and (eos_check_interval is None or num_steps % eos_check_interval == 0)
+            if (check_eos and unfinished_sequences.max() == 0) or stopping_criteria(input_ids, scores):
+                if not synced_gpus:
+                    break
+                else:
+                    this_peer_finished = True
+
+        if streamer is not None:
+            streamer.end()
+
+        if return_dict_in_generate:
+            if self.config.is_encoder_decoder:
+                return ContrastiveSearchEncoderDecoderOutput(
+                    sequences=input_ids,
+                    scores=scores,
+                    encoder_attentions=encoder_attentions,
+                    encoder_hidden_states=encoder_hidden_states,
+                    decoder_attentions=decoder_attentions,
+                    cross_attentions=cross_attentions,
+                    decoder_hidden_states=decoder_hidden_states,
+                )
+            else:
+                return ContrastiveSearchDecoderOnlyOutput(
+                    sequences=input_ids,
+                    scores=scores,
+                    attentions=decoder_attentions,
+                    hidden_states=decoder_hidden_states,
+                )
+        else:
+            return input_ids
+
+    def greedy_search(
+        self,
+        input_ids: torch.LongTensor,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        stopping_criteria: Optional[StoppingCriteriaList] = None,
+        max_length: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        output_attentions: Optional[bool] = None,
+        output_hidden_states: Optional[bool] = None,
+        output_scores: Optional[bool] = None,
+        return_dict_in_generate: Optional[bool] = None,
+        synced_gpus: Optional[bool] = False,
+        streamer: Optional["BaseStreamer"] = None,
+        logprobs: Optional["LogprobsBuffer"] = None,
+        batch_compaction: Optional["BatchCompaction"] = None,
+        token_constraint: Optional["TokenConstraintFSM"] = None,
+        lazy_mode: Optional[bool] = False,
+        ignore_eos: Optional[bool] = None,
+        eos_check_interval: Optional[int] = None,
+        **model_kwargs,
+    ) -> Union[GreedySearchOutput, torch.LongTensor]:
+        r"""
+        Generates sequences of token ids for models with a language modeling head using **greedy decoding** and can be
+        used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+
+        <Tip warning={true}>
+
+        In most cases, you do not need to call [`~generation.GenerationMixin.greedy_search`] directly. Use generate()
+        instead. For an overview of generation strategies and code examples, check the [following
+        guide](../generation_strategies).
+
+        </Tip>
+
+
+        Parameters:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The sequence used as a prompt for the generation.
+            logits_processor (`LogitsProcessorList`, *optional*):
+                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
+                used to modify the prediction scores of the language modeling head applied at each generation step.
+            stopping_criteria (`StoppingCriteriaList`, *optional*):
+                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
+                used to tell if the generation loop should stop.
+            max_length (`int`, *optional*, defaults to 20):
+                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
+                tokens. The maximum length of the sequence to be generated.
+            pad_token_id (`int`, *optional*):
+                The id of the *padding* token.
+            eos_token_id (`Union[int, List[int]]`, *optional*):
+                The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
+            output_attentions (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
+                returned tensors for more details.
+            output_hidden_states (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
+                for more details.
+            output_scores (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
+            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
+                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
+            synced_gpus (`bool`, *optional*, defaults to `False`):
+                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
+            streamer (`BaseStreamer`, *optional*):
+                Streamer object that will be used to stream the generated sequences. Generated tokens are passed
+                through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
+            logprobs (`LogprobsBuffer`, *optional*):
+                If provided, the log-probabilities of the generated tokens are written into its buffers, which should
+                have been allocated for this generation.
+            batch_compaction (`BatchCompaction`, *optional*):
+                If provided, the batch is shrunk to the sequences that are still running as sequences finish.
+            token_constraint (`TokenConstraintFSM`, *optional*):
+                If provided, the scores of the tokens its state machine does not allow are masked at each step.
+            lazy_mode (`bool`, *optional*, defaults to `False`):
+                Whether the run is executed in lazy mode or not (i.e. eager mode).
+            ignore_eos (`bool`, *optional*):
+                Whether to ignore finished sequences (faster in lazy mode and with HPU graphs) or not (eager mode).
+            eos_check_interval (`int`, *optional*):
+                If set, whether all the sequences are finished is only checked every `eos_check_interval` steps, also in
+                lazy mode.
+            model_kwargs:
+                Additional model specific keyword arguments will be forwarded to the `forward` function of the model.
+                If model is an encoder-decoder model the kwargs should include `encoder_outputs`.
+
+        Return:
+            [`transformers.generation.GreedySearchDecoderOnlyOutput`], [`transformers.generation.GreedySearchEncoderDecoderOutput`]
+            or `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
+            [`transformers.generation.GreedySearchDecoderOnlyOutput`] if `model.config.is_encoder_decoder=False` and
+            `return_dict_in_generate=True` or a [`transformers.generation.GreedySearchEncoderDecoderOutput`] if
+            `model.config.is_encoder_decoder=True`.
 
         Examples:
 
@@ -1026,6 +1966,12 @@ class GaudiGenerationMixin(GenerationMixin):
             unfinished_sequences = torch.ones(input_ids.shape[0], dtype=torch.long, device=input_ids.device)
 
         this_peer_finished = False  # used by synced_gpus only
+        vocab_parallel_lm_head = _get_vocab_parallel_lm_head(self)
+        if batch_compaction is not None:
+            batch_compaction.start(input_ids)
+        if token_constraint is not None:
+            constraint_states = token_constraint.initial_states(input_ids.shape[0], input_ids.device)
+        num_steps = 0
         while True:
             if lazy_mode:
                 self.htcore_generation.mark_step()
@@ -1056,12 +2002,14 @@ class GaudiGenerationMixin(GenerationMixin):
 
             token_idx = model_kwargs.get("token_idx", None)
             if token_idx is not None and outputs.logits.shape[-2] > 1:
-                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1)
+                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
             else:
                 next_token_logits = outputs.logits[:, -1, :]
 
             # pre-process distribution
             next_tokens_scores = logits_processor(input_ids, next_token_logits)
+            if token_constraint is not None:
+                next_tokens_scores = token_constraint.mask(next_tokens_scores, constraint_states)
 
             # Store scores, attentions and hidden_states when required
             if return_dict_in_generate:
@@ -1082,13 +2030,20 @@ class GaudiGenerationMixin(GenerationMixin):
                     )
 
             # argmax
-            next_tokens = torch.argmax(next_tokens_scores, dim=-1)
+            if vocab_parallel_lm_head is not None:
+                next_tokens = vocab_parallel_lm_head.argmax(next_tokens_scores)
+            else:
+                next_tokens = torch.argmax(next_tokens_scores, dim=-1)
+            if logprobs is not None:
+                logprobs.put(next_tokens_scores, next_tokens)
 
             # finished sentences should have their next token be a padding token
             if not ignore_eos and eos_token_id is not None:
                 if pad_token_id is None:
                     raise ValueError("If `eos_token_id` is defined, make sure that `pad_token_id` is defined.")
                 next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
+            if token_constraint is not None:
+                constraint_states = token_constraint.advance(constraint_states, next_tokens)
 
             # update generated ids, model inputs, and length for next step
             if token_idx is not None:
@@ -1098,7 +2053,7 @@ class GaudiGenerationMixin(GenerationMixin):
             else:
                 input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
             if streamer is not None:
-                streamer.put(next_tokens.cpu())
+                _put_to_streamer(streamer, next_tokens)
             model_kwargs = self._update_model_kwargs_for_generation(
                 outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
             )
@@ -1109,16 +2064,29 @@ class GaudiGenerationMixin(GenerationMixin):
                     next_tokens.tile(eos_token_id_tensor.shape[0], 1).ne(eos_token_id_tensor.unsqueeze(1)).prod(dim=0)
                 )
 
-            # stop if we exceed the maximum length, or when each sentence is finished (eager mode only)
-            if (not ignore_eos and unfinished_sequences.max() == 0) or stopping_criteria(input_ids, scores):
+            # stop if we exceed the maximum length, or when each sentence is finished (checked every
+            # `eos_check_interval` steps if given)
+            num_steps += 1
+            check_eos = not ignore_eos and (eos_check_interval is None or num_steps % eos_check_interval == 0)
+            if (check_eos and unfinished_sequences.max() == 0) or stopping_criteria(input_ids, scores):
                 if not synced_gpus:
                     break
                 else:
                     this_peer_finished = True
+            elif check_eos and batch_compaction is not None:
+                input_ids, unfinished_sequences, model_kwargs = batch_compaction.compact(
+                    input_ids, unfinished_sequences, model_kwargs
+                )
+                if token_constraint is not None:
+                    constraint_states = batch_compaction.select_rows(constraint_states)
 
         if streamer is not None:
             streamer.end()
 
+        if batch_compaction is not None:
+            # Rows removed from the batch go back to their original positions
+            input_ids = batch_compaction.gather(input_ids, pad_token_id)
+
         if return_dict_in_generate:
             if self.config.is_encoder_decoder:
                 return GreedySearchEncoderDecoderOutput(
@@ -1155,7 +2123,14 @@ class GaudiGenerationMixin(GenerationMixin):
         return_dict_in_generate: Optional[bool] = None,
         synced_gpus: Optional[bool] = False,
         streamer: Optional["BaseStreamer"] = None,
+        logprobs: Optional["LogprobsBuffer"] = None,
+        batch_compaction: Optional["BatchCompaction"] = None,
+        token_constraint: Optional["TokenConstraintFSM"] = None,
         lazy_mode: Optional[bool] = False,
+        ignore_eos: Optional[bool] = None,
+        eos_check_interval: Optional[int] = None,
+        sampler: Optional[StaticTopKTopPSampler] = None,
+        max_new_tokens: Optional[torch.LongTensor] = None,
         **model_kwargs,
     ) -> Union[SampleOutput, torch.LongTensor]:
         r"""
@@ -1205,8 +2180,26 @@ class GaudiGenerationMixin(GenerationMixin):
             streamer (`BaseStreamer`, *optional*):
                 Streamer object that will be used to stream the generated sequences. Generated tokens are passed
                 through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
+            logprobs (`LogprobsBuffer`, *optional*):
+                If provided, the log-probabilities of the generated tokens are written into its buffers, which should
+                have been allocated for this generation.
+            batch_compaction (`BatchCompaction`, *optional*):
+                If provided, the batch is shrunk to the sequences that are still running as sequences finish.
+            token_constraint (`TokenConstraintFSM`, *optional*):
+                If provided, the scores of the tokens its state machine does not allow are masked at each step.
             lazy_mode (`bool`, *optional*, defaults to `False`):
                 Whether the run is executed in lazy mode or not (i.e. eager mode).
+            ignore_eos (`bool`, *optional*):
+                Whether to ignore finished sequences (faster in lazy mode and with HPU graphs) or not (eager mode).
+            eos_check_interval (`int`, *optional*):
+                If set, whether all the sequences are finished is only checked every `eos_check_interval` steps, also in
+                lazy mode.
+            sampler (`StaticTopKTopPSampler`, *optional*):
+                If provided, replaces `logits_warper` and the multinomial draw over the whole vocabulary with a single
+                top-k, top-p and temperature sampling stage of fixed shape.
+            max_new_tokens (`torch.LongTensor` of shape `(batch_size,)`, *optional*):
+                The maximum number of tokens to generate for each sequence, sequences being finished and then padded
+                once they reach it. Requires static shapes (`token_idx`).
             model_kwargs:
                 Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
                 an encoder-decoder model the kwargs should include `encoder_outputs`.
@@ -1321,6 +2314,19 @@ class GaudiGenerationMixin(GenerationMixin):
         unfinished_sequences = torch.ones(input_ids.shape[0], dtype=torch.long, device=input_ids.device)
 
         this_peer_finished = False  # used by synced_gpus only
+        vocab_parallel_lm_head = _get_vocab_parallel_lm_head(self)
+        if max_new_tokens is not None:
+            if model_kwargs.get("token_idx", None) is None:
+                raise ValueError("Per-sequence `max_new_tokens` requires static shapes (`token_idx`).")
+            if pad_token_id is None:
+                raise ValueError("Per-sequence `max_new_tokens` requires `pad_token_id` to pad finished sequences.")
+            # Number of valid tokens at which each sequence is finished, kept on device
+            max_lengths = model_kwargs["token_idx"] + max_new_tokens.to(input_ids.device)
+        if batch_compaction is not None:
+            batch_compaction.start(input_ids)
+        if token_constraint is not None:
+            constraint_states = token_constraint.initial_states(input_ids.shape[0], input_ids.device)
+        num_steps = 0
         # auto-regressive generation
         while True:
             if lazy_mode:
@@ -1352,17 +2358,29 @@ class GaudiGenerationMixin(GenerationMixin):
 
             token_idx = model_kwargs.get("token_idx", None)
             if token_idx is not None and outputs.logits.shape[-2] > 1:
-                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1)
+                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
             else:
                 next_token_logits = outputs.logits[:, -1, :]
 
             # pre-process distribution
             next_token_scores = logits_processor(input_ids, next_token_logits)
-            next_token_scores = logits_warper(input_ids, next_token_scores)
+            if token_constraint is not None:
+                next_token_scores = token_constraint.mask(next_token_scores, constraint_states)
+            if vocab_parallel_lm_head is not None:
+                # The best tokens of each rank contain the best tokens of the whole vocabulary
+                candidate_scores, candidate_ids = vocab_parallel_lm_head.top_k(next_token_scores, sampler.top_k)
+                top_scores, top_indices = sampler.warp(candidate_scores)
+                top_ids = torch.gather(candidate_ids, 1, top_indices)
+            elif sampler is not None:
+                top_scores, top_ids = sampler.warp(next_token_scores)
+            else:
+                next_token_scores = logits_warper(input_ids, next_token_scores)
 
             # Store scores, attentions and hidden_states when required
             if return_dict_in_generate:
                 if output_scores:
+                    if sampler is not None:
+                        next_token_scores = sampler.scatter(top_scores, top_ids, next_token_scores.shape[-1])
                     scores += (next_token_scores,)
                 if output_attentions:
                     decoder_attentions += (
@@ -1379,14 +2397,27 @@ class GaudiGenerationMixin(GenerationMixin):
                     )
 
             # sample
-            probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
-            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+            if sampler is not None:
+                next_tokens = sampler.sample(top_scores, top_ids)
+                if vocab_parallel_lm_head is not None:
+                    # Random number generators may differ across ranks, all ranks keep the tokens of the first one
+                    next_tokens = vocab_parallel_lm_head.broadcast(next_tokens)
+            else:
+                probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
+                next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+            if logprobs is not None:
+                if sampler is not None:
+                    logprobs.put(top_scores, next_tokens, token_ids=top_ids)
+                else:
+                    logprobs.put(next_token_scores, next_tokens)
 
             # finished sentences should have their next token be a padding token
-            if eos_token_id is not None:
+            if eos_token_id is not None or max_new_tokens is not None:
                 if pad_token_id is None:
                     raise ValueError("If `eos_token_id` is defined, make sure that `pad_token_id` is defined.")
                 next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
+            if token_constraint is not None:
+                constraint_states = token_constraint.advance(constraint_states, next_tokens)
 
             # update generated ids, model inputs, and length for next step
             if token_idx is not None:
@@ -1396,7 +2427,7 @@ class GaudiGenerationMixin(GenerationMixin):
             else:
                 input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
             if streamer is not None:
-                streamer.put(next_tokens.cpu())
+                _put_to_streamer(streamer, next_tokens)
             model_kwargs = self._update_model_kwargs_for_generation(
                 outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
             )
@@ -1406,20 +2437,40 @@ class GaudiGenerationMixin(GenerationMixin):
                 unfinished_sequences = unfinished_sequences.mul(
                     next_tokens.tile(eos_token_id_tensor.shape[0], 1).ne(eos_token_id_tensor.unsqueeze(1)).prod(dim=0)
                 )
+            # sequences that generated their own maximum number of new tokens are finished too
+            if max_new_tokens is not None:
+                unfinished_sequences = unfinished_sequences.mul((model_kwargs["token_idx"] < max_lengths).long())
 
             # if lazy_mode and not hpu_graphs:
             #     self.htcore_generation.mark_step()
 
-            # stop if we exceed the maximum length, or when each sentence is finished (eager mode only)
-            if stopping_criteria(input_ids, scores) or (unfinished_sequences.max() == 0 and not lazy_mode):
+            # stop if we exceed the maximum length, or when each sentence is finished (checked every
+            # `eos_check_interval` steps if given)
+            num_steps += 1
+            check_eos = not ignore_eos and (eos_check_interval is None or num_steps % eos_check_interval == 0)
+            if stopping_criteria(input_ids, scores) or (check_eos and unfinished_sequences.max() == 0):
                 if not synced_gpus:
                     break
                 else:
                     this_peer_finished = True
+            elif check_eos and batch_compaction is not None:
+                input_ids, unfinished_sequences, model_kwargs = batch_compaction.compact(
+                    input_ids, unfinished_sequences, model_kwargs
+                )
+                if sampler is not None:
+                    sampler.select_rows(batch_compaction)
+                if max_new_tokens is not None:
+                    max_lengths = batch_compaction.select_rows(max_lengths)
+                if token_constraint is not None:
+                    constraint_states = batch_compaction.select_rows(constraint_states)
 
         if streamer is not None:
             streamer.end()
 
+        if batch_compaction is not None:
+            # Rows removed from the batch go back to their original positions
+            input_ids = batch_compaction.gather(input_ids, pad_token_id)
+
         if return_dict_in_generate:
             if self.config.is_encoder_decoder:
                 return SampleEncoderDecoderOutput(
@@ -1441,75 +2492,304 @@ class GaudiGenerationMixin(GenerationMixin):
         else:
             return input_ids
 
-    def beam_search(
+    def assisted_decoding(
         self,
         input_ids: torch.LongTensor,
-        beam_scorer: BeamScorer,
+        assistant_model: "PreTrainedModel",
+        num_assistant_tokens: int = 5,
+        do_sample: bool = False,
         logits_processor: Optional[LogitsProcessorList] = None,
-        stopping_criteria: Optional[StoppingCriteriaList] = None,
-        max_length: Optional[int] = None,
+        logits_warper: Optional[LogitsProcessorList] = None,
+        max_new_tokens: Optional[int] = None,
         pad_token_id: Optional[int] = None,
         eos_token_id: Optional[Union[int, List[int]]] = None,
-        output_attentions: Optional[bool] = None,
-        output_hidden_states: Optional[bool] = None,
-        output_scores: Optional[bool] = None,
-        return_dict_in_generate: Optional[bool] = None,
-        synced_gpus: Optional[bool] = False,
+        streamer: Optional["BaseStreamer"] = None,
         lazy_mode: Optional[bool] = False,
+        ignore_eos: Optional[bool] = False,
         **model_kwargs,
-    ) -> Union[BeamSearchOutput, torch.LongTensor]:
+    ) -> torch.LongTensor:
         r"""
-        Generates sequences of token ids for models with a language modeling head using **beam search decoding** and
-        can be used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+        Generates sequences of token ids for models with a language modeling head using **speculative decoding**: a
+        small assistant model proposes `num_assistant_tokens` tokens, which are then checked by the model in a single
+        forward pass. Greedy decoding gives exactly the same tokens as [`~generation.GenerationMixin.greedy_search`],
+        and sampling draws from the same distribution as [`~generation.GenerationMixin.sample`] (see [Fast Inference
+        from Transformers via Speculative Decoding](https://arxiv.org/abs/2211.17192)).
 
-        <Tip warning={true}>
-
-        In most cases, you do not need to call [`~generation.GenerationMixin.beam_search`] directly. Use generate()
-        instead. For an overview of generation strategies and code examples, check the [following
-        guide](../generation_strategies).
-
-        </Tip>
+        Both models run on the static-shape path: their key/value caches are preallocated and written in place at
+        `token_idx`, and only three input shapes are ever used, `(1, 2)` and `(1, 1)` for the assistant and
+        `(1, num_assistant_tokens + 1)` for the model. Only a batch size of 1 is supported.
 
         Parameters:
-            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
-                The sequence used as a prompt for the generation.
-            beam_scorer (`BeamScorer`):
-                An derived instance of [`BeamScorer`] that defines how beam hypotheses are constructed, stored and
-                sorted during generation. For more information, the documentation of [`BeamScorer`] should be read.
+            input_ids (`torch.LongTensor` of shape `(1, sequence_length)`):
+                The prompt, padded on the right with at least `max_new_tokens` tokens.
+            assistant_model ([`PreTrainedModel`]):
+                The model proposing tokens. It must share the tokenizer of the model and accept `token_idx`.
+            num_assistant_tokens (`int`, *optional*, defaults to 5):
+                The number of tokens proposed by the assistant model at each step.
+            do_sample (`bool`, *optional*, defaults to `False`):
+                Whether to sample tokens or to pick them greedily.
             logits_processor (`LogitsProcessorList`, *optional*):
                 An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
                 used to modify the prediction scores of the language modeling head applied at each generation step.
-            stopping_criteria (`StoppingCriteriaList`, *optional*):
-                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
-                used to tell if the generation loop should stop.
-            max_length (`int`, *optional*, defaults to 20):
-                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
-                tokens. The maximum length of the sequence to be generated.
+            logits_warper (`LogitsProcessorList`, *optional*):
+                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsWarper`] used
+                to warp the prediction score distribution of the language modeling head applied before multinomial
+                sampling at each generation step. Only used when `do_sample=True`.
+            max_new_tokens (`int`):
+                The maximum number of tokens to generate.
             pad_token_id (`int`, *optional*):
                 The id of the *padding* token.
             eos_token_id (`Union[int, List[int]]`, *optional*):
                 The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
-            output_attentions (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
-                returned tensors for more details.
-            output_hidden_states (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
-                for more details.
-            output_scores (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
-            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
-                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
-            synced_gpus (`bool`, *optional*, defaults to `False`):
-                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
+            streamer (`BaseStreamer`, *optional*):
+                Streamer object that will be used to stream the generated sequences. Generated tokens are passed
+                through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
             lazy_mode (`bool`, *optional*, defaults to `False`):
                 Whether the run is executed in lazy mode or not (i.e. eager mode).
+            ignore_eos (`bool`, *optional*, defaults to `False`):
+                Whether to keep generating after an *end-of-sequence* token or not.
             model_kwargs:
-                Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
-                an encoder-decoder model the kwargs should include `encoder_outputs`.
+                Must contain `token_idx`, the length of the prompt, and `attention_mask`.
 
         Return:
-            [`transformers.generation.utils.BeamSearchDecoderOnlyOutput`], [`transformers.generation.BeamSearchEncoderDecoderOutput`] or
-            `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
+            `torch.LongTensor` of shape `(1, sequence_length)`: the prompt followed by the generated tokens and padding.
+
+        Examples:
+
+        ```python
+        >>> model = AutoModelForCausalLM.from_pretrained("bigscience/bloom-7b1")
+        >>> assistant_model = AutoModelForCausalLM.from_pretrained("bigscience/bloom-560m")
+        >>> inputs = tokenizer("It might be possible to", return_tensors="pt")
+        >>> prompt_length = inputs.input_ids.shape[-1]
+        >>> input_ids = torch.nn.functional.pad(inputs.input_ids, (0, 50), value=model.config.pad_token_id)
+        >>> attention_mask = torch.nn.functional.pad(inputs.attention_mask, (0, 50), value=0)
+        >>> outputs = model.generate(
+        ...     input_ids,
+        ...     attention_mask=attention_mask,
+        ...     token_idx=torch.tensor(prompt_length),
+        ...     max_new_tokens=50,
+        ...     assistant_model=assistant_model,
+        ... )
+        ```"""
+        # init values
+        logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        logits_warper = logits_warper if logits_warper is not None else LogitsProcessorList()
+        pad_token_id = pad_token_id if pad_token_id is not None else self.generation_config.pad_token_id
+        eos_token_id = eos_token_id if eos_token_id is not None else self.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        if ignore_eos or eos_token_id is None:
+            eos_token_id = []
+
+        if input_ids.shape[0] != 1:
+            raise ValueError(f"Assisted generation only supports a batch size of 1, but got {input_ids.shape[0]}.")
+        if model_kwargs.get("token_idx", None) is None or model_kwargs.get("attention_mask", None) is None:
+            raise ValueError("Assisted generation needs `token_idx` and `attention_mask` (static shapes).")
+        if num_assistant_tokens < 1:
+            raise ValueError(f"`num_assistant_tokens` should be at least 1, but is {num_assistant_tokens}.")
+
+        num_candidates = num_assistant_tokens
+        total_length = input_ids.shape[-1]
+        prompt_length = int(model_kwargs["token_idx"])
+        stop_length = min(prompt_length + max_new_tokens, total_length)
+
+        # Room for the tokens speculated past the last position, so that shapes never change
+        input_ids = torch.nn.functional.pad(input_ids, (0, num_candidates), value=pad_token_id)
+        attention_mask = torch.nn.functional.pad(model_kwargs["attention_mask"], (0, num_candidates), value=0)
+        positions = torch.arange(input_ids.shape[-1], device=input_ids.device)
+
+        def get_scores(logits, first_position):
+            # Row i predicts the token at first_position + i and is processed as if the sequence stopped right before
+            scores = []
+            for i in range(logits.shape[0]):
+                prefix_ids = torch.where(positions < first_position + i, input_ids, pad_token_id)
+                row_scores = logits_processor(prefix_ids, logits[i : i + 1])
+                if do_sample:
+                    row_scores = logits_warper(prefix_ids, row_scores)
+                scores.append(row_scores)
+            return torch.cat(scores)
+
+        def pick(scores):
+            if do_sample:
+                return torch.multinomial(torch.nn.functional.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            return torch.argmax(scores, dim=-1)
+
+        def run(model, first_position, num_tokens, past_key_values):
+            # The tokens from first_position onwards are run and written into the cache from first_position
+            outputs = model(
+                input_ids=torch.index_select(input_ids, 1, positions[first_position : first_position + num_tokens]),
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                token_idx=torch.tensor(first_position + 1, device=input_ids.device),
+                use_cache=True,
+                return_dict=True,
+            )
+            if lazy_mode:
+                self.htcore_generation.mark_step()
+            return outputs
+
+        def append(tokens, first_position):
+            index = positions[first_position : first_position + tokens.shape[-1]]
+            input_ids.index_copy_(1, index, tokens.view(1, -1))
+            attention_mask.index_fill_(1, index, 1)
+
+        # Prefill both models, the first token is given by the model
+        token_idx = torch.tensor(prompt_length, device=input_ids.device)
+        outputs = self(
+            input_ids=input_ids, attention_mask=attention_mask, token_idx=token_idx, use_cache=True, return_dict=True
+        )
+        past_key_values = outputs.past_key_values
+        assistant_past_key_values = assistant_model(
+            input_ids=input_ids, attention_mask=attention_mask, token_idx=token_idx, use_cache=True, return_dict=True
+        ).past_key_values
+        if lazy_mode:
+            self.htcore_generation.mark_step()
+
+        next_token = pick(get_scores(outputs.logits[0, prompt_length - 1 : prompt_length], prompt_length))
+        append(next_token, prompt_length)
+        new_tokens = next_token.tolist()
+        if streamer is not None:
+            _put_to_streamer(streamer, next_token)
+        # Both caches hold all the tokens but the last one, that is the next input
+        cur_len = prompt_length + 1
+        finished = cur_len >= stop_length or any(token in eos_token_id for token in new_tokens)
+
+        while not finished:
+            # 1. The assistant speculates tokens. Its first step re-runs the token before the last one as it is
+            # missing from its cache when all the tokens speculated at the previous step were accepted.
+            assistant_probs = []
+            for i in range(num_candidates):
+                if i == 0:
+                    assistant_outputs = run(assistant_model, cur_len - 2, 2, assistant_past_key_values)
+                else:
+                    assistant_outputs = run(assistant_model, cur_len + i - 1, 1, assistant_past_key_values)
+                assistant_past_key_values = assistant_outputs.past_key_values
+                assistant_scores = get_scores(assistant_outputs.logits[0, -1:], cur_len + i)
+                append(pick(assistant_scores), cur_len + i)
+                if do_sample:
+                    assistant_probs.append(torch.nn.functional.softmax(assistant_scores, dim=-1))
+
+            # 2. The model checks all the candidates in a single forward pass
+            outputs = run(self, cur_len - 1, num_candidates + 1, past_key_values)
+            past_key_values = outputs.past_key_values
+            scores = get_scores(outputs.logits[0], cur_len)
+            candidates = input_ids[0, cur_len : cur_len + num_candidates]
+
+            # 3. Candidates are accepted up to the first mismatch, where the token is chosen by the model
+            if do_sample:
+                probs = torch.nn.functional.softmax(scores, dim=-1)
+                assistant_probs = torch.cat(assistant_probs)
+                candidate_probs = probs[:-1].gather(-1, candidates.unsqueeze(-1)).squeeze(-1)
+                candidate_assistant_probs = assistant_probs.gather(-1, candidates.unsqueeze(-1)).squeeze(-1)
+                accepted = torch.rand_like(candidate_probs) * candidate_assistant_probs <= candidate_probs
+                # A rejected token is replaced by a sample from the normalized max(0, p - q)
+                residual_probs = (probs[:-1] - assistant_probs).clamp(min=0)
+                residual_mass = residual_probs.sum(dim=-1, keepdim=True)
+                residual_probs = torch.where(residual_mass > 0, residual_probs / residual_mass, probs[:-1])
+                fallback_tokens = torch.multinomial(torch.cat([residual_probs, probs[-1:]]), num_samples=1).squeeze(1)
+            else:
+                fallback_tokens = torch.argmax(scores, dim=-1)
+                accepted = candidates == fallback_tokens[:-1]
+            num_accepted = accepted.long().cumprod(dim=-1).sum()
+            next_tokens = torch.where(
+                positions[: num_candidates + 1] < num_accepted,
+                torch.nn.functional.pad(candidates, (0, 1), value=pad_token_id),
+                fallback_tokens,
+            )
+            append(next_tokens, cur_len)
+
+            # 4. Single synchronization with the host per step, to know how many tokens were generated
+            new_tokens = next_tokens[: int(num_accepted) + 1].tolist()
+            for i, token in enumerate(new_tokens):
+                if token in eos_token_id:
+                    new_tokens = new_tokens[: i + 1]
+                    finished = True
+                    break
+            new_tokens = new_tokens[: stop_length - cur_len]
+            if streamer is not None:
+                streamer.put(torch.tensor([new_tokens]))
+            cur_len += len(new_tokens)
+            finished = finished or cur_len >= stop_length
+
+            # Rejected candidates are dropped from the attention mask, their cache entries are overwritten later
+            attention_mask.masked_fill_(positions >= cur_len, 0)
+
+        if streamer is not None:
+            streamer.end()
+
+        input_ids = input_ids[:, :total_length]
+        input_ids.masked_fill_(positions[:total_length] >= cur_len, pad_token_id)
+        return input_ids
+
+    def beam_search(
+        self,
+        input_ids: torch.LongTensor,
+        beam_scorer: BeamScorer,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        stopping_criteria: Optional[StoppingCriteriaList] = None,
+        max_length: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        output_attentions: Optional[bool] = None,
+        output_hidden_states: Optional[bool] = None,
+        output_scores: Optional[bool] = None,
+        return_dict_in_generate: Optional[bool] = None,
+        synced_gpus: Optional[bool] = False,
+        lazy_mode: Optional[bool] = False,
+        **model_kwargs,
+    ) -> Union[BeamSearchOutput, torch.LongTensor]:
+        r"""
+        Generates sequences of token ids for models with a language modeling head using **beam search decoding** and
+        can be used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+
+        <Tip warning={true}>
+
+        In most cases, you do not need to call [`~generation.GenerationMixin.beam_search`] directly. Use generate()
+        instead. For an overview of generation strategies and code examples, check the [following
+        guide](../generation_strategies).
+
+        </Tip>
+
+        Parameters:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The sequence used as a prompt for the generation.
+            beam_scorer (`BeamScorer`):
+                An derived instance of [`BeamScorer`] that defines how beam hypotheses are constructed, stored and
+                sorted during generation. For more information, the documentation of [`BeamScorer`] should be read.
+            logits_processor (`LogitsProcessorList`, *optional*):
+                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
+                used to modify the prediction scores of the language modeling head applied at each generation step.
+            stopping_criteria (`StoppingCriteriaList`, *optional*):
+                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
+                used to tell if the generation loop should stop.
+            max_length (`int`, *optional*, defaults to 20):
+                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
+                tokens. The maximum length of the sequence to be generated.
+            pad_token_id (`int`, *optional*):
+                The id of the *padding* token.
+            eos_token_id (`Union[int, List[int]]`, *optional*):
+                The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
+            output_attentions (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
+                returned tensors for more details.
+            output_hidden_states (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
+                for more details.
+            output_scores (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
+            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
+                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
+            synced_gpus (`bool`, *optional*, defaults to `False`):
+                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
+            lazy_mode (`bool`, *optional*, defaults to `False`):
+                Whether the run is executed in lazy mode or not (i.e. eager mode).
+            model_kwargs:
+                Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
+                an encoder-decoder model the kwargs should include `encoder_outputs`.
+
+        Return:
+            [`transformers.generation.utils.BeamSearchDecoderOnlyOutput`], [`transformers.generation.BeamSearchEncoderDecoderOutput`] or
+            `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
             [`transformers.generation.BeamSearchDecoderOnlyOutput`] if `model.config.is_encoder_decoder=False` and
             `return_dict_in_generate=True` or a [`transformers.generation.BeamSearchEncoderDecoderOutput`] if
             `model.config.is_encoder_decoder=True`.
@@ -1595,7 +2875,18 @@ class GaudiGenerationMixin(GenerationMixin):
             else self.generation_config.return_dict_in_generate
         )
 
-        batch_size = len(beam_scorer._beam_hyps)
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None:
+            if not isinstance(beam_scorer, StaticBeamSearchScorer):
+                raise ValueError(
+                    "Beam search with static shapes (i.e. with `token_idx`) requires a `StaticBeamSearchScorer`."
+                )
+            batch_size = beam_scorer.batch_size
+            # The static beam scorer needs to know the current length of the sequences
+            process_kwargs = {"token_idx": token_idx}
+        else:
+            batch_size = len(beam_scorer._beam_hyps)
+            process_kwargs = {}
         num_beams = beam_scorer.num_beams
 
         batch_beam_size, cur_len = input_ids.shape
@@ -1607,8 +2898,11 @@ class GaudiGenerationMixin(GenerationMixin):
 
         # init attention / hidden states / scores tuples
         scores = () if (return_dict_in_generate and output_scores) else None
+        # beam indices are not tracked with static shapes as this would require a host synchronization at every step
         beam_indices = (
-            tuple(() for _ in range(batch_beam_size)) if (return_dict_in_generate and output_scores) else None
+            tuple(() for _ in range(batch_beam_size))
+            if (return_dict_in_generate and output_scores and token_idx is None)
+            else None
         )
         decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
         cross_attentions = () if (return_dict_in_generate and output_attentions) else None
@@ -1629,6 +2923,9 @@ class GaudiGenerationMixin(GenerationMixin):
 
         this_peer_finished = False  # used by synced_gpus only
         while True:
+            if lazy_mode:
+                self.htcore_generation.mark_step()
+
             if synced_gpus:
                 # Under synced_gpus the `forward` call must continue until all gpus complete their sequence.
                 # The following logic allows an early break if all peers finished generating their sequence
@@ -1652,7 +2949,10 @@ class GaudiGenerationMixin(GenerationMixin):
                 cur_len = cur_len + 1
                 continue  # don't waste resources running the code we don't need
 
-            next_token_logits = outputs.logits[:, -1, :]
+            if token_idx is not None and outputs.logits.shape[-2] > 1:
+                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+            else:
+                next_token_logits = outputs.logits[:, -1, :]
             # hack: adjust tokens for Marian. For Marian we have to make sure that the `pad_token_id`
             # cannot be generated both before and after the `torch.nn.functional.log_softmax` operation.
             next_token_logits = self.adjust_logits_during_generation(next_token_logits, cur_len=cur_len)
@@ -1702,29 +3002,37 @@ class GaudiGenerationMixin(GenerationMixin):
                 pad_token_id=pad_token_id,
                 eos_token_id=eos_token_id,
                 beam_indices=beam_indices,
+                **process_kwargs,
             )
 
             beam_scores = beam_outputs["next_beam_scores"]
             beam_next_tokens = beam_outputs["next_beam_tokens"]
             beam_idx = beam_outputs["next_beam_indices"]
 
-            input_ids = torch.cat([input_ids[beam_idx, :], beam_next_tokens.unsqueeze(-1)], dim=-1)
+            if token_idx is not None:
+                input_ids = torch.index_select(input_ids, 0, beam_idx)
+                input_ids.index_copy_(1, token_idx, beam_next_tokens.unsqueeze(-1))
+            else:
+                input_ids = torch.cat([input_ids[beam_idx, :], beam_next_tokens.unsqueeze(-1)], dim=-1)
 
             model_kwargs = self._update_model_kwargs_for_generation(
                 outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
             )
             if model_kwargs["past_key_values"] is not None:
-                model_kwargs["past_key_values"] = self._reorder_cache(model_kwargs["past_key_values"], beam_idx)
+                if token_idx is not None:
+                    # The preallocated cache is reordered in place to keep static shapes
+                    model_kwargs["past_key_values"] = self._reorder_static_cache(
+                        model_kwargs["past_key_values"], beam_idx
+                    )
+                else:
+                    model_kwargs["past_key_values"] = self._reorder_cache(model_kwargs["past_key_values"], beam_idx)
 
-            if return_dict_in_generate and output_scores:
+            if beam_indices is not None:
                 beam_indices = tuple((beam_indices[beam_idx[i]] + (beam_idx[i],) for i in range(len(beam_indices))))
 
             # increase cur_len
             cur_len = cur_len + 1
 
-            # if lazy_mode and not hpu_graphs:
-            #     self.htcore_generation.mark_step()
-
             if stopping_criteria(input_ids, scores) or (beam_scorer.is_done and not lazy_mode):
                 if not synced_gpus:
                     break
@@ -1740,6 +3048,7 @@ class GaudiGenerationMixin(GenerationMixin):
             eos_token_id=eos_token_id,
             max_length=stopping_criteria.max_length,
             beam_indices=beam_indices,
+            **process_kwargs,
         )
 
         if return_dict_in_generate:
@@ -1909,85 +3218,315 @@ class GaudiGenerationMixin(GenerationMixin):
         ['Wie alt bist du?']
         ```"""
 
-        raise NotImplementedError("Beam search sampling is not supported by optimum-habana yet.")
+        # init values
+        logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        stopping_criteria = stopping_criteria if stopping_criteria is not None else StoppingCriteriaList()
+        if max_length is not None:
+            warnings.warn(
+                (
+                    "`max_length` is deprecated in this function, use"
+                    " `stopping_criteria=StoppingCriteriaList(MaxLengthCriteria(max_length=max_length))` instead."
+                ),
+                UserWarning,
+            )
+            stopping_criteria = validate_stopping_criteria(stopping_criteria, max_length)
+        pad_token_id = pad_token_id if pad_token_id is not None else self.generation_config.pad_token_id
+        eos_token_id = eos_token_id if eos_token_id is not None else self.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        output_scores = output_scores if output_scores is not None else self.generation_config.output_scores
+        output_attentions = (
+            output_attentions if output_attentions is not None else self.generation_config.output_attentions
+        )
+        output_hidden_states = (
+            output_hidden_states if output_hidden_states is not None else self.generation_config.output_hidden_states
+        )
+        return_dict_in_generate = (
+            return_dict_in_generate
+            if return_dict_in_generate is not None
+            else self.generation_config.return_dict_in_generate
+        )
 
-    def group_beam_search(
-        self,
-        input_ids: torch.LongTensor,
-        beam_scorer: BeamScorer,
-        logits_processor: Optional[LogitsProcessorList] = None,
-        stopping_criteria: Optional[StoppingCriteriaList] = None,
-        max_length: Optional[int] = None,
-        pad_token_id: Optional[int] = None,
-        eos_token_id: Optional[Union[int, List[int]]] = None,
-        output_attentions: Optional[bool] = None,
-        output_hidden_states: Optional[bool] = None,
-        output_scores: Optional[bool] = None,
-        return_dict_in_generate: Optional[bool] = None,
-        synced_gpus: Optional[bool] = False,
-        lazy_mode: Optional[bool] = False,
-        hpuy_graphs: Optional[bool] = False,
-        **model_kwargs,
-    ):
-        r"""
-        Generates sequences of token ids for models with a language modeling head using **diverse beam search
-        decoding** and can be used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None:
+            if not isinstance(beam_scorer, StaticBeamSearchScorer):
+                raise ValueError(
+                    "Beam search with static shapes (i.e. with `token_idx`) requires a `StaticBeamSearchScorer`."
+                )
+            batch_size = beam_scorer.batch_size
+            # The static beam scorer needs to know the current length of the sequences
+            process_kwargs = {"token_idx": token_idx}
+        else:
+            batch_size = len(beam_scorer._beam_hyps)
+            process_kwargs = {}
+        num_beams = beam_scorer.num_beams
 
-        <Tip warning={true}>
+        batch_beam_size, cur_len = input_ids.shape
 
-        In most cases, you do not need to call [`~generation.GenerationMixin.group_beam_search`] directly. Use
-        generate() instead. For an overview of generation strategies and code examples, check the [following
-        guide](../generation_strategies).
+        # init attention / hidden states / scores tuples
+        scores = () if (return_dict_in_generate and output_scores) else None
+        # beam indices are not tracked with static shapes as this would require a host synchronization at every step
+        beam_indices = (
+            tuple(() for _ in range(batch_beam_size))
+            if (return_dict_in_generate and output_scores and token_idx is None)
+            else None
+        )
+        decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
+        cross_attentions = () if (return_dict_in_generate and output_attentions) else None
+        decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
 
-        </Tip>
+        # if model is an encoder-decoder, retrieve encoder attention weights and hidden states
+        if return_dict_in_generate and self.config.is_encoder_decoder:
+            encoder_attentions = model_kwargs["encoder_outputs"].get("attentions") if output_attentions else None
+            encoder_hidden_states = (
+                model_kwargs["encoder_outputs"].get("hidden_states") if output_hidden_states else None
+            )
 
-        Parameters:
-            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
-                The sequence used as a prompt for the generation.
-            beam_scorer (`BeamScorer`):
-                An derived instance of [`BeamScorer`] that defines how beam hypotheses are constructed, stored and
-                sorted during generation. For more information, the documentation of [`BeamScorer`] should be read.
-            logits_processor (`LogitsProcessorList`, *optional*):
-                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
-                used to modify the prediction scores of the language modeling head applied at each generation step.
-            stopping_criteria (`StoppingCriteriaList`, *optional*):
-                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
-                used to tell if the generation loop should stop.
-            max_length (`int`, *optional*, defaults to 20):
-                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
-                tokens. The maximum length of the sequence to be generated.
-            pad_token_id (`int`, *optional*):
-                The id of the *padding* token.
-            eos_token_id (`Union[int, List[int]]`, *optional*):
-                The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
-            output_attentions (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
-                returned tensors for more details.
-            output_hidden_states (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
-                for more details.
-            output_scores (`bool`, *optional*, defaults to `False`):
-                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
-            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
-                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
-            synced_gpus (`bool`, *optional*, defaults to `False`):
-                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
-            lazy_mode (`bool`, *optional*, defaults to `False`):
-                Whether the run is executed in lazy mode or not (i.e. eager mode).
-            model_kwargs:
-                Additional model specific kwargs that will be forwarded to the `forward` function of the model. If
-                model is an encoder-decoder model the kwargs should include `encoder_outputs`.
+        beam_scores = torch.zeros((batch_size, num_beams), dtype=torch.float, device=input_ids.device)
+        beam_scores = beam_scores.view((batch_size * num_beams,))
 
-        Return:
-            [`transformers.generation.BeamSearchDecoderOnlyOutput`], [`transformers.generation.BeamSearchEncoderDecoderOutput`] or
-            `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
-            [`transformers.generation.BeamSearchDecoderOnlyOutput`] if [`transformers.generation.BeamSearchDecoderOnlyOutput`] if
-            `model.config.is_encoder_decoder=False` and `return_dict_in_generate=True` or a
-            [`transformers.generation.BeamSearchEncoderDecoderOutput`] if `model.config.is_encoder_decoder=True`.
+        this_peer_finished = False  # used by synced_gpus only
+        while True:
+            if lazy_mode:
+                self.htcore_generation.mark_step()
 
-        Examples:
+            if synced_gpus:
+                # Under synced_gpus the `forward` call must continue until all gpus complete their sequence.
+                # The following logic allows an early break if all peers finished generating their sequence
+                this_peer_finished_flag = torch.tensor(0.0 if this_peer_finished else 1.0).to(input_ids.device)
+                # send 0.0 if we finished, 1.0 otherwise
+                dist.all_reduce(this_peer_finished_flag, op=dist.ReduceOp.SUM)
+                # did all peers finish? the reduced sum will be 0.0 then
+                if this_peer_finished_flag.item() == 0.0:
+                    break
 
-        ```python
+            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+
+            outputs = self(
+                **model_inputs,
+                return_dict=True,
+                output_attentions=output_attentions,
+                output_hidden_states=output_hidden_states,
+            )
+
+            if synced_gpus and this_peer_finished:
+                cur_len = cur_len + 1
+                continue  # don't waste resources running the code we don't need
+
+            if token_idx is not None and outputs.logits.shape[-2] > 1:
+                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+            else:
+                next_token_logits = outputs.logits[:, -1, :]
+
+            # hack: adjust tokens for Marian. For Marian we have to make sure that the `pad_token_id`
+            # cannot be generated both before and after the `torch.nn.functional.log_softmax` operation.
+            next_token_logits = self.adjust_logits_during_generation(next_token_logits, cur_len=cur_len)
+            next_token_scores = torch.nn.functional.log_softmax(
+                next_token_logits, dim=-1
+            )  # (batch_size * num_beams, vocab_size)
+
+            next_token_scores_processed = logits_processor(input_ids, next_token_scores)
+            next_token_scores = next_token_scores_processed + beam_scores[:, None].expand_as(next_token_scores)
+            # Note: logits warpers are intentionally applied after adding running beam scores. On some logits warpers
+            # (like top_p) this is indiferent, but on others (like temperature) it is not. For reference, see
+            # https://github.com/huggingface/transformers/pull/5420#discussion_r449779867
+            next_token_scores = logits_warper(input_ids, next_token_scores)
+
+            # Store scores, attentions and hidden_states when required
+            if return_dict_in_generate:
+                if output_scores:
+                    scores += (logits_warper(input_ids, next_token_scores_processed),)
+                if output_attentions:
+                    decoder_attentions += (
+                        (outputs.decoder_attentions,) if self.config.is_encoder_decoder else (outputs.attentions,)
+                    )
+                    if self.config.is_encoder_decoder:
+                        cross_attentions += (outputs.cross_attentions,)
+
+                if output_hidden_states:
+                    decoder_hidden_states += (
+                        (outputs.decoder_hidden_states,)
+                        if self.config.is_encoder_decoder
+                        else (outputs.hidden_states,)
+                    )
+
+            # reshape for beam search
+            vocab_size = next_token_scores.shape[-1]
+            next_token_scores = next_token_scores.view(batch_size, num_beams * vocab_size)
+
+            probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
+
+            next_tokens = torch.multinomial(probs, num_samples=2 * num_beams)
+            next_token_scores = torch.gather(next_token_scores, -1, next_tokens)
+
+            next_token_scores, _indices = torch.sort(next_token_scores, descending=True, dim=1)
+            next_tokens = torch.gather(next_tokens, -1, _indices)
+
+            next_indices = torch.div(next_tokens, vocab_size, rounding_mode="floor")
+            next_tokens = next_tokens % vocab_size
+
+            # stateless
+            beam_outputs = beam_scorer.process(
+                input_ids,
+                next_token_scores,
+                next_tokens,
+                next_indices,
+                pad_token_id=pad_token_id,
+                eos_token_id=eos_token_id,
+                beam_indices=beam_indices,
+                **process_kwargs,
+            )
+            beam_scores = beam_outputs["next_beam_scores"]
+            beam_next_tokens = beam_outputs["next_beam_tokens"]
+            beam_idx = beam_outputs["next_beam_indices"]
+
+            if token_idx is not None:
+                input_ids = torch.index_select(input_ids, 0, beam_idx)
+                input_ids.index_copy_(1, token_idx, beam_next_tokens.unsqueeze(-1))
+            else:
+                input_ids = torch.cat([input_ids[beam_idx, :], beam_next_tokens.unsqueeze(-1)], dim=-1)
+
+            model_kwargs = self._update_model_kwargs_for_generation(
+                outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+            )
+            if model_kwargs["past_key_values"] is not None:
+                if token_idx is not None:
+                    # The preallocated cache is reordered in place to keep static shapes
+                    model_kwargs["past_key_values"] = self._reorder_static_cache(
+                        model_kwargs["past_key_values"], beam_idx
+                    )
+                else:
+                    model_kwargs["past_key_values"] = self._reorder_cache(model_kwargs["past_key_values"], beam_idx)
+
+            if beam_indices is not None:
+                beam_indices = tuple((beam_indices[beam_idx[i]] + (beam_idx[i],) for i in range(len(beam_indices))))
+
+            # increase cur_len
+            cur_len = cur_len + 1
+
+            if stopping_criteria(input_ids, scores) or (beam_scorer.is_done and not lazy_mode):
+                if not synced_gpus:
+                    break
+                else:
+                    this_peer_finished = True
+
+        sequence_outputs = beam_scorer.finalize(
+            input_ids,
+            beam_scores,
+            next_tokens,
+            next_indices,
+            pad_token_id=pad_token_id,
+            eos_token_id=eos_token_id,
+            max_length=stopping_criteria.max_length,
+            beam_indices=beam_indices,
+            **process_kwargs,
+        )
+
+        if return_dict_in_generate:
+            if not output_scores:
+                sequence_outputs["sequence_scores"] = None
+
+            if self.config.is_encoder_decoder:
+                return BeamSampleEncoderDecoderOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    beam_indices=sequence_outputs["beam_indices"],
+                    encoder_attentions=encoder_attentions,
+                    encoder_hidden_states=encoder_hidden_states,
+                    decoder_attentions=decoder_attentions,
+                    cross_attentions=cross_attentions,
+                    decoder_hidden_states=decoder_hidden_states,
+                )
+            else:
+                return BeamSampleDecoderOnlyOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    beam_indices=sequence_outputs["beam_indices"],
+                    attentions=decoder_attentions,
+                    hidden_states=decoder_hidden_states,
+                )
+        else:
+            return sequence_outputs["sequences"]
+
+    def group_beam_search(
+        self,
+        input_ids: torch.LongTensor,
+        beam_scorer: BeamScorer,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        stopping_criteria: Optional[StoppingCriteriaList] = None,
+        max_length: Optional[int] = None,
+        pad_token_id: Optional[int] = None,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        output_attentions: Optional[bool] = None,
+        output_hidden_states: Optional[bool] = None,
+        output_scores: Optional[bool] = None,
+        return_dict_in_generate: Optional[bool] = None,
+        synced_gpus: Optional[bool] = False,
+        lazy_mode: Optional[bool] = False,
+        hpuy_graphs: Optional[bool] = False,
+        **model_kwargs,
+    ):
+        r"""
+        Generates sequences of token ids for models with a language modeling head using **diverse beam search
+        decoding** and can be used for text-decoder, text-to-text, speech-to-text, and vision-to-text models.
+
+        <Tip warning={true}>
+
+        In most cases, you do not need to call [`~generation.GenerationMixin.group_beam_search`] directly. Use
+        generate() instead. For an overview of generation strategies and code examples, check the [following
+        guide](../generation_strategies).
+
+        </Tip>
+
+        Parameters:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The sequence used as a prompt for the generation.
+            beam_scorer (`BeamScorer`):
+                An derived instance of [`BeamScorer`] that defines how beam hypotheses are constructed, stored and
+                sorted during generation. For more information, the documentation of [`BeamScorer`] should be read.
+            logits_processor (`LogitsProcessorList`, *optional*):
+                An instance of [`LogitsProcessorList`]. List of instances of class derived from [`LogitsProcessor`]
+                used to modify the prediction scores of the language modeling head applied at each generation step.
+            stopping_criteria (`StoppingCriteriaList`, *optional*):
+                An instance of [`StoppingCriteriaList`]. List of instances of class derived from [`StoppingCriteria`]
+                used to tell if the generation loop should stop.
+            max_length (`int`, *optional*, defaults to 20):
+                **DEPRECATED**. Use `logits_processor` or `stopping_criteria` directly to cap the number of generated
+                tokens. The maximum length of the sequence to be generated.
+            pad_token_id (`int`, *optional*):
+                The id of the *padding* token.
+            eos_token_id (`Union[int, List[int]]`, *optional*):
+                The id of the *end-of-sequence* token. Optionally, use a list to set multiple *end-of-sequence* tokens.
+            output_attentions (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the attentions tensors of all attention layers. See `attentions` under
+                returned tensors for more details.
+            output_hidden_states (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the hidden states of all layers. See `hidden_states` under returned tensors
+                for more details.
+            output_scores (`bool`, *optional*, defaults to `False`):
+                Whether or not to return the prediction scores. See `scores` under returned tensors for more details.
+            return_dict_in_generate (`bool`, *optional*, defaults to `False`):
+                Whether or not to return a [`transformers.generationutils.ModelOutput`] instead of a plain tuple.
+            synced_gpus (`bool`, *optional*, defaults to `False`):
+                Whether to continue running the while loop until max_length (needed for ZeRO stage 3)
+            lazy_mode (`bool`, *optional*, defaults to `False`):
+                Whether the run is executed in lazy mode or not (i.e. eager mode).
+            model_kwargs:
+                Additional model specific kwargs that will be forwarded to the `forward` function of the model. If
+                model is an encoder-decoder model the kwargs should include `encoder_outputs`.
+
+        Return:
+            [`transformers.generation.BeamSearchDecoderOnlyOutput`], [`transformers.generation.BeamSearchEncoderDecoderOutput`] or
+            `torch.LongTensor`: A `torch.LongTensor` containing the generated tokens (default behaviour) or a
+            [`transformers.generation.BeamSearchDecoderOnlyOutput`] if [`transformers.generation.BeamSearchDecoderOnlyOutput`] if
+            `model.config.is_encoder_decoder=False` and `return_dict_in_generate=True` or a
+            [`transformers.generation.BeamSearchEncoderDecoderOutput`] if `model.config.is_encoder_decoder=True`.
+
+        Examples:
+
+        ```python
         >>> from transformers import (
         ...     AutoTokenizer,
         ...     AutoModelForSeq2SeqLM,
@@ -2026,23 +3565,311 @@ class GaudiGenerationMixin(GenerationMixin):
         ...     num_beam_groups=3,
         ... )
 
-        >>> # instantiate logits processors
-        >>> logits_processor = LogitsProcessorList(
-        ...     [
-        ...         HammingDiversityLogitsProcessor(5.5, num_beams=6, num_beam_groups=3),
-        ...         MinLengthLogitsProcessor(5, eos_token_id=model.config.eos_token_id),
-        ...     ]
-        ... )
+        >>> # instantiate logits processors
+        >>> logits_processor = LogitsProcessorList(
+        ...     [
+        ...         HammingDiversityLogitsProcessor(5.5, num_beams=6, num_beam_groups=3),
+        ...         MinLengthLogitsProcessor(5, eos_token_id=model.config.eos_token_id),
+        ...     ]
+        ... )
+
+        >>> outputs = model.group_beam_search(
+        ...     input_ids, beam_scorer, logits_processor=logits_processor, **model_kwargs
+        ... )
+
+        >>> tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        ['Wie alt bist du?']
+        ```"""
+
+        # init values
+        logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        stopping_criteria = stopping_criteria if stopping_criteria is not None else StoppingCriteriaList()
+        if max_length is not None:
+            warnings.warn(
+                (
+                    "`max_length` is deprecated in this function, use"
+                    " `stopping_criteria=StoppingCriteriaList(MaxLengthCriteria(max_length=max_length))` instead."
+                ),
+                UserWarning,
+            )
+            stopping_criteria = validate_stopping_criteria(stopping_criteria, max_length)
+        pad_token_id = pad_token_id if pad_token_id is not None else self.generation_config.pad_token_id
+        eos_token_id = eos_token_id if eos_token_id is not None else self.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        output_scores = output_scores if output_scores is not None else self.generation_config.output_scores
+        output_attentions = (
+            output_attentions if output_attentions is not None else self.generation_config.output_attentions
+        )
+        output_hidden_states = (
+            output_hidden_states if output_hidden_states is not None else self.generation_config.output_hidden_states
+        )
+        return_dict_in_generate = (
+            return_dict_in_generate
+            if return_dict_in_generate is not None
+            else self.generation_config.return_dict_in_generate
+        )
+
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None:
+            if not isinstance(beam_scorer, StaticBeamSearchScorer):
+                raise ValueError(
+                    "Beam search with static shapes (i.e. with `token_idx`) requires a `StaticBeamSearchScorer`."
+                )
+            batch_size = beam_scorer.batch_size
+            # The static beam scorer needs to know the current length of the sequences
+            process_kwargs = {"token_idx": token_idx}
+        else:
+            batch_size = len(beam_scorer._beam_hyps)
+            process_kwargs = {}
+        num_beams = beam_scorer.num_beams
+        num_beam_groups = beam_scorer.num_beam_groups
+        num_sub_beams = num_beams // num_beam_groups
+        device = input_ids.device
+
+        batch_beam_size, cur_len = input_ids.shape
+
+        # beam indices are not tracked with static shapes as this would require a host synchronization at every step
+        if return_dict_in_generate and output_scores and token_idx is None:
+            beam_indices = [tuple(() for _ in range(num_sub_beams * batch_size)) for _ in range(num_beam_groups)]
+        else:
+            beam_indices = None
+
+        if num_beams * batch_size != batch_beam_size:
+            raise ValueError(
+                f"Batch dimension of `input_ids` should be {num_beams * batch_size}, but is {batch_beam_size}."
+            )
+
+        # init attention / hidden states / scores tuples
+        scores = () if (return_dict_in_generate and output_scores) else None
+        decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
+        cross_attentions = () if (return_dict_in_generate and output_attentions) else None
+        decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
+
+        # if model is an encoder-decoder, retrieve encoder attention weights and hidden states
+        if return_dict_in_generate and self.config.is_encoder_decoder:
+            encoder_attentions = model_kwargs["encoder_outputs"].get("attentions") if output_attentions else None
+            encoder_hidden_states = (
+                model_kwargs["encoder_outputs"].get("hidden_states") if output_hidden_states else None
+            )
+
+        # initialise score of first beam of each group with 0 and the rest with -1e9. This ensures that the beams in
+        # the same group don't produce same tokens everytime.
+        beam_scores = torch.full((batch_size, num_beams), -1e9, dtype=torch.float, device=device)
+        beam_scores[:, ::num_sub_beams] = 0
+        beam_scores = beam_scores.view((batch_size * num_beams,))
+
+        # indices of the beams of each group among all sentences in batch, computed once so that every step only uses
+        # device-side index operations
+        batch_group_indices = [
+            (
+                torch.arange(batch_size, device=device).unsqueeze(-1) * num_beams
+                + torch.arange(beam_group_idx * num_sub_beams, (beam_group_idx + 1) * num_sub_beams, device=device)
+            ).view(-1)
+            for beam_group_idx in range(num_beam_groups)
+        ]
+
+        this_peer_finished = False  # used by synced_gpus only
+        while True:
+            if lazy_mode:
+                self.htcore_generation.mark_step()
+
+            if synced_gpus:
+                # Under synced_gpus the `forward` call must continue until all gpus complete their sequence.
+                # The following logic allows an early break if all peers finished generating their sequence
+                this_peer_finished_flag = torch.tensor(0.0 if this_peer_finished else 1.0).to(input_ids.device)
+                # send 0.0 if we finished, 1.0 otherwise
+                dist.all_reduce(this_peer_finished_flag, op=dist.ReduceOp.SUM)
+                # did all peers finish? the reduced sum will be 0.0 then
+                if this_peer_finished_flag.item() == 0.0:
+                    break
+
+            # predicted tokens in cur_len step
+            current_tokens = torch.zeros(batch_size * num_beams, dtype=input_ids.dtype, device=device)
+
+            # indices which will form the beams in the next time step
+            reordering_indices = torch.zeros(batch_size * num_beams, dtype=torch.long, device=device)
+
+            # do one decoder step on all beams of all sentences in batch
+            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+            outputs = self(
+                **model_inputs,
+                return_dict=True,
+                output_attentions=output_attentions,
+                output_hidden_states=output_hidden_states,
+            )
+
+            if synced_gpus and this_peer_finished:
+                cur_len = cur_len + 1
+                continue  # don't waste resources running the code we don't need
+
+            if token_idx is not None and outputs.logits.shape[-2] > 1:
+                all_next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+            else:
+                all_next_token_logits = outputs.logits[:, -1, :]
+
+            if output_scores:
+                processed_score = torch.zeros_like(all_next_token_logits)
+
+            for beam_group_idx in range(num_beam_groups):
+                group_start_idx = beam_group_idx * num_sub_beams
+                group_size = num_sub_beams
+                group_indices = batch_group_indices[beam_group_idx]
+                group_input_ids = torch.index_select(input_ids, 0, group_indices)
+
+                # select outputs of beams of current group only
+                next_token_logits = torch.index_select(all_next_token_logits, 0, group_indices)
+
+                # hack: adjust tokens for Marian. For Marian we have to make sure that the `pad_token_id`
+                # cannot be generated both before and after the `torch.nn.functional.log_softmax` operation.
+                next_token_logits = self.adjust_logits_during_generation(next_token_logits, cur_len=cur_len)
+                next_token_scores = torch.nn.functional.log_softmax(
+                    next_token_logits, dim=-1
+                )  # (batch_size * group_size, vocab_size)
+                vocab_size = next_token_scores.shape[-1]
+
+                next_token_scores_processed = logits_processor(
+                    group_input_ids, next_token_scores, current_tokens=current_tokens, beam_group_idx=beam_group_idx
+                )
+                next_token_scores = next_token_scores_processed + torch.index_select(
+                    beam_scores, 0, group_indices
+                ).unsqueeze(-1)
+                next_token_scores = next_token_scores.expand_as(next_token_scores_processed)
+
+                if output_scores:
+                    processed_score.index_copy_(0, group_indices, next_token_scores_processed)
+
+                # reshape for beam search
+                next_token_scores = next_token_scores.view(batch_size, group_size * vocab_size)
+
+                # Sample 2 next tokens for each beam (so we have some spare tokens and match output of beam search)
+                next_token_scores, next_tokens = torch.topk(
+                    next_token_scores, 2 * group_size, dim=1, largest=True, sorted=True
+                )
+
+                next_indices = torch.div(next_tokens, vocab_size, rounding_mode="floor")
+                next_tokens = next_tokens % vocab_size
+
+                # stateless
+                process_beam_indices = sum(beam_indices, ()) if beam_indices is not None else None
+                beam_outputs = beam_scorer.process(
+                    group_input_ids,
+                    next_token_scores,
+                    next_tokens,
+                    next_indices,
+                    pad_token_id=pad_token_id,
+                    eos_token_id=eos_token_id,
+                    beam_indices=process_beam_indices,
+                    **process_kwargs,
+                )
+                beam_scores.index_copy_(0, group_indices, beam_outputs["next_beam_scores"])
+                beam_next_tokens = beam_outputs["next_beam_tokens"]
+                beam_idx = beam_outputs["next_beam_indices"]
+
+                if beam_indices is not None:
+                    beam_indices[beam_group_idx] = tuple(
+                        beam_indices[beam_group_idx][beam_idx[i]] + (beam_idx[i],) for i in range(len(beam_indices[0]))
+                    )
+
+                input_ids.index_copy_(0, group_indices, torch.index_select(group_input_ids, 0, beam_idx))
+                current_tokens.index_copy_(0, group_indices, beam_next_tokens)
+
+                # (beam_idx // group_size) -> batch_idx
+                # (beam_idx % group_size) -> offset of idx inside the group
+                reordering_indices.index_copy_(
+                    0,
+                    group_indices,
+                    num_beams * torch.div(beam_idx, group_size, rounding_mode="floor")
+                    + group_start_idx
+                    + (beam_idx % group_size),
+                )
+
+            # Store scores, attentions and hidden_states when required
+            if return_dict_in_generate:
+                if output_scores:
+                    scores += (processed_score,)
+                if output_attentions:
+                    decoder_attentions += (
+                        (outputs.decoder_attentions,) if self.config.is_encoder_decoder else (outputs.attentions,)
+                    )
+                    if self.config.is_encoder_decoder:
+                        cross_attentions += (outputs.cross_attentions,)
+
+                if output_hidden_states:
+                    decoder_hidden_states += (
+                        (outputs.decoder_hidden_states,)
+                        if self.config.is_encoder_decoder
+                        else (outputs.hidden_states,)
+                    )
+
+            if token_idx is not None:
+                input_ids.index_copy_(1, token_idx, current_tokens.unsqueeze(-1))
+            else:
+                input_ids = torch.cat([input_ids, current_tokens.unsqueeze(-1)], dim=-1)
+
+            model_kwargs = self._update_model_kwargs_for_generation(
+                outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+            )
+            if model_kwargs["past_key_values"] is not None:
+                if token_idx is not None:
+                    # The preallocated cache is reordered in place to keep static shapes
+                    model_kwargs["past_key_values"] = self._reorder_static_cache(
+                        model_kwargs["past_key_values"], reordering_indices
+                    )
+                else:
+                    model_kwargs["past_key_values"] = self._reorder_cache(
+                        model_kwargs["past_key_values"], reordering_indices
+                    )
+
+            # increase cur_len
+            cur_len = cur_len + 1
 
-        >>> outputs = model.group_beam_search(
-        ...     input_ids, beam_scorer, logits_processor=logits_processor, **model_kwargs
-        ... )
+            if stopping_criteria(input_ids, scores) or (beam_scorer.is_done and not lazy_mode):
+                if not synced_gpus:
+                    break
+                else:
+                    this_peer_finished = True
 
-        >>> tokenizer.batch_decode(outputs, skip_special_tokens=True)
-        ['Wie alt bist du?']
-        ```"""
+        final_beam_indices = sum(beam_indices, ()) if beam_indices is not None else None
+        sequence_outputs = beam_scorer.finalize(
+            input_ids,
+            beam_scores,
+            next_tokens,
+            next_indices,
+            pad_token_id=pad_token_id,
+            eos_token_id=eos_token_id,
+            max_length=stopping_criteria.max_length,
+            beam_indices=final_beam_indices,
+            **process_kwargs,
+        )
+
+        if return_dict_in_generate:
+            if not output_scores:
+                sequence_outputs["sequence_scores"] = None
 
-        raise NotImplementedError("Group beam search is not supported by optimum-habana yet.")
+            if self.config.is_encoder_decoder:
+                return BeamSearchEncoderDecoderOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    beam_indices=sequence_outputs["beam_indices"],
+                    encoder_attentions=encoder_attentions,
+                    encoder_hidden_states=encoder_hidden_states,
+                    decoder_attentions=decoder_attentions,
+                    cross_attentions=cross_attentions,
+                    decoder_hidden_states=decoder_hidden_states,
+                )
+            else:
+                return BeamSearchDecoderOnlyOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    beam_indices=sequence_outputs["beam_indices"],
+                    attentions=decoder_attentions,
+                    hidden_states=decoder_hidden_states,
+                )
+        else:
+            return sequence_outputs["sequences"]
 
     def constrained_beam_search(
         self,
@@ -2178,4 +4005,226 @@ class GaudiGenerationMixin(GenerationMixin):
         ['Wie alt sind Sie?']
         ```"""
 
-        raise NotImplementedError("Constrained beam search is not supported by optimum-habana yet.")
+        # init values
+        logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        stopping_criteria = stopping_criteria if stopping_criteria is not None else StoppingCriteriaList()
+        if max_length is not None:
+            warnings.warn(
+                (
+                    "`max_length` is deprecated in this function, use"
+                    " `stopping_criteria=StoppingCriteriaList(MaxLengthCriteria(max_length=max_length))` instead."
+                ),
+                UserWarning,
+            )
+            stopping_criteria = validate_stopping_criteria(stopping_criteria, max_length)
+        if len(stopping_criteria) == 0:
+            warnings.warn("You don't have defined any stopping_criteria, this will likely loop forever", UserWarning)
+        pad_token_id = pad_token_id if pad_token_id is not None else self.generation_config.pad_token_id
+        eos_token_id = eos_token_id if eos_token_id is not None else self.generation_config.eos_token_id
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        output_scores = output_scores if output_scores is not None else self.generation_config.output_scores
+        output_attentions = (
+            output_attentions if output_attentions is not None else self.generation_config.output_attentions
+        )
+        output_hidden_states = (
+            output_hidden_states if output_hidden_states is not None else self.generation_config.output_hidden_states
+        )
+        return_dict_in_generate = (
+            return_dict_in_generate
+            if return_dict_in_generate is not None
+            else self.generation_config.return_dict_in_generate
+        )
+
+        # init attention / hidden states / scores tuples
+        scores = () if (return_dict_in_generate and output_scores) else None
+        decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
+        cross_attentions = () if (return_dict_in_generate and output_attentions) else None
+        decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
+
+        # if model is an encoder-decoder, retrieve encoder attention weights and hidden states
+        if return_dict_in_generate and self.config.is_encoder_decoder:
+            encoder_attentions = model_kwargs["encoder_outputs"].get("attentions") if output_attentions else None
+            encoder_hidden_states = (
+                model_kwargs["encoder_outputs"].get("hidden_states") if output_hidden_states else None
+            )
+
+        token_idx = model_kwargs.get("token_idx", None)
+        if token_idx is not None:
+            if not isinstance(constrained_beam_scorer, StaticConstrainedBeamSearchScorer):
+                raise ValueError(
+                    "Constrained beam search with static shapes (i.e. with `token_idx`) requires a"
+                    " `StaticConstrainedBeamSearchScorer`."
+                )
+            batch_size = constrained_beam_scorer.batch_size
+            # The static beam scorer needs to know the current length of the sequences
+            process_kwargs = {"token_idx": token_idx}
+        else:
+            batch_size = len(constrained_beam_scorer._beam_hyps)
+            process_kwargs = {}
+        num_beams = constrained_beam_scorer.num_beams
+
+        batch_beam_size, cur_len = input_ids.shape
+
+        if num_beams * batch_size != batch_beam_size:
+            raise ValueError(
+                f"Batch dimension of `input_ids` should be {num_beams * batch_size}, but is {batch_beam_size}."
+            )
+
+        # initialise score of first beam with 0 and the rest with -1e9. This makes sure that only tokens
+        # of the first beam are considered to avoid sampling the exact same tokens across all beams.
+        beam_scores = torch.zeros((batch_size, num_beams), dtype=torch.float, device=input_ids.device)
+        beam_scores[:, 1:] = -1e9
+        beam_scores = beam_scores.view((batch_size * num_beams,))
+
+        this_peer_finished = False  # used by synced_gpus only
+        while True:
+            if lazy_mode:
+                self.htcore_generation.mark_step()
+
+            if synced_gpus:
+                # Under synced_gpus the `forward` call must continue until all gpus complete their sequence.
+                # The following logic allows an early break if all peers finished generating their sequence
+                this_peer_finished_flag = torch.tensor(0.0 if this_peer_finished else 1.0).to(input_ids.device)
+                # send 0.0 if we finished, 1.0 otherwise
+                dist.all_reduce(this_peer_finished_flag, op=dist.ReduceOp.SUM)
+                # did all peers finish? the reduced sum will be 0.0 then
+                if this_peer_finished_flag.item() == 0.0:
+                    break
+
+            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+
+            outputs = self(
+                **model_inputs,
+                return_dict=True,
+                output_attentions=output_attentions,
+                output_hidden_states=output_hidden_states,
+            )
+
+            if synced_gpus and this_peer_finished:
+                cur_len = cur_len + 1
+                continue  # don't waste resources running the code we don't need
+
+            if token_idx is not None and outputs.logits.shape[-2] > 1:
+                next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+            else:
+                next_token_logits = outputs.logits[:, -1, :]
+            # hack: adjust tokens for Marian. For Marian we have to make sure that the `pad_token_id`
+            # cannot be generated both before and after the `torch.nn.functional.log_softmax` operation.
+            next_token_logits = self.adjust_logits_during_generation(next_token_logits, cur_len=cur_len)
+            next_token_scores = torch.nn.functional.log_softmax(
+                next_token_logits, dim=-1
+            )  # (batch_size * num_beams, vocab_size)
+
+            next_token_scores_processed = logits_processor(input_ids, next_token_scores)
+            next_token_scores = next_token_scores_processed + beam_scores[:, None].expand_as(next_token_scores)
+
+            scores_for_all_vocab = next_token_scores.clone()
+
+            # Store scores, attentions and hidden_states when required
+            if return_dict_in_generate:
+                if output_scores:
+                    scores += (next_token_scores,)
+                if output_attentions:
+                    decoder_attentions += (
+                        (outputs.decoder_attentions,) if self.config.is_encoder_decoder else (outputs.attentions,)
+                    )
+                    if self.config.is_encoder_decoder:
+                        cross_attentions += (outputs.cross_attentions,)
+
+                if output_hidden_states:
+                    decoder_hidden_states += (
+                        (outputs.decoder_hidden_states,)
+                        if self.config.is_encoder_decoder
+                        else (outputs.hidden_states,)
+                    )
+
+            # reshape for beam search
+            vocab_size = next_token_scores.shape[-1]
+            next_token_scores = next_token_scores.view(batch_size, num_beams * vocab_size)
+
+            # Sample 2 next tokens for each beam (so we have some spare tokens and match output of beam search)
+            next_token_scores, next_tokens = torch.topk(
+                next_token_scores, 2 * num_beams, dim=1, largest=True, sorted=True
+            )
+
+            next_indices = torch.div(next_tokens, vocab_size, rounding_mode="floor")
+            next_tokens = next_tokens % vocab_size
+
+            # stateless
+            beam_outputs = constrained_beam_scorer.process(
+                input_ids,
+                next_token_scores,
+                next_tokens,
+                next_indices,
+                scores_for_all_vocab,
+                pad_token_id=pad_token_id,
+                eos_token_id=eos_token_id,
+                **process_kwargs,
+            )
+            beam_scores = beam_outputs["next_beam_scores"]
+            beam_next_tokens = beam_outputs["next_beam_tokens"]
+            beam_idx = beam_outputs["next_beam_indices"]
+
+            if token_idx is not None:
+                input_ids = torch.index_select(input_ids, 0, beam_idx)
+                input_ids.index_copy_(1, token_idx, beam_next_tokens.unsqueeze(-1))
+            else:
+                input_ids = torch.cat([input_ids[beam_idx, :], beam_next_tokens.unsqueeze(-1)], dim=-1)
+
+            model_kwargs = self._update_model_kwargs_for_generation(
+                outputs, model_kwargs, is_encoder_decoder=self.config.is_encoder_decoder
+            )
+            if model_kwargs["past_key_values"] is not None:
+                if token_idx is not None:
+                    # The preallocated cache is reordered in place to keep static shapes
+                    model_kwargs["past_key_values"] = self._reorder_static_cache(
+                        model_kwargs["past_key_values"], beam_idx
+                    )
+                else:
+                    model_kwargs["past_key_values"] = self._reorder_cache(model_kwargs["past_key_values"], beam_idx)
+
+            # increase cur_len
+            cur_len = cur_len + 1
+
+            if stopping_criteria(input_ids, scores) or (constrained_beam_scorer.is_done and not lazy_mode):
+                if not synced_gpus:
+                    break
+                else:
+                    this_peer_finished = True
+
+        sequence_outputs = constrained_beam_scorer.finalize(
+            input_ids,
+            beam_scores,
+            next_tokens,
+            next_indices,
+            pad_token_id=pad_token_id,
+            eos_token_id=eos_token_id,
+            max_length=stopping_criteria.max_length,
+            **process_kwargs,
+        )
+
+        if return_dict_in_generate:
+            if not output_scores:
+                sequence_outputs["sequence_scores"] = None
+            if self.config.is_encoder_decoder:
+                return BeamSearchEncoderDecoderOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    encoder_attentions=encoder_attentions,
+                    encoder_hidden_states=encoder_hidden_states,
+                    decoder_attentions=decoder_attentions,
+                    cross_attentions=cross_attentions,
+                    decoder_hidden_states=decoder_hidden_states,
+                )
+            else:
+                return BeamSearchDecoderOnlyOutput(
+                    sequences=sequence_outputs["sequences"],
+                    sequences_scores=sequence_outputs["sequence_scores"],
+                    scores=scores,
+                    attentions=decoder_attentions,
+                    hidden_states=decoder_hidden_states,
+                )
+        else:
+            return sequence_outputs["sequences"]
@@ -28,11 +28,13 @@ from .models import (
     GaudiBloomMLP,
     GaudiBloomModel,
     GaudiGPT2Attention,
+    GaudiGPT2LMHeadModel,
     gaudi_albert_forward,
     gaudi_bloom_attention_forward,
     gaudi_bloom_block_forward,
     gaudi_conv1d_forward,
     gaudi_get_extended_attention_mask,
+    gaudi_gpt2_block_forward,
     gaudi_gpt2_forward,
     gaudi_invert_attention_mask,
     gaudi_vit_self_attention_forward,
@@ -63,8 +65,14 @@ def adapt_transformers_to_gaudi():
     # Generation is modified to run faster in lazy mode
     GenerationMixin.generate = GaudiGenerationMixin.generate
     GenerationMixin._update_model_kwargs_for_generation = GaudiGenerationMixin._update_model_kwargs_for_generation
+    GenerationMixin._expand_inputs_for_generation = staticmethod(GaudiGenerationMixin._expand_inputs_for_generation)
+    GenerationMixin._reorder_static_cache = staticmethod(GaudiGenerationMixin._reorder_static_cache)
+    GenerationMixin._expand_static_cache = staticmethod(GaudiGenerationMixin._expand_static_cache)
+    GenerationMixin._get_logits_processor = GaudiGenerationMixin._get_logits_processor
+    GenerationMixin.contrastive_search = GaudiGenerationMixin.contrastive_search
     GenerationMixin.greedy_search = GaudiGenerationMixin.greedy_search
     GenerationMixin.sample = GaudiGenerationMixin.sample
+    GenerationMixin.assisted_decoding = GaudiGenerationMixin.assisted_decoding
     GenerationMixin.beam_search = GaudiGenerationMixin.beam_search
     GenerationMixin.beam_sample = GaudiGenerationMixin.beam_sample
     GenerationMixin.group_beam_search = GaudiGenerationMixin.group_beam_search
@@ -88,3 +96,7 @@ def adapt_transformers_to_gaudi():
     # Since HCCL cannot handle this dtype, we revert it back to uint8 (same behaviour as Transformers <= 4.26)
     modeling_gpt2.GPT2Attention = GaudiGPT2Attention
     modeling_gpt2.GPT2Model.forward = gaudi_gpt2_forward
+
+    # Optimization for GPT-2 generation on Gaudi
+    modeling_gpt2.GPT2Block.forward = gaudi_gpt2_block_forward
+    modeling_gpt2.GPT2LMHeadModel = GaudiGPT2LMHeadModel
@@ -1,13 +1,23 @@
 from .albert import gaudi_albert_forward
 from .bloom import (
     GaudiBloomForCausalLM,
+    GaudiBloomInt8KVCache,
     GaudiBloomMLP,
     GaudiBloomModel,
+    GaudiBloomPagedKVCache,
+    GaudiBloomPrefixCache,
     gaudi_bloom_attention_forward,
     gaudi_bloom_block_forward,
 )
-from .gpt2 import GaudiGPT2Attention, gaudi_gpt2_forward
-from .modeling_all_models import gaudi_conv1d_forward, gaudi_get_extended_attention_mask, gaudi_invert_attention_mask
+from .gpt2 import GaudiGPT2Attention, GaudiGPT2LMHeadModel, gaudi_gpt2_block_forward, gaudi_gpt2_forward
+from .modeling_all_models import (
+    gaudi_conv1d_forward,
+    gaudi_get_extended_attention_mask,
+    gaudi_get_logits_positions,
+    gaudi_invert_attention_mask,
+    gaudi_select_logits_positions,
+)
+from .sink_kv_cache import GaudiSinkKVCache
 from .vit import gaudi_vit_self_attention_forward
 from .wav2vec2 import (
     _gaudi_wav2vec2_compute_mask_indices,
@@ -1,3 +1,4 @@
+from .kv_cache import GaudiBloomInt8KVCache, GaudiBloomPagedKVCache, GaudiBloomPrefixCache
 from .modeling_bloom import (
     GaudiBloomForCausalLM,
     GaudiBloomMLP,
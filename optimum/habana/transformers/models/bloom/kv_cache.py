@@ -0,0 +1,440 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import math
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import torch
+from transformers import BloomConfig
+
+
+class GaudiBloomPagedKVCache:
+    """
+    Block-paged key/value cache for [`GaudiBloomModel`].
+
+    Keys and values are stored in a pool of `num_blocks` blocks of `block_size` tokens shared by all the sequences of
+    the batch. Each row of the batch has a block table mapping its logical blocks to blocks of the pool, so a sequence
+    only holds the blocks it actually needs instead of a dense `max_length` cache. Blocks are handed out on the host
+    with [`~GaudiBloomPagedKVCache.allocate`] and given back with [`~GaudiBloomPagedKVCache.free`], while reads and
+    writes happen on device through `token_idx` so that shapes stay static.
+
+    Block 0 is never allocated: the entries of the block tables that are not backed by an allocated block point to it,
+    so that writes to the padding positions of a sequence are harmless. Positions read from it are always masked out.
+
+    The cache is given to the model as `past_key_values` (or as `paged_kv_cache` to `generate`). A multi-token input
+    is written from position 0 and attends to itself only (prefill), a single-token input is written at `token_idx - 1`
+    and attends to the whole cache of its row (decoding).
+
+    Args:
+        config ([`BloomConfig`]):
+            The configuration of the model.
+        num_blocks (`int`):
+            The number of blocks in the pool, including the reserved block 0.
+        block_size (`int`):
+            The number of tokens per block.
+        batch_size (`int`):
+            The number of rows of the batch.
+        max_length (`int`):
+            The maximum length of a sequence, i.e. the length of the attention mask.
+        dtype (`torch.dtype`, *optional*, defaults to `torch.float32`):
+            The dtype of the keys and values.
+        device (`torch.device` or `str`, *optional*):
+            The device the cache is allocated on.
+        num_heads (`int`, *optional*):
+            The number of attention heads on this device. Defaults to `config.n_head`, it should be set when the model
+            is sharded with tensor parallelism.
+
+    Example:
+
+    ```python
+    >>> cache = GaudiBloomPagedKVCache(model.config, num_blocks=64, block_size=16, batch_size=4, max_length=128)
+    >>> for row in range(4):
+    ...     cache.allocate(row, 128)
+    >>> outputs = model.generate(**inputs, token_idx=token_idx, paged_kv_cache=cache)
+    ```
+    """
+
+    def __init__(
+        self,
+        config: BloomConfig,
+        num_blocks: int,
+        block_size: int,
+        batch_size: int,
+        max_length: int,
+        dtype: torch.dtype = torch.float32,
+        device: Optional[Union[torch.device, str]] = None,
+        num_heads: Optional[int] = None,
+    ):
+        if num_blocks < 2:
+            raise ValueError(f"`num_blocks` should be at least 2 since block 0 is reserved, but is {num_blocks}.")
+        if block_size < 1:
+            raise ValueError(f"`block_size` should be a strictly positive integer, but is {block_size}.")
+
+        self.num_heads = num_heads if num_heads is not None else config.n_head
+        self.head_dim = config.hidden_size // config.n_head
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_blocks_per_sequence = math.ceil(max_length / block_size)
+
+        # [num_blocks, block_size, num_heads, head_dim] so that a token of the pool is a row of a flat view
+        shape = (num_blocks, block_size, self.num_heads, self.head_dim)
+        self.key_blocks = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(config.n_layer)]
+        self.value_blocks = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(config.n_layer)]
+        self.block_tables = torch.zeros(
+            (batch_size, self.max_blocks_per_sequence), dtype=torch.long, device=self.key_blocks[0].device
+        )
+
+        # Host-side bookkeeping, popped from the end so that blocks are handed out in increasing order
+        self.free_blocks = list(range(num_blocks - 1, 0, -1))
+        self.allocated_blocks: List[List[int]] = [[] for _ in range(batch_size)]
+
+    def __len__(self) -> int:
+        return len(self.key_blocks)
+
+    def __getitem__(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.key_blocks[layer_idx], self.value_blocks[layer_idx]
+
+    @property
+    def num_free_blocks(self) -> int:
+        return len(self.free_blocks)
+
+    def get_num_blocks(self, num_tokens: int) -> int:
+        """
+        Returns the number of blocks needed to hold `num_tokens` tokens.
+        """
+        return math.ceil(num_tokens / self.block_size)
+
+    def can_allocate(self, num_tokens: int, row: Optional[int] = None) -> bool:
+        """
+        Returns whether there are enough free blocks to hold `num_tokens` tokens in `row`, or in an empty row if `row`
+        is not given.
+        """
+        num_allocated = len(self.allocated_blocks[row]) if row is not None else 0
+        return self.get_num_blocks(num_tokens) - num_allocated <= self.num_free_blocks
+
+    def allocate(self, row: int, num_tokens: int):
+        """
+        Makes sure `row` has enough blocks to hold `num_tokens` tokens. Blocks already held by the row are kept, so a
+        sequence can be grown as it is generated.
+
+        Args:
+            row (`int`):
+                The row of the batch.
+            num_tokens (`int`):
+                The number of tokens the row should be able to hold.
+        """
+        if num_tokens > self.max_length:
+            raise ValueError(f"Cannot allocate {num_tokens} tokens, the maximum length is {self.max_length}.")
+        if not self.can_allocate(num_tokens, row):
+            raise ValueError(
+                f"Not enough free blocks to hold {num_tokens} tokens in row {row}: {self.num_free_blocks} free"
+                f" block(s) of {self.block_size} tokens left."
+            )
+
+        blocks = self.allocated_blocks[row]
+        first_new_block = len(blocks)
+        while len(blocks) < self.get_num_blocks(num_tokens):
+            blocks.append(self.free_blocks.pop())
+        if len(blocks) > first_new_block:
+            self.block_tables[row, first_new_block : len(blocks)] = torch.tensor(
+                blocks[first_new_block:], dtype=torch.long, device=self.block_tables.device
+            )
+
+    def check_allocated(self, num_tokens: int):
+        """
+        Raises an error if a row of the batch does not have the blocks to hold `num_tokens` tokens. Writes to missing
+        blocks would go to the reserved block 0 and reads from them would return garbage.
+        """
+        if num_tokens > self.max_length:
+            raise ValueError(f"Sequences of {num_tokens} tokens are longer than the maximum length {self.max_length}.")
+        num_blocks = self.get_num_blocks(num_tokens)
+        missing_rows = (self.block_tables[:, :num_blocks] == 0).any(dim=-1).nonzero().flatten().tolist()
+        if len(missing_rows) > 0:
+            raise ValueError(
+                f"Rows {missing_rows} of the paged key/value cache do not have the blocks to hold {num_tokens} tokens,"
+                " call `allocate` for every row of the batch before generating."
+            )
+
+    def free(self, row: int):
+        """
+        Gives the blocks of `row` back to the pool.
+        """
+        self.free_blocks.extend(reversed(self.allocated_blocks[row]))
+        self.allocated_blocks[row] = []
+        self.block_tables[row].zero_()
+
+    def select(self, rows: Union[List[int], torch.LongTensor]) -> "GaudiBloomPagedKVCache":
+        """
+        Returns a view of the cache restricted to some rows of the batch, for instance to prefill a single sequence.
+        The view shares the pool with this cache, blocks should only be allocated and freed through this cache.
+        """
+        rows = torch.as_tensor(rows, dtype=torch.long, device=self.block_tables.device)
+        view = copy.copy(self)
+        view.block_tables = self.block_tables.index_select(0, rows)
+        view.batch_size = rows.numel()
+        return view
+
+    def get_slot_mapping(self, positions: torch.LongTensor) -> torch.LongTensor:
+        """
+        Maps positions of shape `(batch_size, seq_length)` to indices in the flattened pool.
+        """
+        block_ids = torch.gather(self.block_tables, 1, torch.div(positions, self.block_size, rounding_mode="floor"))
+        return block_ids * self.block_size + torch.remainder(positions, self.block_size)
+
+
+class GaudiBloomInt8KVCache:
+    """
+    Static key/value cache for [`GaudiBloomModel`] storing keys and values as int8, which halves the memory of a bf16
+    cache so that larger batches or longer sequences fit on a device.
+
+    Keys and values are quantized symmetrically with one scale per token and per head (the absolute maximum over the
+    head dimension divided by 127), so that writing a new token never requantizes the rest of the cache. They are
+    dequantized on read inside the attention matmuls: the scale of a key only depends on its position so it scales the
+    corresponding column of the attention scores, and the scale of a value scales the corresponding attention
+    probability.
+
+    Keys are stored as `[batch_size * num_heads, head_dim, max_length]` and values as `[batch_size * num_heads,
+    max_length, head_dim]` like the static cache of Bloom, with scales of shape `[batch_size * num_heads, 1, max_length]`
+    and `[batch_size * num_heads, max_length, 1]`. Each layer of the cache is the tuple `(key, value, key_scale,
+    value_scale)`.
+
+    The cache is given to the model as `past_key_values` (or as `int8_kv_cache` to `generate`) with static shapes
+    (`token_idx`). A multi-token input is written from position 0 and attends to its own keys and values in full
+    precision (prefill), a single-token input is written at `token_idx - 1` and attends to the whole cache (decoding).
+
+    Args:
+        config ([`BloomConfig`]):
+            The configuration of the model.
+        batch_size (`int`):
+            The number of rows of the batch, including beams and returned sequences.
+        max_length (`int`):
+            The maximum length of a sequence, i.e. the length of the attention mask.
+        dtype (`torch.dtype`, *optional*, defaults to `torch.float32`):
+            The dtype of the scales, usually the one of the model.
+        device (`torch.device` or `str`, *optional*):
+            The device the cache is allocated on.
+        num_heads (`int`, *optional*):
+            The number of attention heads on this device. Defaults to `config.n_head`, it should be set when the model
+            is sharded with tensor parallelism.
+
+    Example:
+
+    ```python
+    >>> cache = GaudiBloomInt8KVCache(model.config, batch_size=4, max_length=128, dtype=torch.bfloat16, device="hpu")
+    >>> outputs = model.generate(**inputs, token_idx=token_idx, int8_kv_cache=cache)
+    ```
+    """
+
+    def __init__(
+        self,
+        config: BloomConfig,
+        batch_size: int,
+        max_length: int,
+        dtype: torch.dtype = torch.float32,
+        device: Optional[Union[torch.device, str]] = None,
+        num_heads: Optional[int] = None,
+    ):
+        self.num_heads = num_heads if num_heads is not None else config.n_head
+        self.head_dim = config.hidden_size // config.n_head
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        num_rows = batch_size * self.num_heads
+        self.keys = [
+            torch.zeros((num_rows, self.head_dim, max_length), dtype=torch.int8, device=device)
+            for _ in range(config.n_layer)
+        ]
+        self.values = [
+            torch.zeros((num_rows, max_length, self.head_dim), dtype=torch.int8, device=device)
+            for _ in range(config.n_layer)
+        ]
+        self.key_scales = [
+            torch.zeros((num_rows, 1, max_length), dtype=dtype, device=device) for _ in range(config.n_layer)
+        ]
+        self.value_scales = [
+            torch.zeros((num_rows, max_length, 1), dtype=dtype, device=device) for _ in range(config.n_layer)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        return self.keys[layer_idx], self.values[layer_idx], self.key_scales[layer_idx], self.value_scales[layer_idx]
+
+    @staticmethod
+    def quantize(
+        tensor: torch.Tensor, dim: int, dtype: Optional[torch.dtype] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Quantizes `tensor` to int8 with one scale per slice along `dim`, returns the int8 tensor and the scales (of
+        the dtype of `tensor` unless `dtype` is given).
+        """
+        scale = tensor.abs().amax(dim=dim, keepdim=True).float().clamp(min=1e-8) / 127
+        quantized = torch.round(tensor.float() / scale).clamp(-127, 127).to(torch.int8)
+        return quantized, scale.to(dtype if dtype is not None else tensor.dtype)
+
+
+class GaudiBloomPrefixCache:
+    """
+    Cache of the keys and values of prompt prefixes shared by several calls to `generate`, such as a system prompt.
+
+    Prompts are split into blocks of `block_size` tokens and a block is identified by its tokens and by the block before
+    it, so that a stored block is only reused after the exact same prefix. The keys and values of Bloom do not depend on
+    the position of the tokens (ALiBi is applied to the attention scores), so the cached blocks are copied as is into
+    the static cache of a new request and only the rest of the prompt is prefilled.
+
+    Blocks are evicted in least recently used order when storing a new block would exceed `max_memory`. The blocks of a
+    prefix are always more recently used than the blocks following them, so that a block is never kept without its
+    prefix.
+
+    The cache is given to `generate` as `prefix_cache`, with static shapes (`token_idx`) and prompts without padding.
+
+    Args:
+        block_size (`int`, *optional*, defaults to 64):
+            The number of tokens per block. Only whole blocks are cached.
+        max_memory (`int`, *optional*, defaults to 1073741824):
+            The maximum number of bytes used by the stored keys and values.
+
+    Example:
+
+    ```python
+    >>> prefix_cache = GaudiBloomPrefixCache(block_size=32, max_memory=2**30)
+    >>> for inputs, token_idx in requests:
+    ...     outputs = model.generate(**inputs, token_idx=token_idx, prefix_cache=prefix_cache, max_new_tokens=32)
+    ```
+    """
+
+    def __init__(self, block_size: int = 64, max_memory: int = 2**30):
+        if block_size < 1:
+            raise ValueError(f"`block_size` should be a strictly positive integer, but is {block_size}.")
+
+        self.block_size = block_size
+        self.max_memory = max_memory
+        self.memory_usage = 0
+        # (id of the previous block or -1, tokens of the block) -> (block id, keys, values), least recently used first.
+        # Keys are [num_layers, num_heads, head_dim, block_size] and values [num_layers, num_heads, block_size,
+        # head_dim], as in the cache of Bloom.
+        self.blocks: "OrderedDict[Tuple[int, Tuple[int, ...]], Tuple[int, torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self.next_block_id = 0
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def clear(self):
+        """
+        Removes all the stored blocks.
+        """
+        self.blocks.clear()
+        self.memory_usage = 0
+
+    def _lookup(self, token_ids: List[int]) -> List[Tuple[int, Tuple[int, ...]]]:
+        """
+        Returns the keys of the stored blocks that make up the longest prefix of `token_ids`.
+        """
+        keys = []
+        previous_block_id = -1
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            key = (previous_block_id, tuple(token_ids[start : start + self.block_size]))
+            if key not in self.blocks:
+                break
+            keys.append(key)
+            previous_block_id = self.blocks[key][0]
+        return keys
+
+    def _touch(self, keys: List[Tuple[int, Tuple[int, ...]]]):
+        # From the last block to the first one, so that a prefix is evicted after the blocks following it
+        for key in reversed(keys):
+            self.blocks.move_to_end(key)
+
+    def get_num_cached_tokens(self, token_ids: List[int]) -> int:
+        """
+        Returns the length of the longest prefix of `token_ids` whose keys and values are stored.
+        """
+        return len(self._lookup(token_ids)) * self.block_size
+
+    def load(
+        self, past_key_values: Tuple[Tuple[torch.Tensor, torch.Tensor], ...], token_ids: List[int], num_tokens: int
+    ):
+        """
+        Copies the keys and values of the first `num_tokens` tokens of `token_ids` into the cache of a sequence.
+
+        Args:
+            past_key_values (`Tuple[Tuple[torch.Tensor, torch.Tensor], ...]`):
+                The cache of a single sequence in Bloom's format, keys of shape `(num_heads, head_dim, max_length)` and
+                values of shape `(num_heads, max_length, head_dim)` for each layer. It is written in place.
+            token_ids (`List[int]`):
+                The prompt of the sequence.
+            num_tokens (`int`):
+                The number of tokens to copy, a multiple of `block_size` that is at most
+                [`~GaudiBloomPrefixCache.get_num_cached_tokens`].
+        """
+        keys = self._lookup(token_ids[:num_tokens])
+        if len(keys) * self.block_size != num_tokens:
+            raise ValueError(f"The first {num_tokens} tokens are not a sequence of blocks of the prefix cache.")
+        if num_tokens == 0:
+            return
+        self._touch(keys)
+
+        key_states = torch.cat([self.blocks[key][1] for key in keys], dim=-1)
+        value_states = torch.cat([self.blocks[key][2] for key in keys], dim=-2)
+        for layer_idx, (past_key, past_value) in enumerate(past_key_values):
+            past_key[:, :, :num_tokens] = key_states[layer_idx]
+            past_value[:, :num_tokens] = value_states[layer_idx]
+
+    def store(
+        self, past_key_values: Tuple[Tuple[torch.Tensor, torch.Tensor], ...], token_ids: List[int], num_tokens: int
+    ):
+        """
+        Stores the keys and values of the whole blocks of the first `num_tokens` tokens of `token_ids`, evicting the
+        least recently used blocks if needed.
+
+        Args:
+            past_key_values (`Tuple[Tuple[torch.Tensor, torch.Tensor], ...]`):
+                The cache of a single sequence in Bloom's format, see [`~GaudiBloomPrefixCache.load`].
+            token_ids (`List[int]`):
+                The prompt of the sequence.
+            num_tokens (`int`):
+                The number of tokens of `token_ids` whose keys and values are in `past_key_values`.
+        """
+        token_ids = token_ids[: num_tokens - num_tokens % self.block_size]
+        keys = self._lookup(token_ids)
+        for start in range(len(keys) * self.block_size, len(token_ids), self.block_size):
+            key_states = torch.stack(
+                [past_key[:, :, start : start + self.block_size] for past_key, _ in past_key_values]
+            )
+            value_states = torch.stack(
+                [past_value[:, start : start + self.block_size] for _, past_value in past_key_values]
+            )
+            block_memory = 2 * key_states.numel() * key_states.element_size()
+            # The blocks of this prefix are kept, the new block would replace them
+            self._touch(keys)
+            while len(self.blocks) > len(keys) and self.memory_usage + block_memory > self.max_memory:
+                _, (_, evicted_keys, evicted_values) = self.blocks.popitem(last=False)
+                self.memory_usage -= 2 * evicted_keys.numel() * evicted_keys.element_size()
+            if self.memory_usage + block_memory > self.max_memory:
+                break
+
+            previous_block_id = self.blocks[keys[-1]][0] if len(keys) > 0 else -1
+            key = (previous_block_id, tuple(token_ids[start : start + self.block_size]))
+            self.blocks[key] = (self.next_block_id, key_states, value_states)
+            self.next_block_id += 1
+            self.memory_usage += block_memory
+            keys.append(key)
+
+        self._touch(keys)
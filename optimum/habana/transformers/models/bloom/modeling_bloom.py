@@ -10,6 +10,16 @@ from transformers.modeling_outputs import BaseModelOutputWithPastAndCrossAttenti
 from transformers.models.bloom.modeling_bloom import BloomForCausalLM, BloomMLP, BloomModel
 from transformers.utils import logging
 
+from ....distributed.tensor_parallel import (
+    ColumnParallelLinear,
+    RowParallelLinear,
+    VocabParallelEmbedding,
+    VocabParallelLMHead,
+)
+from ..modeling_all_models import gaudi_get_logits_positions, gaudi_select_logits_positions
+from ..sink_kv_cache import GaudiSinkKVCache
+from .kv_cache import GaudiBloomInt8KVCache, GaudiBloomPagedKVCache, GaudiBloomPrefixCache
+
 
 logger = logging.get_logger(__name__)
 
@@ -29,7 +39,13 @@ def build_alibi_slope_tensor(n_head: int) -> torch.Tensor:
 
 
 def gaudi_bloom_build_alibi_tensor(
-    attention_mask: torch.Tensor, slopes: torch.Tensor, num_heads: int, dtype: torch.dtype
+    attention_mask: torch.Tensor,
+    slopes: torch.Tensor,
+    num_heads: int,
+    dtype: torch.dtype,
+    tp_index: Optional[int] = None,
+    tp_world_size: Optional[int] = None,
+    positions: Optional[torch.Tensor] = None,
 ) -> torch.Tensor:
     """
     Link to paper: https://arxiv.org/abs/2108.12409 Alibi tensor is not causal as the original paper mentions, it
@@ -46,16 +62,25 @@ def gaudi_bloom_build_alibi_tensor(
             number of heads
         dtype (`torch.dtype`, *optional*, default=`torch.bfloat16`):
             dtype of the output tensor
+        tp_index (`int`, *optional*):
+            tensor-parallel rank whose heads are returned, read from the `RANK` env variable if not given
+        tp_world_size (`int`, *optional*):
+            number of tensor-parallel ranks, read from the `WORLD_SIZE` env variable if not given
+        positions (`torch.Tensor`, *optional*):
+            positions of the keys, of shape (max_seq_len,), e.g. the positions within a rolling cache. Defaults to
+            `0, ..., max_seq_len - 1`
     """
     batch_size = attention_mask.size()[0]
     max_seq_len = attention_mask.size()[1]
-    alibi = slopes.unsqueeze(1).unsqueeze(1) * torch.arange(max_seq_len, device=attention_mask.device).unsqueeze(
-        0
-    ).unsqueeze(0).expand(num_heads, -1, -1)
+    if positions is None:
+        positions = torch.arange(max_seq_len, device=attention_mask.device)
+    alibi = slopes.unsqueeze(1).unsqueeze(1) * positions.unsqueeze(0).unsqueeze(0).expand(num_heads, -1, -1)
 
     # Select the part of the tensor that corresponds to our tensor parallel index.
-    tp_world_size = int(os.environ.get("WORLD_SIZE", 1))
-    tp_index = int(os.environ.get("RANK", 0))
+    if tp_world_size is None:
+        tp_world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if tp_index is None:
+        tp_index = int(os.environ.get("RANK", 0))
     alibi = alibi.reshape((tp_world_size, -1, *alibi.shape[1:]))[tp_index]
 
     alibi = alibi.repeat(batch_size, 1, 1)
@@ -91,6 +116,8 @@ def gaudi_bloom_attention_forward(
     use_cache: bool = False,
     output_attentions: bool = False,
     token_idx=None,
+    block_table=None,
+    slot_mapping=None,
 ):
     fused_qkv = self.query_key_value(hidden_states)  # [batch_size, seq_length, 3 x hidden_size]
 
@@ -104,15 +131,82 @@ def gaudi_bloom_attention_forward(
         key_layer.permute(0, 2, 3, 1).reshape(batch_size * self.num_heads, self.head_dim, q_length).contiguous()
     )
     value_layer = value_layer.transpose(1, 2).reshape(batch_size * self.num_heads, q_length, self.head_dim)
-    if layer_past is not None:
+    # Scales of the keys and values read from an int8 cache, dequantized inside the matmuls below
+    key_scale = None
+    value_scale = None
+    if layer_past is not None and len(layer_past) == 4:
+        # Int8 cache, see GaudiBloomInt8KVCache: (key, value, key_scale, value_scale)
+        past_key, past_value, past_key_scale, past_value_scale = layer_past
+        quantized_key, new_key_scale = GaudiBloomInt8KVCache.quantize(key_layer, 1, past_key_scale.dtype)
+        quantized_value, new_value_scale = GaudiBloomInt8KVCache.quantize(value_layer, 2, past_value_scale.dtype)
+        if q_length > 1:
+            # Prefill: written from position 0, attends to its own keys and values in full precision
+            past_key[..., :q_length].copy_(quantized_key)
+            past_value[:, :q_length].copy_(quantized_value)
+            past_key_scale[..., :q_length].copy_(new_key_scale)
+            past_value_scale[:, :q_length].copy_(new_value_scale)
+        else:
+            if token_idx.dim() > 0:
+                # One index per sequence (continuous batching): each row writes at its own position
+                row_idx = (token_idx - 1).repeat_interleave(self.num_heads).view(-1, 1, 1)
+                past_key.scatter_(2, row_idx.expand(-1, self.head_dim, 1), quantized_key)
+                past_value.scatter_(1, row_idx.expand(-1, 1, self.head_dim), quantized_value)
+                past_key_scale.scatter_(2, row_idx, new_key_scale)
+                past_value_scale.scatter_(1, row_idx, new_value_scale)
+            else:
+                past_key.index_copy_(2, token_idx - 1, quantized_key)
+                past_value.index_copy_(1, token_idx - 1, quantized_value)
+                past_key_scale.index_copy_(2, token_idx - 1, new_key_scale)
+                past_value_scale.index_copy_(1, token_idx - 1, new_value_scale)
+            key_layer, value_layer = past_key, past_value
+            key_scale, value_scale = past_key_scale, past_value_scale
+    elif layer_past is not None and slot_mapping is not None:
+        # Paged cache: pools of [num_blocks, block_size, num_heads, head_dim], one pool row per token
+        key_blocks, value_blocks = layer_past
+        key_blocks.view(-1, self.num_heads, self.head_dim).index_copy_(
+            0,
+            slot_mapping.view(-1),
+            key_layer.view(batch_size, self.num_heads, self.head_dim, q_length)
+            .permute(0, 3, 1, 2)
+            .reshape(-1, self.num_heads, self.head_dim),
+        )
+        value_blocks.view(-1, self.num_heads, self.head_dim).index_copy_(
+            0,
+            slot_mapping.view(-1),
+            value_layer.view(batch_size, self.num_heads, q_length, self.head_dim)
+            .transpose(1, 2)
+            .reshape(-1, self.num_heads, self.head_dim),
+        )
+        if block_table is not None:
+            # Gather the blocks of each row back into Bloom's layout, positions past the mask length are dropped
+            kv_length = attention_mask.shape[-1]
+            key_layer = key_blocks.index_select(0, block_table.view(-1)).view(
+                batch_size, -1, self.num_heads, self.head_dim
+            )[:, :kv_length]
+            key_layer = key_layer.permute(0, 2, 3, 1).reshape(batch_size * self.num_heads, self.head_dim, kv_length)
+            value_layer = value_blocks.index_select(0, block_table.view(-1)).view(
+                batch_size, -1, self.num_heads, self.head_dim
+            )[:, :kv_length]
+            value_layer = value_layer.transpose(1, 2).reshape(batch_size * self.num_heads, kv_length, self.head_dim)
+    elif layer_past is not None:
         past_key, past_value = layer_past
         # concatenate along seq_length dimension:
         #  - key: [batch_size * self.num_heads, head_dim, kv_length]
         #  - value: [batch_size * self.num_heads, kv_length, head_dim]
         if token_idx is not None:
-            # HPU bug WA
-            past_key.index_add_(2, token_idx - 1, key_layer - torch.index_select(past_key, 2, token_idx - 1))
-            past_value.index_add_(1, token_idx - 1, value_layer - torch.index_select(past_value, 1, token_idx - 1))
+            if token_idx.dim() > 0:
+                # One index per sequence (continuous batching): each row writes at its own position
+                row_idx = (token_idx - 1).repeat_interleave(self.num_heads).view(-1, 1, 1)
+                past_key.scatter_(2, row_idx.expand(-1, self.head_dim, 1), key_layer)
+                past_value.scatter_(1, row_idx.expand(-1, 1, self.head_dim), value_layer)
+            else:
+                # Several new tokens are written from token_idx - 1 onwards (e.g. to verify speculated tokens)
+                write_idx = token_idx - 1
+                if q_length > 1:
+                    write_idx = write_idx + torch.arange(q_length, device=write_idx.device)
+                # HPU bug WA
+                past_key.index_add_(2, write_idx, key_layer - torch.index_select(past_key, 2, write_idx))
+                past_value.index_add_(1, write_idx, value_layer - torch.index_select(past_value, 1, write_idx))
             key_layer = past_key
             value_layer = past_value
         else:
@@ -122,18 +216,26 @@ def gaudi_bloom_attention_forward(
     _, _, kv_length = key_layer.shape
 
     if use_cache is True:
-        present = (key_layer, value_layer)
+        # Paged and int8 caches are written in place
+        present = layer_past if slot_mapping is not None or key_scale is not None else (key_layer, value_layer)
     else:
         present = None
 
     # [batch_size * num_heads, q_length, kv_length]
-    # we use `torch.Tensor.baddbmm` instead of `torch.baddbmm` as the latter isn't supported by TorchScript v1.11
-    matmul_result = alibi.baddbmm(
-        batch1=query_layer,
-        batch2=key_layer,
-        beta=self.beta,
-        alpha=self.inv_norm_factor,
-    )
+    if key_scale is not None:
+        # The scale of a key scales the column of the scores of its position
+        matmul_result = (
+            torch.bmm(query_layer, key_layer.to(query_layer.dtype)) * (key_scale * self.inv_norm_factor)
+            + self.beta * alibi
+        )
+    else:
+        # we use `torch.Tensor.baddbmm` instead of `torch.baddbmm` as the latter isn't supported by TorchScript v1.11
+        matmul_result = alibi.baddbmm(
+            batch1=query_layer,
+            batch2=key_layer,
+            beta=self.beta,
+            alpha=self.inv_norm_factor,
+        )
 
     # change view to [batch_size, num_heads, q_length, kv_length]
     attention_scores = matmul_result.view(batch_size, self.num_heads, q_length, kv_length)
@@ -153,6 +255,11 @@ def gaudi_bloom_attention_forward(
     # change view [batch_size x num_heads, q_length, kv_length]
     attention_probs_reshaped = attention_probs.view(batch_size * self.num_heads, q_length, kv_length)
 
+    if value_scale is not None:
+        # The scale of a value scales the attention probability of its position
+        attention_probs_reshaped = attention_probs_reshaped * value_scale.transpose(1, 2)
+        value_layer = value_layer.to(attention_probs_reshaped.dtype)
+
     # matmul: [batch_size * num_heads, q_length, head_dim]
     context_layer = torch.bmm(attention_probs_reshaped, value_layer)
 
@@ -196,6 +303,8 @@ def gaudi_bloom_block_forward(
     use_cache: bool = False,
     output_attentions: bool = False,
     token_idx=None,
+    block_table=None,
+    slot_mapping=None,
 ):
     # hidden_states: [batch_size, seq_length, hidden_size]
 
@@ -219,6 +328,8 @@ def gaudi_bloom_block_forward(
         use_cache=use_cache,
         output_attentions=output_attentions,
         token_idx=token_idx,
+        block_table=block_table,
+        slot_mapping=slot_mapping,
     )
 
     attention_output = attn_outputs[0]
@@ -248,11 +359,48 @@ class GaudiBloomModel(BloomModel):
     def __init__(self, config):
         super().__init__(config)
         self.register_buffer("alibi_slope", build_alibi_slope_tensor(self.num_heads), persistent=False)
+        # (batch size, dtype, device) and ALiBi bias kept across forward calls, see `_get_alibi`
+        self._alibi_cache = None
+        # Set by `GaudiBloomForCausalLM.shard_for_tensor_parallel`, read from the environment otherwise (DeepSpeed)
+        self.tp_index = None
+        self.tp_world_size = None
+
+    def _get_alibi(self, attention_mask: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+        """
+        Returns the ALiBi bias of shape `(batch_size * num_heads, 1, max_seq_len)` for `attention_mask`.
+
+        The bias only depends on the shape of the mask (padding is handled by the causal mask), so it is built once
+        for the heads of this tensor-parallel shard and sliced at the following calls, e.g. at every decoding step.
+        It is rebuilt when the batch size, dtype or device change, and its length is doubled when the mask is longer.
+        """
+        batch_size, max_seq_len = attention_mask.shape
+        key = (batch_size, dtype, attention_mask.device)
+        if self._alibi_cache is None or self._alibi_cache[0] != key or self._alibi_cache[1].shape[-1] < max_seq_len:
+            capacity = max_seq_len
+            if self._alibi_cache is not None and self._alibi_cache[0] == key:
+                capacity = max(max_seq_len, 2 * self._alibi_cache[1].shape[-1])
+            alibi = gaudi_bloom_build_alibi_tensor(
+                attention_mask.new_ones((batch_size, capacity)),
+                self.alibi_slope,
+                self.num_heads,
+                dtype,
+                tp_index=self.tp_index,
+                tp_world_size=self.tp_world_size,
+            )
+            self._alibi_cache = (key, alibi)
+        return self._alibi_cache[1][..., :max_seq_len]
 
     def forward(
         self,
         input_ids: Optional[torch.LongTensor] = None,
-        past_key_values: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None,
+        past_key_values: Optional[
+            Union[
+                Tuple[Tuple[torch.Tensor, torch.Tensor], ...],
+                GaudiBloomPagedKVCache,
+                GaudiBloomInt8KVCache,
+                GaudiSinkKVCache,
+            ]
+        ] = None,
         attention_mask: Optional[torch.Tensor] = None,
         head_mask: Optional[torch.LongTensor] = None,
         inputs_embeds: Optional[torch.LongTensor] = None,
@@ -289,7 +437,49 @@ class GaudiBloomModel(BloomModel):
         else:
             raise ValueError("You have to specify either input_ids or inputs_embeds")
 
-        if past_key_values is None:
+        paged_kv_cache = None
+        int8_kv_cache = None
+        sink_kv_cache = None
+        block_table = None
+        slot_mapping = None
+        if isinstance(past_key_values, GaudiBloomPagedKVCache):
+            if token_idx is None:
+                raise ValueError("A paged key/value cache can only be used with `token_idx`.")
+            paged_kv_cache = past_key_values
+            if seq_length == 1:
+                # Decoding: write at token_idx - 1 and attend to the whole cache of each row
+                positions = (token_idx - 1).view(-1, 1).expand(batch_size, 1)
+                block_table = paged_kv_cache.block_tables
+            else:
+                # Prefill: write the whole input from position 0, it only attends to itself
+                positions = torch.arange(seq_length, device=token_idx.device).unsqueeze(0).expand(batch_size, -1)
+            slot_mapping = paged_kv_cache.get_slot_mapping(positions)
+            past_key_values = tuple(zip(paged_kv_cache.key_blocks, paged_kv_cache.value_blocks))
+        elif isinstance(past_key_values, GaudiBloomInt8KVCache):
+            if token_idx is None:
+                raise ValueError("An int8 key/value cache can only be used with `token_idx`.")
+            if past_key_values.batch_size != batch_size:
+                raise ValueError(
+                    f"The int8 key/value cache has {past_key_values.batch_size} rows but the batch size is {batch_size}."
+                )
+            int8_kv_cache = past_key_values
+            past_key_values = tuple(int8_kv_cache)
+        elif isinstance(past_key_values, GaudiSinkKVCache):
+            if token_idx is not None or attention_mask is not None:
+                raise ValueError(
+                    "A sink key/value cache tracks positions itself, `token_idx` and `attention_mask` cannot be given."
+                )
+            if past_key_values.batch_size != batch_size:
+                raise ValueError(
+                    f"The sink key/value cache has {past_key_values.batch_size} rows but the batch size is"
+                    f" {batch_size}."
+                )
+            sink_kv_cache = past_key_values
+            # The new tokens are written from token_idx - 1 like in a static cache, but the slots are not in order
+            write_slot, attended_slots, key_positions, _ = sink_kv_cache.prepare_step(seq_length)
+            token_idx = write_slot + 1
+            past_key_values = tuple(sink_kv_cache)
+        elif past_key_values is None:
             past_key_values = tuple([None] * len(self.h))
 
         # Prepare head mask if needed
@@ -310,7 +500,11 @@ class GaudiBloomModel(BloomModel):
         # Compute alibi tensor: check gaudi_bloom_build_alibi_tensor
         seq_length_with_past = seq_length
         past_key_values_length = 0
-        if past_key_values[0] is not None:
+        # The prefill of a paged or int8 cache only attends to itself
+        if sink_kv_cache is not None:
+            # The keys are the slots of the cache
+            seq_length_with_past = sink_kv_cache.num_slots
+        elif past_key_values[0] is not None and paged_kv_cache is None and (int8_kv_cache is None or seq_length == 1):
             past_key_values_length = past_key_values[0][0].shape[2]
             seq_length_with_past = seq_length_with_past + past_key_values_length
         if attention_mask is None:
@@ -318,13 +512,35 @@ class GaudiBloomModel(BloomModel):
         else:
             attention_mask = attention_mask.to(hidden_states.device)
 
-        alibi = gaudi_bloom_build_alibi_tensor(attention_mask, self.alibi_slope, self.num_heads, hidden_states.dtype)
-
-        causal_mask = self._prepare_attn_mask(
-            attention_mask,
-            input_shape=(batch_size, seq_length),
-            past_key_values_length=past_key_values_length,
-        )
+        if sink_kv_cache is not None:
+            # The ALiBi bias of a slot depends on the position of its token within the cache, which changes as the
+            # window rolls
+            alibi = gaudi_bloom_build_alibi_tensor(
+                attention_mask,
+                self.alibi_slope,
+                self.num_heads,
+                hidden_states.dtype,
+                tp_index=self.tp_index,
+                tp_world_size=self.tp_world_size,
+                positions=key_positions,
+            )
+            causal_mask = ~attended_slots.view(1, 1, seq_length, -1).expand(batch_size, -1, -1, -1)
+        elif token_idx is not None and seq_length > 1 and past_key_values_length > 0:
+            alibi = self._get_alibi(attention_mask, hidden_states.dtype)
+            # The new tokens start at token_idx - 1 in a preallocated cache, each one sees the positions up to its own
+            causal_mask = self._prepare_attn_mask(
+                attention_mask, input_shape=(batch_size, 1), past_key_values_length=0
+            )
+            query_positions = token_idx - 1 + torch.arange(seq_length, device=causal_mask.device)
+            key_positions = torch.arange(attention_mask.shape[-1], device=causal_mask.device)
+            causal_mask = causal_mask | (key_positions.unsqueeze(0) > query_positions.unsqueeze(-1))
+        else:
+            alibi = self._get_alibi(attention_mask, hidden_states.dtype)
+            causal_mask = self._prepare_attn_mask(
+                attention_mask,
+                input_shape=(batch_size, seq_length),
+                past_key_values_length=past_key_values_length,
+            )
 
         for i, (block, layer_past) in enumerate(zip(self.h, past_key_values)):
             if output_hidden_states:
@@ -361,6 +577,8 @@ class GaudiBloomModel(BloomModel):
                     output_attentions=output_attentions,
                     alibi=alibi,
                     token_idx=token_idx,
+                    block_table=block_table,
+                    slot_mapping=slot_mapping,
                 )
 
             hidden_states = outputs[0]
@@ -370,6 +588,16 @@ class GaudiBloomModel(BloomModel):
             if output_attentions:
                 all_self_attentions = all_self_attentions + (outputs[2 if use_cache else 1],)
 
+        if use_cache is True and paged_kv_cache is not None:
+            presents = paged_kv_cache
+        elif use_cache is True and int8_kv_cache is not None:
+            presents = int8_kv_cache
+        elif use_cache is True and sink_kv_cache is not None:
+            presents = sink_kv_cache
+        if sink_kv_cache is not None:
+            # The new tokens have been written by all the layers
+            sink_kv_cache.advance(seq_length)
+
         # Add last hidden state
         hidden_states = self.ln_f(hidden_states)
 
@@ -396,37 +624,247 @@ class GaudiBloomForCausalLM(BloomForCausalLM):
         N = 2
         self.lm_head_chunks = [c.t() for c in self.lm_head.weight.chunk(N, dim=0)]
 
+    def shard_for_tensor_parallel(self, group: Optional[torch.distributed.ProcessGroup] = None):
+        """
+        Shards the model in place across the ranks of `group` for tensor-parallel inference, without DeepSpeed. It
+        works with any `torch.distributed` backend and every rank should call it on the same full model.
+
+        The attention heads are split across the ranks: `query_key_value` and `dense_h_to_4h` are split along their
+        outputs, `dense` and `dense_4h_to_h` along their inputs, so that there is a single all-reduce after the
+        attention and after the MLP of each block. The word embeddings and the LM head are split along the
+        vocabulary, so the logits returned by the model are those of the vocabulary slice of the rank, of size
+        `vocab_size // world_size`. `generate` picks the next tokens from these slices without gathering the full
+        logits, see [`~optimum.habana.distributed.VocabParallelLMHead`].
+
+        Args:
+            group (`torch.distributed.ProcessGroup`, *optional*):
+                The tensor-parallel process group. Defaults to the default process group.
+        """
+        tp_index, tp_world_size = torch.distributed.get_rank(group), torch.distributed.get_world_size(group)
+        if self.config.n_head % tp_world_size != 0:
+            raise ValueError(f"{self.config.n_head} attention heads cannot be split across {tp_world_size} ranks.")
+
+        for block in self.transformer.h:
+            attention, mlp = block.self_attention, block.mlp
+            if (attention.pretraining_tp > 1 and attention.slow_but_exact) or (
+                mlp.pretraining_tp > 1 and mlp.slow_but_exact
+            ):
+                raise ValueError("Tensor parallelism is not supported with `slow_but_exact=True`.")
+            # The fused projection is laid out head by head, so contiguous shards hold whole heads
+            attention.query_key_value = ColumnParallelLinear(attention.query_key_value, group)
+            attention.dense = RowParallelLinear(attention.dense, group)
+            attention.num_heads //= tp_world_size
+            attention.hidden_size //= tp_world_size
+            attention.split_size = attention.hidden_size
+            mlp.dense_h_to_4h = ColumnParallelLinear(mlp.dense_h_to_4h, group)
+            mlp.dense_4h_to_h = RowParallelLinear(mlp.dense_4h_to_h, group)
+
+        self.transformer.word_embeddings = VocabParallelEmbedding(self.transformer.word_embeddings, group)
+        self.lm_head = VocabParallelLMHead(self.lm_head, group)
+        if self.config.tie_word_embeddings:
+            self.lm_head.weight = self.transformer.word_embeddings.weight
+        self.lm_head_chunks = []
+
+        self.transformer.tp_index = tp_index
+        self.transformer.tp_world_size = tp_world_size
+        self.transformer._alibi_cache = None
+        return self
+
+    def _allocate_static_cache(
+        self, batch_size: int, max_length: int, device: torch.device
+    ) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """
+        Returns a static cache of zeros for `batch_size` sequences of `max_length` tokens, in the dtype of the model.
+        """
+        num_heads = self.transformer.h[0].self_attention.num_heads
+        head_dim = self.config.hidden_size // self.config.n_head
+        dtype = self.transformer.word_embeddings.weight.dtype
+        return tuple(
+            (
+                torch.zeros((batch_size * num_heads, head_dim, max_length), dtype=dtype, device=device),
+                torch.zeros((batch_size * num_heads, max_length, head_dim), dtype=dtype, device=device),
+            )
+            for _ in range(self.config.n_layer)
+        )
+
+    def _prefill_with_prefix_cache(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.Tensor],
+        token_idx: Optional[torch.Tensor],
+        prefix_cache: GaudiBloomPrefixCache,
+    ) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """
+        Returns a static cache holding the keys and values of the prompts but their last token. The longest prefix
+        shared by all the prompts that is in `prefix_cache` is copied from it, the rest is computed in a single forward
+        pass and stored in `prefix_cache`.
+        """
+        if token_idx is None or token_idx.dim() > 0:
+            raise ValueError("A prefix cache can only be used with static shapes and a single `token_idx`.")
+        prompt_length = int(token_idx)
+        if attention_mask is not None and not bool(attention_mask[:, :prompt_length].all()):
+            raise ValueError("A prefix cache can only be used with prompts that are not padded.")
+
+        batch_size, max_length = input_ids.shape
+        past_key_values = self._allocate_static_cache(batch_size, max_length, input_ids.device)
+        num_heads = self.transformer.h[0].self_attention.num_heads
+
+        def get_row_cache(row):
+            return tuple(
+                (
+                    past_key[row * num_heads : (row + 1) * num_heads],
+                    past_value[row * num_heads : (row + 1) * num_heads],
+                )
+                for past_key, past_value in past_key_values
+            )
+
+        # The last token of the prompts is computed by the first decoding step
+        num_tokens = prompt_length - 1
+        prompts = input_ids[:, :num_tokens].tolist()
+        num_cached_tokens = min(prefix_cache.get_num_cached_tokens(prompt) for prompt in prompts)
+        for row, prompt in enumerate(prompts):
+            prefix_cache.load(get_row_cache(row), prompt, num_cached_tokens)
+
+        if num_cached_tokens < num_tokens:
+            # The new tokens are written from num_cached_tokens onwards, only their keys and values are needed so the
+            # LM head is skipped
+            self.transformer(
+                input_ids[:, num_cached_tokens:num_tokens],
+                past_key_values=past_key_values,
+                attention_mask=attention_mask,
+                use_cache=True,
+                token_idx=torch.tensor(num_cached_tokens + 1, device=input_ids.device),
+            )
+            for row, prompt in enumerate(prompts):
+                prefix_cache.store(get_row_cache(row), prompt, num_tokens)
+
+        return past_key_values
+
+    def _prefill_in_chunks(
+        self,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.Tensor],
+        token_idx: Optional[torch.Tensor],
+        chunk_size: int,
+    ) -> Tuple[Tuple[torch.Tensor, torch.Tensor], ...]:
+        """
+        Returns a static cache holding the keys and values of the prompts but their last token, computed by forward
+        passes over `chunk_size` tokens. The attention scores of a chunk are of shape
+        `(batch_size * num_heads, chunk_size, max_length)`, so the peak memory of the prefill is bounded by
+        `chunk_size` instead of the prompt length. All chunks have the same shape: the last one is shifted back to end
+        at the last token to prefill, its overlap with the previous chunk is computed again and written with the same
+        values.
+        """
+        if token_idx is None or token_idx.dim() > 0:
+            raise ValueError("Chunked prefill can only be used with static shapes and a single `token_idx`.")
+        if chunk_size <= 0:
+            raise ValueError(f"`prefill_chunk_size` should be a strictly positive integer, but is {chunk_size}.")
+
+        batch_size, max_length = input_ids.shape
+        past_key_values = self._allocate_static_cache(batch_size, max_length, input_ids.device)
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        positions = torch.arange(max_length, device=input_ids.device)
+
+        # The last token of the prompts is computed by the first decoding step
+        num_tokens = int(token_idx) - 1
+        chunk_size = max(min(chunk_size, num_tokens), 1)
+        for start in range(0, num_tokens, chunk_size):
+            start = min(start, num_tokens - chunk_size)
+            # Only the keys and values of the chunk are needed so the LM head is skipped. The positions after the
+            # chunk are masked, they are not written yet.
+            self.transformer(
+                input_ids[:, start : start + chunk_size],
+                past_key_values=past_key_values,
+                attention_mask=attention_mask * (positions < start + chunk_size),
+                use_cache=True,
+                token_idx=torch.tensor(start + 1, device=input_ids.device),
+            )
+            if input_ids.device.type == "hpu":
+                # Run each chunk as its own graph so that their activations are not alive at the same time
+                import habana_frameworks.torch.core as htcore
+
+                htcore.mark_step()
+
+        return past_key_values
+
     def prepare_inputs_for_generation(
         self,
         input_ids: torch.LongTensor,
         past_key_values: Optional[torch.Tensor] = None,
         attention_mask: Optional[torch.Tensor] = None,
         token_idx: Optional[torch.Tensor] = None,
+        paged_kv_cache: Optional[GaudiBloomPagedKVCache] = None,
+        prefix_cache: Optional[GaudiBloomPrefixCache] = None,
+        int8_kv_cache: Optional[GaudiBloomInt8KVCache] = None,
+        prefill_chunk_size: Optional[int] = None,
+        trim_logits: bool = False,
         **kwargs,
     ) -> dict:
+        if sum(cache is not None for cache in (paged_kv_cache, prefix_cache, int8_kv_cache, prefill_chunk_size)) > 1:
+            raise ValueError(
+                "Only one of `paged_kv_cache`, `prefix_cache`, `int8_kv_cache` and `prefill_chunk_size` can be used at"
+                " once."
+            )
+
         # only last token for input_ids if past is not None
         if past_key_values:
             if token_idx is not None:
-                input_ids = torch.index_select(input_ids, 1, token_idx - 1)
+                if token_idx.dim() > 0:
+                    input_ids = torch.gather(input_ids, 1, (token_idx - 1).unsqueeze(-1))
+                else:
+                    input_ids = torch.index_select(input_ids, 1, token_idx - 1)
             else:
                 input_ids = input_ids[:, -1].unsqueeze(-1)
 
             # the cache may be in the stardard format (e.g. in contrastive search), convert to bloom's format if needed
-            if past_key_values[0][0].shape[0] == input_ids.shape[0]:
+            if (
+                not isinstance(past_key_values, (GaudiBloomPagedKVCache, GaudiBloomInt8KVCache))
+                and past_key_values[0][0].shape[0] == input_ids.shape[0]
+            ):
                 past_key_values = self._convert_to_bloom_cache(past_key_values)
-
-        return {
+        elif paged_kv_cache is not None:
+            # The prompt is written into the paged cache by the first forward pass
+            past_key_values = paged_kv_cache
+        elif int8_kv_cache is not None:
+            # The prompt is quantized into the int8 cache by the first forward pass
+            past_key_values = int8_kv_cache
+        elif prefix_cache is not None:
+            # The prompt but its last token is read from the prefix cache or prefilled, the last token is run as a
+            # decoding step to get the scores of the next token
+            past_key_values = self._prefill_with_prefix_cache(input_ids, attention_mask, token_idx, prefix_cache)
+            input_ids = torch.index_select(input_ids, 1, token_idx - 1)
+        elif prefill_chunk_size is not None:
+            # The prompt but its last token is prefilled chunk by chunk, the last token is run as a decoding step
+            past_key_values = self._prefill_in_chunks(input_ids, attention_mask, token_idx, prefill_chunk_size)
+            input_ids = torch.index_select(input_ids, 1, token_idx - 1)
+
+        model_inputs = {
             "input_ids": input_ids,
             "past_key_values": past_key_values,
             "use_cache": kwargs.get("use_cache"),
             "attention_mask": attention_mask,
             "token_idx": token_idx,
         }
+        if trim_logits:
+            # Only the logits of the last prompt position are needed at prefill
+            model_inputs["logits_positions"] = gaudi_get_logits_positions(
+                input_ids.shape[-1], token_idx, input_ids.device
+            )
+        return model_inputs
 
     def forward(
         self,
         input_ids: Optional[torch.LongTensor] = None,
-        past_key_values: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None,
+        past_key_values: Optional[
+            Union[
+                Tuple[Tuple[torch.Tensor, torch.Tensor], ...],
+                GaudiBloomPagedKVCache,
+                GaudiBloomInt8KVCache,
+                GaudiSinkKVCache,
+            ]
+        ] = None,
         attention_mask: Optional[torch.Tensor] = None,
         head_mask: Optional[torch.Tensor] = None,
         inputs_embeds: Optional[torch.Tensor] = None,
@@ -436,6 +874,7 @@ class GaudiBloomForCausalLM(BloomForCausalLM):
         output_hidden_states: Optional[bool] = None,
         return_dict: Optional[bool] = None,
         token_idx: Optional[bool] = None,
+        logits_positions: Optional[torch.LongTensor] = None,
         **deprecated_arguments,
     ) -> Union[Tuple[torch.Tensor], CausalLMOutputWithCrossAttentions]:
         r"""
@@ -443,6 +882,8 @@ class GaudiBloomForCausalLM(BloomForCausalLM):
             Labels for language modeling. Note that the labels **are shifted** inside the model, i.e. you can set
             `labels = input_ids` Indices are selected in `[-100, 0, ..., config.vocab_size]` All labels set to `-100`
             are ignored (masked), the loss is only computed for labels in `[0, ..., config.vocab_size]`
+        logits_positions (`torch.LongTensor` of shape `(num_positions,)` or `(batch_size, num_positions)`, *optional*):
+            If given, logits are only computed for these positions, see `gaudi_select_logits_positions`.
         """
         if deprecated_arguments.pop("position_ids", False) is not False:
             # `position_ids` could have been `torch.Tensor` or `None` so defaulting pop to `False` allows to detect if users were passing explicitly `None`
@@ -470,6 +911,10 @@ class GaudiBloomForCausalLM(BloomForCausalLM):
         )
         hidden_states = transformer_outputs[0]
 
+        if logits_positions is not None:
+            if labels is not None:
+                raise ValueError("`logits_positions` cannot be used with `labels`.")
+            hidden_states = gaudi_select_logits_positions(hidden_states, logits_positions)
         if len(self.lm_head_chunks) > 0:
             lm_logits = torch.cat([torch.matmul(hidden_states, c) for c in self.lm_head_chunks], dim=-1)
         else:
@@ -477,6 +922,8 @@ class GaudiBloomForCausalLM(BloomForCausalLM):
 
         loss = None
         if labels is not None:
+            if isinstance(self.lm_head, VocabParallelLMHead):
+                raise ValueError("`labels` cannot be used with a vocabulary-parallel LM head.")
             # move labels to correct device to enable model parallelism
             labels = labels.to(lm_logits.device)
             # Shift so that tokens < n predict n
@@ -1 +1 @@
-from .modeling_gpt2 import GaudiGPT2Attention, gaudi_gpt2_forward
+from .modeling_gpt2 import GaudiGPT2Attention, GaudiGPT2LMHeadModel, gaudi_gpt2_block_forward, gaudi_gpt2_forward
@@ -1,10 +1,14 @@
 from typing import Optional, Tuple, Union
 
 import torch
-from transformers.modeling_outputs import BaseModelOutputWithPastAndCrossAttentions
-from transformers.models.gpt2.modeling_gpt2 import logger
+from torch.nn import CrossEntropyLoss
+from transformers.modeling_outputs import BaseModelOutputWithPastAndCrossAttentions, CausalLMOutputWithCrossAttentions
+from transformers.models.gpt2.modeling_gpt2 import GPT2LMHeadModel, logger
 from transformers.pytorch_utils import Conv1D, find_pruneable_heads_and_indices, prune_conv1d_layer
 
+from ..modeling_all_models import gaudi_get_logits_positions, gaudi_select_logits_positions
+from ..sink_kv_cache import GaudiSinkKVCache
+
 
 class GaudiGPT2Attention(torch.nn.Module):
     """
@@ -12,6 +16,8 @@ class GaudiGPT2Attention(torch.nn.Module):
     The only differences are:
     - `self.bias` is a torch.uint8 and not a torch.bool
     - it is casted to bool before being used in torch.where
+    - add new arg token_idx to write in place in a key/value cache preallocated at max_length (static shapes)
+    - add new arg causal_mask to replace the causal mask, e.g. for a rolling cache whose slots are not in order
     """
 
     def __init__(self, config, is_cross_attention=False, layer_idx=None):
@@ -71,7 +77,16 @@ class GaudiGPT2Attention(torch.nn.Module):
         self.num_heads = self.num_heads - len(heads)
         self.pruned_heads = self.pruned_heads.union(heads)
 
-    def _attn(self, query, key, value, attention_mask=None, head_mask=None):
+    def _get_causal_mask(self, query_length, key_length, token_idx=None):
+        if token_idx is not None and query_length < key_length:
+            # Static cache: the queries start at position token_idx - 1 and the keys span the whole cache
+            query_positions = token_idx - 1
+            if query_length > 1:
+                query_positions = query_positions + torch.arange(query_length, device=query_positions.device)
+            return torch.index_select(self.bias[:, :, :, :key_length], 2, query_positions).bool()
+        return self.bias[:, :, key_length - query_length : key_length, :key_length].bool()
+
+    def _attn(self, query, key, value, attention_mask=None, head_mask=None, token_idx=None, causal_mask=None):
         attn_weights = torch.matmul(query, key.transpose(-1, -2))
 
         if self.scale_attn_weights:
@@ -85,8 +100,9 @@ class GaudiGPT2Attention(torch.nn.Module):
 
         if not self.is_cross_attention:
             # if only "normal" attention layer implements causal mask
-            query_length, key_length = query.size(-2), key.size(-2)
-            causal_mask = self.bias[:, :, key_length - query_length : key_length, :key_length].bool()
+            if causal_mask is None:
+                query_length, key_length = query.size(-2), key.size(-2)
+                causal_mask = self._get_causal_mask(query_length, key_length, token_idx)
             mask_value = torch.finfo(attn_weights.dtype).min
             # Need to be a tensor, otherwise we get error: `RuntimeError: expected scalar type float but found double`.
             # Need to be on the same device, otherwise `RuntimeError: ..., x and y to be on the same device`
@@ -111,7 +127,9 @@ class GaudiGPT2Attention(torch.nn.Module):
 
         return attn_output, attn_weights
 
-    def _upcast_and_reordered_attn(self, query, key, value, attention_mask=None, head_mask=None):
+    def _upcast_and_reordered_attn(
+        self, query, key, value, attention_mask=None, head_mask=None, token_idx=None, causal_mask=None
+    ):
         # Use `torch.baddbmm` (a bit more efficient w/ alpha param for scaling -- from Megatron-LM)
         bsz, num_heads, q_seq_len, dk = query.size()
         _, _, k_seq_len, _ = key.size()
@@ -133,8 +151,9 @@ class GaudiGPT2Attention(torch.nn.Module):
 
         if not self.is_cross_attention:
             # if only "normal" attention layer implements causal mask
-            query_length, key_length = query.size(-2), key.size(-2)
-            causal_mask = self.bias[:, :, key_length - query_length : key_length, :key_length].bool()
+            if causal_mask is None:
+                query_length, key_length = query.size(-2), key.size(-2)
+                causal_mask = self._get_causal_mask(query_length, key_length, token_idx)
             mask_value = torch.finfo(attn_weights.dtype).min
             # Need to be a tensor, otherwise we get error: `RuntimeError: expected scalar type float but found double`.
             # Need to be on the same device, otherwise `RuntimeError: ..., x and y to be on the same device`
@@ -187,6 +206,8 @@ class GaudiGPT2Attention(torch.nn.Module):
         encoder_attention_mask: Optional[torch.FloatTensor] = None,
         use_cache: Optional[bool] = False,
         output_attentions: Optional[bool] = False,
+        token_idx: Optional[torch.Tensor] = None,
+        causal_mask: Optional[torch.BoolTensor] = None,
     ) -> Tuple[Union[torch.Tensor, Tuple[torch.Tensor]], ...]:
         if encoder_hidden_states is not None:
             if not hasattr(self, "q_attn"):
@@ -207,8 +228,19 @@ class GaudiGPT2Attention(torch.nn.Module):
 
         if layer_past is not None:
             past_key, past_value = layer_past
-            key = torch.cat((past_key, key), dim=-2)
-            value = torch.cat((past_value, value), dim=-2)
+            if token_idx is not None:
+                # Several new tokens are written from token_idx - 1 onwards (e.g. to verify speculated tokens)
+                write_idx = token_idx - 1
+                if key.shape[-2] > 1:
+                    write_idx = write_idx + torch.arange(key.shape[-2], device=write_idx.device)
+                # HPU bug WA
+                past_key.index_add_(2, write_idx, key - torch.index_select(past_key, 2, write_idx))
+                past_value.index_add_(2, write_idx, value - torch.index_select(past_value, 2, write_idx))
+                key = past_key
+                value = past_value
+            else:
+                key = torch.cat((past_key, key), dim=-2)
+                value = torch.cat((past_value, value), dim=-2)
 
         if use_cache is True:
             present = (key, value)
@@ -216,9 +248,13 @@ class GaudiGPT2Attention(torch.nn.Module):
             present = None
 
         if self.reorder_and_upcast_attn:
-            attn_output, attn_weights = self._upcast_and_reordered_attn(query, key, value, attention_mask, head_mask)
+            attn_output, attn_weights = self._upcast_and_reordered_attn(
+                query, key, value, attention_mask, head_mask, token_idx, causal_mask
+            )
         else:
-            attn_output, attn_weights = self._attn(query, key, value, attention_mask, head_mask)
+            attn_output, attn_weights = self._attn(
+                query, key, value, attention_mask, head_mask, token_idx, causal_mask
+            )
 
         attn_output = self._merge_heads(attn_output, self.num_heads, self.head_dim)
         attn_output = self.c_proj(attn_output)
@@ -231,10 +267,81 @@ class GaudiGPT2Attention(torch.nn.Module):
         return outputs  # a, present, (attentions)
 
 
+def gaudi_gpt2_block_forward(
+    self,
+    hidden_states: Optional[Tuple[torch.FloatTensor]],
+    layer_past: Optional[Tuple[torch.Tensor]] = None,
+    attention_mask: Optional[torch.FloatTensor] = None,
+    head_mask: Optional[torch.FloatTensor] = None,
+    encoder_hidden_states: Optional[torch.Tensor] = None,
+    encoder_attention_mask: Optional[torch.FloatTensor] = None,
+    use_cache: Optional[bool] = False,
+    output_attentions: Optional[bool] = False,
+    token_idx: Optional[torch.Tensor] = None,
+    causal_mask: Optional[torch.BoolTensor] = None,
+) -> Union[Tuple[torch.Tensor], Optional[Tuple[torch.Tensor, Tuple[torch.FloatTensor, ...]]]]:
+    """
+    Copied from GPT2Block.forward: https://github.com/huggingface/transformers/blob/main/src/transformers/models/gpt2/modeling_gpt2.py
+    The only differences are:
+    - add new args token_idx and causal_mask
+    """
+    residual = hidden_states
+    hidden_states = self.ln_1(hidden_states)
+    attn_outputs = self.attn(
+        hidden_states,
+        layer_past=layer_past,
+        attention_mask=attention_mask,
+        head_mask=head_mask,
+        use_cache=use_cache,
+        output_attentions=output_attentions,
+        token_idx=token_idx,
+        causal_mask=causal_mask,
+    )
+    attn_output = attn_outputs[0]  # output_attn: a, present, (attentions)
+    outputs = attn_outputs[1:]
+    # residual connection
+    hidden_states = attn_output + residual
+
+    if encoder_hidden_states is not None:
+        # add one self-attention block for cross-attention
+        if not hasattr(self, "crossattention"):
+            raise ValueError(
+                f"If `encoder_hidden_states` are passed, {self} has to be instantiated with "
+                "cross-attention layers by setting `config.add_cross_attention=True`"
+            )
+        residual = hidden_states
+        hidden_states = self.ln_cross_attn(hidden_states)
+        cross_attn_outputs = self.crossattention(
+            hidden_states,
+            attention_mask=attention_mask,
+            head_mask=head_mask,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            output_attentions=output_attentions,
+        )
+        attn_output = cross_attn_outputs[0]
+        # residual connection
+        hidden_states = residual + attn_output
+        outputs = outputs + cross_attn_outputs[2:]  # add cross attentions if we output attention weights
+
+    residual = hidden_states
+    hidden_states = self.ln_2(hidden_states)
+    feed_forward_hidden_states = self.mlp(hidden_states)
+    # residual connection
+    hidden_states = residual + feed_forward_hidden_states
+
+    if use_cache:
+        outputs = (hidden_states,) + outputs
+    else:
+        outputs = (hidden_states,) + outputs[1:]
+
+    return outputs  # hidden_states, present, (attentions, cross_attentions)
+
+
 def gaudi_gpt2_forward(
     self,
     input_ids: Optional[torch.LongTensor] = None,
-    past_key_values: Optional[Tuple[Tuple[torch.Tensor]]] = None,
+    past_key_values: Optional[Union[Tuple[Tuple[torch.Tensor]], GaudiSinkKVCache]] = None,
     attention_mask: Optional[torch.FloatTensor] = None,
     token_type_ids: Optional[torch.LongTensor] = None,
     position_ids: Optional[torch.LongTensor] = None,
@@ -246,11 +353,14 @@ def gaudi_gpt2_forward(
     output_attentions: Optional[bool] = None,
     output_hidden_states: Optional[bool] = None,
     return_dict: Optional[bool] = None,
+    token_idx: Optional[torch.Tensor] = None,
 ) -> Union[Tuple, BaseModelOutputWithPastAndCrossAttentions]:
     """
     Copied from GPT2Model.forward: https://github.com/huggingface/transformers/blob/main/src/transformers/models/gpt2/modeling_gpt2.py
     The only differences are:
     - disable HMP cast for attention_mask
+    - add new arg token_idx
+    - support a rolling key/value cache (`GaudiSinkKVCache`) as `past_key_values`
     """
 
     output_attentions = output_attentions if output_attentions is not None else self.config.output_attentions
@@ -279,14 +389,39 @@ def gaudi_gpt2_forward(
     if position_ids is not None:
         position_ids = position_ids.view(-1, input_shape[-1])
 
+    sink_kv_cache = None
+    causal_mask = None
+    if isinstance(past_key_values, GaudiSinkKVCache):
+        if token_idx is not None or attention_mask is not None:
+            raise ValueError(
+                "A sink key/value cache tracks positions itself, `token_idx` and `attention_mask` cannot be given."
+            )
+        if past_key_values.batch_size != batch_size:
+            raise ValueError(
+                f"The sink key/value cache has {past_key_values.batch_size} rows but the batch size is {batch_size}."
+            )
+        sink_kv_cache = past_key_values
+        # The new tokens are written from token_idx - 1 like in a static cache, but the slots are not in order
+        write_slot, attended_slots, _, query_positions = sink_kv_cache.prepare_step(input_shape[-1])
+        token_idx = write_slot + 1
+        causal_mask = attended_slots.view(1, 1, input_shape[-1], -1)
+        if position_ids is None:
+            position_ids = query_positions.unsqueeze(0)
+        past_key_values = tuple(sink_kv_cache)
+
     if past_key_values is None:
         past_length = 0
         past_key_values = tuple([None] * len(self.h))
     else:
         past_length = past_key_values[0][0].size(-2)
     if position_ids is None:
-        position_ids = torch.arange(past_length, input_shape[-1] + past_length, dtype=torch.long, device=device)
-        position_ids = position_ids.unsqueeze(0).view(-1, input_shape[-1])
+        if token_idx is not None and past_length > 0:
+            # The cache is preallocated, so positions are given by token_idx and not by the cache length
+            position_ids = token_idx - 1 + torch.arange(input_shape[-1], dtype=torch.long, device=device)
+            position_ids = position_ids.unsqueeze(0).view(-1, input_shape[-1])
+        else:
+            position_ids = torch.arange(past_length, input_shape[-1] + past_length, dtype=torch.long, device=device)
+            position_ids = position_ids.unsqueeze(0).view(-1, input_shape[-1])
 
     # GPT2Attention mask.
     if attention_mask is not None:
@@ -396,6 +531,8 @@ def gaudi_gpt2_forward(
                 encoder_attention_mask=encoder_attention_mask,
                 use_cache=use_cache,
                 output_attentions=output_attentions,
+                token_idx=token_idx,
+                causal_mask=causal_mask,
             )
 
         hidden_states = outputs[0]
@@ -413,6 +550,12 @@ def gaudi_gpt2_forward(
                 if i == v[-1] and "cuda:" + str(k) != self.last_device:
                     hidden_states = hidden_states.to("cuda:" + str(k + 1))
 
+    if sink_kv_cache is not None:
+        # The new tokens have been written by all the layers
+        sink_kv_cache.advance(input_shape[-1])
+        if use_cache is True:
+            presents = sink_kv_cache
+
     hidden_states = self.ln_f(hidden_states)
 
     hidden_states = hidden_states.view(output_shape)
@@ -434,3 +577,150 @@ def gaudi_gpt2_forward(
         attentions=all_self_attentions,
         cross_attentions=all_cross_attentions,
     )
+
+
+class GaudiGPT2LMHeadModel(GPT2LMHeadModel):
+    """
+    Copied from GPT2LMHeadModel: https://github.com/huggingface/transformers/blob/main/src/transformers/models/gpt2/modeling_gpt2.py
+    The only differences are:
+    - add new arg token_idx
+    - select the current token with token_idx in prepare_inputs_for_generation
+    - add new arg logits_positions to only apply the LM head where logits are needed, set at prefill in
+      prepare_inputs_for_generation if trim_logits is True
+    """
+
+    def prepare_inputs_for_generation(
+        self, input_ids, past_key_values=None, inputs_embeds=None, token_idx=None, trim_logits=False, **kwargs
+    ):
+        token_type_ids = kwargs.get("token_type_ids", None)
+        # only last token for inputs_ids if past is defined in kwargs
+        if past_key_values:
+            if token_idx is not None:
+                input_ids = torch.index_select(input_ids, 1, token_idx - 1)
+            else:
+                input_ids = input_ids[:, -1].unsqueeze(-1)
+            if token_type_ids is not None:
+                if token_idx is not None:
+                    token_type_ids = torch.index_select(token_type_ids, 1, token_idx - 1)
+                else:
+                    token_type_ids = token_type_ids[:, -1].unsqueeze(-1)
+
+        attention_mask = kwargs.get("attention_mask", None)
+        position_ids = kwargs.get("position_ids", None)
+
+        if attention_mask is not None and position_ids is None:
+            # create position_ids on the fly for batch generation
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+            if past_key_values:
+                if token_idx is not None:
+                    position_ids = torch.index_select(position_ids, 1, token_idx - 1)
+                else:
+                    position_ids = position_ids[:, -1].unsqueeze(-1)
+        else:
+            position_ids = None
+
+        # if `inputs_embeds` are passed, we only want to use them in the 1st generation step
+        if inputs_embeds is not None and past_key_values is None:
+            model_inputs = {"inputs_embeds": inputs_embeds}
+        else:
+            model_inputs = {"input_ids": input_ids}
+
+        if trim_logits:
+            # Only the logits of the last prompt position are needed at prefill
+            inputs = model_inputs.get("input_ids", model_inputs.get("inputs_embeds"))
+            model_inputs["logits_positions"] = gaudi_get_logits_positions(inputs.shape[1], token_idx, inputs.device)
+
+        model_inputs.update(
+            {
+                "past_key_values": past_key_values,
+                "use_cache": kwargs.get("use_cache"),
+                "position_ids": position_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": token_type_ids,
+                "token_idx": token_idx,
+            }
+        )
+        return model_inputs
+
+    def forward(
+        self,
+        input_ids: Optional[torch.LongTensor] = None,
+        past_key_values: Optional[Union[Tuple[Tuple[torch.Tensor]], GaudiSinkKVCache]] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+        token_type_ids: Optional[torch.LongTensor] = None,
+        position_ids: Optional[torch.LongTensor] = None,
+        head_mask: Optional[torch.FloatTensor] = None,
+        inputs_embeds: Optional[torch.FloatTensor] = None,
+        encoder_hidden_states: Optional[torch.Tensor] = None,
+        encoder_attention_mask: Optional[torch.FloatTensor] = None,
+        labels: Optional[torch.LongTensor] = None,
+        use_cache: Optional[bool] = None,
+        output_attentions: Optional[bool] = None,
+        output_hidden_states: Optional[bool] = None,
+        return_dict: Optional[bool] = None,
+        token_idx: Optional[torch.Tensor] = None,
+        logits_positions: Optional[torch.LongTensor] = None,
+    ) -> Union[Tuple, CausalLMOutputWithCrossAttentions]:
+        r"""
+        labels (`torch.LongTensor` of shape `(batch_size, sequence_length)`, *optional*):
+            Labels for language modeling. Note that the labels **are shifted** inside the model, i.e. you can set
+            `labels = input_ids` Indices are selected in `[-100, 0, ..., config.vocab_size]` All labels set to `-100`
+            are ignored (masked), the loss is only computed for labels in `[0, ..., config.vocab_size]`
+        logits_positions (`torch.LongTensor` of shape `(num_positions,)` or `(batch_size, num_positions)`, *optional*):
+            If given, logits are only computed for these positions, see `gaudi_select_logits_positions`.
+        """
+        return_dict = return_dict if return_dict is not None else self.config.use_return_dict
+
+        transformer_outputs = self.transformer(
+            input_ids,
+            past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            position_ids=position_ids,
+            head_mask=head_mask,
+            inputs_embeds=inputs_embeds,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            use_cache=use_cache,
+            output_attentions=output_attentions,
+            output_hidden_states=output_hidden_states,
+            return_dict=return_dict,
+            token_idx=token_idx,
+        )
+        hidden_states = transformer_outputs[0]
+
+        # Set device for model parallelism
+        if self.model_parallel:
+            torch.cuda.set_device(self.transformer.first_device)
+            hidden_states = hidden_states.to(self.lm_head.weight.device)
+
+        if logits_positions is not None:
+            if labels is not None:
+                raise ValueError("`logits_positions` cannot be used with `labels`.")
+            hidden_states = gaudi_select_logits_positions(hidden_states, logits_positions)
+        lm_logits = self.lm_head(hidden_states)
+
+        loss = None
+        if labels is not None:
+            # move labels to correct device to enable model parallelism
+            labels = labels.to(lm_logits.device)
+            # Shift so that tokens < n predict n
+            shift_logits = lm_logits[..., :-1, :].contiguous()
+            shift_labels = labels[..., 1:].contiguous()
+            # Flatten the tokens
+            loss_fct = CrossEntropyLoss()
+            loss = loss_fct(shift_logits.view(-1, shift_logits.size(-1)), shift_labels.view(-1))
+
+        if not return_dict:
+            output = (lm_logits,) + transformer_outputs[1:]
+            return ((loss,) + output) if loss is not None else output
+
+        return CausalLMOutputWithCrossAttentions(
+            loss=loss,
+            logits=lm_logits,
+            past_key_values=transformer_outputs.past_key_values,
+            hidden_states=transformer_outputs.hidden_states,
+            attentions=transformer_outputs.attentions,
+            cross_attentions=transformer_outputs.cross_attentions,
+        )
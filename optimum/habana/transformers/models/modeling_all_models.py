@@ -15,7 +15,7 @@
 # limitations under the License.
 
 import warnings
-from typing import Tuple
+from typing import Optional, Tuple
 
 import torch
 from transformers.modeling_utils import ModuleUtilsMixin
@@ -108,3 +108,37 @@ def gaudi_conv1d_forward(self, x):
     bias = self.bias.view(bias_shape)
     x = x + bias
     return x
+
+
+def gaudi_get_logits_positions(
+    seq_length: int, token_idx: Optional[torch.Tensor] = None, device: Optional[torch.device] = None
+) -> Optional[torch.LongTensor]:
+    """
+    Returns the positions of an input of `seq_length` tokens whose logits are needed to generate the next token, i.e.
+    `token_idx - 1` with static shapes and the last position otherwise, to be given as `logits_positions` to the forward
+    of a causal language model. Returns `None` for a single token since there is nothing to trim.
+    """
+    if seq_length == 1:
+        return None
+    if token_idx is None:
+        return torch.tensor([seq_length - 1], device=device)
+    if token_idx.dim() > 0:
+        # One position per sequence
+        return (token_idx - 1).view(-1, 1)
+    return (token_idx - 1).view(1)
+
+
+def gaudi_select_logits_positions(hidden_states: torch.Tensor, logits_positions: torch.LongTensor) -> torch.Tensor:
+    """
+    Selects the hidden states of `logits_positions` before the language modeling head, so that logits are only computed
+    where they are needed (e.g. at the last prompt position during prefill) instead of for the whole sequence.
+
+    Args:
+        hidden_states (`torch.Tensor` of shape `(batch_size, sequence_length, hidden_size)`):
+            The last hidden states of the model.
+        logits_positions (`torch.LongTensor` of shape `(num_positions,)` or `(batch_size, num_positions)`):
+            The positions to keep, shared by the batch or given for each sequence.
+    """
+    if logits_positions.dim() == 1:
+        return torch.index_select(hidden_states, 1, logits_positions)
+    return torch.gather(hidden_states, 1, logits_positions.unsqueeze(-1).expand(-1, -1, hidden_states.shape[-1]))
@@ -0,0 +1,168 @@
+# coding=utf-8
+# Copyright 2023 The HuggingFace Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Tuple, Union
+
+import torch
+from transformers import PretrainedConfig
+
+
+class GaudiSinkKVCache:
+    """
+    Fixed-size rolling key/value cache for streaming generation, as in StreamingLLM
+    (https://arxiv.org/abs/2309.17453): the first `num_sink_tokens` tokens ("attention sinks") are kept forever and the
+    following ones are written circularly into a window of `window_size` slots, so that each token attends to the sinks
+    and to the `window_size` most recent tokens (itself included). The cache holds `num_sink_tokens + window_size`
+    slots whatever the number of tokens seen, so memory is constant and decoding always runs with the same shapes.
+
+    The cache counts the tokens it has seen in `num_tokens`, on device, and the model computes the slots to write and
+    the mask from it at every forward pass, so it should be given as `past_key_values` without `token_idx` nor
+    `attention_mask`. All the rows of the batch are at the same position, prompts cannot be padded. A multi-token input
+    (e.g. a prompt) should fit in the slots left before the window wraps around, longer inputs are fed token by token,
+    see [`~generation.StreamingGenerationSession`].
+
+    Positions are taken within the cache rather than in the whole stream: the sinks are at positions
+    `0, ..., num_sink_tokens - 1` and the tokens of the window follow them in order, the newest one being at position
+    `num_sink_tokens + window_size - 1` once the window is full. With ALiBi (BLOOM), the bias of every slot is
+    recomputed from these positions at each step. With learned position embeddings (GPT-2), the position of a key is
+    part of its hidden states and cannot be recomputed, new tokens take the position of the newest slot.
+
+    Supported models: BLOOM (keys of shape `(batch_size * num_heads, head_dim, num_slots)`, values of shape
+    `(batch_size * num_heads, num_slots, head_dim)`) and GPT-2 (keys and values of shape
+    `(batch_size, num_heads, num_slots, head_dim)`).
+
+    Args:
+        config ([`PretrainedConfig`]):
+            The configuration of the model.
+        batch_size (`int`):
+            The number of sequences.
+        window_size (`int`):
+            The number of recent tokens kept in the cache.
+        num_sink_tokens (`int`, *optional*, defaults to 4):
+            The number of first tokens kept in the cache.
+        dtype (`torch.dtype`, *optional*, defaults to `torch.float32`):
+            The dtype of the keys and values, usually the one of the model.
+        device (`torch.device` or `str`, *optional*):
+            The device the cache is allocated on.
+        num_heads (`int`, *optional*):
+            The number of attention heads on this device. Defaults to `config.num_attention_heads`, it should be set
+            when the model is sharded with tensor parallelism.
+
+    Example:
+
+    ```python
+    >>> cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=1020, dtype=torch.bfloat16, device="hpu")
+    >>> outputs = model(input_ids, past_key_values=cache, use_cache=True)
+    ```
+    """
+
+    def __init__(
+        self,
+        config: PretrainedConfig,
+        batch_size: int,
+        window_size: int,
+        num_sink_tokens: int = 4,
+        dtype: torch.dtype = torch.float32,
+        device: Optional[Union[torch.device, str]] = None,
+        num_heads: Optional[int] = None,
+    ):
+        if window_size <= 0:
+            raise ValueError(f"`window_size` should be a strictly positive integer, but is {window_size}.")
+        if num_sink_tokens < 0:
+            raise ValueError(f"`num_sink_tokens` should be a positive integer, but is {num_sink_tokens}.")
+        if config.model_type not in ("bloom", "gpt2"):
+            raise ValueError(f"A sink key/value cache is not supported for {config.model_type} models.")
+        num_slots = num_sink_tokens + window_size
+        if config.model_type == "gpt2" and num_slots > config.max_position_embeddings:
+            raise ValueError(
+                f"The cache has {num_slots} slots but the model only has {config.max_position_embeddings} positions."
+            )
+
+        self.batch_size = batch_size
+        self.window_size = window_size
+        self.num_sink_tokens = num_sink_tokens
+        self.num_slots = num_slots
+        self.num_heads = num_heads if num_heads is not None else config.num_attention_heads
+        self.head_dim = config.hidden_size // config.num_attention_heads
+
+        if config.model_type == "bloom":
+            key_shape = (batch_size * self.num_heads, self.head_dim, num_slots)
+            value_shape = (batch_size * self.num_heads, num_slots, self.head_dim)
+        else:
+            key_shape = value_shape = (batch_size, self.num_heads, num_slots, self.head_dim)
+        self.keys = [torch.zeros(key_shape, dtype=dtype, device=device) for _ in range(config.num_hidden_layers)]
+        self.values = [torch.zeros(value_shape, dtype=dtype, device=device) for _ in range(config.num_hidden_layers)]
+        # Number of tokens seen since the last reset, updated in place so that decoding does not need host inputs
+        self.num_tokens = torch.zeros((), dtype=torch.long, device=device)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.keys[layer_idx], self.values[layer_idx]
+
+    def reset(self):
+        """
+        Empties the cache, e.g. to start a new conversation. The keys and values are not cleared, they are masked.
+        """
+        self.num_tokens.zero_()
+
+    def _get_slot(self, position: torch.Tensor) -> torch.Tensor:
+        window_slot = self.num_sink_tokens + (position - self.num_sink_tokens) % self.window_size
+        return torch.where(position < self.num_sink_tokens, position, window_slot)
+
+    def prepare_step(
+        self, num_new_tokens: int
+    ) -> Tuple[torch.LongTensor, torch.BoolTensor, torch.LongTensor, torch.LongTensor]:
+        """
+        Returns what a forward pass over `num_new_tokens` new tokens needs, computed on device.
+
+        Args:
+            num_new_tokens (`int`):
+                The number of new tokens, they are written at consecutive slots.
+
+        Returns:
+            `Tuple[torch.LongTensor, torch.BoolTensor, torch.LongTensor, torch.LongTensor]`:
+            - the slot of the first new token, a scalar tensor,
+            - which slots each new token attends to, of shape `(num_new_tokens, num_slots)`,
+            - the positions within the cache of the slots once the new tokens are written, of shape `(num_slots,)`,
+            - the positions within the cache of the new tokens, of shape `(num_new_tokens,)`.
+        """
+        if num_new_tokens > 1 and int(self.num_tokens) + num_new_tokens > self.num_slots:
+            raise ValueError(
+                f"{num_new_tokens} tokens cannot be written at once after {int(self.num_tokens)} tokens in a cache of"
+                f" {self.num_slots} slots, they should be fed one at a time once the window is full."
+            )
+        device = self.num_tokens.device
+        query_positions = self.num_tokens + torch.arange(num_new_tokens, device=device)
+        num_tokens = self.num_tokens + num_new_tokens
+
+        # Position in the stream of the token held by each slot once the new tokens are written
+        slots = torch.arange(self.num_slots, device=device)
+        age = (self._get_slot(num_tokens - 1) - slots) % self.window_size
+        key_positions = torch.where(slots < self.num_sink_tokens, slots, num_tokens - 1 - age)
+        is_written = slots < num_tokens
+        attended = is_written.unsqueeze(0) & (key_positions.unsqueeze(0) <= query_positions.unsqueeze(-1))
+
+        # Once the window has wrapped around, the tokens of the window are shifted to follow the sinks
+        offset = (num_tokens - self.num_slots).clamp(min=0)
+        key_positions = torch.where(slots < self.num_sink_tokens, slots, key_positions - offset)
+        return self._get_slot(self.num_tokens), attended, key_positions, query_positions - offset
+
+    def advance(self, num_new_tokens: int):
+        """
+        Records that `num_new_tokens` tokens have been written, called by the model after its forward pass.
+        """
+        self.num_tokens.add_(num_new_tokens)
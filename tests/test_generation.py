@@ -0,0 +1,1787 @@
+# coding=utf-8
+# Copyright 2023 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+import tempfile
+import unittest
+from threading import Thread
+from unittest import mock
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from transformers import BloomConfig, GPT2Config
+from transformers.generation.logits_process import (
+    LogitsProcessor,
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+from optimum.habana.transformers.generation import (
+    AsyncTokenStreamer,
+    BatchCompaction,
+    BatchSamplingParams,
+    ContinuousBatchingScheduler,
+    GenerationLatencyBenchmark,
+    GenerationShapeBuckets,
+    LogprobsBuffer,
+    StaticNoRepeatNGramLogitsProcessor,
+    StaticRepetitionPenaltyLogitsProcessor,
+    StaticTopKTopPSampler,
+    StreamingGenerationSession,
+    TokenConstraintFSM,
+    json_schema_to_regex,
+    load_request_trace,
+    sample_request_trace,
+)
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import (
+    GaudiBloomForCausalLM,
+    GaudiBloomInt8KVCache,
+    GaudiBloomPagedKVCache,
+    GaudiBloomPrefixCache,
+    GaudiGPT2LMHeadModel,
+    GaudiSinkKVCache,
+)
+from optimum.habana.transformers.models.bloom import modeling_bloom
+
+
+adapt_transformers_to_gaudi()
+
+PAD_TOKEN_ID = 0
+EOS_TOKEN_ID = 2
+
+
+def get_tiny_bloom():
+    torch.manual_seed(0)
+    config = BloomConfig(
+        vocab_size=64,
+        hidden_size=32,
+        n_layer=2,
+        n_head=4,
+        pad_token_id=PAD_TOKEN_ID,
+        eos_token_id=EOS_TOKEN_ID,
+        bos_token_id=1,
+    )
+    return GaudiBloomForCausalLM(config).eval()
+
+
+def get_tiny_gpt2():
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=64,
+        n_embd=32,
+        n_layer=2,
+        n_head=4,
+        n_positions=64,
+        pad_token_id=PAD_TOKEN_ID,
+        eos_token_id=EOS_TOKEN_ID,
+        bos_token_id=1,
+    )
+    return GaudiGPT2LMHeadModel(config).eval()
+
+
+def static_generate(model, prompt_ids, max_new_tokens, **kwargs):
+    """
+    Runs greedy generation on the static-shape path for a single unpadded prompt.
+    """
+    prompt_length = prompt_ids.shape[-1]
+    input_ids = F.pad(prompt_ids.view(1, -1), (0, max_new_tokens), value=PAD_TOKEN_ID)
+    attention_mask = F.pad(torch.ones_like(prompt_ids.view(1, -1)), (0, max_new_tokens), value=0)
+    return model.generate(
+        input_ids,
+        attention_mask=attention_mask,
+        token_idx=torch.tensor(prompt_length),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        ignore_eos=False,
+        **kwargs,
+    )
+
+
+class ContinuousBatchingTester(unittest.TestCase):
+    """
+    Unit tests for the in-flight batching scheduler.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(42)
+        self.prompts = [torch.randint(3, 64, (length,), generator=generator) for length in [3, 7, 5, 2, 6]]
+        self.max_new_tokens = [4, 10, 1, 8, 11]
+
+    def test_matches_static_generation(self):
+        scheduler = ContinuousBatchingScheduler(self.model, num_slots=2, max_length=17)
+        request_ids = [
+            scheduler.add_request(prompt, max_new_tokens)
+            for prompt, max_new_tokens in zip(self.prompts, self.max_new_tokens)
+        ]
+        outputs = scheduler.run()
+
+        for request_id, prompt, max_new_tokens in zip(request_ids, self.prompts, self.max_new_tokens):
+            expected = static_generate(self.model, prompt, max_new_tokens)[0]
+            output = outputs[request_id]
+            self.assertTrue(torch.equal(output, expected[: output.numel()]))
+            # Anything after an early stop can only be padding
+            self.assertTrue(torch.all(expected[output.numel() :] == PAD_TOKEN_ID))
+            self.assertTrue(output.numel() == prompt.numel() + max_new_tokens or output[-1] == EOS_TOKEN_ID)
+
+        self.assertFalse(scheduler.has_unfinished_requests())
+
+    def test_request_too_long(self):
+        scheduler = ContinuousBatchingScheduler(self.model, num_slots=2, max_length=8)
+        with self.assertRaises(ValueError):
+            scheduler.add_request(self.prompts[1], max_new_tokens=2)
+
+
+class GenerationShapeBucketsTester(unittest.TestCase):
+    """
+    Unit tests for prompt-length bucketing.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(42)
+        self.prompts = [torch.randint(3, 64, (length,), generator=generator) for length in [3, 5, 7, 2, 4]]
+
+    def test_matches_static_generation(self):
+        max_new_tokens = 6
+        shape_buckets = GenerationShapeBuckets(prompt_length_buckets=[4, 8], total_length_buckets=[16, 32])
+
+        for prompt in self.prompts:
+            expected = static_generate(self.model, prompt, max_new_tokens)[0]
+            output = self.model.generate(
+                prompt.view(1, -1),
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                ignore_eos=False,
+                shape_buckets=shape_buckets,
+            )[0]
+
+            self.assertEqual(output.numel(), 16)
+            prompt_bucket = shape_buckets.get_prompt_bucket(prompt.numel())
+            # Left padding before the prompt, then the same tokens as without bucketing
+            self.assertTrue(torch.all(output[: prompt_bucket - prompt.numel()] == PAD_TOKEN_ID))
+            generated = output[prompt_bucket - prompt.numel() :]
+            self.assertTrue(torch.equal(generated[: expected.numel()], expected))
+
+        # Five prompt lengths and two prompt buckets, but both buckets are padded to the same total length
+        self.assertEqual(shape_buckets.num_shapes, 1)
+
+        # A new total length is a new shape
+        self.model.generate(
+            self.prompts[2].view(1, -1), max_new_tokens=10, do_sample=False, shape_buckets=shape_buckets
+        )
+        self.assertEqual(shape_buckets.num_shapes, 2)
+
+    def test_no_bucket_fits(self):
+        shape_buckets = GenerationShapeBuckets(prompt_length_buckets=[4])
+        with self.assertRaises(ValueError):
+            self.model.generate(self.prompts[2].view(1, -1), max_new_tokens=2, shape_buckets=shape_buckets)
+
+
+class PagedKVCacheTester(unittest.TestCase):
+    """
+    Unit tests for the block-paged key/value cache of Bloom.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(42)
+        self.prompts = [torch.randint(3, 64, (length,), generator=generator) for length in [3, 7, 5, 2, 6]]
+        self.max_new_tokens = [4, 10, 1, 8, 11]
+
+    def test_generate_matches_dense_cache(self):
+        max_new_tokens = 7
+        input_ids = torch.stack([self.prompts[1][:5], self.prompts[4][:5]])
+        attention_mask = torch.ones_like(input_ids)
+        # Left padding on the second row
+        input_ids[1, :2] = PAD_TOKEN_ID
+        attention_mask[1, :2] = 0
+        input_ids = F.pad(input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID)
+        attention_mask = F.pad(attention_mask, (0, max_new_tokens), value=0)
+        max_length = input_ids.shape[-1]
+
+        kwargs = {"max_new_tokens": max_new_tokens, "do_sample": False, "ignore_eos": False}
+        expected = self.model.generate(
+            input_ids.clone(), attention_mask=attention_mask.clone(), token_idx=torch.tensor(5), **kwargs
+        )
+
+        cache = GaudiBloomPagedKVCache(self.model.config, num_blocks=8, block_size=4, batch_size=2, max_length=12)
+        for row in range(2):
+            cache.allocate(row, max_length)
+        outputs = self.model.generate(
+            input_ids.clone(),
+            attention_mask=attention_mask.clone(),
+            token_idx=torch.tensor(5),
+            paged_kv_cache=cache,
+            **kwargs,
+        )
+
+        self.assertTrue(torch.equal(outputs, expected))
+
+    def test_invalid_usage(self):
+        input_ids = self.prompts[1][:5]
+        cache = GaudiBloomPagedKVCache(self.model.config, num_blocks=8, block_size=4, batch_size=1, max_length=12)
+        with self.assertRaises(ValueError):
+            # No block was allocated
+            static_generate(self.model, input_ids, 7, paged_kv_cache=cache)
+        cache.allocate(0, 8)
+        with self.assertRaises(ValueError):
+            # The blocks do not cover the generated tokens
+            static_generate(self.model, input_ids, 7, paged_kv_cache=cache)
+        cache.allocate(0, 12)
+        with self.assertRaises(ValueError):
+            static_generate(self.model, input_ids, 7, paged_kv_cache=cache, assistant_model=get_tiny_bloom())
+        static_generate(self.model, input_ids, 7, paged_kv_cache=cache)
+
+    def test_beam_search(self):
+        # One row per beam, all allocated
+        cache = GaudiBloomPagedKVCache(self.model.config, num_blocks=10, block_size=4, batch_size=3, max_length=12)
+        for row in range(3):
+            cache.allocate(row, 12)
+        with self.assertRaises(ValueError):
+            static_generate(self.model, self.prompts[1][:5], 7, num_beams=3, paged_kv_cache=cache)
+
+    def test_allocate_and_free(self):
+        cache = GaudiBloomPagedKVCache(self.model.config, num_blocks=5, block_size=4, batch_size=2, max_length=16)
+        self.assertEqual(cache.num_free_blocks, 4)
+
+        cache.allocate(0, 5)
+        self.assertEqual(cache.block_tables[0].tolist(), [1, 2, 0, 0])
+        # Growing a row keeps its blocks
+        cache.allocate(0, 9)
+        self.assertEqual(cache.block_tables[0].tolist(), [1, 2, 3, 0])
+        self.assertFalse(cache.can_allocate(8))
+        with self.assertRaises(ValueError):
+            cache.allocate(1, 8)
+
+        cache.free(0)
+        self.assertEqual(cache.num_free_blocks, 4)
+        self.assertEqual(cache.block_tables[0].tolist(), [0, 0, 0, 0])
+        with self.assertRaises(ValueError):
+            cache.allocate(1, 17)
+
+    def test_continuous_batching(self):
+        max_length = 17
+        # 9 usable blocks of 4 tokens for 3 slots, whereas dense slots would need 3 * 17 tokens
+        cache = GaudiBloomPagedKVCache(
+            self.model.config, num_blocks=10, block_size=4, batch_size=3, max_length=max_length
+        )
+        scheduler = ContinuousBatchingScheduler(self.model, num_slots=3, max_length=max_length, paged_kv_cache=cache)
+        request_ids = [
+            scheduler.add_request(prompt, max_new_tokens)
+            for prompt, max_new_tokens in zip(self.prompts, self.max_new_tokens)
+        ]
+        outputs = scheduler.run()
+
+        for request_id, prompt, max_new_tokens in zip(request_ids, self.prompts, self.max_new_tokens):
+            expected = static_generate(self.model, prompt, max_new_tokens)[0]
+            output = outputs[request_id]
+            self.assertTrue(torch.equal(output, expected[: output.numel()]))
+            self.assertTrue(torch.all(expected[output.numel() :] == PAD_TOKEN_ID))
+
+        self.assertEqual(cache.num_free_blocks, 9)
+
+    def test_request_too_large_for_cache(self):
+        cache = GaudiBloomPagedKVCache(self.model.config, num_blocks=4, block_size=4, batch_size=2, max_length=17)
+        scheduler = ContinuousBatchingScheduler(self.model, num_slots=2, max_length=17, paged_kv_cache=cache)
+        with self.assertRaises(ValueError):
+            scheduler.add_request(self.prompts[1], max_new_tokens=8)
+
+
+class PrefixCacheTester(unittest.TestCase):
+    """
+    Unit tests for the shared-prefix key/value cache of Bloom.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(43)
+        system_prompt = torch.randint(3, 64, (10,), generator=generator)
+        self.prompts = [
+            torch.cat([system_prompt, torch.randint(3, 64, (length,), generator=generator)]) for length in [3, 4, 6]
+        ]
+
+    def test_matches_static_generation(self):
+        prefix_cache = GaudiBloomPrefixCache(block_size=4)
+        kwargs = {"output_scores": True, "return_dict_in_generate": True}
+        for prompt, num_cached_tokens in zip(self.prompts, [0, 8, 8]):
+            self.assertEqual(prefix_cache.get_num_cached_tokens(prompt.tolist()), num_cached_tokens)
+            expected = static_generate(self.model, prompt, 6, **kwargs)
+            outputs = static_generate(self.model, prompt, 6, prefix_cache=prefix_cache, **kwargs)
+
+            self.assertTrue(torch.equal(outputs.sequences, expected.sequences))
+            for scores, expected_scores in zip(outputs.scores, expected.scores):
+                self.assertTrue(torch.allclose(scores, expected_scores, atol=1e-5))
+
+        # The system prompt is stored once, followed by the last block of each prompt
+        self.assertEqual(len(prefix_cache), 5)
+
+    def test_cached_keys_and_values_are_used(self):
+        prefix_cache = GaudiBloomPrefixCache(block_size=4)
+        kwargs = {"output_scores": True, "return_dict_in_generate": True}
+        expected = static_generate(self.model, self.prompts[0], 1, prefix_cache=prefix_cache, **kwargs)
+        for _, key_states, value_states in prefix_cache.blocks.values():
+            key_states.zero_()
+            value_states.zero_()
+        outputs = static_generate(self.model, self.prompts[0], 1, prefix_cache=prefix_cache, **kwargs)
+        self.assertFalse(torch.allclose(outputs.scores[0], expected.scores[0]))
+
+    def test_lru_eviction(self):
+        prefix_cache = GaudiBloomPrefixCache(block_size=4)
+        static_generate(self.model, self.prompts[0], 2, prefix_cache=prefix_cache)
+        block_memory = prefix_cache.memory_usage // len(prefix_cache)
+
+        # Room for 3 blocks: the first prompt is evicted from its last block, its prefix is kept while used
+        prefix_cache = GaudiBloomPrefixCache(block_size=4, max_memory=3 * block_memory)
+        static_generate(self.model, self.prompts[0], 2, prefix_cache=prefix_cache)
+        static_generate(self.model, self.prompts[2], 2, prefix_cache=prefix_cache)
+        self.assertEqual(len(prefix_cache), 3)
+        self.assertEqual(prefix_cache.memory_usage, 3 * block_memory)
+        self.assertEqual(prefix_cache.get_num_cached_tokens(self.prompts[0].tolist()), 8)
+        self.assertEqual(prefix_cache.get_num_cached_tokens(self.prompts[2].tolist()), 12)
+
+    def test_invalid_inputs(self):
+        prefix_cache = GaudiBloomPrefixCache(block_size=4)
+        input_ids = F.pad(self.prompts[0].view(1, -1), (2, 4), value=PAD_TOKEN_ID)
+        attention_mask = (input_ids != PAD_TOKEN_ID).long()
+        with self.assertRaises(ValueError):
+            self.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                token_idx=torch.tensor(2 + self.prompts[0].numel()),
+                max_new_tokens=4,
+                prefix_cache=prefix_cache,
+            )
+        with self.assertRaises(ValueError):
+            static_generate(self.model, self.prompts[0], 4, prefix_cache=prefix_cache, penalty_alpha=0.6, top_k=4)
+
+
+class Int8KVCacheTester(unittest.TestCase):
+    """
+    Unit tests for the int8 key/value cache of BLOOM.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(5)
+        self.input_ids = torch.randint(3, 64, (2, 6), generator=generator)
+
+    def static_inputs(self, max_new_tokens):
+        return {
+            "input_ids": F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            "attention_mask": F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens), value=0),
+            "token_idx": torch.tensor(self.input_ids.shape[-1]),
+            "max_new_tokens": max_new_tokens,
+            "ignore_eos": False,
+        }
+
+    def test_quantize(self):
+        tensor = torch.randn(8, 16, 10)
+        quantized, scale = GaudiBloomInt8KVCache.quantize(tensor, dim=1)
+        self.assertEqual(quantized.dtype, torch.int8)
+        self.assertEqual(scale.shape, (8, 1, 10))
+        # The rounding error is at most half a quantization step
+        self.assertTrue(torch.all((quantized * scale - tensor).abs() <= scale / 2 + 1e-6))
+
+    def test_memory_footprint(self):
+        cache = GaudiBloomInt8KVCache(self.model.config, batch_size=2, max_length=32)
+        head_dim = self.model.config.hidden_size // self.model.config.n_head
+        self.assertEqual(len(cache), self.model.config.n_layer)
+        key, value, key_scale, value_scale = cache[0]
+        self.assertEqual(key.shape, (2 * self.model.config.n_head, head_dim, 32))
+        self.assertEqual(value.shape, (2 * self.model.config.n_head, 32, head_dim))
+        self.assertEqual(key.element_size(), 1)
+        self.assertEqual(value.element_size(), 1)
+
+    def test_greedy_matches_dense_cache(self):
+        max_new_tokens = 8
+        inputs = self.static_inputs(max_new_tokens)
+        expected = self.model.generate(**inputs, do_sample=False, output_scores=True, return_dict_in_generate=True)
+        cache = GaudiBloomInt8KVCache(self.model.config, batch_size=2, max_length=inputs["input_ids"].shape[-1])
+        outputs = self.model.generate(
+            **self.static_inputs(max_new_tokens),
+            do_sample=False,
+            output_scores=True,
+            return_dict_in_generate=True,
+            int8_kv_cache=cache,
+        )
+        self.assertTrue(torch.equal(outputs.sequences, expected.sequences))
+        for scores, expected_scores in zip(outputs.scores, expected.scores):
+            self.assertTrue(torch.allclose(scores, expected_scores, atol=1e-2))
+        # The cache holds the quantized keys of the prompt and of the generated tokens
+        self.assertTrue(torch.any(cache.keys[0][..., -2] != 0))
+
+    def test_beam_search(self):
+        max_new_tokens = 6
+        num_beams = 3
+        inputs = self.static_inputs(max_new_tokens)
+        expected = self.model.generate(**inputs, num_beams=num_beams)
+        cache = GaudiBloomInt8KVCache(
+            self.model.config, batch_size=2 * num_beams, max_length=inputs["input_ids"].shape[-1]
+        )
+        outputs = self.model.generate(**self.static_inputs(max_new_tokens), num_beams=num_beams, int8_kv_cache=cache)
+        self.assertTrue(torch.equal(outputs, expected))
+
+    def test_invalid_usage(self):
+        cache = GaudiBloomInt8KVCache(self.model.config, batch_size=2, max_length=12)
+        with self.assertRaises(ValueError):
+            # The cache relies on token_idx to know where to write
+            self.model(self.input_ids, past_key_values=cache)
+        with self.assertRaises(ValueError):
+            self.model(self.input_ids[:1], past_key_values=cache, token_idx=torch.tensor(6))
+        with self.assertRaises(ValueError):
+            # The verification pass of assisted decoding would write the drafted tokens from position 0
+            cache = GaudiBloomInt8KVCache(self.model.config, batch_size=1, max_length=10)
+            static_generate(self.model, self.input_ids[0], 4, assistant_model=get_tiny_bloom(), int8_kv_cache=cache)
+
+
+class ChunkedPrefillTester(unittest.TestCase):
+    """
+    Unit tests for prefilling the static cache of BLOOM chunk by chunk.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(7)
+        self.input_ids = torch.randint(3, 64, (2, 11), generator=generator)
+        # The first prompt is left-padded
+        self.attention_mask = torch.ones_like(self.input_ids)
+        self.attention_mask[0, :3] = 0
+
+    def generate(self, max_new_tokens=6, **kwargs):
+        return self.model.generate(
+            F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(self.attention_mask, (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(self.input_ids.shape[-1]),
+            max_new_tokens=max_new_tokens,
+            ignore_eos=False,
+            output_scores=True,
+            return_dict_in_generate=True,
+            **kwargs,
+        )
+
+    def test_matches_single_prefill(self):
+        expected = self.generate()
+        for chunk_size in [1, 3, 4, 10, 32]:
+            outputs = self.generate(prefill_chunk_size=chunk_size)
+            self.assertTrue(torch.equal(outputs.sequences, expected.sequences))
+            for scores, expected_scores in zip(outputs.scores, expected.scores):
+                self.assertTrue(torch.allclose(scores, expected_scores, atol=1e-5))
+
+    def test_single_chunk_shape(self):
+        query_lengths = []
+        handle = self.model.transformer.h[0].self_attention.register_forward_hook(
+            lambda module, args, output: query_lengths.append(args[0].shape[1])
+        )
+        try:
+            self.generate(max_new_tokens=3, prefill_chunk_size=4)
+        finally:
+            handle.remove()
+        # 10 tokens are prefilled in 3 chunks of 4 tokens, the last prompt token and the next ones are decoded
+        self.assertEqual(query_lengths, [4, 4, 4, 1, 1, 1])
+
+    def test_invalid_usage(self):
+        with self.assertRaises(ValueError):
+            self.generate(prefill_chunk_size=0)
+        with self.assertRaises(ValueError):
+            cache = GaudiBloomInt8KVCache(self.model.config, batch_size=2, max_length=17)
+            self.generate(prefill_chunk_size=4, int8_kv_cache=cache)
+        with self.assertRaises(ValueError):
+            self.generate(prefill_chunk_size=4, penalty_alpha=0.6, top_k=4)
+        with self.assertRaises(ValueError):
+            static_generate(self.model, self.input_ids[1], 4, prefill_chunk_size=4, assistant_model=get_tiny_bloom())
+
+
+class BloomAlibiCacheTester(unittest.TestCase):
+    """
+    Unit tests for reusing the ALiBi bias of BLOOM across forward calls.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(4)
+        self.input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+
+    def generate_and_count_builds(self, static_shapes, max_new_tokens=6):
+        kwargs = {"max_new_tokens": max_new_tokens, "do_sample": False}
+        if static_shapes:
+            kwargs.update(
+                attention_mask=F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens), value=0),
+                token_idx=torch.tensor(self.input_ids.shape[-1]),
+            )
+            input_ids = F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID)
+        else:
+            input_ids = self.input_ids
+        with mock.patch.object(
+            modeling_bloom, "gaudi_bloom_build_alibi_tensor", wraps=modeling_bloom.gaudi_bloom_build_alibi_tensor
+        ) as build:
+            outputs = self.model.generate(input_ids, **kwargs)
+        return outputs, build.call_count
+
+    def test_built_once_per_shape(self):
+        self.model.transformer._alibi_cache = None
+        outputs, num_builds = self.generate_and_count_builds(static_shapes=True)
+        self.assertEqual(num_builds, 1)
+        # Same shape, the bias is reused
+        self.assertTrue(torch.equal(self.generate_and_count_builds(static_shapes=True)[0], outputs))
+        self.assertEqual(self.generate_and_count_builds(static_shapes=True)[1], 0)
+
+        # Without static shapes, the bias grows geometrically: lengths 5 to 10 need two builds
+        self.model.transformer._alibi_cache = None
+        dynamic_outputs, num_builds = self.generate_and_count_builds(static_shapes=False)
+        self.assertEqual(num_builds, 2)
+        self.assertTrue(torch.equal(dynamic_outputs, outputs[:, : dynamic_outputs.shape[-1]]))
+
+    def test_matches_built_bias(self):
+        transformer = self.model.transformer
+        for batch_size, length in [(2, 7), (2, 3), (3, 7), (2, 12)]:
+            attention_mask = torch.ones(batch_size, length)
+            expected = modeling_bloom.gaudi_bloom_build_alibi_tensor(
+                attention_mask, transformer.alibi_slope, transformer.num_heads, torch.float32
+            )
+            self.assertTrue(torch.equal(transformer._get_alibi(attention_mask, torch.float32), expected))
+
+
+def run_tensor_parallel_bloom(rank, world_size, init_file, results_file):
+    """
+    Compares a tiny BLOOM model sharded across `world_size` CPU processes with the same model on a single process.
+    """
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=world_size)
+    model = get_tiny_bloom()
+    generator = torch.Generator().manual_seed(6)
+    prompt_ids = torch.randint(3, 64, (2, 6), generator=generator)
+    max_new_tokens = 8
+    inputs = {
+        "input_ids": F.pad(prompt_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+        "attention_mask": F.pad(torch.ones_like(prompt_ids), (0, max_new_tokens), value=0),
+        "max_new_tokens": max_new_tokens,
+        "ignore_eos": False,
+    }
+
+    results = {"logits": model(prompt_ids).logits}
+    results["greedy"] = model.generate(**inputs, token_idx=torch.tensor(6), do_sample=False)
+    torch.manual_seed(0)
+    results["sample"] = model.generate(**inputs, token_idx=torch.tensor(6), do_sample=True, top_k=10, top_p=0.9)
+
+    model.shard_for_tensor_parallel()
+    results["sharded_logits"] = model(prompt_ids).logits
+    results["sharded_greedy"] = model.generate(**inputs, token_idx=torch.tensor(6), do_sample=False)
+    # Tokens are drawn by the first rank, whatever the state of the generators of the other ranks
+    torch.manual_seed(rank)
+    results["sharded_sample"] = model.generate(
+        **inputs, token_idx=torch.tensor(6), do_sample=True, top_k=10, top_p=0.9
+    )
+    torch.save(results, f"{results_file}.{rank}")
+    dist.destroy_process_group()
+
+
+class TensorParallelBloomTester(unittest.TestCase):
+    """
+    Unit tests for tensor-parallel BLOOM inference, run with the gloo backend on CPU processes.
+    """
+
+    world_size = 2
+
+    def test_matches_single_process(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_file = os.path.join(tmp_dir, "results")
+            mp.spawn(
+                run_tensor_parallel_bloom,
+                args=(self.world_size, os.path.join(tmp_dir, "init"), results_file),
+                nprocs=self.world_size,
+            )
+            results = [torch.load(f"{results_file}.{rank}") for rank in range(self.world_size)]
+
+        vocab_size = results[0]["logits"].shape[-1]
+        shard_size = vocab_size // self.world_size
+        for rank, rank_results in enumerate(results):
+            # Each rank only has the logits of its slice of the vocabulary
+            self.assertEqual(rank_results["sharded_logits"].shape[-1], shard_size)
+            self.assertTrue(
+                torch.allclose(
+                    rank_results["sharded_logits"],
+                    rank_results["logits"][..., rank * shard_size : (rank + 1) * shard_size],
+                    atol=1e-5,
+                )
+            )
+            self.assertTrue(torch.equal(rank_results["sharded_greedy"], rank_results["greedy"]))
+            self.assertTrue(torch.equal(rank_results["sharded_sample"], results[0]["sample"]))
+
+    def test_invalid_usage(self):
+        model = get_tiny_bloom()
+        with mock.patch.object(dist, "get_rank", return_value=0), mock.patch.object(
+            dist, "get_world_size", return_value=3
+        ):
+            # 4 heads cannot be split across 3 ranks
+            with self.assertRaises(ValueError):
+                model.shard_for_tensor_parallel()
+
+
+class LogitsPositionsTester(unittest.TestCase):
+    """
+    Unit tests for only applying the LM head to the positions whose logits are needed.
+    """
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(11)
+        self.input_ids = torch.randint(3, 64, (2, 6), generator=generator)
+
+    @torch.no_grad()
+    def test_forward(self):
+        for model in [get_tiny_bloom(), get_tiny_gpt2()]:
+            expected = model(self.input_ids).logits
+            for positions in [torch.tensor([5]), torch.tensor([1, 4]), torch.tensor([[3], [5]])]:
+                logits = model(self.input_ids, logits_positions=positions).logits
+                if positions.dim() == 1:
+                    self.assertTrue(torch.allclose(logits, expected[:, positions], atol=1e-6))
+                else:
+                    self.assertTrue(
+                        torch.allclose(logits, expected[torch.arange(2).unsqueeze(-1), positions], atol=1e-6)
+                    )
+            with self.assertRaises(ValueError):
+                model(self.input_ids, labels=self.input_ids, logits_positions=torch.tensor([5]))
+
+    @torch.no_grad()
+    def test_prefill(self):
+        max_new_tokens = 4
+        padded_input_ids = F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID)
+        attention_mask = F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens), value=0)
+        for model in [get_tiny_bloom(), get_tiny_gpt2()]:
+            expected = model(self.input_ids).logits[:, -1]
+            for input_ids, kwargs in [
+                (self.input_ids, {}),
+                (padded_input_ids, {"attention_mask": attention_mask, "token_idx": torch.tensor(6)}),
+                (padded_input_ids, {"attention_mask": attention_mask, "token_idx": torch.tensor([6, 6])}),
+            ]:
+                model_inputs = model.prepare_inputs_for_generation(input_ids, trim_logits=True, **kwargs)
+                logits = model(**model_inputs).logits
+                self.assertEqual(logits.shape, (2, 1, 64))
+                self.assertTrue(torch.allclose(logits[:, -1], expected, atol=1e-5))
+
+            # The scores of the first step are the ones of the last prompt position
+            outputs = model.generate(
+                padded_input_ids,
+                attention_mask=attention_mask,
+                token_idx=torch.tensor(6),
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                return_dict_in_generate=True,
+                output_scores=True,
+            )
+            self.assertTrue(torch.allclose(outputs.scores[0], expected, atol=1e-5))
+
+
+class GPT2StaticKVCacheTester(unittest.TestCase):
+    """
+    Unit tests for the static-shape generation path of GPT-2.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_gpt2()
+        generator = torch.Generator().manual_seed(42)
+        self.input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+        self.attention_mask = torch.ones_like(self.input_ids)
+        # Left padding on the second row
+        self.input_ids[1, :2] = PAD_TOKEN_ID
+        self.attention_mask[1, :2] = 0
+
+    def test_matches_dynamic_generation(self):
+        max_new_tokens = 7
+        kwargs = {"max_new_tokens": max_new_tokens, "do_sample": False, "ignore_eos": False}
+        expected = self.model.generate(self.input_ids, attention_mask=self.attention_mask, **kwargs)
+        outputs = self.model.generate(
+            F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(self.attention_mask, (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(self.input_ids.shape[-1]),
+            **kwargs,
+        )
+
+        self.assertTrue(torch.equal(outputs, expected))
+
+    @torch.no_grad()
+    def test_cache_shape_is_static(self):
+        max_length = 12
+        input_ids = F.pad(self.input_ids, (0, max_length - 5), value=PAD_TOKEN_ID)
+        attention_mask = F.pad(self.attention_mask, (0, max_length - 5), value=0)
+        token_idx = torch.tensor(5)
+
+        outputs = self.model(input_ids, attention_mask=attention_mask, use_cache=True, token_idx=token_idx)
+        past_key_values = outputs.past_key_values
+        cache_shape = past_key_values[0][0].shape
+        self.assertEqual(cache_shape[-2], max_length)
+
+        for _ in range(3):
+            attention_mask.index_fill_(1, token_idx, 1)
+            token_idx = token_idx + 1
+            model_inputs = self.model.prepare_inputs_for_generation(
+                input_ids,
+                past_key_values=past_key_values,
+                attention_mask=attention_mask,
+                token_idx=token_idx,
+                use_cache=True,
+            )
+            outputs = self.model(**model_inputs)
+            self.assertEqual(outputs.logits.shape[-2], 1)
+            # The cache is written in place instead of growing
+            self.assertEqual(outputs.past_key_values[0][0].shape, cache_shape)
+            self.assertEqual(outputs.past_key_values[0][0].data_ptr(), past_key_values[0][0].data_ptr())
+            past_key_values = outputs.past_key_values
+
+
+class AssistedDecodingTester(unittest.TestCase):
+    """
+    Unit tests for speculative decoding with an assistant model.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        torch.manual_seed(1)
+        self.assistant_model = GaudiBloomForCausalLM(self.model.config).eval()
+        generator = torch.Generator().manual_seed(42)
+        self.prompt = torch.randint(3, 64, (6,), generator=generator)
+
+    def test_greedy_matches_static_generation(self):
+        max_new_tokens = 11
+        expected = static_generate(self.model, self.prompt, max_new_tokens)
+        for assistant_model in [self.assistant_model, self.model]:
+            for num_assistant_tokens in [1, 3]:
+                outputs = static_generate(
+                    self.model,
+                    self.prompt,
+                    max_new_tokens,
+                    assistant_model=assistant_model,
+                    num_assistant_tokens=num_assistant_tokens,
+                )
+                self.assertTrue(torch.equal(outputs, expected))
+
+    def test_greedy_gpt2(self):
+        model = get_tiny_gpt2()
+        torch.manual_seed(1)
+        assistant_model = GaudiGPT2LMHeadModel(model.config).eval()
+        expected = static_generate(model, self.prompt, 9)
+        outputs = static_generate(model, self.prompt, 9, assistant_model=assistant_model, num_assistant_tokens=4)
+        self.assertTrue(torch.equal(outputs, expected))
+
+    @torch.no_grad()
+    def test_sampling_matches_target_distribution(self):
+        # A small vocabulary and a large initializer range so that target and assistant distributions are far apart
+        config = BloomConfig(
+            vocab_size=8, hidden_size=32, n_layer=2, n_head=4, pad_token_id=PAD_TOKEN_ID, initializer_range=0.5
+        )
+        torch.manual_seed(1)
+        model = GaudiBloomForCausalLM(config).eval()
+        torch.manual_seed(2)
+        assistant_model = GaudiBloomForCausalLM(config).eval()
+        prompt = torch.tensor([3, 4, 5])
+
+        def second_token_distribution(m):
+            first = torch.softmax(m(prompt.view(1, -1)).logits[0, -1], dim=-1)
+            distribution = torch.zeros(config.vocab_size)
+            for token in range(config.vocab_size):
+                next_logits = m(torch.cat([prompt, torch.tensor([token])]).view(1, -1)).logits[0, -1]
+                distribution += first[token] * torch.softmax(next_logits, dim=-1)
+            return distribution
+
+        expected = second_token_distribution(model)
+        self.assertGreater((expected - second_token_distribution(assistant_model)).abs().sum() / 2, 0.5)
+
+        # The first new token comes from the prefill, the second one is proposed by the assistant
+        torch.manual_seed(0)
+        num_samples = 500
+        counts = torch.zeros(config.vocab_size)
+        for _ in range(num_samples):
+            outputs = model.generate(
+                F.pad(prompt.view(1, -1), (0, 2), value=PAD_TOKEN_ID),
+                attention_mask=F.pad(torch.ones(1, 3, dtype=torch.long), (0, 2), value=0),
+                token_idx=torch.tensor(3),
+                max_new_tokens=2,
+                do_sample=True,
+                top_k=0,
+                ignore_eos=True,
+                assistant_model=assistant_model,
+                num_assistant_tokens=1,
+            )
+            counts[outputs[0, -1]] += 1
+
+        total_variation = (counts / num_samples - expected).abs().sum() / 2
+        self.assertLess(total_variation, 0.1)
+
+    def test_invalid_inputs(self):
+        with self.assertRaises(ValueError):
+            static_generate(self.model, self.prompt, 4, assistant_model=self.assistant_model, num_return_sequences=2)
+        with self.assertRaises(ValueError):
+            self.model.generate(
+                self.prompt.view(1, -1), max_new_tokens=4, assistant_model=self.assistant_model, ignore_eos=False
+            )
+
+
+class StaticBeamSearchTester(unittest.TestCase):
+    """
+    Unit tests for beam search on the static-shape generation path.
+    """
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(3)
+        self.input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+        self.attention_mask = torch.ones_like(self.input_ids)
+        # Left padding on the second row
+        self.input_ids[1, :2] = PAD_TOKEN_ID
+        self.attention_mask[1, :2] = 0
+
+    def check_matches_dynamic_beam_search(self, model, check_eos=True, **kwargs):
+        max_new_tokens = 8
+        # Use a token the model actually generates as EOS so that some hypotheses finish early
+        eos_token_id = model.generate(
+            self.input_ids, attention_mask=self.attention_mask, max_new_tokens=3, do_sample=False
+        )[0, -1].item()
+        kwargs.setdefault("do_sample", False)
+        kwargs.update(
+            max_new_tokens=max_new_tokens,
+            ignore_eos=False,
+            eos_token_id=eos_token_id,
+            return_dict_in_generate=True,
+            output_scores=True,
+        )
+        # Same seed for both runs in case of sampling
+        torch.manual_seed(0)
+        expected = model.generate(self.input_ids, attention_mask=self.attention_mask.clone(), **kwargs)
+        torch.manual_seed(0)
+        outputs = model.generate(
+            F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(self.attention_mask, (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(self.input_ids.shape[-1]),
+            **kwargs,
+        )
+
+        length = expected.sequences.shape[-1]
+        self.assertTrue(torch.equal(outputs.sequences[:, :length], expected.sequences))
+        self.assertTrue(torch.all(outputs.sequences[:, length:] == PAD_TOKEN_ID))
+        self.assertTrue(torch.allclose(outputs.sequences_scores, expected.sequences_scores, atol=1e-5))
+        if check_eos:
+            self.assertTrue(torch.any(outputs.sequences[:, self.input_ids.shape[-1] :] == eos_token_id))
+
+    def test_bloom(self):
+        model = get_tiny_bloom()
+        for early_stopping in [False, True, "never"]:
+            self.check_matches_dynamic_beam_search(
+                model, num_beams=4, num_return_sequences=2, early_stopping=early_stopping
+            )
+
+    def test_gpt2(self):
+        model = get_tiny_gpt2()
+        self.check_matches_dynamic_beam_search(model, num_beams=3, num_return_sequences=3, length_penalty=0.5)
+
+    def test_beam_sample(self):
+        model = get_tiny_bloom()
+        self.check_matches_dynamic_beam_search(model, num_beams=4, num_return_sequences=2, do_sample=True, top_k=10)
+
+    def test_group_beam_search(self):
+        model = get_tiny_bloom()
+        self.check_matches_dynamic_beam_search(
+            model, num_beams=6, num_beam_groups=3, num_return_sequences=3, diversity_penalty=1.0
+        )
+
+    def test_constrained_beam_search(self):
+        model = get_tiny_bloom()
+        # The second phrase starts like the first one so that constraints are reset while in progress
+        self.check_matches_dynamic_beam_search(
+            model, check_eos=False, num_beams=4, num_return_sequences=2, force_words_ids=[[5, 6], [5, 9, 10]]
+        )
+
+    def test_constrained_beam_search_disjunctive_constraint(self):
+        model = get_tiny_bloom()
+        with self.assertRaises(ValueError):
+            model.generate(
+                F.pad(self.input_ids, (0, 4), value=PAD_TOKEN_ID),
+                attention_mask=F.pad(self.attention_mask, (0, 4), value=0),
+                token_idx=torch.tensor(self.input_ids.shape[-1]),
+                max_new_tokens=4,
+                num_beams=2,
+                force_words_ids=[[[5, 6], [7]]],
+            )
+
+    def test_cache_is_reordered_in_place(self):
+        model = get_tiny_bloom()
+        with torch.no_grad():
+            outputs = model(self.input_ids, attention_mask=self.attention_mask, use_cache=True)
+        past_key_values = tuple(tuple(t.clone() for t in layer) for layer in outputs.past_key_values)
+        beam_idx = torch.tensor([1, 1])
+
+        expected = model._reorder_cache(past_key_values, beam_idx)
+        data_ptr = past_key_values[0][0].data_ptr()
+        reordered = model._reorder_static_cache(past_key_values, beam_idx)
+
+        self.assertEqual(reordered[0][0].data_ptr(), data_ptr)
+        for layer, expected_layer in zip(reordered, expected):
+            for past_state, expected_state in zip(layer, expected_layer):
+                self.assertTrue(torch.equal(past_state, expected_state))
+
+
+class StaticContrastiveSearchTester(unittest.TestCase):
+    """
+    Unit tests for contrastive search on the static-shape generation path.
+    """
+
+    def check_matches_dynamic_contrastive_search(self, model):
+        generator = torch.Generator().manual_seed(4)
+        input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+        attention_mask = torch.ones_like(input_ids)
+        input_ids[1, :2] = PAD_TOKEN_ID
+        attention_mask[1, :2] = 0
+        max_new_tokens = 8
+        kwargs = {
+            "max_new_tokens": max_new_tokens,
+            "penalty_alpha": 0.6,
+            "top_k": 4,
+            "return_dict_in_generate": True,
+            "output_scores": True,
+        }
+
+        expected = model.generate(input_ids, attention_mask=attention_mask.clone(), **kwargs)
+        outputs = model.generate(
+            F.pad(input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(attention_mask, (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(input_ids.shape[-1]),
+            **kwargs,
+        )
+
+        self.assertEqual(outputs.sequences.shape, (2, input_ids.shape[-1] + max_new_tokens))
+        self.assertTrue(torch.equal(outputs.sequences, expected.sequences))
+        for scores, expected_scores in zip(outputs.scores, expected.scores):
+            self.assertTrue(torch.allclose(scores, expected_scores, atol=1e-5))
+
+    def test_bloom(self):
+        self.check_matches_dynamic_contrastive_search(get_tiny_bloom())
+
+    def test_gpt2(self):
+        self.check_matches_dynamic_contrastive_search(get_tiny_gpt2())
+
+    def test_unsupported_caches(self):
+        model = get_tiny_bloom()
+        input_ids = torch.randint(3, 64, (5,), generator=torch.Generator().manual_seed(4))
+        paged_kv_cache = GaudiBloomPagedKVCache(model.config, num_blocks=4, block_size=4, batch_size=1, max_length=12)
+        paged_kv_cache.allocate(0, 12)
+        with self.assertRaises(ValueError):
+            static_generate(model, input_ids, 7, penalty_alpha=0.6, top_k=3, paged_kv_cache=paged_kv_cache)
+        with self.assertRaises(ValueError):
+            model.generate(
+                input_ids.view(1, -1),
+                max_new_tokens=7,
+                penalty_alpha=0.6,
+                top_k=3,
+                past_key_values=GaudiSinkKVCache(model.config, batch_size=1, window_size=16),
+            )
+
+
+class StaticLogitsProcessorsTester(unittest.TestCase):
+    """
+    Unit tests for the logits processors of the static-shape generation path.
+    """
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(5)
+        self.input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+        self.attention_mask = torch.ones_like(self.input_ids)
+        self.input_ids[1, :2] = PAD_TOKEN_ID
+        self.attention_mask[1, :2] = 0
+
+    def test_processors_ignore_padding(self):
+        generator = torch.Generator().manual_seed(6)
+        # Few distinct tokens so that n-grams are repeated
+        input_ids = torch.randint(3, 6, (3, 12), generator=generator)
+        scores = torch.randn(3, 64, generator=generator)
+        padded_input_ids = F.pad(input_ids, (0, 4), value=PAD_TOKEN_ID)
+        for token_idx in [torch.tensor(12), torch.tensor([12, 12, 12])]:
+            for processor, expected_processor in [
+                (StaticRepetitionPenaltyLogitsProcessor(1.5, token_idx), RepetitionPenaltyLogitsProcessor(1.5)),
+                (StaticNoRepeatNGramLogitsProcessor(1, token_idx), NoRepeatNGramLogitsProcessor(1)),
+                (StaticNoRepeatNGramLogitsProcessor(3, token_idx), NoRepeatNGramLogitsProcessor(3)),
+            ]:
+                expected = expected_processor(input_ids, scores.clone())
+                self.assertTrue(torch.equal(processor(padded_input_ids, scores.clone()), expected))
+
+    def check_matches_dynamic_generation(self, model, **kwargs):
+        max_new_tokens = 8
+        # Use the first generated token as EOS so that the minimum length matters
+        eos_token_id = model.generate(
+            self.input_ids, attention_mask=self.attention_mask, max_new_tokens=1, do_sample=False
+        )[0, -1].item()
+        kwargs.update(
+            max_new_tokens=max_new_tokens,
+            eos_token_id=eos_token_id,
+            ignore_eos=False,
+            return_dict_in_generate=True,
+            output_scores=True,
+        )
+        expected = model.generate(self.input_ids, attention_mask=self.attention_mask.clone(), **kwargs)
+        outputs = model.generate(
+            F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(self.attention_mask, (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(self.input_ids.shape[-1]),
+            **kwargs,
+        )
+
+        length = expected.sequences.shape[-1]
+        self.assertTrue(torch.equal(outputs.sequences[:, :length], expected.sequences))
+        for scores, expected_scores in zip(outputs.scores, expected.scores):
+            self.assertTrue(torch.allclose(scores, expected_scores, atol=1e-5))
+
+    def test_greedy_search(self):
+        model = get_tiny_bloom()
+        self.check_matches_dynamic_generation(model, repetition_penalty=1.3, min_new_tokens=3)
+        self.check_matches_dynamic_generation(model, no_repeat_ngram_size=2, min_length=8)
+
+    def test_beam_search(self):
+        model = get_tiny_gpt2()
+        self.check_matches_dynamic_generation(
+            model, num_beams=3, repetition_penalty=1.3, no_repeat_ngram_size=2, min_new_tokens=3
+        )
+
+    def test_contrastive_search(self):
+        model = get_tiny_bloom()
+        self.check_matches_dynamic_generation(
+            model, penalty_alpha=0.6, top_k=4, repetition_penalty=1.3, no_repeat_ngram_size=2, min_length=8
+        )
+
+
+class StaticTopKTopPSamplerTester(unittest.TestCase):
+    """
+    Unit tests for the fused sampling stage of the static-shape generation path.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(7)
+        self.input_ids = torch.randint(3, 64, (1, 5), generator=generator)
+
+    def sample(self, input_ids, max_new_tokens=6, **kwargs):
+        return self.model.generate(
+            F.pad(input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(torch.ones_like(input_ids), (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(input_ids.shape[-1]),
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            **kwargs,
+        )
+
+    def test_matches_logits_warpers(self):
+        scores = torch.randn(4, 64, generator=torch.Generator().manual_seed(8))
+        sampler = StaticTopKTopPSampler(top_k=10, top_p=0.7, temperature=0.8)
+        warpers = LogitsProcessorList([TemperatureLogitsWarper(0.8), TopKLogitsWarper(10), TopPLogitsWarper(0.7)])
+
+        expected = warpers(None, scores.clone())
+        top_scores, top_ids = sampler.warp(scores)
+        outputs = sampler.scatter(top_scores, top_ids, scores.shape[-1])
+
+        self.assertTrue(torch.equal(torch.isinf(outputs), torch.isinf(expected)))
+        self.assertTrue(torch.allclose(outputs[~torch.isinf(outputs)], expected[~torch.isinf(expected)]))
+        for _ in range(10):
+            next_tokens = sampler.sample(top_scores, top_ids)
+            self.assertFalse(torch.any(torch.isinf(expected.gather(1, next_tokens.unsqueeze(-1)))))
+
+    def test_top_k_one_is_greedy(self):
+        expected = static_generate(self.model, self.input_ids[0], 6)
+        self.assertTrue(torch.equal(self.sample(self.input_ids, top_k=1), expected))
+
+    def test_per_sequence_generators(self):
+        input_ids = self.input_ids.repeat(2, 1)
+        kwargs = {"top_k": 20, "temperature": 2.0, "output_scores": True, "return_dict_in_generate": True}
+        outputs = self.sample(input_ids, generators=[torch.Generator().manual_seed(i) for i in [1, 1]], **kwargs)
+        self.assertTrue(torch.equal(outputs.sequences[0], outputs.sequences[1]))
+        self.assertEqual(outputs.scores[0].shape, (2, 64))
+
+        # A sequence only depends on its own generator
+        other_outputs = self.sample(input_ids, generators=[torch.Generator().manual_seed(i) for i in [1, 2]], **kwargs)
+        self.assertTrue(torch.equal(other_outputs.sequences[0], outputs.sequences[0]))
+
+    def test_invalid_generators(self):
+        with self.assertRaises(ValueError):
+            self.sample(self.input_ids, top_k=20, generators=[torch.Generator(), torch.Generator()])
+        with self.assertRaises(ValueError):
+            self.model.generate(
+                self.input_ids, max_new_tokens=2, do_sample=True, top_k=20, generators=[torch.Generator()]
+            )
+
+
+class BatchSamplingParamsTester(unittest.TestCase):
+    """
+    Unit tests for sampling parameters given per sequence.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(7)
+        self.input_ids = torch.randint(3, 64, (3, 5), generator=generator)
+        self.params = {
+            "temperature": [0.5, 1.0, 2.0],
+            "top_k": [1, 5, 30],
+            "top_p": [1.0, 0.9, 0.5],
+            "seed": [0, 1, 2],
+            "max_new_tokens": [8, 3, 5],
+        }
+
+    def sample(self, input_ids, sampling_params, **kwargs):
+        max_new_tokens = 8
+        return self.model.generate(
+            F.pad(input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(torch.ones_like(input_ids), (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(input_ids.shape[-1]),
+            do_sample=True,
+            sampling_params=sampling_params,
+            **kwargs,
+        )
+
+    def test_warp_matches_per_sequence_samplers(self):
+        scores = torch.randn(3, 64, generator=torch.Generator().manual_seed(8))
+        sampler = StaticTopKTopPSampler(
+            top_k=torch.tensor(self.params["top_k"]),
+            top_p=torch.tensor(self.params["top_p"]),
+            temperature=torch.tensor(self.params["temperature"]),
+        )
+        outputs = sampler.scatter(*sampler.warp(scores), scores.shape[-1])
+        for i in range(scores.shape[0]):
+            row_sampler = StaticTopKTopPSampler(
+                top_k=self.params["top_k"][i], top_p=self.params["top_p"][i], temperature=self.params["temperature"][i]
+            )
+            expected = row_sampler.scatter(*row_sampler.warp(scores[i : i + 1]), scores.shape[-1])
+            self.assertTrue(torch.allclose(outputs[i : i + 1], expected))
+
+    def test_matches_one_sequence_per_call(self):
+        outputs = self.sample(self.input_ids, BatchSamplingParams(**self.params))
+        for i in range(self.input_ids.shape[0]):
+            row_params = BatchSamplingParams(**{name: values[i : i + 1] for name, values in self.params.items()})
+            self.assertTrue(torch.equal(self.sample(self.input_ids[i : i + 1], row_params)[0], outputs[i]))
+
+        # Each sequence stops after its own number of new tokens, top-k 1 is greedy
+        num_new_tokens = (outputs[:, self.input_ids.shape[-1] :] != PAD_TOKEN_ID).sum(dim=-1)
+        self.assertEqual(num_new_tokens.tolist(), self.params["max_new_tokens"])
+        self.assertTrue(torch.equal(outputs[0], static_generate(self.model, self.input_ids[0], 8)[0]))
+
+    def test_defaults_from_generation_config(self):
+        params = BatchSamplingParams(top_k=[1, 1, 1])
+        outputs = self.sample(self.input_ids, params, max_new_tokens=4, temperature=3.0)
+        for i in range(self.input_ids.shape[0]):
+            self.assertTrue(torch.equal(outputs[i, :9], static_generate(self.model, self.input_ids[i], 4)[0]))
+
+    def test_batch_compaction(self):
+        compaction = BatchCompaction()
+        outputs = self.sample(self.input_ids, BatchSamplingParams(**self.params), batch_compaction=compaction)
+        self.assertTrue(torch.equal(outputs, self.sample(self.input_ids, BatchSamplingParams(**self.params))))
+        self.assertEqual(compaction.batch_sizes_history, [3, 1])
+
+    def test_invalid_usage(self):
+        with self.assertRaises(ValueError):
+            BatchSamplingParams(top_k=[1, 2], temperature=[1.0])
+        with self.assertRaises(ValueError):
+            BatchSamplingParams(max_new_tokens=[0, 2])
+        with self.assertRaises(ValueError):
+            self.sample(self.input_ids, BatchSamplingParams(top_k=[1, 2]))
+        with self.assertRaises(ValueError):
+            self.sample(self.input_ids, BatchSamplingParams(top_k=[1, 0, 2]))
+        with self.assertRaises(ValueError):
+            self.sample(self.input_ids, BatchSamplingParams(seed=[0, 1, 2]), generators=[torch.Generator()] * 3)
+        with self.assertRaises(ValueError):
+            self.model.generate(
+                self.input_ids, max_new_tokens=2, do_sample=True, sampling_params=BatchSamplingParams(top_k=[1, 2, 3])
+            )
+
+
+class LogprobsBufferTester(unittest.TestCase):
+    """
+    Unit tests for writing the log-probabilities of the generated tokens into preallocated buffers.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(9)
+        self.input_ids = torch.randint(3, 64, (2, 5), generator=generator)
+
+    def generate(self, static_shapes, max_new_tokens=6, **kwargs):
+        kwargs.update(max_new_tokens=max_new_tokens, return_dict_in_generate=True, output_scores=True)
+        if not static_shapes:
+            return self.model.generate(self.input_ids, **kwargs)
+        return self.model.generate(
+            F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+            attention_mask=F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens), value=0),
+            token_idx=torch.tensor(self.input_ids.shape[-1]),
+            **kwargs,
+        )
+
+    def check_matches_scores(self, logprobs, outputs):
+        prompt_length = self.input_ids.shape[-1]
+        num_tokens = len(outputs.scores)
+        self.assertEqual(logprobs.token_logprobs.shape, (self.input_ids.shape[0], num_tokens))
+        for step, scores in enumerate(outputs.scores):
+            expected = torch.log_softmax(scores, dim=-1)
+            next_tokens = outputs.sequences[:, prompt_length + step]
+            self.assertTrue(
+                torch.allclose(logprobs.token_logprobs[:, step], expected.gather(1, next_tokens.unsqueeze(-1))[:, 0])
+            )
+            expected_top_logprobs = torch.topk(expected, logprobs.num_top_logprobs, dim=-1).values
+            self.assertTrue(torch.allclose(logprobs.top_logprobs[:, step], expected_top_logprobs))
+            self.assertTrue(
+                torch.allclose(expected.gather(1, logprobs.top_token_ids[:, step]), logprobs.top_logprobs[:, step])
+            )
+
+    def test_greedy_and_contrastive_search(self):
+        for kwargs in [{"do_sample": False, "repetition_penalty": 1.3}, {"penalty_alpha": 0.6, "top_k": 4}]:
+            for static_shapes in [False, True]:
+                logprobs = LogprobsBuffer(num_top_logprobs=3)
+                outputs = self.generate(static_shapes, logprobs=logprobs, **kwargs)
+                self.check_matches_scores(logprobs, outputs)
+                # Greedy tokens have the highest log-probability
+                if "penalty_alpha" not in kwargs:
+                    self.assertTrue(torch.equal(logprobs.token_logprobs, logprobs.top_logprobs[..., 0]))
+
+    def test_sample(self):
+        generators = [torch.Generator().manual_seed(i) for i in range(2)]
+        for static_shapes, kwargs in [(False, {}), (True, {"generators": generators})]:
+            logprobs = LogprobsBuffer(num_top_logprobs=6)
+            outputs = self.generate(static_shapes, do_sample=True, top_k=4, logprobs=logprobs, **kwargs)
+            # Only 4 tokens can be sampled
+            self.assertTrue(torch.all(torch.isinf(logprobs.top_logprobs[..., 4:])))
+            logprobs.num_top_logprobs = 4
+            logprobs.top_logprobs = logprobs.top_logprobs[..., :4]
+            logprobs.top_token_ids = logprobs.top_token_ids[..., :4]
+            self.check_matches_scores(logprobs, outputs)
+
+    def test_reuse_and_early_stop(self):
+        logprobs = LogprobsBuffer()
+        self.generate(False, max_new_tokens=3, do_sample=False, logprobs=logprobs)
+        eos_token_id = self.model.generate(self.input_ids[:1], max_new_tokens=1, do_sample=False)[0, -1].item()
+        outputs = self.model.generate(
+            self.input_ids[:1], max_new_tokens=4, do_sample=False, eos_token_id=eos_token_id, logprobs=logprobs
+        )
+        self.assertEqual(outputs.shape[-1], self.input_ids.shape[-1] + 1)
+        self.assertEqual(logprobs.token_logprobs.shape, (1, 4))
+        self.assertTrue(torch.all(logprobs.token_logprobs[:, 1:] == 0))
+
+    def test_unsupported_modes(self):
+        with self.assertRaises(ValueError):
+            self.model.generate(self.input_ids, max_new_tokens=2, num_beams=2, logprobs=LogprobsBuffer())
+        with self.assertRaises(ValueError):
+            LogprobsBuffer(num_top_logprobs=-1)
+
+
+class EosAfterBudgetLogitsProcessor(LogitsProcessor):
+    """
+    Forces the end of each sequence after a number of new tokens that only depends on its first prompt token, so that
+    sequences finish at different steps whatever their position in the batch.
+    """
+
+    def __init__(self, prompt_length):
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        scores = scores.clone()
+        scores[:, PAD_TOKEN_ID] = -float("inf")
+        num_new_tokens = (input_ids != PAD_TOKEN_ID).sum(dim=-1) - self.prompt_length
+        finished = num_new_tokens >= input_ids[:, 0] % 6 + 1
+        scores[finished] = -float("inf")
+        scores[finished, EOS_TOKEN_ID] = 0
+        return scores
+
+
+class BatchCompactionTester(unittest.TestCase):
+    """
+    Unit tests for shrinking the batch as sequences finish.
+    """
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(8)
+        self.input_ids = torch.randint(3, 64, (8, 5), generator=generator)
+
+    def generate(self, model, static_shapes, max_new_tokens=10, **kwargs):
+        kwargs["logits_processor"] = LogitsProcessorList([EosAfterBudgetLogitsProcessor(self.input_ids.shape[-1])])
+        if static_shapes:
+            return model.generate(
+                F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID),
+                attention_mask=F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens), value=0),
+                token_idx=torch.tensor(self.input_ids.shape[-1]),
+                max_new_tokens=max_new_tokens,
+                ignore_eos=False,
+                **kwargs,
+            )
+        return model.generate(self.input_ids, max_new_tokens=max_new_tokens, **kwargs)
+
+    def test_get_batch_size(self):
+        self.assertEqual(BatchCompaction().get_batch_size(5, 8), 8)
+        self.assertEqual(BatchCompaction().get_batch_size(4, 8), 4)
+        self.assertEqual(BatchCompaction(threshold=0.25).get_batch_size(3, 8), 8)
+        compaction = BatchCompaction(batch_sizes=[2, 4, 8])
+        self.assertEqual(compaction.get_batch_size(5, 8), 8)
+        self.assertEqual(compaction.get_batch_size(3, 8), 4)
+        self.assertEqual(compaction.get_batch_size(3, 4), 4)
+        self.assertEqual(compaction.get_batch_size(1, 4), 2)
+
+    def test_greedy_matches_full_batch(self):
+        for get_model in [get_tiny_bloom, get_tiny_gpt2]:
+            model = get_model()
+            for static_shapes in [True, False]:
+                with self.subTest(model=model.__class__.__name__, static_shapes=static_shapes):
+                    expected = self.generate(model, static_shapes)
+                    compaction = BatchCompaction(batch_sizes=[2, 4, 8]) if static_shapes else BatchCompaction()
+                    outputs = self.generate(model, static_shapes, batch_compaction=compaction)
+                    self.assertTrue(torch.equal(outputs, expected))
+                    self.assertEqual(compaction.batch_sizes_history, [8, 4, 2] if static_shapes else [8, 4, 1])
+
+    def test_sample_with_generators(self):
+        # With one generator per sequence, the tokens drawn for a sequence do not depend on its row
+        model = get_tiny_bloom()
+
+        def sample(**kwargs):
+            generators = [torch.Generator().manual_seed(i) for i in range(self.input_ids.shape[0])]
+            return self.generate(model, True, do_sample=True, top_k=20, generators=generators, **kwargs)
+
+        for lazy_mode in [False, True]:
+            with self.subTest(lazy_mode=lazy_mode):
+                compaction = BatchCompaction(batch_sizes=[2, 4])
+                outputs = sample(batch_compaction=compaction, lazy_mode=lazy_mode)
+                self.assertTrue(torch.equal(outputs, sample(lazy_mode=lazy_mode)))
+                self.assertGreater(len(compaction.batch_sizes_history), 1)
+
+    def test_invalid_usage(self):
+        model = get_tiny_bloom()
+        with self.assertRaises(ValueError):
+            self.generate(model, True, num_beams=2, batch_compaction=BatchCompaction())
+        with self.assertRaises(ValueError):
+            self.generate(
+                model, True, output_scores=True, return_dict_in_generate=True, batch_compaction=BatchCompaction()
+            )
+        with self.assertRaises(ValueError):
+            BatchCompaction(threshold=0.0)
+
+        max_length = self.input_ids.shape[-1] + 10
+        int8_kv_cache = GaudiBloomInt8KVCache(model.config, batch_size=8, max_length=max_length)
+        with self.assertRaises(ValueError):
+            self.generate(model, True, int8_kv_cache=int8_kv_cache, batch_compaction=BatchCompaction())
+        # Rejected before the first forward pass
+        self.assertTrue(torch.all(int8_kv_cache.keys[0] == 0))
+        paged_kv_cache = GaudiBloomPagedKVCache(
+            model.config, num_blocks=33, block_size=4, batch_size=8, max_length=max_length
+        )
+        for row in range(8):
+            paged_kv_cache.allocate(row, max_length)
+        with self.assertRaises(ValueError):
+            self.generate(model, True, paged_kv_cache=paged_kv_cache, batch_compaction=BatchCompaction())
+        with self.assertRaises(ValueError):
+            self.generate(
+                model,
+                False,
+                past_key_values=GaudiSinkKVCache(model.config, batch_size=8, window_size=16),
+                batch_compaction=BatchCompaction(),
+            )
+
+
+# Text of the tokens of the tiny models, the padding, unknown and end-of-sequence tokens are never generated
+CONSTRAINT_VOCABULARY = (
+    [None, None, None]
+    + list("0123456789abcdefghijklmnopqrstuvwxyz")
+    + ["{", "}", '"', ":", ",", " ", "[", "]", "true", "false", "null", '"tag":', "ab", "12", "-"]
+)
+CONSTRAINT_VOCABULARY += ["?"] * (64 - len(CONSTRAINT_VOCABULARY))
+
+
+class TokenConstraintFSMTester(unittest.TestCase):
+    """
+    Unit tests for constraining generation with token-level state machines of regular expressions and JSON schemas.
+    """
+
+    def setUp(self):
+        self.schema = {
+            "type": "object",
+            "properties": {"ok": {"type": "boolean"}, "tag": {"type": "string", "maxLength": 3}},
+            "required": ["tag"],
+        }
+        self.regex = json_schema_to_regex(self.schema)
+        self.fsm = TokenConstraintFSM.from_json_schema(self.schema, CONSTRAINT_VOCABULARY, eos_token_id=EOS_TOKEN_ID)
+        generator = torch.Generator().manual_seed(1)
+        self.input_ids = torch.randint(3, 64, (4, 5), generator=generator)
+
+    def decode(self, token_ids):
+        """
+        Returns the text of the generated tokens up to the end-of-sequence token, or `None` if there is none.
+        """
+        text = ""
+        for token_id in token_ids[self.input_ids.shape[-1] :].tolist():
+            if token_id == EOS_TOKEN_ID:
+                return text
+            text += CONSTRAINT_VOCABULARY[token_id] or ""
+        return None
+
+    def test_json_schema_to_regex(self):
+        for document in ['{"tag":"ab"}', '{"ok":true, "tag":"abc"}', '{ "tag":"" }']:
+            self.assertIsNotNone(re.fullmatch(self.regex, document))
+        for document in ['{"ok":true}', '{"tag":"abcd"}', '{"tag":"a",}', '{"tag":"a","ok":true}']:
+            self.assertIsNone(re.fullmatch(self.regex, document))
+
+        schema = {"type": "array", "items": {"anyOf": [{"type": "integer"}, {"enum": ["a", None]}]}, "maxItems": 2}
+        regex = json_schema_to_regex(schema)
+        for document in ["[]", '[-12, "a"]', "[null]"]:
+            self.assertIsNotNone(re.fullmatch(regex, document))
+        for document in ["[1,2,3]", '["b"]', "[01]"]:
+            self.assertIsNone(re.fullmatch(regex, document))
+
+    def test_tables(self):
+        # Any path through the tables ends with a text matching the schema
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(50):
+            states, text = torch.zeros(1, dtype=torch.long), ""
+            while True:
+                allowed_tokens = self.fsm.allowed_tokens[states[0]].nonzero().view(-1)
+                token = allowed_tokens[torch.randint(len(allowed_tokens), (1,), generator=generator)]
+                if token.item() == EOS_TOKEN_ID:
+                    break
+                text += CONSTRAINT_VOCABULARY[token.item()]
+                states = self.fsm.advance(states, token)
+            self.assertIsNotNone(re.fullmatch(self.regex, text))
+            self.assertIn("tag", json.loads(text))
+
+        # Only the end-of-sequence token can follow the end-of-sequence token
+        end_state = self.fsm.advance(states, token)
+        self.assertEqual(self.fsm.allowed_tokens[end_state[0]].nonzero().view(-1).tolist(), [EOS_TOKEN_ID])
+
+    def test_regex(self):
+        fsm = TokenConstraintFSM.from_regex(r"(?:ab|[0-9])+-\d{2}", CONSTRAINT_VOCABULARY, eos_token_id=EOS_TOKEN_ID)
+        scores = torch.zeros(2, 64)
+        masked_scores = fsm.mask(scores, fsm.initial_states(2, scores.device))
+        allowed_ids = torch.isfinite(masked_scores[0]).nonzero().view(-1).tolist()
+        # "a" is allowed as the first character of "ab"
+        self.assertEqual(
+            sorted(CONSTRAINT_VOCABULARY[token_id] for token_id in allowed_ids),
+            sorted(list("0123456789") + ["12", "a", "ab"]),
+        )
+
+    def test_generate(self):
+        for get_model in [get_tiny_bloom, get_tiny_gpt2]:
+            model = get_model()
+            for static_shapes in [True, False]:
+                for kwargs in [{}, {"do_sample": True}, {"batch_compaction": BatchCompaction()}]:
+                    with self.subTest(model=model.__class__.__name__, static_shapes=static_shapes, **kwargs):
+                        max_new_tokens = 40
+                        if static_shapes:
+                            kwargs["token_idx"] = torch.tensor(self.input_ids.shape[-1])
+                            kwargs["ignore_eos"] = False
+                            input_ids = F.pad(self.input_ids, (0, max_new_tokens), value=PAD_TOKEN_ID)
+                            kwargs["attention_mask"] = F.pad(torch.ones_like(self.input_ids), (0, max_new_tokens))
+                        else:
+                            input_ids = self.input_ids
+                        outputs = model.generate(
+                            input_ids, max_new_tokens=max_new_tokens, token_constraint=self.fsm, **kwargs
+                        )
+                        for token_ids in outputs:
+                            text = self.decode(token_ids)
+                            self.assertIsNotNone(text)
+                            self.assertIsNotNone(re.fullmatch(self.regex, text))
+
+    def test_cache(self):
+        fsm = TokenConstraintFSM.from_json_schema(json.dumps(self.schema), CONSTRAINT_VOCABULARY, EOS_TOKEN_ID)
+        self.assertIs(fsm, self.fsm)
+        self.assertIs(fsm.to("cpu"), fsm)
+        other_vocabulary = CONSTRAINT_VOCABULARY[:-1] + ["!"]
+        self.assertIsNot(TokenConstraintFSM.from_json_schema(self.schema, other_vocabulary, EOS_TOKEN_ID), fsm)
+
+    def test_invalid_usage(self):
+        with self.assertRaises(ValueError):
+            TokenConstraintFSM.from_regex("(?=a)b", CONSTRAINT_VOCABULARY, eos_token_id=EOS_TOKEN_ID)
+        with self.assertRaises(ValueError):
+            # No token starts with an uppercase letter
+            TokenConstraintFSM.from_regex("[A-Z]+", CONSTRAINT_VOCABULARY, eos_token_id=EOS_TOKEN_ID)
+        with self.assertRaises(ValueError):
+            json_schema_to_regex({"type": "object"})
+        with self.assertRaises(ValueError):
+            get_tiny_bloom().generate(self.input_ids, max_new_tokens=2, num_beams=2, token_constraint=self.fsm)
+
+
+class EosCheckIntervalTester(unittest.TestCase):
+    """
+    Unit tests for checking finished sequences every few steps.
+    """
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(42)
+        self.input_ids = torch.randint(3, 64, (1, 5), generator=generator)
+        # The first generated token is used as EOS so that the sequence is finished after one step
+        self.eos_token_id = self.model.generate(self.input_ids, max_new_tokens=1, do_sample=False)[0, -1].item()
+
+    def test_stops_at_next_check(self):
+        for do_sample in [False, True]:
+            kwargs = {"max_new_tokens": 10, "eos_token_id": self.eos_token_id, "do_sample": do_sample, "top_k": 1}
+            expected = self.model.generate(self.input_ids, **kwargs)
+            outputs = self.model.generate(self.input_ids, eos_check_interval=3, **kwargs)
+
+            self.assertEqual(expected.shape[-1], self.input_ids.shape[-1] + 1)
+            # Generation stops at the first check after all sequences are finished, finished sequences are padded
+            self.assertEqual(outputs.shape[-1], self.input_ids.shape[-1] + 3)
+            self.assertTrue(torch.equal(outputs[:, : expected.shape[-1]], expected))
+            self.assertTrue(torch.all(outputs[:, expected.shape[-1] :] == PAD_TOKEN_ID))
+
+    def test_ignore_eos(self):
+        with self.assertRaises(ValueError):
+            self.model.generate(self.input_ids, max_new_tokens=4, ignore_eos=True, eos_check_interval=2)
+
+
+class AsyncTokenStreamerTester(unittest.TestCase):
+    """
+    Unit tests for the streamer buffering tokens on device.
+    """
+
+    class SpaceTokenizer:
+        """
+        Decodes token `i` as the word `w{i}` followed by a space.
+        """
+
+        def decode(self, token_ids, **kwargs):
+            return "".join(f"w{token_id} " for token_id in token_ids)
+
+    def setUp(self):
+        self.model = get_tiny_bloom()
+        generator = torch.Generator().manual_seed(5)
+        self.input_ids = torch.randint(3, 64, (2, 4), generator=generator)
+
+    def generate_in_thread(self, streamer, max_new_tokens):
+        outputs = {}
+
+        def run():
+            outputs["sequences"] = self.model.generate(
+                self.input_ids, max_new_tokens=max_new_tokens, do_sample=False, streamer=streamer
+            )
+
+        thread = Thread(target=run)
+        thread.start()
+        chunks = list(streamer)
+        thread.join()
+        return outputs["sequences"], chunks
+
+    def test_token_chunks(self):
+        streamer = AsyncTokenStreamer(chunk_size=3, skip_prompt=True)
+        sequences, chunks = self.generate_in_thread(streamer, max_new_tokens=7)
+
+        # Two full chunks and the remaining step, flushed at the end
+        self.assertEqual([chunk.shape for chunk in chunks], [(2, 3), (2, 3), (2, 1)])
+        self.assertTrue(torch.equal(torch.cat(chunks, dim=-1), sequences[:, self.input_ids.shape[-1] :]))
+
+    def test_prompt_and_reuse(self):
+        streamer = AsyncTokenStreamer(chunk_size=4)
+        for _ in range(2):
+            sequences, chunks = self.generate_in_thread(streamer, max_new_tokens=5)
+            self.assertTrue(torch.equal(chunks[0], self.input_ids))
+            self.assertTrue(torch.equal(torch.cat(chunks, dim=-1), sequences))
+
+    def test_incremental_detokenization(self):
+        streamer = AsyncTokenStreamer(tokenizer=self.SpaceTokenizer(), chunk_size=2, skip_prompt=True)
+        sequences, chunks = self.generate_in_thread(streamer, max_new_tokens=5)
+
+        self.assertTrue(all(len(texts) == 2 for texts in chunks))
+        for i, row in enumerate(sequences[:, self.input_ids.shape[-1] :].tolist()):
+            self.assertEqual("".join(texts[i] for texts in chunks), self.SpaceTokenizer().decode(row))
+
+
+class GenerationLatencyBenchmarkTester(unittest.TestCase):
+    """
+    Unit tests for the latency benchmark replaying request traces.
+    """
+
+    def test_sample_request_trace(self):
+        requests = sample_request_trace(8, prompt_length=(4, 8), max_new_tokens=3, request_rate=100.0, seed=1)
+        self.assertEqual(len(requests), 8)
+        self.assertTrue(all(4 <= r.prompt_length <= 8 and r.max_new_tokens == 3 for r in requests))
+        arrival_times = [r.arrival_time for r in requests]
+        self.assertEqual(arrival_times, sorted(arrival_times))
+        self.assertEqual(requests, sample_request_trace(8, (4, 8), 3, request_rate=100.0, seed=1))
+
+        requests = sample_request_trace(4, 5, 3, request_rate=10.0, arrival_process="constant")
+        for i, request in enumerate(requests):
+            self.assertAlmostEqual(request.arrival_time, i / 10.0)
+
+    def test_run(self):
+        requests = sample_request_trace(4, prompt_length=(3, 6), max_new_tokens=(2, 4), request_rate=1000.0)
+        for model in [get_tiny_bloom(), get_tiny_gpt2()]:
+            for shape_buckets in [None, GenerationShapeBuckets([8])]:
+                results = GenerationLatencyBenchmark(model, requests, shape_buckets=shape_buckets).run()
+
+                self.assertEqual(results["num_requests"], 4)
+                self.assertEqual(
+                    [r["num_generated_tokens"] for r in results["requests"]], [r.max_new_tokens for r in requests]
+                )
+                self.assertEqual(results["num_generated_tokens"], sum(r.max_new_tokens for r in requests))
+                self.assertGreaterEqual(results["graph_compilation_time"], 0.0)
+                for metric in ["time_to_first_token", "inter_token_latency", "end_to_end_latency"]:
+                    percentiles = results[metric]
+                    self.assertEqual(list(percentiles.keys()), ["p50", "p90", "p99"])
+                    self.assertTrue(0.0 <= percentiles["p50"] <= percentiles["p90"] <= percentiles["p99"])
+
+    def test_save_and_load(self):
+        requests = sample_request_trace(2, prompt_length=4, max_new_tokens=2)
+        results = GenerationLatencyBenchmark(get_tiny_bloom(), requests).run()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_path = os.path.join(tmp_dir, "latency.json")
+            GenerationLatencyBenchmark.save(results, results_path, name="bloom")
+            GenerationLatencyBenchmark.save(results, results_path, name="bloom_2")
+            with open(results_path) as f:
+                content = json.load(f)
+            self.assertEqual(list(content.keys()), ["bloom", "bloom_2"])
+            self.assertEqual(content["bloom"]["num_generated_tokens"], 4)
+
+            trace_path = os.path.join(tmp_dir, "trace.json")
+            with open(trace_path, "w") as f:
+                json.dump([vars(r) for r in reversed(requests)], f)
+            self.assertEqual(load_request_trace(trace_path), requests)
+
+
+class SinkKVCacheTester(unittest.TestCase):
+    """
+    Unit tests for the rolling key/value cache with attention sinks and the streaming generation session.
+    """
+
+    prompt = torch.tensor([[5, 9, 13, 7, 21, 30, 11]])
+
+    def test_matches_static_generation_before_wrap(self):
+        for model in [get_tiny_bloom(), get_tiny_gpt2()]:
+            expected = static_generate(model, self.prompt[0], 12, eos_token_id=None)
+            cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=24, num_sink_tokens=4)
+            session = StreamingGenerationSession(model, cache, eos_token_id=63)
+            outputs = session.generate(self.prompt, max_new_tokens=12)
+
+            self.assertTrue(torch.equal(outputs[0], expected[0, self.prompt.shape[-1] :]))
+            # The last generated token is written into the cache by the next call
+            self.assertEqual(session.num_tokens, self.prompt.shape[-1] + 11)
+
+    def test_alibi_positions_after_wrap(self):
+        # With a single layer, the keys and values only depend on their token, so each step should match a forward
+        # pass without cache over the sinks and the window
+        torch.manual_seed(0)
+        config = BloomConfig(vocab_size=64, hidden_size=32, n_layer=1, n_head=4, pad_token_id=PAD_TOKEN_ID)
+        model = GaudiBloomForCausalLM(config).eval()
+        num_sink_tokens, window_size = 2, 5
+        cache = GaudiSinkKVCache(config, batch_size=2, window_size=window_size, num_sink_tokens=num_sink_tokens)
+        tokens = torch.randint(3, 64, (2, 20))
+        key_ptr = cache.keys[0].data_ptr()
+
+        for i in range(tokens.shape[-1]):
+            logits = model(tokens[:, i : i + 1], past_key_values=cache, use_cache=True).logits[:, -1]
+            kept_positions = list(range(min(num_sink_tokens, i + 1)))
+            kept_positions += list(range(max(num_sink_tokens, i + 1 - window_size), i + 1))
+            expected = model(tokens[:, kept_positions]).logits[:, -1]
+            self.assertTrue(torch.allclose(logits, expected, atol=1e-5))
+
+        self.assertEqual(int(cache.num_tokens), tokens.shape[-1])
+        self.assertEqual(cache.keys[0].data_ptr(), key_ptr)
+        self.assertEqual(cache.keys[0].shape[-1], num_sink_tokens + window_size)
+
+    def test_unbounded_stream(self):
+        # GPT-2 has 64 positions, the stream goes past them
+        for model in [get_tiny_bloom(), get_tiny_gpt2()]:
+            cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=12, num_sink_tokens=4)
+            session = StreamingGenerationSession(model, cache, eos_token_id=63)
+            # A prompt longer than the cache is written in one pass up to the cache size, then token by token
+            first_turn = session.generate(torch.arange(3, 23).view(1, -1), max_new_tokens=30)
+            second_turn = session.generate(self.prompt, max_new_tokens=30)
+
+            self.assertEqual(first_turn.shape, (1, 30))
+            self.assertEqual(second_turn.shape, (1, 30))
+            self.assertEqual(session.num_tokens, 20 + 30 + self.prompt.shape[-1] + 29)
+
+            # Continuing from a new session that was fed the same stream token by token gives the same tokens
+            reference_cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=12, num_sink_tokens=4)
+            reference = StreamingGenerationSession(model, reference_cache, eos_token_id=63)
+            stream = torch.cat([torch.arange(3, 23).view(1, -1), first_turn, self.prompt], dim=-1)
+            for i in range(stream.shape[-1] - 1):
+                model(stream[:, i : i + 1], past_key_values=reference_cache, use_cache=True)
+            self.assertTrue(torch.equal(reference.generate(stream[:, -1:], max_new_tokens=30), second_turn))
+
+            session.reset()
+            self.assertEqual(session.num_tokens, 0)
+            self.assertTrue(torch.equal(session.generate(torch.arange(3, 23).view(1, -1), 30), first_turn))
+
+    def test_finished_rows(self):
+        model = get_tiny_bloom()
+        cache = GaudiSinkKVCache(model.config, batch_size=2, window_size=8, num_sink_tokens=2)
+        expected = StreamingGenerationSession(model, cache, eos_token_id=63).generate(self.prompt.repeat(2, 1), 6)
+
+        # Stop the first row at its third token
+        eos_token_id = int(expected[0, 2])
+        cache.reset()
+        session = StreamingGenerationSession(model, cache, eos_token_id=eos_token_id)
+        outputs = session.generate(torch.cat([self.prompt, self.prompt.flip(-1)]), max_new_tokens=6)
+        first_eos = (outputs[0] == eos_token_id).nonzero()[0, 0]
+        self.assertTrue(torch.all(outputs[0, first_eos + 1 :] == PAD_TOKEN_ID))
+
+    def test_fixed_shapes(self):
+        model = get_tiny_bloom()
+        expected = static_generate(model, self.prompt[0], 12, eos_token_id=None, repetition_penalty=1.5)
+        cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=24, num_sink_tokens=4)
+        session = StreamingGenerationSession(model, cache, eos_token_id=63)
+        shapes = []
+        session.logits_processor = LogitsProcessorList(
+            [
+                StaticRepetitionPenaltyLogitsProcessor(1.5, session.token_idx),
+                lambda input_ids, scores: shapes.append(input_ids.shape) or scores,
+            ]
+        )
+        outputs = session.generate(self.prompt, max_new_tokens=12)
+
+        self.assertTrue(torch.equal(outputs[0], expected[0, self.prompt.shape[-1] :]))
+        # The processors are given the same buffer at every step
+        self.assertEqual(set(shapes), {(1, self.prompt.shape[-1] + 12)})
+
+    def test_eos_check_interval(self):
+        model = get_tiny_gpt2()
+        cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=24, num_sink_tokens=4)
+        expected = StreamingGenerationSession(model, cache, eos_token_id=63).generate(self.prompt, 12)
+        # The sequence is finished at its second token
+        eos_token_id = int(expected[0, 1])
+        for lazy_mode, eos_check_interval, num_generated_tokens in [(False, None, 2), (True, None, 12), (True, 3, 3)]:
+            with self.subTest(lazy_mode=lazy_mode, eos_check_interval=eos_check_interval):
+                cache.reset()
+                session = StreamingGenerationSession(
+                    model,
+                    cache,
+                    eos_token_id=eos_token_id,
+                    lazy_mode=lazy_mode,
+                    eos_check_interval=eos_check_interval,
+                )
+                outputs = session.generate(self.prompt, max_new_tokens=12)
+                self.assertEqual(outputs.shape, (1, num_generated_tokens))
+                self.assertTrue(torch.equal(outputs[:, :2], expected[:, :2]))
+                self.assertTrue(torch.all(outputs[:, 2:] == PAD_TOKEN_ID))
+
+    def test_errors(self):
+        model = get_tiny_gpt2()
+        with self.assertRaises(ValueError):
+            GaudiSinkKVCache(model.config, batch_size=1, window_size=0)
+        with self.assertRaises(ValueError):
+            # More slots than GPT-2 positions
+            GaudiSinkKVCache(model.config, batch_size=1, window_size=64, num_sink_tokens=4)
+
+        cache = GaudiSinkKVCache(model.config, batch_size=1, window_size=4, num_sink_tokens=2)
+        with self.assertRaises(ValueError):
+            model(self.prompt, past_key_values=cache, attention_mask=torch.ones_like(self.prompt))
+        with self.assertRaises(ValueError):
+            model(self.prompt.repeat(2, 1), past_key_values=cache)
+        with self.assertRaises(ValueError):
+            # The prompt does not fit in the cache
+            model(self.prompt, past_key_values=cache)